@@ -119,7 +119,8 @@ def run_startup_bootstrap() -> None:
     """
     Crea las tablas si no existen (idempotente), asegura los catálogos de
     referencia (tipo_vehiculo, tipo_contacto, tipo_servicio_polo,
-    tipo_servicio) y garantiza que exista al menos un usuario con rol
+    tipo_servicio), reconstruye el directorio desnormalizado del chatbot
+    (directorio_empresa) y garantiza que exista al menos un usuario con rol
     admin_polo, tomando las credenciales de BOOTSTRAP_ADMIN_EMAIL /
     BOOTSTRAP_ADMIN_PASSWORD. Los catálogos y roles se revisan en cada
     arranque; la creación del admin solo pasa si todavía no hay ninguno.
@@ -133,6 +134,10 @@ def run_startup_bootstrap() -> None:
         _ensure_catalogs(db)
         db.commit()
 
+        # El directorio desnormalizado del chatbot se mantiene en cada commit;
+        # al arrancar se rearma entero por si hubo cambios por fuera del ORM.
+        services.refresh_directory_read_model(db)
+
         ya_hay_admin = (
             db.query(models.Usuario)
             .join(models.RolUsuario, models.RolUsuario.id_usuario == models.Usuario.id_usuario)
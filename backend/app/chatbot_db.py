@@ -0,0 +1,163 @@
+# app/chatbot_db.py
+"""
+Pool de conexiones propio para el SQL del chatbot.
+
+Las consultas que genera el modelo compartían app.config.engine (pool por
+default, echo=True) con login, registro y el panel de administración: una
+ráfaga de preguntas en los tótems dejaba sin conexiones a los logins. Acá
+el chatbot tiene su propio engine, con tamaño/overflow/timeout configurables
+y transacciones de solo lectura (SET TRANSACTION READ ONLY en PostgreSQL,
+PRAGMA query_only en SQLite). Si se define CHATBOT_DATABASE_URL apunta a
+esa base (p. ej. una réplica de lectura); si no, a DATABASE_URL.
+
+La espera de cada checkout y la ocupación del pool se exponen en /health
+(get_chatbot_pool_stats) y en /metrics para poder dimensionarlo aparte del
+pool general.
+"""
+import os
+import threading
+import time
+from typing import Dict, Iterator
+
+from sqlalchemy import create_engine, event
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from app import metrics
+from app.config import DATABASE_URL
+
+CHATBOT_DATABASE_URL = os.getenv("CHATBOT_DATABASE_URL") or DATABASE_URL
+CHATBOT_DB_POOL_SIZE = int(os.getenv("CHATBOT_DB_POOL_SIZE", "5"))
+CHATBOT_DB_MAX_OVERFLOW = int(os.getenv("CHATBOT_DB_MAX_OVERFLOW", "5"))
+# Segundos que una consulta del chatbot espera una conexión libre antes de
+# fallar: mejor un error rápido en el tótem que una cola que crece.
+CHATBOT_DB_POOL_TIMEOUT = float(os.getenv("CHATBOT_DB_POOL_TIMEOUT", "5"))
+
+
+# ═══════════════════════════════════════════════════════════════════
+# MÉTRICAS DEL POOL
+# ═══════════════════════════════════════════════════════════════════
+
+_stats_lock = threading.Lock()
+_stats = {
+    "checkouts": 0,
+    "timeouts": 0,
+    "wait_ms_total": 0.0,
+    "wait_ms_max": 0.0,
+    "checked_out_peak": 0,
+}
+
+
+def _record_checkout(wait_ms: float, timed_out: bool) -> None:
+    metrics.DB_POOL_WAIT_SECONDS.observe(wait_ms / 1000, pool="chatbot", outcome="timeout" if timed_out else "ok")
+    with _stats_lock:
+        if timed_out:
+            _stats["timeouts"] += 1
+        else:
+            _stats["checkouts"] += 1
+            _stats["wait_ms_total"] += wait_ms
+        _stats["wait_ms_max"] = max(_stats["wait_ms_max"], wait_ms)
+
+
+class _TimedQueuePool(QueuePool):
+    """QueuePool que mide cuánto espera cada checkout por una conexión libre."""
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except sa_exc.TimeoutError:
+            _record_checkout((time.perf_counter() - started) * 1000, timed_out=True)
+            raise
+        _record_checkout((time.perf_counter() - started) * 1000, timed_out=False)
+        checked_out = self.checkedout()
+        with _stats_lock:
+            _stats["checked_out_peak"] = max(_stats["checked_out_peak"], checked_out)
+        return connection
+
+
+def _make_chatbot_engine(url: str):
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend == "sqlite" and parsed.database in (None, "", ":memory:"):
+        # SQLite en memoria (tests): cada conexión sería otra base, así que
+        # queda el pool por default del dialecto.
+        engine = create_engine(url)
+    else:
+        engine = create_engine(
+            url,
+            poolclass=_TimedQueuePool,
+            pool_size=CHATBOT_DB_POOL_SIZE,
+            max_overflow=CHATBOT_DB_MAX_OVERFLOW,
+            pool_timeout=CHATBOT_DB_POOL_TIMEOUT,
+            pool_pre_ping=True,
+        )
+
+    if backend == "postgresql":
+        @event.listens_for(engine, "begin")
+        def _read_only_transaction(conn):
+            conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+    elif backend == "sqlite":
+        @event.listens_for(engine, "connect")
+        def _read_only_connection(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA query_only = ON")
+            cursor.close()
+
+    return engine
+
+
+chatbot_engine = _make_chatbot_engine(CHATBOT_DATABASE_URL)
+ChatbotSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=chatbot_engine)
+
+
+def get_chatbot_db() -> Iterator[Session]:
+    """Dependencia de FastAPI: sesión de solo lectura del pool del chatbot."""
+    db = ChatbotSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_chatbot_pool_stats() -> Dict:
+    """Ocupación actual del pool del chatbot y espera acumulada de checkout."""
+    pool = chatbot_engine.pool
+    with _stats_lock:
+        stats = dict(_stats)
+    checkouts = stats["checkouts"]
+    stats["wait_ms_avg"] = round(stats["wait_ms_total"] / checkouts, 2) if checkouts else 0.0
+    stats["wait_ms_total"] = round(stats["wait_ms_total"], 2)
+    stats["wait_ms_max"] = round(stats["wait_ms_max"], 2)
+
+    if isinstance(pool, QueuePool):
+        capacity = pool.size() + max(CHATBOT_DB_MAX_OVERFLOW, 0)
+        checked_out = pool.checkedout()
+        stats.update(
+            {
+                "pool_size": pool.size(),
+                "max_overflow": CHATBOT_DB_MAX_OVERFLOW,
+                "timeout_seconds": pool.timeout(),
+                "checked_out": checked_out,
+                "idle": pool.checkedin(),
+                "utilization": round(checked_out / capacity, 3) if capacity else 0.0,
+            }
+        )
+    return stats
+
+
+def update_chatbot_pool_gauges() -> None:
+    """Volcar la ocupación actual del pool a las métricas de /metrics."""
+    stats = get_chatbot_pool_stats()
+    if "pool_size" in stats:
+        metrics.DB_POOL_CONNECTIONS.set(stats["checked_out"], pool="chatbot", state="checked_out")
+        metrics.DB_POOL_CONNECTIONS.set(stats["pool_size"] + stats["max_overflow"], pool="chatbot", state="capacity")
+
+
+def reset_chatbot_pool_stats() -> None:
+    """Pone en cero los contadores. Pensado para uso en tests."""
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0.0 if isinstance(_stats[key], float) else 0
@@ -1,4 +1,5 @@
 # app/main.py
+import asyncio
 import sys
 from datetime import datetime
 
@@ -12,7 +13,9 @@ for _stream in (sys.stdout, sys.stderr):
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app import services
+from fastapi.responses import Response
+from app import metrics, services
+from app.chatbot_db import get_chatbot_pool_stats, update_chatbot_pool_gauges
 from app.routes.auth import router as auth_router
 from app.routes.company_user import router as company_user_router
 from app.routes.admin_users import router as admin_users_router
@@ -22,9 +25,10 @@ from app.routes.tipos import router as tipos
 from app.routes.google_auth import router as google_auth_router
 
 # ✨ IMPORTAR EL NUEVO ROUTER DE VOZ
-from app.routes.voice import router as voice_router
+from app.routes.voice import router as voice_router, ws_router as voice_ws_router, audio_router as voice_audio_router
 
 from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
 from app.security_headers import SecurityHeadersMiddleware
 import os
@@ -74,6 +78,10 @@ app.add_middleware(
 # middlewares anteriores (CORS incluido) sin pisarles ningún header propio.
 app.add_middleware(SecurityHeadersMiddleware)
 
+# Métricas por ruta afuera de todo, para medir también lo que agregan los
+# middlewares de arriba.
+app.add_middleware(metrics.MetricsMiddleware)
+
 # ═══════════════════════════════════════════════════════════════════
 # RUTAS
 # ═══════════════════════════════════════════════════════════════════
@@ -89,6 +97,8 @@ app.include_router(google_auth_router)
 
 # ✨ INCLUIR EL ROUTER DE VOZ
 app.include_router(voice_router)
+app.include_router(voice_ws_router)
+app.include_router(voice_audio_router)
 
 # ═══════════════════════════════════════════════════════════════════
 # ENDPOINTS RAÍZ
@@ -113,6 +123,7 @@ def read_root():
             "docs": "/docs",
             "voice_status": "/api/voice/status",
             "voice_chat": "/api/voice/chat",
+            "voice_chat_ws": "/api/voice/chat/ws",
             "health": "/health"
         }
     }
@@ -137,13 +148,41 @@ def health_check():
             "gemini_ai": " Configured",
             "voice_provider": voice_provider if voice_provider else "⚠️ Not configured",
         },
+        "gemini_models": services.get_model_status(),
+        "chat_cache": services.get_chat_cache_stats(),
+        "chat_schema_context": services.get_schema_context_stats(),
+        "chat_history": services.get_history_stats(),
+        "chat_answer_renderer": services.get_renderer_stats(),
+        "chat_result_encoding": services.get_encoder_stats(),
+        "chatbot_db_pool": get_chatbot_pool_stats(),
+        "directory_search": services.get_search_stats(),
+        "directory_vectors": services.get_vector_stats(),
+        "ai_transport": services.get_transport_stats(),
+        "tts_cache": services.get_tts_cache_stats(),
+        "voice_audio_store": services.get_audio_store_stats(),
+        "voice_preprocessing": services.get_preprocessing_stats(),
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/metrics", tags=["health"], include_in_schema=False)
+async def metrics_endpoint():
+    """
+    Métricas en formato de texto de Prometheus (ver app/metrics.py). Es
+    async a propósito: la ocupación del threadpool se lee desde el event loop.
+    """
+    metrics.update_threadpool_gauges()
+    update_chatbot_pool_gauges()
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 # ═══════════════════════════════════════════════════════════════════
 # STARTUP EVENT (OPCIONAL)
 # ═══════════════════════════════════════════════════════════════════
 
+# Referencias a las tareas lanzadas al arrancar, para que no las junte el GC
+# mientras corren; cada una se saca sola del set al terminar.
+_background_tasks = set()
+
+
 @app.on_event("startup")
 async def startup_event():
     """
@@ -177,6 +216,20 @@ async def startup_event():
             print(f"   💡 Configura GOOGLE_APPLICATION_CREDENTIALS")
     except Exception as e:
         print(f"🎤 Servicios de voz:  Error - {str(e)}")
+
+    # Audio de las respuestas fijas (error genérico, rechazo, fuera de tema)
+    # en segundo plano, para no demorar el arranque.
+    if services.tts_cache.PREWARM_ENABLED:
+        task = asyncio.create_task(services.prewarm_voice_cache())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    # Primera sincronización del índice vectorial del directorio (embeber
+    # todas las empresas): acá y no en la primera pregunta semántica.
+    if services.directory_vectors.is_available():
+        task = asyncio.create_task(run_in_threadpool(services.warm_directory_vectors))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
     
     print("="*70)
     print(" API lista en: http://localhost:8000")
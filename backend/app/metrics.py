@@ -0,0 +1,299 @@
+# app/metrics.py
+"""
+Métricas del backend en formato de texto de Prometheus (GET /metrics).
+
+Hasta ahora la única forma de ver dónde se iba el tiempo de un chat eran
+los print() del pipeline. Acá hay histogramas por etapa para saber, cuando
+sube el p95, si el problema está en Gemini, en PostgreSQL o en Google
+Speech:
+
+- polo_chat_stage_seconds{stage, outcome}: intención, validación y
+  ejecución del SQL, búsquedas del directorio y respuesta final;
+- polo_chat_final_answers_total{source}: quién armó la respuesta final
+  (model, template o fallback);
+- polo_voice_seconds{operation, outcome}: STT y TTS de Google;
+- polo_db_pool_wait_seconds{pool, outcome}: espera por una conexión del
+  pool del chatbot;
+- polo_http_request_seconds{route, method, outcome}: por ruta (la
+  plantilla de FastAPI, no el path con ids);
+- polo_threadpool_threads{state}: ocupación del threadpool de Starlette,
+  leída en cada scrape.
+
+Implementación propia y mínima (sin prometheus_client, que no está en
+requirements.txt): contadores, histogramas con buckets fijos y gauges. Como
+el resto del estado en memoria, es por proceso (uvicorn corre sin
+--workers).
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import Response
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Segundos: de una consulta SQL (milisegundos) a una respuesta de Gemini lenta.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: se esperaban las etiquetas {self.labelnames}, llegaron {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+    def reset(self) -> None:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {_format_number(value)}"
+            for key, value in items
+        ]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    _samples = Counter._samples
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [conteos por bucket (no acumulados), suma, cantidad]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def timer(self, **labels: str) -> Iterator[Dict[str, str]]:
+        """
+        Medir un bloque. Devuelve las etiquetas para poder cambiar el
+        outcome adentro ("ok" por default, "error" si sale una excepción).
+        """
+        if "outcome" in self.labelnames:
+            labels.setdefault("outcome", "ok")
+        started = time.perf_counter()
+        try:
+            yield labels
+        except BaseException:
+            if labels.get("outcome") == "ok":
+                labels["outcome"] = "error"
+            raise
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> int:
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self._values.items())
+        lines = []
+        for key, (bucket_counts, total, count) in items:
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(pairs + [('le', _format_number(bound))])} {cumulative}"
+                )
+            lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(pairs)} {_format_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(pairs)} {count}")
+        return lines
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+REGISTRY: List[_Metric] = []
+
+
+# ═══════════════════════════════════════════════════════════════════
+# MÉTRICAS DEL BACKEND
+# ═══════════════════════════════════════════════════════════════════
+
+CHAT_STAGE_SECONDS = Histogram(
+    "polo_chat_stage_seconds",
+    "Duración de cada etapa del pipeline del chatbot.",
+    ("stage", "outcome"),
+)
+CHAT_FINAL_ANSWERS = Counter(
+    "polo_chat_final_answers_total",
+    "Respuestas finales del chatbot según quién las armó (model, template, fallback).",
+    ("source",),
+)
+VOICE_SECONDS = Histogram(
+    "polo_voice_seconds",
+    "Duración de las llamadas a Google Speech-to-Text y Text-to-Speech.",
+    ("operation", "outcome"),
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "polo_db_pool_wait_seconds",
+    "Espera por una conexión libre del pool.",
+    ("pool", "outcome"),
+    buckets=POOL_WAIT_BUCKETS,
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "polo_db_pool_connections",
+    "Conexiones del pool por estado (checked_out, capacity).",
+    ("pool", "state"),
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "polo_http_request_seconds",
+    "Duración de los pedidos HTTP hasta los headers de la respuesta, por ruta.",
+    ("route", "method", "outcome"),
+)
+THREADPOOL_THREADS = Gauge(
+    "polo_threadpool_threads",
+    "Hilos del threadpool de Starlette (anyio) en uso y disponibles.",
+    ("state",),
+)
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+def reset_metrics() -> None:
+    """Pone todas las métricas en cero. Pensado para tests."""
+    for metric in REGISTRY:
+        metric.reset()
+
+
+def update_threadpool_gauges() -> None:
+    """Leer la ocupación del threadpool. Hay que llamarla desde el event loop."""
+    from anyio import to_thread
+
+    limiter = to_thread.current_default_thread_limiter()
+    THREADPOOL_THREADS.set(limiter.borrowed_tokens, state="busy")
+    THREADPOOL_THREADS.set(limiter.total_tokens, state="total")
+
+
+def _outcome(status_code: int) -> str:
+    if status_code >= 500:
+        return "error"
+    if status_code >= 400:
+        return "client_error"
+    return "ok"
+
+
+class MetricsMiddleware(BaseHTTPMiddleware):
+    """Histograma por ruta. Usa la plantilla de la ruta (/empresas/{cuil}) para no explotar las etiquetas."""
+
+    async def dispatch(self, request: Request, call_next) -> Response:
+        started = time.perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                route=getattr(route, "path", "unmatched"),
+                method=request.method,
+                outcome=_outcome(status_code),
+            )
@@ -401,4 +401,48 @@ class ChatMensaje(Base):
     contenido  = Column(Text, nullable=False)
     fecha      = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
 
-    usuario = relationship("Usuario", back_populates="chat_mensajes")
\ No newline at end of file
+    usuario = relationship("Usuario", back_populates="chat_mensajes")
+
+# ─── Directorio desnormalizado (read model del chatbot) ─────────────────────
+
+class DirectorioEmpresa(Base):
+    """
+    Una fila por empresa con lo que pregunta la gente en el tótem: datos de
+    la empresa, contacto comercial, servicios/lotes del polo e información
+    comercial, ya aplanados. No se edita a mano: lo mantiene
+    app/services/directory_read_model.py en cada commit que toca las tablas
+    de origen. Sin FK a empresa a propósito: es una copia derivada.
+    """
+    __tablename__ = "directorio_empresa"
+
+    cuil                        = Column(BigInteger, primary_key=True)
+    nombre                      = Column(String, nullable=False, index=True)
+    rubro                       = Column(String)
+    cant_empleados              = Column(Integer)
+    horario_trabajo             = Column(String)
+    observaciones               = Column(Text)
+    fecha_ingreso               = Column(Date)
+    estado                      = Column(Boolean)
+    estado_solicitud            = Column(String)
+    # Contacto comercial (o el primero cargado, si no hay uno comercial).
+    contacto_nombre             = Column(String)
+    contacto_telefono           = Column(String)
+    contacto_direccion          = Column(String)
+    contacto_datos              = Column(Text)  # web, correo, redes: "clave: valor; ..."
+    # Servicios/espacios del polo y lotes, como texto ("Nave Norte (nave)";
+    # "manzana 3 lote 12"). manzana/lote: los del primer lote, para filtrar.
+    servicios_polo              = Column(Text)
+    lotes                       = Column(Text)
+    manzana                     = Column(Integer)
+    lote                        = Column(Integer)
+    # info_comercial aplanada
+    productos_servicios         = Column(Text)
+    publico_objetivo            = Column(String)
+    atiende_publico             = Column(Boolean)
+    horario_atencion_comercial  = Column(String)
+    rango_precios               = Column(String)
+    modalidad_venta             = Column(String)
+    marcas_representadas        = Column(Text)
+    certificaciones             = Column(Text)
+    observaciones_comerciales   = Column(Text)
+    actualizado                 = Column(DateTime, nullable=False)
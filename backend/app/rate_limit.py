@@ -12,13 +12,14 @@ import time
 from collections import defaultdict, deque
 from typing import Deque, Dict, Tuple
 
-from fastapi import HTTPException, Request
+from fastapi import HTTPException, WebSocket, WebSocketException, status
+from starlette.requests import HTTPConnection
 
 
 _buckets: Dict[Tuple[str, str], Deque[float]] = defaultdict(deque)
 
 
-def _client_key(request: Request) -> str:
+def _client_key(request: HTTPConnection) -> str:
     """
     Identifica al cliente por IP. Prioriza los headers que pone un proxy
     delante (Cloudflare / nginx) sobre request.client.host, que detrás de
@@ -39,10 +40,11 @@ def rate_limit(name: str, max_requests: int, window_seconds: int):
     """
     Dependencia de FastAPI: como máximo `max_requests` solicitudes cada
     `window_seconds` segundos, por IP y por `name` (para que endpoints
-    distintos no compartan el mismo balde).
+    distintos no compartan el mismo balde). Sirve también para WebSockets:
+    ahí el exceso cierra la conexión con 1008 en vez de responder 429.
     """
 
-    def dependency(request: Request) -> None:
+    def dependency(request: HTTPConnection) -> None:
         key = (name, _client_key(request))
         now = time.monotonic()
         bucket = _buckets[key]
@@ -52,6 +54,8 @@ def rate_limit(name: str, max_requests: int, window_seconds: int):
 
         if len(bucket) >= max_requests:
             retry_after = max(1, int(window_seconds - (now - bucket[0])))
+            if isinstance(request, WebSocket):
+                raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Demasiadas solicitudes")
             raise HTTPException(
                 status_code=429,
                 detail="Demasiadas solicitudes. Intentá de nuevo en unos momentos.",
@@ -1,5 +1,5 @@
 #auth.py
-from fastapi import Depends, HTTPException, APIRouter
+from fastapi import Depends, HTTPException, APIRouter, WebSocket, WebSocketException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import or_
@@ -69,6 +69,25 @@ def get_current_user(
         raise HTTPException(401, "Token inválido")
 
 
+def get_current_user_ws(websocket: WebSocket, db: Session = Depends(get_db)) -> models.Usuario:
+    """
+    get_current_user para WebSockets: el navegador no puede mandar el header
+    Authorization al abrir un WebSocket, así que el token viaja como
+    `?token=...` (o como header, si el cliente puede). Un token inválido
+    cierra la conexión con 1008 (policy violation).
+    """
+    token = websocket.query_params.get("token")
+    authorization = websocket.headers.get("authorization", "")
+    if not token and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    if not token:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Falta el token")
+    try:
+        return get_current_user(token=token, db=db)
+    except HTTPException as exc:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason=str(exc.detail))
+
+
 # ═══════════════════════════════════════════════════════════════════
 # >>> AGREGADO: Cooldown por intentos fallidos en cambio de contraseña
 _MAX_FAILS_CHANGE_PW = 3          # intentos fallidos permitidos antes del bloqueo
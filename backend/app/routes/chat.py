@@ -1,9 +1,8 @@
 #app/routes/chat.py
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
-from starlette.concurrency import run_in_threadpool
-from app.services import get_chat_response, GENERIC_ERROR_MESSAGE
-from app.config import get_db
+from app.services import get_chat_response_async, GENERIC_ERROR_MESSAGE
+from app.chatbot_db import get_chatbot_db
 from app.rate_limit import rate_limit
 from sqlalchemy.orm import Session
 from typing import List, Dict, Optional
@@ -19,15 +18,16 @@ class ChatRequest(BaseModel):
     history: Optional[List[Dict[str, str]]] = None
 
 @router.post("/", dependencies=[Depends(rate_limit("chat", max_requests=30, window_seconds=60))])
-async def chat(request: ChatRequest, db: Session = Depends(get_db)):
+async def chat(request: ChatRequest, db: Session = Depends(get_chatbot_db)):
     try:
-        # get_chat_response es sincrónico y bloqueante (llamadas a Gemini + queries
-        # a la DB). Llamarlo directo desde un endpoint `async def` bloquearía el
-        # único event loop del proceso: mientras se procesa un chat, TODO el resto
-        # de la API (incluso endpoints livianos como /health) queda colgado.
-        # run_in_threadpool lo corre en un hilo aparte para que no bloquee.
-        response_text, data, corrected_entity = await run_in_threadpool(
-            get_chat_response, db, request.message, request.history
+        # Variante async del pipeline: las llamadas a Gemini se esperan sin
+        # ocupar un hilo, y solo los accesos a la DB (milisegundos) pasan por
+        # el threadpool. Antes todo el chat corría en el threadpool (~40 hilos
+        # compartidos con login, directorio, etc.) y una ráfaga de tótems lo
+        # agotaba. Nunca llamar acá a la versión sincrónica get_chat_response:
+        # bloquearía el único event loop del proceso.
+        response_text, data, corrected_entity = await get_chat_response_async(
+            db, request.message, request.history
         )
 
         if not isinstance(response_text, str):
@@ -14,7 +14,7 @@ from fastapi import APIRouter, HTTPException, Depends
 from sqlalchemy.orm import Session, selectinload
 
 from app.config import get_db
-from app import models, schemas
+from app import models, schemas, services
 from app.models import Empresa, ServicioPolo, TipoServicioPolo
 from app.schemas import EmpresaDetailOutPublic, ContactoOutPublic, LoteOutPublic
 from app.routes.auth import get_current_user
@@ -106,16 +106,31 @@ def get_empresas_directorio(db: Session = Depends(get_db)):
     return [build_empresa_detail_public(empresa) for empresa in empresas]
 
 
+# Tope de resultados de la búsqueda full-text (?q=) de /search.
+SEARCH_MAX_RESULTS = 50
+
+
 @router.get("/search", response_model=List[EmpresaDetailOutPublic], summary="Buscar empresas por criterios especificos")
 def search_companies(
     name: Optional[str] = None,
     rubro: Optional[str] = None,
     servicio_polo: Optional[str] = None,
+    q: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    """Buscar empresas por nombre, rubro o tipo de servicio del polo"""
+    """
+    Buscar empresas por nombre, rubro o tipo de servicio del polo. Con `q`,
+    búsqueda full-text (productos, marcas, rubro, observaciones...) ordenada
+    por relevancia; se combina con los demás filtros.
+    """
     query = db.query(Empresa).options(*EMPRESA_DETAIL_EAGER_OPTIONS)
 
+    ranking = None
+    if q:
+        ranked = services.search_directory(db, q, limit=SEARCH_MAX_RESULTS, only_active=False)
+        ranking = {cuil: position for position, (cuil, _) in enumerate(ranked)}
+        query = query.filter(Empresa.cuil.in_(list(ranking)))
+
     if name:
         query = query.filter(Empresa.nombre.ilike(f"%{name}%"))
 
@@ -132,6 +147,9 @@ def search_companies(
     if not companies:
         raise HTTPException(status_code=404, detail="No se encontraron empresas")
 
+    if ranking is not None:
+        companies.sort(key=lambda empresa: ranking[empresa.cuil])
+
     return [build_empresa_detail_public(empresa) for empresa in companies]
 
 
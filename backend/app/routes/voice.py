@@ -1,21 +1,26 @@
 # app/routes/voice.py
 
-from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, Body, Request
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, Body, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, StreamingResponse, JSONResponse
 from fastapi.encoders import jsonable_encoder
 from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Literal
+import asyncio
 import io
 import base64
 import json
+import re
 
 from app.config import get_db
-from app.routes.auth import get_current_user
+from app.chatbot_db import get_chatbot_db
+from app.routes.auth import get_current_user, get_current_user_ws
 from app.rate_limit import rate_limit
 from app import services, models, schemas
 
 MAX_SYNTHESIZE_TEXT_LENGTH = 5000
+# Tope de audio por conexión del WebSocket de voz (~10 minutos de Opus).
+MAX_STREAM_AUDIO_BYTES = 5 * 1024 * 1024
 
 
 def _validate_synthesize_text(text: str) -> None:
@@ -36,15 +41,35 @@ router = APIRouter(
     dependencies=[Depends(get_current_user)]
 )
 
+# Los WebSockets van en un router aparte: get_current_user lee el token con
+# OAuth2PasswordBearer, que solo funciona con requests HTTP.
+ws_router = APIRouter(prefix="/api/voice", tags=["voice"])
+
+# El audio por URL tampoco pasa por get_current_user: un <audio src> no manda
+# el header Authorization, y el token de la URL (aleatorio, de vida corta)
+# ya es la credencial. Ver app/services/audio_store.py.
+audio_router = APIRouter(prefix="/api/voice", tags=["voice"])
+
+
+def _sse_event(event: str, payload: Dict) -> str:
+    """Serializar un evento en formato Server-Sent Events."""
+    data = json.dumps(payload, ensure_ascii=False, default=services.custom_json_serializer)
+    return f"event: {event}\ndata: {data}\n\n"
+
 
 @router.post("/chat/stream", dependencies=[Depends(rate_limit("voice-chat-stream", max_requests=30, window_seconds=60))])
 async def voice_chat_stream(
     payload: Dict = Body(..., description="JSON con 'text' y opcional 'history'"),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_chatbot_db),
+    auth_db: Session = Depends(get_db),
 ):
     """
-    Streaming de la respuesta de texto del bot (sin audio).
-    Entrega los chunks de texto a medida que se generan.
+    Streaming de la respuesta de texto del bot (sin audio), como Server-Sent Events.
+
+    Eventos: `intent` (entidad corregida), `data` (filas de la consulta),
+    `text` (fragmentos de la respuesta a medida que Gemini los genera) y
+    `done` (texto completo + `ttft_ms` y `total_ms`). Si algo falla a mitad
+    de camino se emite `error`.
     """
     text = payload.get("text")
     history = payload.get("history")
@@ -52,18 +77,188 @@ async def voice_chat_stream(
     if not text or not text.strip():
         raise HTTPException(status_code=400, detail="Debes enviar el campo 'text'")
 
+    # Es la misma sesión con la que get_current_user validó el token: se
+    # cierra acá para que su conexión no quede tomada mientras dura el stream.
+    auth_db.close()
+
     def stream_generator():
         try:
-            for chunk, _, _ in services.get_chat_response_stream(
+            for event, event_payload in services.get_chat_response_stream(
                 db=db, text_message=text, history=history
             ):
-                if chunk:
-                    yield chunk
+                yield _sse_event(event, event_payload)
         except Exception as exc:
             print(f" Error en streaming de respuesta: {exc}")
-            return
+            yield _sse_event("error", {"message": services.GENERIC_ERROR_MESSAGE})
+
+    return StreamingResponse(
+        stream_generator(),
+        media_type="text/event-stream",
+        # Sin buffering intermedio (nginx) ni cache: cada evento tiene que
+        # llegar al tótem apenas se genera.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/chat/audio-stream", dependencies=[Depends(rate_limit("voice-chat-audio-stream", max_requests=30, window_seconds=60))])
+async def voice_chat_audio_stream(
+    payload: Dict = Body(..., description="JSON con 'text' o 'audio_base64', y opcional 'history'"),
+    db: Session = Depends(get_chatbot_db),
+    auth_db: Session = Depends(get_db),
+):
+    """
+    Chat con voz con el audio en streaming, como Server-Sent Events.
+
+    La respuesta se sintetiza por oraciones, en paralelo, y cada segmento
+    MP3 se envía apenas está listo y en orden, así el tótem empieza a hablar
+    sin esperar el audio completo. Eventos: `transcript` (si vino audio),
+    `text` (respuesta completa + filas), `audio` (un segmento: `index`,
+    `total`, `text`, `audio_base64`) y `done` (`ttfa_ms`: tiempo al primer
+    audio, `total_ms`). Si algo falla a mitad de camino se emite `error`.
+    """
+    text = payload.get("text")
+    history = payload.get("history")
+    audio_payload = payload.get("audio_base64")
+    try:
+        audio_bytes = base64.b64decode(audio_payload) if audio_payload else None
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="audio_base64 inválido")
+
+    if not audio_bytes and not (text and text.strip()):
+        raise HTTPException(status_code=400, detail="Debes enviar audio o texto")
+
+    # Igual que en /chat/stream: la conexión de get_current_user no queda
+    # tomada mientras dura el stream.
+    auth_db.close()
+
+    async def stream_generator():
+        try:
+            async for event, event_payload in services.get_chat_response_audio_stream(
+                db, audio_content=audio_bytes, text_message=text, history=history
+            ):
+                yield _sse_event(event, event_payload)
+        except Exception as exc:
+            print(f" Error en streaming de audio: {exc}")
+            yield _sse_event("error", {"message": services.GENERIC_ERROR_MESSAGE})
+
+    return StreamingResponse(
+        stream_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _ws_message(message_type: str, payload: Dict) -> str:
+    return json.dumps({"type": message_type, **payload}, ensure_ascii=False, default=services.custom_json_serializer)
+
 
-    return StreamingResponse(stream_generator(), media_type="text/plain")
+def _ws_control(message: Dict) -> Dict:
+    """Mensaje de control (JSON en un frame de texto) del WebSocket de voz; {} si no lo es."""
+    try:
+        control = json.loads(message.get("text") or "")
+    except json.JSONDecodeError:
+        return {}
+    return control if isinstance(control, dict) else {}
+
+
+@ws_router.websocket(
+    "/chat/ws",
+    dependencies=[Depends(rate_limit("voice-chat-ws", max_requests=30, window_seconds=60))],
+)
+async def voice_chat_websocket(
+    websocket: WebSocket,
+    current_user: models.Usuario = Depends(get_current_user_ws),
+    db: Session = Depends(get_chatbot_db),
+    auth_db: Session = Depends(get_db),
+):
+    """
+    Chat con voz transcribiendo mientras el usuario habla.
+
+    El token va en `?token=...`. Protocolo del cliente: un mensaje JSON
+    opcional `{"type": "start", "history": [...], "language": "es-AR"}`,
+    después el audio en frames binarios (WebM/Opus del MediaRecorder) y
+    `{"type": "stop"}` al soltar el botón. El servidor responde
+    `{"type": "transcript", "text", "final"}` con cada resultado de Google
+    y, apenas hay uno final (sin esperar el "stop"), los mismos eventos que
+    /chat/audio-stream: `text`, `audio` y `done` (o `error`). Después
+    cierra la conexión.
+
+    /transcribe y /chat siguen para los clientes sin WebSocket.
+    """
+    # La sesión con la que get_current_user_ws validó el token no queda
+    # tomada mientras la conexión está abierta.
+    auth_db.close()
+    await websocket.accept()
+
+    history = None
+    language = "es-AR"
+    queue: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue()
+
+    async def receive_audio(first_message: Dict) -> None:
+        """Pasar el audio a la cola hasta el "stop", el tope o el corte. None marca el fin."""
+        received = 0
+        message = first_message
+        try:
+            while message["type"] != "websocket.disconnect":
+                if message.get("bytes"):
+                    received += len(message["bytes"])
+                    if received > MAX_STREAM_AUDIO_BYTES:
+                        print(f" WebSocket de voz: audio cortado en {received} bytes")
+                        break
+                    await queue.put(message["bytes"])
+                elif _ws_control(message).get("type") == "stop":
+                    break
+                message = await websocket.receive()
+        finally:
+            queue.put_nowait(None)
+
+    async def audio_chunks():
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                return
+            yield chunk
+
+    receiver = None
+    try:
+        first_message = await websocket.receive()
+        start = _ws_control(first_message)
+        if start.get("type") == "start":
+            history = start.get("history")
+            language = start.get("language") or language
+            first_message = await websocket.receive()
+        receiver = asyncio.create_task(receive_audio(first_message))
+
+        # Con el primer resultado final se deja de escuchar: el chatbot
+        # arranca mientras el cliente quizás todavía está subiendo audio.
+        transcript = ""
+        transcripts = services.stream_transcribe_async(audio_chunks(), language)
+        try:
+            async for text, is_final in transcripts:
+                transcript = text
+                await websocket.send_text(_ws_message("transcript", {"text": text, "final": is_final}))
+                if is_final:
+                    break
+        finally:
+            await transcripts.aclose()
+
+        async for event, event_payload in services.get_chat_response_audio_stream(
+            db, history=history, transcript=transcript
+        ):
+            await websocket.send_text(_ws_message(event, event_payload))
+        await websocket.close()
+    except WebSocketDisconnect:
+        print(" WebSocket de voz: el cliente se desconectó")
+    except Exception as exc:
+        print(f" Error en WebSocket de voz: {exc}")
+        try:
+            await websocket.send_text(_ws_message("error", {"message": services.GENERIC_ERROR_MESSAGE}))
+            await websocket.close(code=1011)
+        except Exception:
+            pass
+    finally:
+        if receiver is not None:
+            receiver.cancel()
 
 # ═══════════════════════════════════════════════════════════════════
 # ENDPOINT 1: Verificar estado de servicios de voz
@@ -114,9 +309,9 @@ async def transcribe_audio_endpoint(
 
         print(f" Recibido audio: {len(audio_bytes)} bytes, tipo: {audio.content_type}")
 
-        # Bloqueante (llamada de red a Google Speech): sin threadpool, colgaría
-        # todo el event loop mientras dura la transcripción.
-        transcript = await run_in_threadpool(services.transcribe_audio, audio_bytes, language)
+        # Cliente async de Google Speech: no bloquea el event loop ni ocupa
+        # un hilo del threadpool mientras dura la transcripción.
+        transcript = await services.transcribe_audio_async(audio_bytes, language)
 
         if not transcript:
             return JSONResponse(
@@ -160,8 +355,8 @@ async def synthesize_text_endpoint(
 
         print(f" Sintetizando: {text[:100]}...")
 
-        # Bloqueante (llamada de red a Google TTS): ver nota en /transcribe.
-        audio_bytes = await run_in_threadpool(services.text_to_speech, text)
+        # Cliente async de Google TTS: ver nota en /transcribe.
+        audio_bytes = await services.text_to_speech_async(text)
 
         return StreamingResponse(
             io.BytesIO(audio_bytes),
@@ -190,14 +385,22 @@ async def voice_chat_endpoint(
     history_form: Optional[str] = Form(
         None, description="Historial de conversación en JSON (solo para multipart/form-data)"
     ),
+    audio_delivery: Literal["base64", "url"] = Query(
+        "base64", description="'url': devuelve `audio_url` sin esperar al TTS, en vez del MP3 en base64"
+    ),
     current_user: models.Usuario = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    chat_db: Session = Depends(get_chatbot_db),
 ):
     """
     - Recibe audio o texto.
     - Transcribe (si hay audio).
     - Procesa con el chatbot (Gemini + DB).
     - Devuelve texto + audio (base64) + resultados de DB.
+
+    Con `?audio_delivery=url` la respuesta sale apenas está el texto y trae
+    `audio_url` (GET /api/voice/audio/{token}, vence en unos minutos) en
+    lugar de `audio_base64`: el MP3 se sintetiza mientras tanto.
     """
     try:
         history: Optional[List[Dict]] = None
@@ -236,13 +439,19 @@ async def voice_chat_endpoint(
             print(f"📥 Audio recibido: {len(file_bytes)} bytes")
             audio_bytes = file_bytes
 
-        # Bloqueante (transcripción + Gemini + TTS encadenados): ver nota en /transcribe.
-        result = await run_in_threadpool(
-            services.get_chat_response_with_audio,
-            db,
+        # Transcripción + Gemini + TTS encadenados, todo async: ver nota en /transcribe.
+        # El pipeline lee por el pool de solo lectura del chatbot; `db` queda
+        # para guardar el turno en el historial. Hasta entonces se devuelve
+        # al pool la conexión que tomó get_current_user: si no, quedaría
+        # ocupada durante la transcripción, Gemini y el TTS (segundos).
+        id_usuario = current_user.id_usuario
+        db.close()
+        result = await services.get_chat_response_with_audio_async(
+            chat_db,
             audio_bytes,
             text,
             history,
+            deferred_audio=audio_delivery == "url",
         )
 
         # Guarda el turno completo (usuario + bot) para que el historial
@@ -251,13 +460,13 @@ async def voice_chat_endpoint(
         bot_turn_text = (result.get("text") or "").strip()
         if user_turn_text:
             db.add(models.ChatMensaje(
-                id_usuario=current_user.id_usuario,
+                id_usuario=id_usuario,
                 remitente="user",
                 contenido=user_turn_text,
             ))
         if bot_turn_text:
             db.add(models.ChatMensaje(
-                id_usuario=current_user.id_usuario,
+                id_usuario=id_usuario,
                 remitente="bot",
                 contenido=bot_turn_text,
             ))
@@ -276,6 +485,8 @@ async def voice_chat_endpoint(
             "error": result.get("error", False),
             "message": "Respuesta generada exitosamente"
         }
+        if result.get("audio_token"):
+            payload["data"]["audio_url"] = request.url_for("get_voice_audio", token=result["audio_token"]).path
 
         return JSONResponse(
             status_code=200,
@@ -302,6 +513,49 @@ async def voice_chat_endpoint(
             }
         )
 
+# ═══════════════════════════════════════════════════════════════════
+# ENDPOINT 4a: Audio de una respuesta por URL (binario, con Range)
+# ═══════════════════════════════════════════════════════════════════
+
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+def _audio_bytes_response(audio: bytes, range_header: Optional[str], headers: Dict[str, str]) -> Response:
+    """MP3 en memoria con soporte de un rango (`Range: bytes=a-b`, `a-` o `-n`)."""
+    size = len(audio)
+    headers = {"Accept-Ranges": "bytes", **headers}
+    match = _RANGE_RE.fullmatch((range_header or "").strip())
+    # Sin Range, o con varios rangos (no soportado): el archivo entero.
+    if not match or match.groups() == ("", ""):
+        return Response(audio, media_type="audio/mpeg", headers=headers)
+
+    start_text, end_text = match.groups()
+    if start_text:
+        start = int(start_text)
+        end = min(int(end_text), size - 1) if end_text else size - 1
+    else:
+        start, end = max(size - int(end_text), 0), size - 1
+    if start >= size or start > end:
+        return Response(status_code=416, headers={"Accept-Ranges": "bytes", "Content-Range": f"bytes */{size}"})
+
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(audio[start:end + 1], status_code=206, media_type="audio/mpeg", headers=headers)
+
+
+@audio_router.get("/audio/{token}", name="get_voice_audio")
+async def get_voice_audio(token: str, request: Request):
+    """
+    MP3 de una respuesta de /chat?audio_delivery=url. Si la síntesis no
+    terminó todavía, espera. Responde con Content-Length y soporta Range
+    (el <audio> del navegador pide rangos para bufferear y adelantar).
+    """
+    stored = await services.audio_store.audio_store.get(token)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="El audio no existe o ya venció")
+
+    headers = {"Cache-Control": f"private, max-age={services.audio_store.AUDIO_URL_TTL_SECONDS}"}
+    return _audio_bytes_response(stored.audio, request.headers.get("range"), headers)
+
 # ═══════════════════════════════════════════════════════════════════
 # ENDPOINT 4b: Historial de conversación del usuario logueado
 # ═══════════════════════════════════════════════════════════════════
@@ -325,7 +579,7 @@ def get_chat_history(
 
 @router.get("/test", dependencies=[Depends(rate_limit("voice-test", max_requests=5, window_seconds=60))])
 async def test_voice_pipeline_endpoint(
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_chatbot_db)
 ):
     """
     Prueba pipeline:
@@ -333,7 +587,8 @@ async def test_voice_pipeline_endpoint(
     - Chat response
     """
     try:
-        # Bloqueante (TTS + chat encadenados): ver nota en /transcribe.
+        # Diagnóstico poco frecuente: usa el pipeline sincrónico, así que va
+        # al threadpool para no bloquear el event loop.
         test_results = await run_in_threadpool(services.test_voice_pipeline, db)
         return JSONResponse(
             status_code=200,
@@ -362,8 +617,8 @@ async def synthesize_text_base64_endpoint(
     try:
         _validate_synthesize_text(text)
 
-        # Bloqueante (llamada de red a Google TTS): ver nota en /transcribe.
-        audio_bytes = await run_in_threadpool(services.text_to_speech, text)
+        # Cliente async de Google TTS: ver nota en /transcribe.
+        audio_bytes = await services.text_to_speech_async(text)
         audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
 
         return JSONResponse(
@@ -6,6 +6,20 @@ Paquete de servicios del backend, separado por responsabilidad:
 - auth_service: hashing, JWT, tokens de recuperación, historial de contraseñas.
 - email_service: envío de emails (bienvenida, notificaciones).
 - voice_service: Speech-to-Text / Text-to-Speech (Google Cloud).
+- tts_cache: cache del audio sintetizado (memoria + disco), direccionado por contenido.
+- audio_store: audio de las respuestas de voz servido por URL de vida corta (en vez de base64).
+- audio_preprocessing: formato, detección de voz y recorte del audio antes de Speech-to-Text.
+- ai_transport: modos record/replay/fake de las llamadas a Gemini y Google Speech (benchmarks sin red).
+- chat_cache: caches en memoria del pipeline del chatbot.
+- answer_renderer: respuestas finales por plantilla para resultados simples (sin segunda llamada a Gemini).
+- result_encoder: filas SQL compactas y con tope de tokens para el prompt final.
+- schema_context: esquema compacto y podado para el prompt de intención.
+- chat_history: historial acotado (con resumen) para los prompts del chatbot.
+- model_health: circuit breaker por modelo de Gemini.
+- sql_guard: validación en una pasada del SQL que genera el modelo.
+- directory_search: índice full-text (en memoria) sobre el directorio, para el chatbot y /search.
+- directory_vectors: índice de embeddings (matriz float32, memmap) para preguntas abiertas del chatbot.
+- directory_read_model: tabla directorio_empresa (una fila por empresa) para el chatbot.
 - chatbot_service: pipeline del chatbot con Gemini.
 
 Todo se re-exporta acá para que el resto del código siga usando
@@ -49,20 +63,108 @@ from app.services.email_service import (
     send_welcome_email,
 )
 
+from app.services import ai_transport
+from app.services.ai_transport import (
+    get_transport_stats,
+    reset_transport_stats,
+)
+
+from app.services import tts_cache
+from app.services.tts_cache import (
+    get_tts_cache_stats,
+    reset_tts_cache,
+)
+
+from app.services import audio_store
+from app.services.audio_store import (
+    get_audio_store_stats,
+    reset_audio_store,
+)
+
+from app.services import audio_preprocessing
+from app.services.audio_preprocessing import (
+    get_preprocessing_stats,
+    reset_preprocessing_stats,
+)
+
 from app.services import voice_service
 from app.services.voice_service import (
     VOICE_PROVIDER,
     speech_client,
     text_to_speech,
+    text_to_speech_async,
     text_to_speech_google,
     tts_client,
     transcribe_audio,
+    transcribe_audio_async,
     transcribe_audio_google,
+    stream_transcribe_async,
     get_voice_services_status,
 )
 
+from app.services import chat_cache
+from app.services.chat_cache import (
+    get_chat_cache_stats,
+    invalidate_data_caches,
+    reset_chat_caches,
+)
+
+from app.services import answer_renderer
+from app.services.answer_renderer import (
+    get_renderer_stats,
+    render_answer,
+    reset_renderer_stats,
+)
+
+from app.services import result_encoder
+from app.services.result_encoder import (
+    encode_results,
+    get_encoder_stats,
+    reset_encoder_stats,
+)
+
+from app.services import chat_history
+from app.services.chat_history import (
+    build_history_context,
+    get_history_stats,
+    reset_history_stats,
+)
+
+from app.services import model_health
+from app.services.model_health import classify_error, reset_model_health
+
+from app.services import sql_guard
+from app.services.sql_guard import SqlVerdict, validate_sql
+
+from app.services import directory_search
+from app.services.directory_search import (
+    get_search_stats,
+    reset_directory_search,
+    search_companies as search_directory,
+)
+
+from app.services import directory_vectors
+from app.services.directory_vectors import (
+    get_vector_stats,
+    reset_directory_vectors,
+    warm_index as warm_directory_vectors,
+)
+
+from app.services import directory_read_model
+from app.services.directory_read_model import (
+    refresh_directory_read_model,
+    refresh_directory_rows,
+)
+
+from app.services import schema_context
+from app.services.schema_context import (
+    get_schema_context_stats,
+    reset_schema_context_stats,
+)
+
 from app.services import chatbot_service
 from app.services.chatbot_service import (
+    CANNED_VOICE_PHRASES,
     FORBIDDEN_RESPONSE_TEXT,
     FORBIDDEN_SQL_TABLES,
     compose_fallback_response,
@@ -70,12 +172,19 @@ from app.services.chatbot_service import (
     execute_sql_query,
     extract_text_from_gemini,
     get_chat_response,
+    get_chat_response_async,
+    get_chat_response_audio_stream,
     get_chat_response_stream,
     get_chat_response_with_audio,
+    get_chat_response_with_audio_async,
+    build_schema_context,
     get_database_schema,
+    get_model_status,
     is_sql_query_allowed,
+    validate_sql_query,
     normalize_text,
     parse_intent_json,
+    prewarm_voice_cache,
     sanitize_response_text,
     test_voice_pipeline,
 )
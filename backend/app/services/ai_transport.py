@@ -0,0 +1,482 @@
+# app/services/ai_transport.py
+"""
+Transporte intercambiable para las llamadas a Gemini y a Google Speech.
+
+Para medir el pipeline (caches, concurrencia, overhead propio) hace falta
+poder correrlo sin red y sin gastar cuota. AI_TRANSPORT elige el modo:
+
+- "live" (default): llamadas reales, sin tocar nada;
+- "record": llamadas reales, y cada respuesta (con su latencia) se guarda
+  como cassette en AI_CASSETTE_DIR;
+- "replay": se responde desde los cassettes, sin red; con latencia
+  inyectada según AI_TRANSPORT_LATENCY (por default, la grabada);
+- "fake": respuestas sintéticas armadas acá (SQL de intención, respuesta
+  final a partir de las filas, transcripción y audio MP3 en silencio).
+
+Cada cassette es un JSON en AI_CASSETTE_DIR/<operación>/<clave>.json; la
+clave es un hash del pedido (prompt, audio o texto), así que la misma
+pregunta con el mismo esquema e historial vuelve a encontrar su respuesta.
+
+La latencia se describe como "none", "recorded", "fixed:MS",
+"uniform:MIN,MAX" o "lognormal:MEDIANA,SIGMA" (ms), y se puede pisar por
+operación con AI_TRANSPORT_LATENCY_GEMINI/_STT/_TTS. El sorteo usa una
+semilla fija (AI_TRANSPORT_SEED) para que dos corridas sean comparables.
+
+Para Gemini se envuelve la instancia del modelo (chatbot_service
+._get_model_instance), así los breakers, la migración de candidatos y el
+hedging se siguen ejercitando; para la voz, las funciones transcribe_audio
+y text_to_speech de voice_service.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from app.services.schema_context import PREFERRED_TABLE
+
+MODES = ("live", "record", "replay", "fake")
+
+MODE = os.getenv("AI_TRANSPORT", "live").strip().lower()
+CASSETTE_DIR = os.getenv("AI_CASSETTE_DIR", "cassettes")
+LATENCY_SPEC = os.getenv("AI_TRANSPORT_LATENCY", "")
+# Qué hacer en replay si no hay cassette: "error" (default) o "fake".
+REPLAY_MISS = os.getenv("AI_TRANSPORT_REPLAY_MISS", "error").strip().lower()
+SEED = int(os.getenv("AI_TRANSPORT_SEED", "0"))
+
+if MODE not in MODES:
+    print(f"⚠️  AI_TRANSPORT='{MODE}' no es válido ({', '.join(MODES)}): se usa 'live'")
+    MODE = "live"
+elif MODE != "live":
+    print(f" Transporte de IA en modo '{MODE}' (cassettes en {CASSETTE_DIR})")
+
+OPERATIONS = ("gemini", "stt", "tts")
+
+
+class CassetteMissError(RuntimeError):
+    """En replay, no hay cassette grabado para este pedido."""
+
+
+def is_offline() -> bool:
+    """True si las llamadas no salen a la red (replay o fake)."""
+    return MODE in ("replay", "fake")
+
+
+# ═══════════════════════════════════════════════════════════════════
+# LATENCIA INYECTADA
+# ═══════════════════════════════════════════════════════════════════
+
+_rng = random.Random(SEED)
+_rng_lock = threading.Lock()
+
+
+def parse_latency(spec: str) -> Callable[[Optional[float]], float]:
+    """
+    Spec de latencia -> función (latencia grabada en ms o None) -> ms a esperar.
+    Un spec inválido se rechaza con ValueError.
+    """
+    spec = (spec or "").strip().lower()
+    kind, _, args = spec.partition(":")
+    values = [float(value) for value in args.split(",") if value.strip()] if args else []
+
+    def _sample(draw: Callable[[random.Random], float]) -> float:
+        with _rng_lock:
+            return max(draw(_rng), 0.0)
+
+    if kind in ("", "recorded"):
+        return lambda recorded_ms: recorded_ms or 0.0
+    if kind == "none":
+        return lambda recorded_ms: 0.0
+    if kind == "fixed" and len(values) == 1:
+        return lambda recorded_ms: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda recorded_ms: _sample(lambda rng: rng.uniform(values[0], values[1]))
+    if kind == "lognormal" and len(values) == 2 and values[0] > 0:
+        mu = math.log(values[0])
+        return lambda recorded_ms: _sample(lambda rng: rng.lognormvariate(mu, values[1]))
+    raise ValueError(f"Latencia inválida: '{spec}'")
+
+
+def _latency_ms(operation: str, recorded_ms: Optional[float]) -> float:
+    spec = os.getenv(f"AI_TRANSPORT_LATENCY_{operation.upper()}", LATENCY_SPEC)
+    if not spec and MODE == "fake":
+        spec = "none"
+    return parse_latency(spec)(recorded_ms)
+
+
+# ═══════════════════════════════════════════════════════════════════
+# CASSETTES
+# ═══════════════════════════════════════════════════════════════════
+
+
+def cassette_key(operation: str, request: Dict) -> str:
+    payload = json.dumps({"operation": operation, **request}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def _cassette_path(operation: str, key: str) -> str:
+    return os.path.join(CASSETTE_DIR, operation, f"{key}.json")
+
+
+def _save_cassette(operation: str, key: str, request: Dict, response: Dict, latency_ms: float) -> None:
+    path = _cassette_path(operation, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cassette = {
+        "operation": operation,
+        "request": request,
+        "response": response,
+        "latency_ms": round(latency_ms, 1),
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    # Escritura atómica: con varios pedidos grabando a la vez no queda un JSON a medias.
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(cassette, fh, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+    _count("recorded", operation)
+
+
+def _load_cassette(operation: str, key: str) -> Optional[Dict]:
+    try:
+        with open(_cassette_path(operation, key), encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def _lookup(operation: str, key: str) -> Optional[Dict]:
+    """Cassette para el replay, o None si hay que caer al fake."""
+    cassette = _load_cassette(operation, key)
+    if cassette is not None:
+        _count("replayed", operation)
+        return cassette
+    _count("misses", operation)
+    if REPLAY_MISS == "fake":
+        return None
+    raise CassetteMissError(f"Sin cassette para {operation} ({key}) en {CASSETTE_DIR}")
+
+
+# ═══════════════════════════════════════════════════════════════════
+# GEMINI
+# ═══════════════════════════════════════════════════════════════════
+
+
+class TextResponse:
+    """Respuesta mínima compatible con extract_text_from_gemini (tiene `.text`)."""
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.candidates = []
+
+
+def _response_text(response) -> str:
+    try:
+        return getattr(response, "text", None) or ""
+    except ValueError:
+        # Respuesta bloqueada: se graba vacía, igual que la ve el pipeline.
+        return ""
+
+
+def _gemini_request(prompt, generation_config) -> Dict:
+    return {
+        "prompt": str(prompt),
+        "json": getattr(generation_config, "response_mime_type", None) == "application/json",
+    }
+
+
+def _split_fragments(text_value: str, size: int = 4) -> List[str]:
+    words = re.findall(r"\S+\s*", text_value)
+    return ["".join(words[i : i + size]) for i in range(0, len(words), size)] or [text_value]
+
+
+class TransportModel:
+    """
+    Reemplazo de genai.GenerativeModel para los modos record, replay y
+    fake. Implementa lo que usa chatbot_service: generate_content (con y
+    sin stream) y generate_content_async.
+    """
+
+    def __init__(self, name: str, live_model) -> None:
+        self.model_name = name
+        self._live = live_model
+
+    def _replayed(self, request: Dict) -> Tuple[List[str], float]:
+        """(fragmentos, ms a esperar) desde cassette o fake."""
+        cassette = _lookup("gemini", cassette_key("gemini", request)) if MODE == "replay" else None
+        if cassette is not None:
+            response = cassette["response"]
+            return response.get("fragments") or [response.get("text", "")], _latency_ms(
+                "gemini", cassette.get("latency_ms")
+            )
+        _count("fake", "gemini")
+        text_value = fake_intent(request["prompt"]) if request["json"] else fake_answer(request["prompt"])
+        return _split_fragments(text_value), _latency_ms("gemini", None)
+
+    def generate_content(self, prompt, generation_config=None, stream: bool = False):
+        request = _gemini_request(prompt, generation_config)
+        _count("calls", "gemini")
+        if MODE == "record":
+            return self._record_stream(prompt, generation_config, request) if stream else self._record(
+                prompt, generation_config, request
+            )
+        fragments, latency_ms = self._replayed(request)
+        if stream:
+            return self._paced(fragments, latency_ms)
+        time.sleep(latency_ms / 1000)
+        return TextResponse("".join(fragments))
+
+    async def generate_content_async(self, prompt, generation_config=None):
+        request = _gemini_request(prompt, generation_config)
+        _count("calls", "gemini")
+        if MODE == "record":
+            started = time.perf_counter()
+            response = await self._live.generate_content_async(prompt, generation_config=generation_config)
+            self._save(request, [_response_text(response)], started)
+            return response
+        fragments, latency_ms = self._replayed(request)
+        await asyncio.sleep(latency_ms / 1000)
+        return TextResponse("".join(fragments))
+
+    @staticmethod
+    def _paced(fragments: List[str], latency_ms: float) -> Iterator[TextResponse]:
+        # La latencia se reparte entre los fragmentos: el primero llega antes que el total.
+        delay = latency_ms / 1000 / max(len(fragments), 1)
+        for fragment in fragments:
+            time.sleep(delay)
+            yield TextResponse(fragment)
+
+    def _record(self, prompt, generation_config, request: Dict):
+        started = time.perf_counter()
+        response = self._live.generate_content(prompt, generation_config=generation_config)
+        self._save(request, [_response_text(response)], started)
+        return response
+
+    def _record_stream(self, prompt, generation_config, request: Dict):
+        started = time.perf_counter()
+        fragments = []
+        for chunk in self._live.generate_content(prompt, generation_config=generation_config, stream=True):
+            fragments.append(_response_text(chunk))
+            yield chunk
+        # Solo streams completos: si el cliente cortó antes, no se graba.
+        self._save(request, fragments, started)
+
+    @staticmethod
+    def _save(request: Dict, fragments: List[str], started: float) -> None:
+        fragments = [fragment for fragment in fragments if fragment]
+        response = {"text": "".join(fragments), "fragments": fragments}
+        _save_cassette(
+            "gemini", cassette_key("gemini", request), request, response, (time.perf_counter() - started) * 1000
+        )
+
+
+def wrap_model(name: str, live_model):
+    """El modelo tal cual en modo live; si no, un TransportModel que lo envuelve."""
+    if MODE == "live":
+        return live_model
+    return TransportModel(name, live_model)
+
+
+# ═══════════════════════════════════════════════════════════════════
+# RESPUESTAS SINTÉTICAS (modo fake)
+# ═══════════════════════════════════════════════════════════════════
+
+_QUESTION_RE = re.compile(r'Consulta del usuario \(texto libre normalizado\): "(.*)"')
+_RESULTS_RE = re.compile(r"Resultados de la consulta:\n(.*?)\nPregunta:", re.DOTALL)
+_GREETING_RE = re.compile(r"^(hola|buen[oa]s|gracias|chau|hey|que tal)\b")
+_CONTACT_RE = re.compile(r"\b(telefono|contacto|direccion|correo|mail|web)\b")
+_STOPWORDS = {
+    "que", "quien", "quienes", "hay", "alguna", "alguno", "algun", "empresa", "empresas", "del", "de",
+    "la", "el", "los", "las", "un", "una", "en", "para", "por", "con", "me", "mi", "se", "y", "o", "a",
+    "donde", "como", "cual", "cuales", "parque", "polo", "vende", "venden", "busco", "necesito",
+    "telefono", "contacto", "direccion", "correo", "mail", "web", "dame", "decime", "tiene", "tienen",
+}
+
+FAKE_TRANSCRIPTS = [
+    "que empresas de logistica hay en el parque",
+    "cuantas empresas hay en el parque",
+    "quien vende tornillos",
+    "telefono de logistica express",
+]
+
+
+def _keywords(question: str) -> List[str]:
+    return [word for word in re.findall(r"[a-z0-9]+", question) if word not in _STOPWORDS and len(word) > 2]
+
+
+def fake_intent(prompt: str) -> str:
+    """JSON de intención plausible a partir de la pregunta que viene en el prompt."""
+    match = _QUESTION_RE.search(prompt)
+    question = match.group(1) if match else ""
+    intent = {"needs_more_info": False, "sql_query": "", "search_query": "", "direct_answer": ""}
+    keywords = _keywords(question)
+    if _GREETING_RE.search(question):
+        intent["direct_answer"] = "¡Hola! Soy POLO, el asistente del parque. ¿En qué te puedo ayudar?"
+    elif "cuant" in question:
+        intent["sql_query"] = f"SELECT COUNT(*) AS total FROM {PREFERRED_TABLE}"
+    elif _CONTACT_RE.search(question) and keywords:
+        intent["sql_query"] = (
+            f"SELECT nombre, contacto_telefono, contacto_direccion FROM {PREFERRED_TABLE} "
+            f"WHERE LOWER(nombre) LIKE '%{keywords[0]}%' LIMIT 5"
+        )
+    elif keywords:
+        intent["search_query"] = " ".join(keywords[:3])
+    else:
+        intent["sql_query"] = f"SELECT nombre, rubro FROM {PREFERRED_TABLE} LIMIT 10"
+    return json.dumps(intent, ensure_ascii=False)
+
+
+def fake_answer(prompt: str) -> str:
+    """Respuesta final armada con las primeras filas que vienen en el prompt."""
+    match = _RESULTS_RE.search(prompt)
+    lines = [line for line in (match.group(1).splitlines() if match else []) if line.strip()]
+    if not lines or lines[0].startswith("(sin resultados)"):
+        return "No encontré resultados para esa consulta en el parque. ¿Querés que busque otra cosa?"
+    if " | " in lines[0]:
+        rows = [line.split(" | ")[0] for line in lines[1:4] if not line.startswith("(")]
+        return f"Encontré esto en el parque: {', '.join(rows)}."
+    return f"Según los datos del parque: {'; '.join(lines[:3])}."
+
+
+# MP3 MPEG-1 Layer III, 128 kbps, 44.1 kHz, sin padding: 417 bytes por
+# cuadro (~26 ms). Con el resto en cero el cuadro decodifica como silencio.
+_SILENT_MP3_FRAME = b"\xff\xfb\x90\x00" + b"\x00" * 413
+_MP3_FRAME_SECONDS = 1152 / 44100
+# Velocidad de habla aproximada de la voz de Google, en caracteres por segundo.
+_CHARS_PER_SECOND = 15
+
+
+def fake_audio(text_value: str) -> bytes:
+    """MP3 en silencio con la duración aproximada que tendría el texto hablado."""
+    seconds = max(len(text_value) / _CHARS_PER_SECOND, 0.5)
+    return _SILENT_MP3_FRAME * int(seconds / _MP3_FRAME_SECONDS)
+
+
+def fake_transcript(audio_content: bytes) -> str:
+    forced = os.getenv("AI_FAKE_TRANSCRIPT")
+    if forced:
+        return forced
+    digest = hashlib.sha256(audio_content).digest()
+    return FAKE_TRANSCRIPTS[digest[0] % len(FAKE_TRANSCRIPTS)]
+
+
+# ═══════════════════════════════════════════════════════════════════
+# VOZ (STT / TTS)
+# ═══════════════════════════════════════════════════════════════════
+
+
+def _stt_request(audio_content: bytes, language_code: str) -> Dict:
+    return {
+        "audio_sha256": hashlib.sha256(audio_content).hexdigest(),
+        "audio_bytes": len(audio_content),
+        "language_code": language_code,
+    }
+
+
+def _offline_voice(operation: str, request: Dict, fake: Callable[[], object]):
+    """(resultado, ms a esperar) para replay o fake."""
+    cassette = _lookup(operation, cassette_key(operation, request)) if MODE == "replay" else None
+    if cassette is not None:
+        response = cassette["response"]
+        result = response["transcript"] if operation == "stt" else base64.b64decode(response["audio_b64"])
+        return result, _latency_ms(operation, cassette.get("latency_ms"))
+    _count("fake", operation)
+    return fake(), _latency_ms(operation, None)
+
+
+def _voice_response(operation: str, result) -> Dict:
+    if operation == "stt":
+        return {"transcript": result}
+    return {"audio_b64": base64.b64encode(result).decode("ascii")}
+
+
+def _call_voice(operation: str, request: Dict, live: Callable[[], object], fake: Callable[[], object]):
+    _count("calls", operation)
+    if MODE == "record":
+        started = time.perf_counter()
+        result = live()
+        _save_cassette(
+            operation, cassette_key(operation, request), request, _voice_response(operation, result),
+            (time.perf_counter() - started) * 1000,
+        )
+        return result
+    result, latency_ms = _offline_voice(operation, request, fake)
+    time.sleep(latency_ms / 1000)
+    return result
+
+
+async def _call_voice_async(
+    operation: str, request: Dict, live: Callable[[], Awaitable], fake: Callable[[], object]
+):
+    _count("calls", operation)
+    if MODE == "record":
+        started = time.perf_counter()
+        result = await live()
+        _save_cassette(
+            operation, cassette_key(operation, request), request, _voice_response(operation, result),
+            (time.perf_counter() - started) * 1000,
+        )
+        return result
+    result, latency_ms = _offline_voice(operation, request, fake)
+    await asyncio.sleep(latency_ms / 1000)
+    return result
+
+
+def transcribe(audio_content: bytes, language_code: str, live: Callable[[bytes, str], str]) -> str:
+    return _call_voice(
+        "stt", _stt_request(audio_content, language_code),
+        lambda: live(audio_content, language_code), lambda: fake_transcript(audio_content),
+    )
+
+
+async def transcribe_async(
+    audio_content: bytes, language_code: str, live: Callable[[bytes, str], Awaitable[str]]
+) -> str:
+    return await _call_voice_async(
+        "stt", _stt_request(audio_content, language_code),
+        lambda: live(audio_content, language_code), lambda: fake_transcript(audio_content),
+    )
+
+
+def synthesize(text_value: str, live: Callable[[str], bytes]) -> bytes:
+    return _call_voice("tts", {"text": text_value}, lambda: live(text_value), lambda: fake_audio(text_value))
+
+
+async def synthesize_async(text_value: str, live: Callable[[str], Awaitable[bytes]]) -> bytes:
+    return await _call_voice_async(
+        "tts", {"text": text_value}, lambda: live(text_value), lambda: fake_audio(text_value)
+    )
+
+
+# ═══════════════════════════════════════════════════════════════════
+# MÉTRICAS
+# ═══════════════════════════════════════════════════════════════════
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, Dict[str, int]] = {}
+
+
+def _count(event: str, operation: str) -> None:
+    with _stats_lock:
+        by_operation = _stats.setdefault(event, {})
+        by_operation[operation] = by_operation.get(operation, 0) + 1
+
+
+def get_transport_stats() -> Dict:
+    with _stats_lock:
+        stats = {event: dict(by_operation) for event, by_operation in _stats.items()}
+    return {"mode": MODE, "cassette_dir": CASSETTE_DIR if MODE in ("record", "replay") else None, **stats}
+
+
+def reset_transport_stats() -> None:
+    """Pone los contadores en cero. Pensado para tests."""
+    global _rng
+    with _stats_lock:
+        _stats.clear()
+    with _rng_lock:
+        _rng = random.Random(SEED)
@@ -0,0 +1,248 @@
+# app/services/answer_renderer.py
+"""
+Respuestas finales armadas con plantillas, sin la segunda llamada a Gemini.
+
+Buena parte de las preguntas del tótem terminan en resultados que no hace
+falta "redactar": el teléfono de una empresa, la lista de empresas de un
+rubro, la manzana y el lote de un lote, un conteo. Para esos casos la
+respuesta final de Gemini (1-2 s) solo reformula lo que ya está en las
+filas. Acá se elige por la forma del resultado y el tipo de pregunta:
+
+- "count": una fila con un único número (COUNT, total, cantidad);
+- "location": una empresa y su manzana/lote;
+- "single_fact": una fila con nombre y hasta MAX_FACT_FIELDS datos cortos;
+- "name_list": varias filas con el nombre y, a lo sumo, un dato corto.
+
+Todo lo demás (sin resultados, textos largos, muchas columnas, filas de
+una búsqueda full-text o semántica, preguntas que piden comparar,
+recomendar o explicar) sigue yendo a Gemini. compose_fallback_response
+(chatbot_service) sigue siendo el último recurso cuando Gemini falla.
+
+Los contadores (respuestas por plantilla vs. por modelo) salen en /health.
+"""
+import os
+import re
+import threading
+from datetime import date
+from typing import AbstractSet, Dict, List, Optional, Tuple
+
+TEMPLATE_ANSWERS_ENABLED = os.getenv("CHAT_TEMPLATE_ANSWERS", "true").lower() not in ("0", "false", "no")
+
+MAX_FACT_FIELDS = 3
+MAX_LIST_ROWS = 15
+# Un valor más largo que esto ("productos_servicios" con un párrafo) se deja
+# para que Gemini lo resuma.
+MAX_VALUE_LENGTH = 120
+
+HIDDEN_COLUMNS = {"id", "cuil", "id_usuario", "id_empresa"}
+
+# Preguntas que piden criterio, no solo datos (sobre el texto normalizado).
+_SYNTHESIS_RE = re.compile(
+    r"\b(por que|porque|compar\w*|recomend\w*|conviene|mejor(es)?|peor(es)?|diferencia\w*|"
+    r"explic\w*|resum\w*|como (hago|puedo|llego|funciona)|que opinas|suger\w*|ventaja\w*)\b"
+)
+_COUNT_COLUMN_RE = re.compile(r"(count|cantidad|total|cuant)")
+
+# Columna -> cómo nombrarla en la respuesta.
+FIELD_LABELS: Dict[str, str] = {
+    "telefono": "teléfono",
+    "contacto_telefono": "teléfono",
+    "direccion": "dirección",
+    "contacto_direccion": "dirección",
+    "contacto_nombre": "contacto",
+    "contacto_datos": "datos de contacto",
+    "datos": "datos de contacto",
+    "horario_trabajo": "horario",
+    "horario_atencion_comercial": "horario de atención",
+    "cant_empleados": "empleados",
+    "fecha_ingreso": "en el parque desde",
+    "servicios_polo": "espacios en el parque",
+    "productos_servicios": "productos y servicios",
+    "rango_precios": "precios",
+    "modalidad_venta": "modalidad de venta",
+    "marcas_representadas": "marcas",
+    "publico_objetivo": "público",
+    "atiende_publico": "atiende al público",
+}
+
+# Tabla de la consulta -> (singular, plural) para el encabezado de una lista.
+# Si la consulta lee otra tabla, o varias, el encabezado es neutro.
+LIST_NOUNS: Dict[str, Tuple[str, str]] = {
+    "empresa": ("esta empresa", "empresas"),
+    "directorio_empresa": ("esta empresa", "empresas"),
+    "contacto": ("este contacto", "contactos"),
+    "servicio_polo": ("este servicio", "servicios"),
+    "lotes": ("este lote", "lotes"),
+}
+_NEUTRAL_NOUNS = ("este resultado", "resultados")
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, object] = {"template": 0, "model": 0, "by_shape": {}}
+
+
+def is_hidden_column(key: str) -> bool:
+    key_lower = key.lower()
+    return key_lower in HIDDEN_COLUMNS or key_lower.startswith("id_") or key_lower.endswith("_id")
+
+
+def format_value(value) -> Optional[str]:
+    """Valor de una fila -> texto para mostrar (None si está vacío)."""
+    if value in (None, "", []):
+        return None
+    if isinstance(value, bool):
+        return "sí" if value else "no"
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, (list, tuple, set)):
+        return ", ".join(str(item) for item in value if item not in (None, "")) or None
+    if isinstance(value, dict):
+        sub_parts = []
+        for sub_key, sub_value in value.items():
+            if sub_value in (None, "", []):
+                continue
+            sub_label = sub_key.replace("_", " ").capitalize()
+            sub_parts.append(f"{sub_label}: {sub_value}")
+        return ", ".join(sub_parts) or None
+    return str(value)
+
+
+def _label(key: str) -> str:
+    return FIELD_LABELS.get(key.lower(), key.replace("_", " ").lower())
+
+
+def _split_row(row: Dict) -> Optional[Tuple[Optional[str], List[Tuple[str, str]]]]:
+    """(nombre, [(columna, valor)]) de una fila; None si algún valor es largo o no es una fila."""
+    if not isinstance(row, dict):
+        return None
+    name = None
+    details: List[Tuple[str, str]] = []
+    for key, value in row.items():
+        if is_hidden_column(key):
+            continue
+        text_value = format_value(value)
+        if text_value is None:
+            continue
+        if len(text_value) > MAX_VALUE_LENGTH:
+            return None
+        if name is None and key.lower().startswith("nombre"):
+            name = text_value
+        else:
+            details.append((key, text_value))
+    return name, details
+
+
+def _join(items: List[str]) -> str:
+    return items[0] if len(items) == 1 else f"{', '.join(items[:-1])} y {items[-1]}"
+
+
+def _render_count(row: Dict) -> Optional[str]:
+    if len(row) != 1:
+        return None
+    key, value = next(iter(row.items()))
+    if isinstance(value, bool) or not isinstance(value, int) or not _COUNT_COLUMN_RE.search(key.lower()):
+        return None
+    return f"En total son {value}."
+
+
+def _render_single(row: Dict) -> Optional[Tuple[str, str]]:
+    split = _split_row(row)
+    if split is None:
+        return None
+    name, details = split
+    if not details or len(details) > MAX_FACT_FIELDS:
+        return None
+    by_key = {key.lower(): value for key, value in details}
+    if name and set(by_key) <= {"manzana", "lote"}:
+        location = ", ".join(f"{key} {by_key[key]}" for key in ("manzana", "lote") if key in by_key)
+        return "location", f"{name} está en la {location}."
+    facts = _join([f"{_label(key)}: {value}" for key, value in details])
+    if name:
+        return "single_fact", f"{name}: {facts}."
+    return "single_fact", f"{facts[0].upper()}{facts[1:]}."
+
+
+def _list_header(count: int, tables: Optional[AbstractSet[str]]) -> str:
+    singular, plural = _NEUTRAL_NOUNS
+    if tables and len(tables) == 1:
+        singular, plural = LIST_NOUNS.get(next(iter(tables)), _NEUTRAL_NOUNS)
+    return f"Encontré {count} {plural}:" if count > 1 else f"Encontré {singular}:"
+
+
+def _render_list(rows: List[Dict], truncated: bool, tables: Optional[AbstractSet[str]]) -> Optional[str]:
+    if len(rows) > MAX_LIST_ROWS:
+        return None
+    lines = []
+    for row in rows:
+        split = _split_row(row)
+        if split is None:
+            return None
+        name, details = split
+        if not name or len(details) > 1:
+            return None
+        lines.append(f"- {name} ({details[0][1]})" if details else f"- {name}")
+    lines = list(dict.fromkeys(lines))
+    text_value = "\n".join([_list_header(len(lines), tables)] + lines)
+    if truncated:
+        text_value += "\nHay más resultados: probá con una búsqueda más específica."
+    return text_value
+
+
+def render_answer(
+    user_input: str,
+    db_results: List[Dict],
+    truncated: bool = False,
+    from_search: bool = False,
+    tables: Optional[AbstractSet[str]] = None,
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    (texto, forma) si el resultado se puede contar con una plantilla, o
+    (None, None) si conviene que lo redacte Gemini. `user_input` es la
+    pregunta ya normalizada (sin acentos, en minúsculas); `from_search`
+    indica filas de una búsqueda rankeada, que Gemini elige y resume;
+    `tables`, las tablas que leyó el SQL (para nombrar lo que se lista).
+    """
+    if not TEMPLATE_ANSWERS_ENABLED or from_search or not db_results:
+        return None, None
+    if not isinstance(db_results[0], dict) or db_results[0].get("error"):
+        return None, None
+    if _SYNTHESIS_RE.search(user_input or ""):
+        return None, None
+
+    if len(db_results) == 1 and not truncated:
+        text_value = _render_count(db_results[0])
+        if text_value:
+            return text_value, "count"
+        rendered = _render_single(db_results[0])
+        if rendered:
+            return rendered[1], rendered[0]
+
+    text_value = _render_list(db_results, truncated, tables)
+    if text_value:
+        return text_value, "name_list"
+    return None, None
+
+
+def record_final_answer(shape: Optional[str]) -> None:
+    """Contar una respuesta final: por plantilla (`shape`) o por el modelo (None)."""
+    with _stats_lock:
+        if shape is None:
+            _stats["model"] += 1
+        else:
+            _stats["template"] += 1
+            _stats["by_shape"][shape] = _stats["by_shape"].get(shape, 0) + 1
+
+
+def get_renderer_stats() -> Dict:
+    with _stats_lock:
+        stats = {"template": _stats["template"], "model": _stats["model"], "by_shape": dict(_stats["by_shape"])}
+    total = stats["template"] + stats["model"]
+    stats["llm_skip_rate"] = round(stats["template"] / total, 4) if total else 0.0
+    stats["enabled"] = TEMPLATE_ANSWERS_ENABLED
+    return stats
+
+
+def reset_renderer_stats() -> None:
+    with _stats_lock:
+        _stats["template"] = 0
+        _stats["model"] = 0
+        _stats["by_shape"] = {}
@@ -0,0 +1,368 @@
+# app/services/audio_preprocessing.py
+"""
+Preprocesamiento local del audio antes de Speech-to-Text.
+
+transcribe_audio_google mandaba cualquier cosa que llegara como WEBM_OPUS a
+48 kHz: un toque al tótem sin hablar, un archivo vacío o uno enorme pagaban
+igual un viaje completo a Google (y otro al TTS para decir el error). Acá,
+en milisegundos y sin red:
+
+- se reconoce el contenedor y el códec por los primeros bytes (WebM/Opus,
+  Ogg/Opus, WAV, FLAC, MP3) y se arma la configuración de Google acorde;
+  lo que Google no acepta (AAC de Safari o en ADTS, Vorbis) se rechaza con 415;
+- se rechaza lo que pasa VOICE_MAX_AUDIO_BYTES (límite del request de
+  Google) y lo que dura más de VOICE_MAX_AUDIO_SECONDS (el WAV se recorta);
+- detección de voz por energía: un clip sin voz no se manda. En PCM (WAV)
+  es la energía RMS por ventanas de 20 ms. En Opus no hay decodificador
+  local, así que se usa el tamaño de cada paquete como indicador de
+  energía: el silencio digital o casi (micrófono muteado, supresión de
+  ruido del navegador) sale en paquetes de pocos bytes;
+- el WAV se pasa a mono, 16 kHz y 16 bits, sin el silencio de los bordes:
+  es lo mínimo que Google necesita para voz. Opus ya viaja comprimido y
+  queda como está (recodificarlo necesitaría libopus).
+
+Los formatos que no se reconocen pasan sin tocar, como antes (WEBM_OPUS).
+"""
+import io
+import os
+import struct
+import threading
+import time
+import wave
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+
+PREPROCESSING_ENABLED = os.getenv("VOICE_PREPROCESSING", "true").lower() not in ("0", "false", "no")
+MAX_AUDIO_BYTES = int(os.getenv("VOICE_MAX_AUDIO_BYTES", str(10 * 1024 * 1024)))
+# Google corta el reconocimiento sincrónico en 60 segundos.
+MAX_AUDIO_SECONDS = float(os.getenv("VOICE_MAX_AUDIO_SECONDS", "55"))
+MIN_SPEECH_MS = float(os.getenv("VOICE_VAD_MIN_SPEECH_MS", "200"))
+VAD_THRESHOLD_DBFS = float(os.getenv("VOICE_VAD_THRESHOLD_DBFS", "-45"))
+# Bytes por cada 20 ms de Opus a partir de los cuales un paquete cuenta como voz.
+OPUS_MIN_VOICED_BYTES = int(os.getenv("VOICE_VAD_OPUS_MIN_BYTES", "20"))
+
+TARGET_SAMPLE_RATE = 16000
+FRAME_MS = 20
+EDGE_PADDING_MS = 300
+
+
+class AudioRejected(Exception):
+    """El audio no vale un viaje a Google. `reason`: empty, silent, too_large, too_long o unsupported."""
+
+    def __init__(self, reason: str, message: str) -> None:
+        super().__init__(message)
+        self.reason = reason
+
+
+@dataclass(frozen=True)
+class AudioFormat:
+    container: str
+    # Nombre del valor de RecognitionConfig.AudioEncoding; None = no soportado por Google.
+    encoding: Optional[str]
+    # None = Google lo lee de la cabecera (WAV, FLAC).
+    sample_rate_hertz: Optional[int]
+
+
+@dataclass
+class PreparedAudio:
+    content: bytes
+    format: AudioFormat
+    duration_ms: Optional[float] = None
+    voiced_ms: Optional[float] = None
+
+
+UNKNOWN_FORMAT = AudioFormat("unknown", "WEBM_OPUS", 48000)
+
+
+def sniff_format(data: bytes) -> AudioFormat:
+    """Contenedor y códec a partir de la cabecera."""
+    head = data[:4096]
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return AudioFormat("webm", "WEBM_OPUS" if b"A_OPUS" in head else None, 48000)
+    if head.startswith(b"OggS"):
+        return AudioFormat("ogg", "OGG_OPUS" if b"OpusHead" in head else None, 48000)
+    if head.startswith(b"RIFF") and head[8:12] == b"WAVE":
+        return AudioFormat("wav", "LINEAR16", None)
+    if head.startswith(b"fLaC"):
+        return AudioFormat("flac", "FLAC", None)
+    if len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        # Mismo sincronismo que MP3, pero capa 00: AAC en ADTS (0xFFF1 / 0xFFF9).
+        if head[1] & 0x06 == 0:
+            return AudioFormat("aac", None, None)
+        return AudioFormat("mp3", "MP3", None)
+    if head.startswith(b"ID3"):
+        return AudioFormat("mp3", "MP3", None)
+    if head[4:8] == b"ftyp":
+        return AudioFormat("mp4", None, None)
+    return UNKNOWN_FORMAT
+
+
+# ═══════════════════════════════════════════════════════════════════
+# OPUS: paquetes desde WebM u Ogg, sin decodificar
+# ═══════════════════════════════════════════════════════════════════
+
+_EBML_CONTAINERS = {0x18538067, 0x1F43B675, 0xA0}  # Segment, Cluster, BlockGroup
+_EBML_BLOCKS = {0xA3, 0xA1}  # SimpleBlock, Block
+
+
+def _read_vint(data: bytes, pos: int, keep_marker: bool = False):
+    first = data[pos]
+    length, mask = 1, 0x80
+    while length <= 8 and not first & mask:
+        length += 1
+        mask >>= 1
+    if length > 8 or pos + length > len(data):
+        raise ValueError("vint inválido")
+    value = first if keep_marker else first & (mask - 1)
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    return value, length
+
+
+def _webm_packets(data: bytes) -> List[bytes]:
+    """Paquetes Opus de los SimpleBlock/Block de un WebM (el del MediaRecorder: sin lacing)."""
+    packets = []
+    pos = 0
+    try:
+        while pos < len(data):
+            element_id, length = _read_vint(data, pos, keep_marker=True)
+            pos += length
+            size, length = _read_vint(data, pos)
+            pos += length
+            unknown_size = size == (1 << (7 * length)) - 1
+            if element_id in _EBML_CONTAINERS:
+                # Los hijos siguen a continuación: basta con seguir leyendo.
+                continue
+            if unknown_size or pos + size > len(data):
+                break
+            if element_id in _EBML_BLOCKS:
+                _, track_length = _read_vint(data, pos)
+                header = track_length + 3  # pista + timecode (2) + flags (1)
+                flags = data[pos + track_length + 2]
+                if not flags & 0x06 and size > header:
+                    packets.append(data[pos + header:pos + size])
+            pos += size
+    except (IndexError, ValueError):
+        pass  # grabación cortada: se usa lo que se llegó a leer
+    return packets
+
+
+def _ogg_packets(data: bytes) -> List[bytes]:
+    """Paquetes de un Ogg, sin los dos de cabecera (OpusHead y OpusTags)."""
+    packets: List[bytes] = []
+    current = bytearray()
+    pos = 0
+    while pos + 27 <= len(data) and data[pos:pos + 4] == b"OggS":
+        segments = data[pos + 26]
+        table = data[pos + 27:pos + 27 + segments]
+        pos += 27 + segments
+        for lacing in table:
+            current += data[pos:pos + lacing]
+            pos += lacing
+            if lacing < 255:
+                packets.append(bytes(current))
+                current = bytearray()
+    return packets[2:]
+
+
+_SILK_FRAME_MS = (10, 20, 40, 60)
+_HYBRID_FRAME_MS = (10, 20)
+_CELT_FRAME_MS = (2.5, 5, 10, 20)
+
+
+def _opus_packet_ms(packet: bytes) -> float:
+    """Duración de un paquete Opus según su byte TOC (RFC 6716, 3.1)."""
+    toc = packet[0]
+    config = toc >> 3
+    if config < 12:
+        frame_ms = _SILK_FRAME_MS[config % 4]
+    elif config < 16:
+        frame_ms = _HYBRID_FRAME_MS[config % 2]
+    else:
+        frame_ms = _CELT_FRAME_MS[config % 4]
+    code = toc & 0x03
+    if code == 0:
+        frames = 1
+    elif code in (1, 2):
+        frames = 2
+    else:
+        frames = packet[1] & 0x3F if len(packet) > 1 else 0
+    return frame_ms * frames
+
+
+def _analyze_opus(packets: List[bytes]):
+    """(duración total, duración con voz) en ms."""
+    duration_ms = voiced_ms = 0.0
+    for packet in packets:
+        if not packet:
+            continue
+        packet_ms = _opus_packet_ms(packet)
+        duration_ms += packet_ms
+        if packet_ms and len(packet) * FRAME_MS / packet_ms >= OPUS_MIN_VOICED_BYTES:
+            voiced_ms += packet_ms
+    return duration_ms, voiced_ms
+
+
+# ═══════════════════════════════════════════════════════════════════
+# PCM (WAV): energía, recorte y remuestreo
+# ═══════════════════════════════════════════════════════════════════
+
+def _read_wav(data: bytes):
+    """(muestras mono float32 en [-1, 1], frecuencia), o None si no es PCM de 16 bits."""
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            if wav.getsampwidth() != 2 or wav.getcomptype() != "NONE":
+                return None
+            channels = wav.getnchannels()
+            rate = wav.getframerate()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError, struct.error):
+        return None
+    samples = np.frombuffer(frames[: len(frames) - len(frames) % (2 * channels)], dtype="<i2")
+    samples = samples.reshape(-1, channels).astype(np.float32).mean(axis=1) / 32768.0
+    return samples, rate
+
+
+def _frame_energy_dbfs(samples: np.ndarray, rate: int) -> np.ndarray:
+    frame = max(1, rate * FRAME_MS // 1000)
+    usable = len(samples) - len(samples) % frame
+    if usable == 0:
+        return np.zeros(0, dtype=np.float32)
+    rms = np.sqrt(np.mean(np.square(samples[:usable].reshape(-1, frame)), axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def _resample(samples: np.ndarray, rate: int, target: int) -> np.ndarray:
+    if rate <= target:
+        return samples
+    # Promedio por bloques antes de interpolar: filtro pasabajos barato para no plegar agudos.
+    factor = rate // target
+    if factor > 1:
+        usable = len(samples) - len(samples) % factor
+        samples = samples[:usable].reshape(-1, factor).mean(axis=1)
+        rate //= factor
+    if rate != target:
+        positions = np.arange(0, len(samples) * target / rate) * rate / target
+        samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+    return samples
+
+
+def _encode_wav(samples: np.ndarray, rate: int) -> bytes:
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def _prepare_wav(data: bytes, audio_format: AudioFormat) -> PreparedAudio:
+    decoded = _read_wav(data)
+    if decoded is None:
+        # LINEAR16 es solo PCM de 16 bits: Google rechazaría el resto igual.
+        raise AudioRejected("unsupported", "Formato de audio no soportado (WAV que no es PCM de 16 bits)")
+    samples, rate = decoded
+    energy = _frame_energy_dbfs(samples, rate)
+    voiced = np.flatnonzero(energy > VAD_THRESHOLD_DBFS)
+    duration_ms = len(samples) * 1000 / rate
+    voiced_ms = float(len(voiced) * FRAME_MS)
+    if voiced_ms < MIN_SPEECH_MS:
+        return PreparedAudio(data, audio_format, duration_ms, voiced_ms)
+
+    # Sin el silencio de los bordes (con un margen) y con el tope de duración.
+    frame = rate * FRAME_MS // 1000
+    padding = rate * EDGE_PADDING_MS // 1000
+    start = max(0, voiced[0] * frame - padding)
+    end = min(len(samples), (voiced[-1] + 1) * frame + padding, start + int(MAX_AUDIO_SECONDS * rate))
+    samples = _resample(samples[start:end], rate, TARGET_SAMPLE_RATE)
+    rate = min(rate, TARGET_SAMPLE_RATE)
+    content = _encode_wav(samples, rate)
+    return PreparedAudio(content, AudioFormat("wav", "LINEAR16", rate), len(samples) * 1000 / rate, voiced_ms)
+
+
+# ═══════════════════════════════════════════════════════════════════
+# ENTRADA
+# ═══════════════════════════════════════════════════════════════════
+
+_stats_lock = threading.Lock()
+_stats = {"processed": 0, "rejected": {}, "bytes_in": 0, "bytes_out": 0, "total_ms": 0.0}
+
+
+def prepare_audio(data: bytes) -> PreparedAudio:
+    """
+    Dejar el audio listo para Google o rechazarlo (AudioRejected) sin
+    llamar a nadie. Con VOICE_PREPROCESSING=false solo se reconoce el formato.
+    """
+    started = time.perf_counter()
+    try:
+        prepared = _prepare(data)
+    except AudioRejected as rejected:
+        _record(data, None, started, rejected.reason)
+        raise
+    _record(data, prepared, started, None)
+    return prepared
+
+
+def _prepare(data: bytes) -> PreparedAudio:
+    if not data:
+        raise AudioRejected("empty", "El audio está vacío")
+    audio_format = sniff_format(data)
+    if not PREPROCESSING_ENABLED:
+        return PreparedAudio(data, audio_format)
+    if len(data) > MAX_AUDIO_BYTES:
+        raise AudioRejected("too_large", f"El audio es demasiado grande (máximo {MAX_AUDIO_BYTES // (1024 * 1024)} MB)")
+    if audio_format.encoding is None:
+        raise AudioRejected("unsupported", f"Formato de audio no soportado ({audio_format.container})")
+
+    if audio_format.container == "wav":
+        prepared = _prepare_wav(data, audio_format)
+    elif audio_format.container in ("webm", "ogg"):
+        packets = _webm_packets(data) if audio_format.container == "webm" else _ogg_packets(data)
+        if packets:
+            prepared = PreparedAudio(data, audio_format, *_analyze_opus(packets))
+        else:
+            # No se pudo leer ningún paquete: mejor que decida Google.
+            prepared = PreparedAudio(data, audio_format)
+    else:
+        prepared = PreparedAudio(data, audio_format)
+
+    if prepared.voiced_ms is not None and prepared.voiced_ms < MIN_SPEECH_MS:
+        raise AudioRejected("silent", "No se detectó voz en el audio")
+    if prepared.duration_ms is not None and prepared.duration_ms > MAX_AUDIO_SECONDS * 1000:
+        raise AudioRejected("too_long", f"El audio es demasiado largo (máximo {MAX_AUDIO_SECONDS:g} segundos)")
+    return prepared
+
+
+def _record(data: bytes, prepared: Optional[PreparedAudio], started: float, rejected_reason: Optional[str]) -> None:
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    with _stats_lock:
+        _stats["processed"] += 1
+        _stats["bytes_in"] += len(data)
+        _stats["total_ms"] += elapsed_ms
+        if rejected_reason:
+            _stats["rejected"][rejected_reason] = _stats["rejected"].get(rejected_reason, 0) + 1
+        else:
+            _stats["bytes_out"] += len(prepared.content)
+
+
+def get_preprocessing_stats() -> Dict:
+    with _stats_lock:
+        processed = _stats["processed"]
+        return {
+            "enabled": PREPROCESSING_ENABLED,
+            "processed": processed,
+            "rejected": dict(_stats["rejected"]),
+            "bytes_in": _stats["bytes_in"],
+            "bytes_out": _stats["bytes_out"],
+            "avg_ms": round(_stats["total_ms"] / processed, 2) if processed else 0.0,
+        }
+
+
+def reset_preprocessing_stats() -> None:
+    """Pone los contadores en cero. Pensado para tests."""
+    with _stats_lock:
+        _stats.update(processed=0, rejected={}, bytes_in=0, bytes_out=0, total_ms=0.0)
@@ -0,0 +1,178 @@
+# app/services/audio_store.py
+"""
+Audio de las respuestas de voz servido por URL, en vez de base64 en el JSON.
+
+/api/voice/chat devolvía el MP3 en base64: un 33% más de bytes, el clip
+copiado varias veces en memoria (bytes, string base64, jsonable_encoder,
+texto JSON) y el texto esperando a que terminara el TTS. Con
+`?audio_delivery=url` la respuesta sale apenas está el texto, con un token
+corto; la síntesis sigue en segundo plano y GET /api/voice/audio/{token}
+la espera si todavía no terminó.
+
+- El token es aleatorio y vence a los VOICE_AUDIO_URL_TTL_SECONDS: hace de
+  credencial (un <audio src> no puede mandar el header Authorization).
+- El audio queda en memoria (acotado por VOICE_AUDIO_STORE_MAX_BYTES, se
+  descartan los más viejos), aunque el cache TTS también lo tenga en disco:
+  el cache poda sus archivos por su cuenta y la URL tiene que seguir
+  sirviendo hasta vencer.
+"""
+import asyncio
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Dict, NamedTuple, Optional
+
+AUDIO_URL_TTL_SECONDS = int(os.getenv("VOICE_AUDIO_URL_TTL_SECONDS", "300"))
+AUDIO_STORE_MAX_BYTES = int(os.getenv("VOICE_AUDIO_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class StoredAudio(NamedTuple):
+    """Lo que sirve el endpoint: los bytes del MP3."""
+
+    audio: bytes
+
+
+class _Entry:
+    __slots__ = ("expires_at", "audio", "task")
+
+    def __init__(self, expires_at: float) -> None:
+        self.expires_at = expires_at
+        self.audio: Optional[bytes] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+class AudioStore:
+    """token -> audio de una respuesta, con vencimiento y tope de bytes."""
+
+    def __init__(self, ttl_seconds: int, max_bytes: int) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # asyncio solo guarda referencias débiles a las tareas: acá quedan
+        # vivas hasta terminar, aunque su entrada venza antes.
+        self._tasks = set()
+        self.stored = 0
+        self.served = 0
+        self.expired = 0
+        self.evictions = 0
+        self.failed = 0
+
+    def put(self, audio: bytes) -> str:
+        """Guardar un audio ya sintetizado; devuelve el token de la URL."""
+        token, entry = self._new_entry()
+        self._complete(token, entry, audio)
+        return token
+
+    def put_pending(self, synthesis: Awaitable[bytes]) -> str:
+        """
+        Registrar un audio que todavía se está sintetizando. Requiere un
+        event loop corriendo: la síntesis sigue como tarea en segundo plano.
+        """
+        token, entry = self._new_entry()
+        entry.task = asyncio.ensure_future(synthesis)
+        self._tasks.add(entry.task)
+        entry.task.add_done_callback(lambda task: self._on_synthesized(token, entry, task))
+        return token
+
+    async def get(self, token: str) -> Optional[StoredAudio]:
+        """El audio del token, esperando la síntesis si hace falta. None si no existe, venció o falló."""
+        with self._lock:
+            self._purge_expired(time.monotonic())
+            entry = self._entries.get(token)
+        if entry is None:
+            return None
+        if entry.task is not None:
+            try:
+                # shield: si el cliente corta, la síntesis sigue para el reintento.
+                await asyncio.shield(entry.task)
+            except Exception:
+                return None
+        if entry.audio is None:
+            return None
+        with self._lock:
+            self.served += 1
+        return StoredAudio(entry.audio)
+
+    def _new_entry(self):
+        token = secrets.token_urlsafe(24)
+        entry = _Entry(time.monotonic() + self.ttl_seconds)
+        with self._lock:
+            self._purge_expired(time.monotonic())
+            self._entries[token] = entry
+            self.stored += 1
+        return token, entry
+
+    def _on_synthesized(self, token: str, entry: _Entry, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        entry.task = None
+        if task.cancelled() or task.exception() is not None:
+            print(" Audio por URL: falló la síntesis del audio")
+            with self._lock:
+                self.failed += 1
+                self._entries.pop(token, None)
+            return
+        self._complete(token, entry, task.result())
+
+    def _complete(self, token: str, entry: _Entry, audio: bytes) -> None:
+        with self._lock:
+            if token not in self._entries:
+                return
+            entry.audio = audio
+            self._bytes += len(audio)
+            # Se descartan los más viejos (orden de inserción) hasta entrar en
+            # el tope; los que todavía se están sintetizando no ocupan nada.
+            stored = [other for other, e in self._entries.items() if e.audio is not None and e is not entry]
+            for evicted_token in stored:
+                if self._bytes <= self.max_bytes:
+                    break
+                self._drop(evicted_token)
+                self.evictions += 1
+
+    def _purge_expired(self, now: float) -> None:
+        while self._entries:
+            token, entry = next(iter(self._entries.items()))
+            if entry.expires_at > now:
+                break
+            self._drop(token)
+            self.expired += 1
+
+    def _drop(self, token: str) -> None:
+        entry = self._entries.pop(token)
+        if entry.audio is not None:
+            self._bytes -= len(entry.audio)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "stored": self.stored,
+                "served": self.served,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "failed": self.failed,
+            }
+
+    def reset(self) -> None:
+        """Vacía el store y pone los contadores en cero. Pensado para tests."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.stored = self.served = self.expired = self.evictions = self.failed = 0
+
+
+audio_store = AudioStore(AUDIO_URL_TTL_SECONDS, AUDIO_STORE_MAX_BYTES)
+
+
+def get_audio_store_stats() -> Dict:
+    return audio_store.stats()
+
+
+def reset_audio_store() -> None:
+    audio_store.reset()
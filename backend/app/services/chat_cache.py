@@ -0,0 +1,305 @@
+# app/services/chat_cache.py
+"""
+Caches en memoria del pipeline del chatbot.
+
+El tótem recibe una y otra vez las mismas preguntas ("¿qué empresas de
+logística hay?"), y cada una cuesta dos llamadas a Gemini (2-4 s). Acá viven
+dos LRU con vencimiento por TTL:
+
+- answer_cache: la respuesta final ya armada, indexada por la pregunta
+  normalizada + un digest del historial. Depende de los datos.
+- plan_cache: la intención ya validada (sql_query / direct_answer /
+  corrected_entity), indexada además por la huella del esquema. No depende
+  de los datos: el SQL se vuelve a ejecutar en cada uso, así que ahorra la
+  primera llamada a Gemini sin servir información vieja.
+
+Invalidación: las respuestas finales dependen de los datos de empresas,
+contactos, servicios del polo, lotes e info comercial. Un listener de
+SQLAlchemy marca la sesión cuando se escribe alguna de esas tablas y, al
+hacer commit, vacía answer_cache. Así cualquier alta/edición/baja desde las
+rutas de admin o de empresa (o desde scripts que usen el ORM) invalida las
+respuestas viejas sin tener que acordarse de llamar a nada en cada endpoint.
+
+Además, `inflight` junta pedidos idénticos simultáneos (single-flight):
+cuando una visita escolar hace la misma pregunta desde varios tótems en el
+mismo segundo, el cache todavía está vacío y cada uno correría el pipeline
+entero. Con la misma clave que answer_cache, el primero lo calcula y los
+demás esperan ese resultado y reciben su propia copia.
+
+Igual que app/rate_limit.py, es estado por proceso (uvicorn corre sin
+--workers).
+"""
+import asyncio
+import concurrent.futures
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Tablas cuyo contenido puede terminar en una respuesta del chatbot.
+CHATBOT_DATA_TABLES = {"empresa", "contacto", "servicio_polo", "lotes", "info_comercial"}
+
+_MISSING = object()
+
+
+class TTLCache:
+    """LRU acotado por cantidad de entradas, con vencimiento por TTL y contadores."""
+
+    def __init__(self, name: str, max_entries: int, ttl_seconds: float) -> None:
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Devuelve una copia del valor cacheado, o `default` si no está o venció."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING or entry[0] <= now:
+                if entry is not _MISSING:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            value = entry[1]
+        # Copia: quien la recibe puede mutar la lista de resultados sin
+        # corromper lo que le toca al próximo usuario.
+        return copy.deepcopy(value)
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds
+        stored = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (expires_at, stored)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Vacía el cache (invalidación). Los contadores se conservan."""
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+
+    def reset(self) -> None:
+        """Vacía el cache y pone los contadores en cero. Pensado para tests."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+answer_cache = TTLCache(
+    "answer",
+    max_entries=int(os.getenv("CHAT_ANSWER_CACHE_MAX_ENTRIES", "512")),
+    ttl_seconds=float(os.getenv("CHAT_ANSWER_CACHE_TTL_SECONDS", "600")),
+)
+
+plan_cache = TTLCache(
+    "plan",
+    max_entries=int(os.getenv("CHAT_PLAN_CACHE_MAX_ENTRIES", "1024")),
+    ttl_seconds=float(os.getenv("CHAT_PLAN_CACHE_TTL_SECONDS", "86400")),
+)
+
+
+class SingleFlight:
+    """
+    Un solo cálculo en vuelo por clave. El primero que llega (líder) lo
+    ejecuta; los que llegan mientras tanto (seguidores) esperan su
+    resultado. Sirve tanto para hilos (`do`) como para corrutinas
+    (`do_async`), y los dos comparten los cálculos en vuelo: la espera es
+    sobre un concurrent.futures.Future.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._calls: Dict[Hashable, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def _join(self, key: Hashable):
+        """(future, es_líder) para `key`."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.followers += 1
+                return future, False
+            future = concurrent.futures.Future()
+            self._calls[key] = future
+            self.leaders += 1
+            return future, True
+
+    def _settle(self, key: Hashable, future: concurrent.futures.Future, result: Any, error: Optional[BaseException]):
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            # Los seguidores copian de acá, no del objeto que recibe el líder.
+            future.set_result(copy.deepcopy(result))
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        future, leader = self._join(key)
+        if not leader:
+            # Copia: cada pedido recibe su propio objeto, como en TTLCache.get.
+            return copy.deepcopy(future.result())
+        try:
+            result = func()
+        except BaseException as e:
+            self._settle(key, future, None, e)
+            raise
+        self._settle(key, future, result, None)
+        return result
+
+    async def do_async(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        future, leader = self._join(key)
+        if not leader:
+            return copy.deepcopy(await asyncio.wrap_future(future))
+        try:
+            result = await func()
+        except BaseException as e:
+            self._settle(key, future, None, e)
+            raise
+        self._settle(key, future, result, None)
+        return result
+
+    def reset(self) -> None:
+        """Pone los contadores en cero. Pensado para tests."""
+        with self._lock:
+            self.leaders = self.followers = 0
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.leaders + self.followers
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.followers,
+            "coalescing_rate": round(self.followers / requests, 4) if requests else 0.0,
+        }
+
+
+inflight = SingleFlight("chat")
+
+
+# ═══════════════════════════════════════════════════════════════════
+# CLAVES
+# ═══════════════════════════════════════════════════════════════════
+
+
+def history_digest(history: Optional[List[Dict[str, str]]]) -> str:
+    """Digest estable de los turnos (usuario/asistente) que van al prompt."""
+    if not history:
+        return ""
+    turns = [[entry.get("user") or "", entry.get("assistant") or ""] for entry in history]
+    raw = json.dumps(turns, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def question_key(normalized_question: str) -> str:
+    """
+    Clave de la pregunta ya pasada por normalize_text: además colapsa
+    espacios y descarta signos de puntuación, para que "¿qué empresas hay?"
+    y "que empresas hay" compartan entrada.
+    """
+    without_punct = re.sub(r"[^\w\s]", " ", normalized_question)
+    return " ".join(without_punct.split())
+
+
+def answer_cache_key(normalized_question: str, history: Optional[List[Dict[str, str]]]) -> tuple:
+    return (question_key(normalized_question), history_digest(history))
+
+
+def schema_fingerprint(schema_text: str) -> str:
+    return hashlib.sha1(schema_text.encode("utf-8")).hexdigest()
+
+
+def plan_cache_key(
+    normalized_question: str, history: Optional[List[Dict[str, str]]], schema_text: str
+) -> tuple:
+    """Como answer_cache_key, más la huella del esquema: si cambia, los planes viejos no se reusan."""
+    return answer_cache_key(normalized_question, history) + (schema_fingerprint(schema_text),)
+
+
+# ═══════════════════════════════════════════════════════════════════
+# INVALIDACIÓN POR ESCRITURAS EN LA BASE
+# ═══════════════════════════════════════════════════════════════════
+
+_DIRTY_FLAG = "chatbot_data_changed"
+
+
+def invalidate_data_caches() -> None:
+    """Descarta todo lo que dependa de los datos del directorio."""
+    answer_cache.clear()
+
+
+@event.listens_for(Session, "after_flush")
+def _track_chatbot_data_changes(session, flush_context) -> None:
+    # En after_flush, new/dirty/deleted todavía reflejan lo que se acaba de escribir.
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if getattr(obj, "__tablename__", None) in CHATBOT_DATA_TABLES:
+            session.info[_DIRTY_FLAG] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session) -> None:
+    if session.info.pop(_DIRTY_FLAG, False):
+        invalidate_data_caches()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session) -> None:
+    session.info.pop(_DIRTY_FLAG, None)
+
+
+# ═══════════════════════════════════════════════════════════════════
+# DIAGNÓSTICO
+# ═══════════════════════════════════════════════════════════════════
+
+
+def get_chat_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Contadores de los caches del chatbot, para dimensionarlos."""
+    return {"answer": answer_cache.stats(), "plan": plan_cache.stats(), "inflight": inflight.stats()}
+
+
+def reset_chat_caches() -> None:
+    """Limpia caches y contadores. Pensado para uso en tests."""
+    answer_cache.reset()
+    plan_cache.reset()
+    inflight.reset()
@@ -0,0 +1,188 @@
+# app/services/chat_history.py
+"""
+Historial de conversación acotado para los prompts del chatbot.
+
+El cliente (tótem / web) manda el historial completo en cada mensaje y antes
+se pegaba entero en los dos prompts de Gemini: una sesión larga en el tótem
+hacía cada turno más lento y más caro. Acá se arma el texto del historial
+una sola vez por pedido, respetando un presupuesto de tokens:
+
+- los últimos CHAT_HISTORY_RECENT_TURNS turnos van textuales;
+- los anteriores se pliegan en un resumen corto (una línea por turno: qué
+  preguntó el usuario y el comienzo de la respuesta);
+- si aun así no entra, se descartan primero las líneas más viejas del
+  resumen y después se recortan los turnos textuales más viejos.
+
+El resumen es incremental ("rolling"): se cachea por el digest de los turnos
+resumidos, así que en el turno siguiente solo se resume el turno que recién
+salió de la ventana textual. Sin llamadas extra a Gemini.
+"""
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from app.services import chat_cache
+from app.services.schema_context import estimate_tokens
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "600"))
+HISTORY_RECENT_TURNS = int(os.getenv("CHAT_HISTORY_RECENT_TURNS", "4"))
+
+SUMMARY_HEADER = "Resumen de la conversación anterior:\n"
+_SUMMARY_USER_CHARS = 120
+_SUMMARY_ASSISTANT_CHARS = 160
+
+summary_cache = chat_cache.TTLCache(
+    "history_summary",
+    max_entries=int(os.getenv("CHAT_HISTORY_SUMMARY_CACHE_MAX_ENTRIES", "256")),
+    ttl_seconds=float(os.getenv("CHAT_HISTORY_SUMMARY_CACHE_TTL_SECONDS", "3600")),
+)
+
+
+@dataclass
+class HistoryContext:
+    """Texto del historial que va a los prompts, con lo que costó armarlo."""
+
+    text: str
+    turns_total: int = 0
+    turns_verbatim: int = 0
+    turns_summarized: int = 0
+    tokens: int = 0
+
+
+def _clip(text_value: str, max_chars: int) -> str:
+    text_value = " ".join(text_value.split())
+    if len(text_value) <= max_chars:
+        return text_value
+    return text_value[: max_chars - 1].rstrip() + "…"
+
+
+def format_turns(history: List[Dict[str, str]]) -> str:
+    """Turnos textuales, en el mismo formato que usaban los prompts."""
+    lines: List[str] = []
+    for entry in history:
+        if entry.get("user"):
+            lines.append(f"Usuario: {entry['user']}\n")
+        if entry.get("assistant"):
+            lines.append(f"Asistente: {entry['assistant']}\n")
+    return "".join(lines)
+
+
+def summarize_turn(entry: Dict[str, str]) -> str:
+    """Una línea por turno: la pregunta y la primera oración de la respuesta."""
+    parts = []
+    if entry.get("user"):
+        parts.append(f"el usuario preguntó \"{_clip(entry['user'], _SUMMARY_USER_CHARS)}\"")
+    if entry.get("assistant"):
+        first_sentence = re.split(r"(?<=[.!?])\s", entry["assistant"].strip(), maxsplit=1)[0]
+        parts.append(f"se respondió \"{_clip(first_sentence, _SUMMARY_ASSISTANT_CHARS)}\"")
+    return f"- {'; '.join(parts)}\n" if parts else ""
+
+
+def _summary_lines(older: List[Dict[str, str]]) -> List[str]:
+    """
+    Resumen de `older`. En una sesión normal el turno anterior ya dejó
+    cacheado el resumen de todos menos el último, así que solo se agrega
+    una línea; si no está (otra sesión, cache vencido) se arma de cero.
+    """
+    if not older:
+        return []
+    key = chat_cache.history_digest(older)
+    cached = summary_cache.get(key)
+    if cached is not None:
+        return cached
+
+    previous = summary_cache.get(chat_cache.history_digest(older[:-1])) if len(older) > 1 else []
+    if previous is not None:
+        lines = previous + [summarize_turn(older[-1])]
+    else:
+        lines = [summarize_turn(entry) for entry in older]
+    summary_cache.set(key, lines)
+    return lines
+
+
+def build_history_context(
+    history: Optional[List[Dict[str, str]]],
+    token_budget: Optional[int] = None,
+    recent_turns: Optional[int] = None,
+) -> HistoryContext:
+    """Armar el texto del historial para ambos prompts dentro del presupuesto de tokens."""
+    turns = [entry for entry in history or [] if entry.get("user") or entry.get("assistant")]
+    if not turns:
+        return _record(HistoryContext(text=""))
+
+    budget = HISTORY_TOKEN_BUDGET if token_budget is None else token_budget
+    keep = HISTORY_RECENT_TURNS if recent_turns is None else recent_turns
+    split = max(len(turns) - max(keep, 0), 0)
+
+    # Los turnos textuales más viejos pasan al resumen mientras no entren.
+    verbatim = format_turns(turns[split:])
+    while split < len(turns) - 1 and estimate_tokens(verbatim) > budget:
+        split += 1
+        verbatim = format_turns(turns[split:])
+    if estimate_tokens(verbatim) > budget:
+        # Un único turno larguísimo: se conserva el final, que es lo más
+        # cercano a la pregunta actual.
+        verbatim = "…" + verbatim[-max(budget * 4 - 1, 0):] if budget > 0 else ""
+
+    summary = ""
+    lines = _summary_lines(turns[:split])
+    remaining = budget - estimate_tokens(verbatim)
+    # Se conservan las líneas más recientes del resumen que entren.
+    kept: List[str] = []
+    for line in reversed(lines):
+        candidate = SUMMARY_HEADER + line + "".join(kept)
+        if estimate_tokens(candidate) > remaining:
+            break
+        kept.insert(0, line)
+    if kept:
+        summary = SUMMARY_HEADER + "".join(kept)
+
+    text_value = summary + verbatim
+    return _record(
+        HistoryContext(
+            text=text_value,
+            turns_total=len(turns),
+            turns_verbatim=len(turns) - split,
+            turns_summarized=len(kept),
+            tokens=estimate_tokens(text_value),
+        )
+    )
+
+
+# ═══════════════════════════════════════════════════════════════════
+# MÉTRICAS
+# ═══════════════════════════════════════════════════════════════════
+
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "summarized_requests": 0, "turns_summarized": 0, "turns_dropped": 0, "history_tokens": 0}
+
+
+def _record(context: HistoryContext) -> HistoryContext:
+    with _stats_lock:
+        _stats["requests"] += 1
+        _stats["history_tokens"] += context.tokens
+        _stats["turns_summarized"] += context.turns_summarized
+        _stats["turns_dropped"] += context.turns_total - context.turns_verbatim - context.turns_summarized
+        if context.turns_summarized:
+            _stats["summarized_requests"] += 1
+    return context
+
+
+def get_history_stats() -> Dict[str, object]:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["token_budget"] = HISTORY_TOKEN_BUDGET
+    stats["recent_turns"] = HISTORY_RECENT_TURNS
+    stats["avg_history_tokens"] = round(stats["history_tokens"] / stats["requests"], 1) if stats["requests"] else 0.0
+    stats["summary_cache"] = summary_cache.stats()
+    return stats
+
+
+def reset_history_stats() -> None:
+    """Pone contadores y cache de resúmenes en cero. Pensado para tests."""
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
+    summary_cache.reset()
@@ -1,20 +1,47 @@
 # app/services/chatbot_service.py
+import asyncio
 import json
 import os
 import re
+import threading
+import time
 import unicodedata
+from dataclasses import dataclass, field
 from datetime import date
-from typing import Dict, List, Optional, Tuple
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
 
 import google.generativeai as genai
 from google.generativeai.types import GenerationConfig
 from sqlalchemy import inspect
 from sqlalchemy.orm import Session
 from sqlalchemy.sql import text
+from starlette.concurrency import run_in_threadpool
 from typing_extensions import TypedDict
 
+from app import metrics
+from app.services import (
+    ai_transport,
+    answer_renderer,
+    audio_store,
+    chat_cache,
+    chat_history,
+    directory_search,
+    directory_vectors,
+    model_health,
+    result_encoder,
+    schema_context,
+    sql_guard,
+)
 from app.services.common import GENERIC_ERROR_MESSAGE
-from app.services.voice_service import text_to_speech, transcribe_audio
+from app.services.voice_service import (
+    prewarm_tts_cache,
+    split_sentences,
+    synthesize_sentences,
+    text_to_speech,
+    text_to_speech_async,
+    transcribe_audio,
+    transcribe_audio_async,
+)
 
 api_key = os.getenv("GOOGLE_API_KEY")
 genai.configure(api_key=api_key)
@@ -24,9 +51,11 @@ genai.configure(api_key=api_key)
 # ═══════════════════════════════════════════════════════════════════
 # En vez de "probar" nombres de modelo solo al construir el cliente (lo cual
 # nunca detecta un modelo deprecado, porque el constructor no hace ninguna
-# llamada de red), se prueba en la primera llamada real y, si el modelo activo
-# fue dado de baja por Google, se pasa automáticamente al siguiente candidato
-# y ese pasa a ser el modelo por defecto para el resto del proceso.
+# llamada de red), se prueba en la primera llamada real y, si el modelo
+# falla, se pasa automáticamente al siguiente candidato. Cada candidato tiene
+# su circuit breaker (app/services/model_health.py): un modelo dado de baja
+# queda salteado, pero un timeout o un 429 pasajero solo lo saca de la
+# rotación un rato, y el preferido se vuelve a probar solo.
 _MODEL_CANDIDATES = [
     os.getenv("GEMINI_MODEL", "gemini-flash-lite-latest"),
     "gemini-flash-lite-latest",
@@ -35,44 +64,197 @@ _MODEL_CANDIDATES = [
     "gemini-2.5-pro",
 ]
 
+# Índice del último candidato que respondió (informativo: la selección la
+# hacen los breakers). Se escribe desde varios hilos del threadpool.
 _active_model_index = 0
+_active_model_lock = threading.Lock()
 _model_instances: Dict[str, "genai.GenerativeModel"] = {}
 
 
 def _get_model_instance(name: str) -> "genai.GenerativeModel":
     if name not in _model_instances:
         _model_instances[name] = genai.GenerativeModel(model_name=name)
-    return _model_instances[name]
-
+    # Con AI_TRANSPORT=record/replay/fake el modelo se envuelve (ver ai_transport).
+    return ai_transport.wrap_model(name, _model_instances[name])
 
-def _generate(prompt: str, generation_config: GenerationConfig):
-    """Genera contenido con el modelo activo, migrando de candidato si falla."""
-    global _active_model_index
 
+def _candidate_indexes() -> Iterator[int]:
+    """
+    Índices de los candidatos a probar, en orden de preferencia, sin repetir
+    nombres y salteando los que tienen el breaker abierto. Es un generador a
+    propósito: la prueba half_open de un modelo se reserva recién cuando le
+    toca el turno, no si un candidato anterior ya respondió.
+    """
     seen = set()
-    last_error = None
-    idx = _active_model_index
-    while idx < len(_MODEL_CANDIDATES):
-        name = _MODEL_CANDIDATES[idx]
+    for idx, name in enumerate(_MODEL_CANDIDATES):
         if name in seen:
-            idx += 1
             continue
         seen.add(name)
+        if model_health.allow_request(name):
+            yield idx
+
+
+def _mark_candidate_working(idx: int, started_at: float) -> None:
+    global _active_model_index
+    model_health.record_success(_MODEL_CANDIDATES[idx], (time.perf_counter() - started_at) * 1000)
+    with _active_model_lock:
+        if idx != _active_model_index:
+            print(
+                f"⚠️  Modelo Gemini: '{_MODEL_CANDIDATES[_active_model_index]}' -> "
+                f"'{_MODEL_CANDIDATES[idx]}'."
+            )
+            _active_model_index = idx
+
+
+def _mark_candidate_failed(idx: int, exc: Exception) -> None:
+    name = _MODEL_CANDIDATES[idx]
+    kind = model_health.record_failure(name, exc)
+    print(f"  Modelo Gemini '{name}' falló ({kind}): {exc}")
+
+
+def get_model_status() -> Dict[str, object]:
+    """Modelo activo y estado de cada breaker, para /health."""
+    with _active_model_lock:
+        active = _MODEL_CANDIDATES[_active_model_index]
+    return {
+        "active": active,
+        "candidates": model_health.get_model_health(_MODEL_CANDIDATES),
+        "hedging": model_health.get_hedge_stats(),
+    }
+
+
+def _generate(prompt: str, generation_config: GenerationConfig):
+    """Genera contenido con el modelo activo, migrando de candidato si falla."""
+    last_error = None
+    for idx in _candidate_indexes():
+        name = _MODEL_CANDIDATES[idx]
+        started_at = time.perf_counter()
         try:
             response = _get_model_instance(name).generate_content(
                 prompt, generation_config=generation_config
             )
-            if idx != _active_model_index:
-                print(
-                    f"⚠️  Modelo Gemini '{_MODEL_CANDIDATES[_active_model_index]}' no disponible, "
-                    f"usando '{name}' de ahora en más."
-                )
-                _active_model_index = idx
+            _mark_candidate_working(idx, started_at)
             return response
         except Exception as exc:
-            print(f"  Modelo Gemini '{name}' falló: {exc}")
+            _mark_candidate_failed(idx, exc)
+            last_error = exc
+
+    raise RuntimeError("Ningún modelo de Gemini disponible") from last_error
+
+
+async def _call_candidate_async(idx: int, prompt: str, generation_config: GenerationConfig):
+    """Una llamada async a un candidato, registrando el resultado en su breaker."""
+    name = _MODEL_CANDIDATES[idx]
+    started_at = time.perf_counter()
+    try:
+        response = await _get_model_instance(name).generate_content_async(
+            prompt, generation_config=generation_config
+        )
+    except asyncio.CancelledError:
+        model_health.release_probe(name)
+        raise
+    except Exception as exc:
+        _mark_candidate_failed(idx, exc)
+        raise
+    _mark_candidate_working(idx, started_at)
+    return response
+
+
+async def _hedged_call_async(
+    idx: int, candidates: Iterator[int], prompt: str, generation_config: GenerationConfig
+):
+    """
+    Llamar a `idx` y, si no respondió dentro del percentil configurado de sus
+    latencias recientes, lanzar la misma llamada al siguiente candidato sano.
+    Gana la primera respuesta válida; la otra se cancela.
+    """
+    model_health.record_hedge_call()
+    primary_name = _MODEL_CANDIDATES[idx]
+    primary_started_at = time.perf_counter()
+    primary = asyncio.ensure_future(_call_candidate_async(idx, prompt, generation_config))
+    done, _ = await asyncio.wait({primary}, timeout=model_health.hedge_delay_seconds(primary_name))
+    if done:
+        return primary.result()
+
+    hedge_idx = next(candidates, None)
+    if hedge_idx is None:
+        return await primary
+
+    print(f"  Hedge: '{primary_name}' demora, lanzando también '{_MODEL_CANDIDATES[hedge_idx]}'")
+    model_health.record_hedge_launched(schema_context.estimate_tokens(prompt))
+    hedge = asyncio.ensure_future(_call_candidate_async(hedge_idx, prompt, generation_config))
+    pending = {primary, hedge}
+    last_error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    last_error = task.exception()
+                    continue
+                hedge_won = task is hedge
+                model_health.record_hedge_outcome(hedge_won)
+                if hedge_won and not primary.done():
+                    model_health.record_latency_sample(
+                        primary_name, (time.perf_counter() - primary_started_at) * 1000
+                    )
+                return task.result()
+        raise last_error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _generate_async(prompt: str, generation_config: GenerationConfig):
+    """
+    Versión asíncrona de _generate (cliente async de Gemini, sin ocupar hilos).
+    Con GEMINI_HEDGING activo, cada intento puede duplicarse en el siguiente
+    candidato si tarda más de lo habitual (ver model_health).
+    """
+    last_error = None
+    candidates = _candidate_indexes()
+    for idx in candidates:
+        try:
+            if model_health.HEDGING_ENABLED:
+                return await _hedged_call_async(idx, candidates, prompt, generation_config)
+            return await _call_candidate_async(idx, prompt, generation_config)
+        except Exception as exc:
+            last_error = exc
+
+    raise RuntimeError("Ningún modelo de Gemini disponible") from last_error
+
+
+def _generate_stream(prompt: str, generation_config: GenerationConfig) -> Iterator[str]:
+    """
+    Igual que _generate, pero entrega el texto de a fragmentos a medida que
+    Gemini los genera. Solo se puede migrar de candidato mientras no se haya
+    entregado ningún fragmento: después, un error corta el stream.
+    """
+    last_error = None
+    for idx in _candidate_indexes():
+        name = _MODEL_CANDIDATES[idx]
+        yielded = False
+        started_at = time.perf_counter()
+        try:
+            response = _get_model_instance(name).generate_content(
+                prompt, generation_config=generation_config, stream=True
+            )
+            for chunk in response:
+                fragment = extract_text_from_gemini(chunk)
+                if fragment:
+                    yielded = True
+                    yield fragment
+            _mark_candidate_working(idx, started_at)
+            return
+        except GeneratorExit:
+            # El cliente cortó el stream: no es culpa del modelo.
+            model_health.release_probe(name)
+            raise
+        except Exception as exc:
+            _mark_candidate_failed(idx, exc)
+            if yielded:
+                raise
             last_error = exc
-            idx += 1
 
     raise RuntimeError("Ningún modelo de Gemini disponible") from last_error
 
@@ -80,6 +262,8 @@ def _generate(prompt: str, generation_config: GenerationConfig):
 class _IntentSchema(TypedDict):
     needs_more_info: bool
     sql_query: str
+    search_query: str
+    semantic_query: str
     direct_answer: str
     corrected_entity: str
     question: str
@@ -125,47 +309,24 @@ FORBIDDEN_SQL_TABLES = {
 POLO_CUIL = int(os.getenv("POLO_CUIL", "44123456789"))
 
 FORBIDDEN_RESPONSE_TEXT = "No tengo permitido compartir esta información."
+# Lo que el prompt final le pide a Gemini responder, textual, ante temas ajenos.
+OFF_TOPIC_RESPONSE_TEXT = "Solo puedo ayudarte con información del Parque Industrial Polo 52."
 
 # Defensa en profundidad: el modelo solo debería generar un único SELECT,
 # pero si un mensaje del usuario lograra manipularlo (prompt injection) para
 # devolver sentencias apiladas ("SELECT ...; DROP TABLE ...;") o DDL/DML,
-# esto lo corta antes de que llegue a execute_sql_query.
-_FORBIDDEN_SQL_KEYWORDS = {
-    "insert", "update", "delete", "drop", "alter", "truncate", "grant",
-    "revoke", "create", "commit", "rollback", "begin", "exec", "execute",
-    "call", "copy", "vacuum", "attach", "detach", "pragma",
-}
-
+# esto lo corta antes de que llegue a execute_sql_query. La validación en sí
+# (una sola pasada sobre los tokens) vive en app/services/sql_guard.py.
 
-def is_sql_query_allowed(sql_query: str) -> bool:
-    """Validar que sea un único SELECT, sin sentencias apiladas ni tablas restringidas."""
-    if not sql_query:
-        return False
 
-    stripped = sql_query.strip()
-    if not stripped.lower().startswith("select"):
-        return False
+def validate_sql_query(sql_query: Optional[str]) -> sql_guard.SqlVerdict:
+    """Veredicto completo: si se permite, el motivo del rechazo y las tablas que lee."""
+    return sql_guard.validate_sql(sql_query, FORBIDDEN_SQL_TABLES)
 
-    # Sin sentencias apiladas: como mucho un ";" al final de la cadena.
-    body = stripped[:-1] if stripped.endswith(";") else stripped
-    if ";" in body:
-        return False
 
-    # Sin comentarios SQL (vector clásico para ocultar sentencias apiladas).
-    if "--" in body or "/*" in body:
-        return False
-
-    normalized = re.sub(r"\s+", " ", body.lower()).replace('"', "").replace("'", "")
-
-    for keyword in _FORBIDDEN_SQL_KEYWORDS:
-        if re.search(rf"\b{keyword}\b", normalized):
-            return False
-
-    for table in FORBIDDEN_SQL_TABLES:
-        if re.search(rf"\b{table}\b", normalized):
-            return False
-
-    return True
+def is_sql_query_allowed(sql_query: str) -> bool:
+    """Validar que sea un único SELECT, sin sentencias apiladas ni tablas restringidas."""
+    return validate_sql_query(sql_query).allowed
 
 
 def normalize_text(text_value: str) -> str:
@@ -187,20 +348,179 @@ def sanitize_response_text(text_value: Optional[str]) -> Optional[str]:
     return sanitized.strip()
 
 
+# Límites para el SQL que genera el modelo: una pregunta tipo "listame todo"
+# no puede traer el directorio entero a memoria ni retener la conexión.
+SQL_MAX_ROWS = int(os.getenv("CHAT_SQL_MAX_ROWS", "50"))
+SQL_MAX_BYTES = int(os.getenv("CHAT_SQL_MAX_BYTES", "16000"))
+SQL_STATEMENT_TIMEOUT_MS = int(os.getenv("CHAT_SQL_TIMEOUT_MS", "3000"))
+# Empresas que trae una búsqueda full-text (search_query de la intención).
+SEARCH_MAX_RESULTS = int(os.getenv("CHAT_SEARCH_MAX_RESULTS", "10"))
+# Empresas más afines (top-k) que trae la búsqueda semántica (semantic_query).
+SEMANTIC_MAX_RESULTS = int(os.getenv("CHAT_SEMANTIC_MAX_RESULTS", "5"))
+
+_TRAILING_LIMIT_RE = re.compile(r"\blimit\s+(\d+|all)(\s+offset\s+\d+)?\s*;?\s*$", re.IGNORECASE)
+# Forma estándar (SQL:2008) del LIMIT: FETCH FIRST|NEXT [n] ROW|ROWS ONLY.
+_TRAILING_FETCH_RE = re.compile(r"\bfetch\s+(?:first|next)\s+(?:(\d+)\s+)?rows?\s+only\s*;?\s*$", re.IGNORECASE)
+
+
+class SqlRows(list):
+    """
+    Filas de una consulta del chatbot. Es una lista común (el resto del
+    pipeline no cambia) que además dice si se cortó y por qué:
+    "rows" (tope de filas), "bytes" (tope de tamaño) o "timeout".
+    """
+
+    truncated: bool = False
+    truncation_reason: Optional[str] = None
+
+
+def enforce_sql_limit(query: str, max_rows: int) -> str:
+    """
+    Forzar un LIMIT de `max_rows` + 1 (la fila extra sirve para saber si
+    hubo más resultados). Si el SQL ya termina en un LIMIT (o FETCH FIRST)
+    menor se respeta; LIMIT ALL y FETCH FIRST se reescriben, porque un
+    segundo LIMIT al final sería un error de sintaxis.
+    """
+    stripped = query.strip()
+    match = _TRAILING_LIMIT_RE.search(stripped)
+    if match:
+        requested = match.group(1)
+        limit = max_rows + 1 if requested.lower() == "all" else min(int(requested), max_rows + 1)
+        return f"{stripped[:match.start(1)]}{limit}{match.group(2) or ''}"
+    match = _TRAILING_FETCH_RE.search(stripped)
+    if match:
+        limit = min(int(match.group(1) or 1), max_rows + 1)
+        return f"{stripped[:match.start()].rstrip()} LIMIT {limit}"
+    if stripped.endswith(";"):
+        stripped = stripped[:-1].rstrip()
+    return f"{stripped} LIMIT {max_rows + 1}"
+
+
+def _is_postgres(db: Session) -> bool:
+    dialect = getattr(getattr(db, "bind", None), "dialect", None)
+    return getattr(dialect, "name", None) == "postgresql"
+
+
 def execute_sql_query(db: Session, query: str) -> List[Dict]:
-    """Ejecutar consulta SQL de forma segura (solo SELECT)"""
+    """
+    Ejecutar consulta SQL de forma segura (solo SELECT), acotada: LIMIT
+    forzado, statement_timeout (en PostgreSQL), cursor del lado del
+    servidor y tope de filas/bytes. Devuelve SqlRows (ver arriba). Al
+    terminar devuelve la conexión al pool (_release_connection).
+    """
+    started, outcome = time.perf_counter(), "ok"
     try:
         if not query.strip().lower().startswith("select"):
             print(f"Consulta no permitida: {query}")
+            outcome = "rejected"
             return [{"error": GENERIC_ERROR_MESSAGE}]
-        result = db.execute(text(query), execution_options={"no_cache": True})
-        columns = result.keys()
-        raw_results = [dict(zip(columns, row)) for row in result.fetchall()]
-        print(f"Resultados crudos de la consulta: {raw_results}")
-        return raw_results
+
+        postgres = _is_postgres(db)
+        if postgres:
+            # SET LOCAL: solo dura lo que la transacción de esta consulta.
+            db.execute(text(f"SET LOCAL statement_timeout = {SQL_STATEMENT_TIMEOUT_MS}"))
+
+        deadline = time.monotonic() + SQL_STATEMENT_TIMEOUT_MS / 1000
+        result = db.execute(
+            text(enforce_sql_limit(query, SQL_MAX_ROWS)),
+            execution_options={"no_cache": True, "stream_results": True, "max_row_buffer": SQL_MAX_ROWS + 1},
+        )
+        rows = SqlRows()
+        size = 0
+        try:
+            columns = list(result.keys())
+            for row in result:
+                if len(rows) >= SQL_MAX_ROWS:
+                    rows.truncated, rows.truncation_reason = True, "rows"
+                    break
+                record = dict(zip(columns, row))
+                size += len(json.dumps(record, ensure_ascii=False, default=custom_json_serializer))
+                if size > SQL_MAX_BYTES and rows:
+                    rows.truncated, rows.truncation_reason = True, "bytes"
+                    break
+                rows.append(record)
+                if time.monotonic() > deadline:
+                    rows.truncated, rows.truncation_reason = True, "timeout"
+                    break
+        finally:
+            result.close()
+
+        suffix = f" (truncado por {rows.truncation_reason})" if rows.truncated else ""
+        print(f"Consulta SQL del chatbot: {len(rows)} fila(s), ~{size} bytes{suffix}")
+        if rows.truncated:
+            outcome = "truncated"
+        return rows
     except Exception as e:
         print(f"Error al ejecutar la consulta SQL: {str(e)}")
+        outcome = "error"
         return [{"error": GENERIC_ERROR_MESSAGE}]
+    finally:
+        _release_connection(db)
+        metrics.CHAT_STAGE_SECONDS.observe(time.perf_counter() - started, stage="sql_execution", outcome=outcome)
+
+
+def search_directory(db: Session, search_query: str) -> List[Dict]:
+    """
+    Búsqueda full-text rankeada sobre el directorio (ver
+    app/services/directory_search.py), para preguntas del tipo "¿quién vende
+    tornillos?". Devuelve filas como execute_sql_query, así el resto del
+    pipeline no distingue de dónde vinieron.
+    """
+    started, outcome = time.perf_counter(), "ok"
+    try:
+        rows = directory_search.search_directory_rows(db, search_query, limit=SEARCH_MAX_RESULTS)
+        print(f"Búsqueda full-text del chatbot: '{search_query}' -> {len(rows)} empresa(s)")
+        return rows
+    except Exception as e:
+        print(f"Error en la búsqueda full-text: {str(e)}")
+        outcome = "error"
+        return [{"error": GENERIC_ERROR_MESSAGE}]
+    finally:
+        _release_connection(db)
+        metrics.CHAT_STAGE_SECONDS.observe(time.perf_counter() - started, stage="directory_search", outcome=outcome)
+
+
+def semantic_search_directory(db: Session, semantic_query: str) -> List[Dict]:
+    """
+    Empresas más afines a una pregunta abierta ("algo para reparar
+    camiones"), por similitud de embeddings (ver
+    app/services/directory_vectors.py). Sin numpy, o si falla la API de
+    embeddings, cae a la búsqueda full-text con el mismo texto. Lo mismo
+    mientras el índice no terminó su primera sincronización (recién
+    arrancado): se sigue armando en segundo plano, no dentro de este pedido.
+    """
+    if not directory_vectors.is_ready():
+        directory_vectors.start_background_sync()
+        return search_directory(db, semantic_query)
+    started = time.perf_counter()
+    try:
+        rows = directory_vectors.semantic_directory_rows(db, semantic_query, limit=SEMANTIC_MAX_RESULTS)
+        print(f"Búsqueda semántica del chatbot: '{semantic_query}' -> {len(rows)} empresa(s)")
+        metrics.CHAT_STAGE_SECONDS.observe(time.perf_counter() - started, stage="semantic_search", outcome="ok")
+        return rows
+    except Exception as e:
+        print(f"Error en la búsqueda semántica, se usa full-text: {str(e)}")
+        metrics.CHAT_STAGE_SECONDS.observe(time.perf_counter() - started, stage="semantic_search", outcome="error")
+        return search_directory(db, semantic_query)
+    finally:
+        _release_connection(db)
+
+
+def _release_connection(db: Session) -> None:
+    """
+    Terminar la transacción de solo lectura del chatbot para devolver la
+    conexión al pool. La Session sigue usable: si hace falta otra consulta,
+    toma otra conexión. Sin esto la conexión quedaba tomada durante la
+    respuesta final de Gemini (y el TTS en voz), segundos por cada chat,
+    cuando la base se usa unos pocos milisegundos. El rollback además
+    descarta el SET LOCAL statement_timeout y, si la consulta falló, deja
+    la sesión lista (un statement_timeout aborta la transacción en
+    PostgreSQL).
+    """
+    try:
+        db.rollback()
+    except Exception as e:
+        print(f"Error liberando la conexión del chatbot: {str(e)}")
 
 
 # ═══════════════════════════════════════════════════════════════════
@@ -208,6 +528,38 @@ def execute_sql_query(db: Session, query: str) -> List[Dict]:
 # ═══════════════════════════════════════════════════════════════════
 
 _schema_cache: Optional[str] = None
+# Catálogo compacto armado en la misma inspección que _schema_cache; ver
+# app/services/schema_context.py.
+_schema_catalog: Optional[schema_context.SchemaCatalog] = None
+
+
+def _inspect_chatbot_tables(db: Session) -> List[schema_context.TableSchema]:
+    inspector = inspect(db.bind)
+    tables = []
+    for table_name in inspector.get_table_names():
+        if table_name.startswith(("pg_", "sql_")):
+            continue
+        if table_name.lower() in FORBIDDEN_SQL_TABLES:
+            continue
+        if table_name.lower().startswith("vw_"):
+            continue
+
+        table = schema_context.TableSchema(name=table_name)
+        for column in inspector.get_columns(table_name):
+            table.columns.append(
+                (
+                    column["name"],
+                    column["type"].__class__.__name__,
+                    bool(column.get("primary_key")),
+                    bool(column.get("nullable")),
+                )
+            )
+        for fk in inspector.get_foreign_keys(table_name):
+            table.foreign_keys.append(
+                (fk["constrained_columns"][0], fk["referred_table"], fk["referred_columns"][0])
+            )
+        tables.append(table)
+    return tables
 
 
 def get_database_schema(db: Session, force_refresh: bool = False) -> str:
@@ -219,38 +571,53 @@ def get_database_schema(db: Session, force_refresh: bool = False) -> str:
     esquema en cada mensaje del chat es puro overhead. `force_refresh=True`
     permite recalcularlo si alguna vez hiciera falta.
     """
-    global _schema_cache
+    global _schema_cache, _schema_catalog
     if _schema_cache is not None and not force_refresh:
         return _schema_cache
 
-    inspector = inspect(db.bind)
+    tables = _inspect_chatbot_tables(db)
     schema = "La base de datos tiene las siguientes tablas, columnas y relaciones:\n"
-    for table_name in inspector.get_table_names():
-        if table_name.startswith(("pg_", "sql_")):
-            continue
-        if table_name.lower() in FORBIDDEN_SQL_TABLES:
-            continue
-        if table_name.lower().startswith("vw_"):
-            continue
-
-        schema += f"- Tabla '{table_name}':\n"
-        for column in inspector.get_columns(table_name):
-            schema += f"  - {column['name']} ({column['type'].__class__.__name__}"
-            if column.get("primary_key"):
+    for table in tables:
+        schema += f"- Tabla '{table.name}':\n"
+        for name, type_name, primary_key, nullable in table.columns:
+            schema += f"  - {name} ({type_name}"
+            if primary_key:
                 schema += ", clave primaria"
-            if column.get("nullable"):
+            if nullable:
                 schema += ", nullable"
             schema += ")\n"
-        for fk in inspector.get_foreign_keys(table_name):
-            schema += (
-                f"  Relación: '{table_name}.{fk['constrained_columns'][0]}' -> "
-                f"'{fk['referred_table']}.{fk['referred_columns'][0]}'\n"
-            )
+        for column, ref_table, ref_column in table.foreign_keys:
+            schema += f"  Relación: '{table.name}.{column}' -> '{ref_table}.{ref_column}'\n"
 
+    if _schema_cache is not None and schema != _schema_cache:
+        # Cambió el esquema: los planes SQL cacheados pueden ya no ser válidos.
+        chat_cache.plan_cache.clear()
     _schema_cache = schema
+    _schema_catalog = schema_context.SchemaCatalog(tables, schema)
     return _schema_cache
 
 
+def build_schema_context(db_schema: str, user_input: str, history: Optional[List[Dict[str, str]]] = None) -> str:
+    """
+    Esquema que va al prompt de intención: solo las tablas relevantes para
+    la pregunta (más las de los JOIN), en formato compacto. Si no hay
+    catálogo para `db_schema` (p. ej. un esquema armado a mano) se usa el
+    texto completo tal cual.
+    """
+    catalog = _schema_catalog
+    if catalog is None or catalog.full_text != db_schema:
+        return db_schema
+
+    previous_question = None
+    for entry in reversed(history or []):
+        if entry.get("user"):
+            previous_question = normalize_text(entry["user"])
+            break
+    context = catalog.context_for(user_input, previous_question)
+    schema_context.record_schema_context(context)
+    return context.text
+
+
 def custom_json_serializer(obj):
     """Serializar objetos date para JSON"""
     if isinstance(obj, date):
@@ -329,34 +696,14 @@ def compose_fallback_response(db_results: List[Dict]) -> Optional[str]:
         detail_parts: List[str] = []
 
         for key, value in row.items():
-            key_lower = key.lower()
-            if key_lower in {"id", "cuil", "id_usuario", "id_empresa"}:
+            if answer_renderer.is_hidden_column(key):
                 continue
-            if key_lower.startswith("id_") or key_lower.endswith("_id"):
+            value = answer_renderer.format_value(value)
+            if value is None:
                 continue
 
-            if value in (None, "", []):
-                continue
-
-            if isinstance(value, date):
-                value = value.strftime("%Y-%m-%d")
-            elif isinstance(value, (list, tuple, set)):
-                value = ", ".join(str(item) for item in value if item not in (None, ""))
-                if not value:
-                    continue
-            elif isinstance(value, dict):
-                sub_parts = []
-                for sub_key, sub_value in value.items():
-                    if sub_value in (None, "", []):
-                        continue
-                    sub_label = sub_key.replace("_", " ").capitalize()
-                    sub_parts.append(f"{sub_label}: {sub_value}")
-                if not sub_parts:
-                    continue
-                value = ", ".join(sub_parts)
-
-            if key_lower.startswith("nombre"):
-                name_parts.append(str(value))
+            if key.lower().startswith("nombre"):
+                name_parts.append(value)
             else:
                 label = key.replace("_", " ").capitalize()
                 detail_parts.append(f"{label}: {value}")
@@ -404,26 +751,66 @@ def parse_intent_json(response) -> Tuple[Optional[dict], Optional[str]]:
             return None, raw_text
 
 
+def _cacheable_plan(intent_data: dict) -> dict:
+    """Quedarse solo con la parte reutilizable de una intención ya validada."""
+    return {
+        "needs_more_info": False,
+        "sql_query": intent_data.get("sql_query") or "",
+        "search_query": intent_data.get("search_query") or "",
+        "semantic_query": intent_data.get("semantic_query") or "",
+        "direct_answer": intent_data.get("direct_answer") or "",
+        "corrected_entity": intent_data.get("corrected_entity") or "",
+        "question": "",
+    }
+
+
 # ═══════════════════════════════════════════════════════════════════
 # PIPELINE PRINCIPAL DEL CHATBOT
 # ═══════════════════════════════════════════════════════════════════
 
 
-def get_chat_response(db: Session, message: str, history: List[Dict[str, str]] = None):
-    """Generar respuesta del chatbot usando Gemini AI"""
-    try:
-        user_input = normalize_text(message)
-        chat_history = ""
-        if history:
-            for entry in history:
-                if entry.get("user"):
-                    chat_history += f"Usuario: {entry['user']}\n"
-                if entry.get("assistant"):
-                    chat_history += f"Asistente: {entry['assistant']}\n"
-
-        db_schema = get_database_schema(db)
-
-        intent_prompt = f"""
+@dataclass
+class _ChatTurn:
+    """
+    Estado de un turno del chat hasta la etapa de respuesta final.
+
+    Si `answer` viene cargada, el turno ya quedó resuelto sin la segunda
+    llamada a Gemini (cache, saludo, aclaración, consulta prohibida, error).
+    Si no, `final_prompt` y `db_results` quedan listos para la etapa final,
+    que puede correr bloqueante, en streaming o async.
+
+    Los pasos que no hacen I/O (_begin_chat_turn, _lookup_plan,
+    _apply_intent, _apply_sql_results) se comparten entre la variante
+    sincrónica y la asíncrona del pipeline: solo cambia cómo se hacen las
+    llamadas a Gemini y a la base.
+    """
+
+    message: str
+    history: Optional[List[Dict[str, str]]]
+    user_input: str
+    cache_key: tuple
+    chat_history: str = ""
+    plan_key: tuple = ()
+    plan_from_cache: bool = False
+    # Plan nuevo que se cachea solo si su consulta a la base sale bien.
+    pending_plan: Optional[dict] = None
+    source: str = "model"  # "answer_cache" | "plan_cache" | "model"
+    answer: Optional[Tuple[str, List[Dict], Optional[str]]] = None
+    final_prompt: str = ""
+    db_results: List[Dict] = field(default_factory=list)
+    results_truncated: bool = False
+    corrected_entity: Optional[str] = None
+    # Tablas que lee el SQL validado (sql_guard), para el encabezado de las plantillas.
+    sql_tables: Set[str] = field(default_factory=set)
+    search_query: str = ""
+    semantic_query: str = ""
+    # Forma del resultado si la respuesta final salió de una plantilla
+    # (app/services/answer_renderer.py) en vez de Gemini.
+    rendered_shape: Optional[str] = None
+
+
+def _build_intent_prompt(db_schema: str, chat_history: str, user_input: str) -> str:
+    return f"""
 Eres POLO, asistente del Parque Industrial Polo 52.
 
 Base de datos disponible:
@@ -439,6 +826,7 @@ Tu inteligencia artificial debe SIEMPRE intentar responder con datos reales. Deb
 
 Política de datos:
 - Solo puedes usar tablas relacionadas con empresas, servicios del parque, lotes, contactos e información comercial de las empresas (tabla 'info_comercial').
+- Fuente preferida: la tabla '{schema_context.PREFERRED_TABLE}' tiene UNA fila por empresa con sus datos, el contacto comercial (contacto_nombre, contacto_telefono, contacto_direccion, contacto_datos con web/correo/redes), los servicios del polo y lotes (servicios_polo, lotes, manzana, lote) y la información comercial ya aplanada. Si la pregunta se puede responder con ella, consultá SOLO esa tabla, sin JOIN. Usá las tablas originales (empresa, contacto, servicio_polo, lotes, info_comercial) únicamente para datos que no estén ahí (p. ej. todos los contactos o todos los lotes de una empresa con su detalle).
 - Tienes prohibido consultar tablas: usuario, rol, rol_usuario, vehiculos, tipo_vehiculo, empresa_vehiculos, servicio, tipo_servicio, empresa_servicio, password_history, chat_mensaje.
 - Si la consulta requiere información prohibida, devuelve sql_query como cadena vacía ("") y needs_more_info en false.
 - La información disponible abarca detalles de empresas, los servicios y espacios del parque, lotes, contactos (incluye teléfono, dirección, web, correo y redes sociales de contactos comerciales) y datos comerciales (productos/servicios que vende cada empresa, público al que atiende, precios, modalidad de venta, marcas, certificaciones, etc.). Usa tu criterio para combinar la información relevante de estas fuentes y ofrecer respuestas útiles, incluyendo consultas comerciales sobre las empresas del parque.
@@ -448,6 +836,8 @@ Política de datos:
 Completa los campos:
 - needs_more_info: false (casi siempre, usa tu IA para interpretar)
 - sql_query: consulta SQL para obtener datos (NUNCA incluyas campos como cuil, id en el SELECT). Si la consulta es solo un saludo, agradecimiento u otra interacción social que no requiera base de datos, deja este campo como cadena vacía.
+- search_query: si la pregunta busca empresas por lo que venden, fabrican u ofrecen, por una marca o un producto ("¿quién vende tornillos?", "¿hay alguna imprenta?", "distribuidores de Bosch"), poné acá solo los términos a buscar ("tornillos", "imprenta", "Bosch") y dejá sql_query vacío: el sistema hace una búsqueda full-text rankeada, que tolera plurales y acentos. Cadena vacía si no aplica.
+- semantic_query: si la pregunta es abierta y describe una necesidad más que un producto, marca o nombre concreto ("algo para reparar camiones", "dónde compro insumos de limpieza", "necesito alguien que haga mantenimiento de aires"), poné acá esa necesidad en pocas palabras y dejá sql_query y search_query vacíos: el sistema busca por similitud de significado las empresas más afines. Cadena vacía si no aplica.
 - direct_answer: texto natural, breve (una o dos frases), para responder saludos, agradecimientos o mensajes sociales similares cuando no se requiera consultar la base. Cadena vacía si no aplica.
 - corrected_entity: corrección si detectas errores de escritura en nombres propios. Cadena vacía si no aplica.
 - question: pregunta de aclaración, solo si needs_more_info es true. Cadena vacía si no aplica.
@@ -455,99 +845,478 @@ Completa los campos:
 Tu IA debe entender saludos, expresiones de cortesía, consultas informales o con errores de escritura y contestar de manera natural sin asumir información restringida.
 """
 
+
+def _build_final_prompt(
+    message: str, db_results: List[Dict], chat_history: str, truncated: bool = False, semantic: bool = False
+) -> str:
+    # Nota: si db_results viene vacío, lo dejamos pasar igual a Gemini en
+    # vez de devolver un mensaje fijo por código. El propio prompt ya le
+    # indica cómo manejar la ausencia de resultados, y así lo resuelve
+    # con criterio propio en vez de una frase enlatada siempre igual.
+    # Las filas van compactas (encabezado una vez, sin nulls ni ids y con
+    # tope de tokens): ver app/services/result_encoder.py.
+    encoded = result_encoder.encode_results(db_results)
+    input_text = f"Resultados de la consulta:\n{encoded.text}\nPregunta:\n{message}"
+    # El encoder puede dejar afuera filas por sus propios topes (filas y
+    # tokens): la nota cuenta las que de verdad van en el prompt.
+    if truncated or encoded.rows_included < encoded.rows_total:
+        input_text += (
+            f"\n(Se muestran solo los primeros {encoded.rows_included} resultados: hay más. "
+            "Aclaralo y sugerí una búsqueda más específica.)"
+        )
+    if semantic:
+        input_text += (
+            "\n(Son las empresas más afines a la pregunta según una búsqueda por similitud, de la más "
+            "a la menos parecida: mencioná solo las que de verdad sirvan para lo que se pide.)"
+        )
+
+    return f"""
+Eres POLO, asistente conversacional del Parque Industrial Polo 52.
+
+Información disponible:
+{input_text}
+
+Historial:
+{chat_history}
+
+Reglas que no podés romper:
+- Solo hablás de temas del Parque Industrial Polo 52 y de los datos que tenés disponibles. Si te preguntan algo ajeno, respondé: "{OFF_TOPIC_RESPONSE_TEXT}"
+- Nunca muestres CUIL, IDs internos ni datos sensibles.
+- Si la consulta es sobre usuarios, contraseñas, roles o vehículos del sistema interno, respondé exactamente: "No tengo permitido compartir esta información". Esto NO aplica a información comercial (productos, servicios, precios, modalidad de venta, público al que atiende, marcas, certificaciones, contacto) de las empresas ni del propio Parque: esa información es pública y siempre podés compartirla con lo que tengas disponible.
+- Si no hay resultados para la consulta, decilo con naturalidad y, si tiene sentido, ofrecé una alternativa relacionada con el parque.
+
+Fuera de esas reglas, usá tu propio criterio: contestá de forma natural y breve (como en una conversación real, sin relleno), con el tono y formato que mejor se adapten a la pregunta.
+Responde naturalmente:"""
+
+
+def _begin_chat_turn(message: str, history: Optional[List[Dict[str, str]]]) -> _ChatTurn:
+    """Arrancar el turno; si la pregunta ya está en el cache de respuestas, queda resuelto."""
+    user_input = normalize_text(message)
+    turn = _ChatTurn(
+        message=message,
+        history=history,
+        user_input=user_input,
+        cache_key=chat_cache.answer_cache_key(user_input, history),
+    )
+
+    # Preguntas repetidas (muy comunes en el tótem) se responden desde el
+    # cache sin tocar Gemini. Ver app/services/chat_cache.py.
+    cached = chat_cache.answer_cache.get(turn.cache_key)
+    if cached is not None:
+        turn.source = "answer_cache"
+        turn.answer = cached
+        turn.db_results, turn.corrected_entity = cached[1], cached[2]
+        turn.results_truncated = bool(getattr(cached[1], "truncated", False))
+        return turn
+
+    # Una sola vez por pedido, acotado por presupuesto de tokens: el mismo
+    # texto va al prompt de intención y al de la respuesta final.
+    turn.chat_history = chat_history.build_history_context(history).text
+    return turn
+
+
+def _lookup_plan(turn: _ChatTurn, db_schema: str) -> Optional[dict]:
+    """
+    Cache de planes (pregunta -> SQL): evita la primera llamada a Gemini
+    para preguntas recurrentes. El SQL se vuelve a ejecutar contra los
+    datos actuales, así que la respuesta nunca queda vieja.
+    """
+    turn.plan_key = chat_cache.plan_cache_key(turn.user_input, turn.history, db_schema)
+    intent_data = chat_cache.plan_cache.get(turn.plan_key)
+    if intent_data is not None:
+        turn.plan_from_cache = True
+        turn.source = "plan_cache"
+    return intent_data
+
+
+def _apply_intent(turn: _ChatTurn, intent_data: Optional[dict], raw_intent_text: Optional[str]) -> Optional[str]:
+    """
+    Validar la intención. Devuelve el SQL a ejecutar, o None si el turno ya
+    quedó resuelto (`turn.answer`) sin necesidad de consultar la base o si
+    va por búsqueda full-text (`turn.search_query`) o semántica
+    (`turn.semantic_query`).
+    """
+    if not intent_data:
+        fallback_text = sanitize_response_text(raw_intent_text)
+        if fallback_text:
+            print("No se pudo interpretar el JSON de intención; devolviendo texto crudo del modelo.")
+            turn.answer = (fallback_text, [], None)
+            return None
+        print(f"Intent parse falló. Respuesta cruda: {raw_intent_text}")
+        turn.answer = ("Disculpa, tuve un problema procesando tu consulta. ¿Podrías reformularla?", [], None)
+        return None
+
+    corrected_entity = intent_data.get("corrected_entity")
+    turn.corrected_entity = corrected_entity
+
+    if intent_data.get("needs_more_info", False):
+        question = intent_data.get("question") or "¿Podrías darme más detalles sobre tu consulta?"
+        turn.answer = (question, [], corrected_entity)
+        return None
+
+    direct_answer = sanitize_response_text(intent_data.get("direct_answer"))
+    sql_query = intent_data.get("sql_query", "")
+    search_query = (intent_data.get("search_query") or "").strip()
+    semantic_query = (intent_data.get("semantic_query") or "").strip()
+
+    if direct_answer:
+        if not turn.plan_from_cache:
+            chat_cache.plan_cache.set(turn.plan_key, _cacheable_plan(intent_data))
+        turn.answer = (direct_answer, [], corrected_entity)
+        chat_cache.answer_cache.set(turn.cache_key, turn.answer)
+        return None
+
+    # Los planes que consultan la base se cachean recién cuando la consulta
+    # funcionó (_apply_sql_results): uno que falla no puede quedar
+    # devolviendo el mismo error durante todo el TTL.
+    if not turn.plan_from_cache:
+        turn.pending_plan = _cacheable_plan(intent_data)
+
+    if search_query and not sql_query:
+        turn.search_query = search_query
+        return None
+
+    if semantic_query and not sql_query:
+        turn.semantic_query = semantic_query
+        return None
+
+    with metrics.CHAT_STAGE_SECONDS.timer(stage="sql_validation") as labels:
+        verdict = validate_sql_query(sql_query)
+        labels["outcome"] = "allowed" if verdict.allowed else "rejected"
+    if not verdict.allowed:
+        if sql_query:
+            print(f"SQL rechazado ({verdict.reason}): {sql_query}")
+        turn.answer = (FORBIDDEN_RESPONSE_TEXT, [], corrected_entity)
+        return None
+
+    turn.sql_tables = verdict.tables
+    return sql_query
+
+
+def _apply_sql_results(turn: _ChatTurn, db_results: List[Dict]) -> None:
+    if db_results and isinstance(db_results[0], dict) and db_results[0].get("error"):
+        turn.answer = (GENERIC_ERROR_MESSAGE, [], turn.corrected_entity)
+        return
+    if turn.pending_plan is not None:
+        chat_cache.plan_cache.set(turn.plan_key, turn.pending_plan)
+        turn.pending_plan = None
+    turn.db_results = db_results
+    turn.results_truncated = bool(getattr(db_results, "truncated", False))
+
+    # Resultados simples (un teléfono, una lista de nombres, un conteo) se
+    # cuentan con una plantilla: se ahorra la segunda llamada a Gemini.
+    text_value, shape = answer_renderer.render_answer(
+        turn.user_input,
+        db_results,
+        turn.results_truncated,
+        bool(turn.search_query or turn.semantic_query),
+        tables=turn.sql_tables,
+    )
+    answer_renderer.record_final_answer(shape)
+    if text_value:
+        metrics.CHAT_FINAL_ANSWERS.inc(source="template")
+        print(f"Respuesta final por plantilla ({shape}), sin llamar a Gemini")
+        turn.rendered_shape = shape
+        turn.answer = (text_value, db_results, turn.corrected_entity)
+        chat_cache.answer_cache.set(turn.cache_key, turn.answer)
+        return
+
+    turn.final_prompt = _build_final_prompt(
+        turn.message, db_results, turn.chat_history, turn.results_truncated, bool(turn.semantic_query)
+    )
+
+
+def _prepare_chat_turn(db: Session, message: str, history: Optional[List[Dict[str, str]]]) -> _ChatTurn:
+    """Etapas previas a la respuesta final: cache, intención y consulta SQL."""
+    turn = _begin_chat_turn(message, history)
+    if turn.answer is not None:
+        return turn
+
+    db_schema = get_database_schema(db)
+    intent_data, raw_intent_text = _lookup_plan(turn, db_schema), None
+    if intent_data is None:
         try:
-            intent_response = _generate(intent_prompt, INTENT_GENERATION_CONFIG)
+            schema_text = build_schema_context(db_schema, turn.user_input, turn.history)
+            intent_prompt = _build_intent_prompt(schema_text, turn.chat_history, turn.user_input)
+            with metrics.CHAT_STAGE_SECONDS.timer(stage="intent"):
+                intent_response = _generate(intent_prompt, INTENT_GENERATION_CONFIG)
             intent_data, raw_intent_text = parse_intent_json(intent_response)
         except Exception as e:
             print(f"Error generando intención: {str(e)}")
             intent_data, raw_intent_text = None, None
 
-        if not intent_data:
-            fallback_text = sanitize_response_text(raw_intent_text)
-            if fallback_text:
-                print("No se pudo interpretar el JSON de intención; devolviendo texto crudo del modelo.")
-                return fallback_text, [], None
-            print(f"Intent parse falló. Respuesta cruda: {raw_intent_text}")
-            return "Disculpa, tuve un problema procesando tu consulta. ¿Podrías reformularla?", [], None
+    sql_query = _apply_intent(turn, intent_data, raw_intent_text)
+    if sql_query:
+        _apply_sql_results(turn, execute_sql_query(db, sql_query))
+    elif turn.search_query:
+        _apply_sql_results(turn, search_directory(db, turn.search_query))
+    elif turn.semantic_query:
+        _apply_sql_results(turn, semantic_search_directory(db, turn.semantic_query))
+    return turn
+
 
-        if intent_data.get("needs_more_info", False):
-            question = intent_data.get("question") or "¿Podrías darme más detalles sobre tu consulta?"
-            return question, [], intent_data.get("corrected_entity")
+async def _prepare_chat_turn_async(
+    db: Session, message: str, history: Optional[List[Dict[str, str]]]
+) -> _ChatTurn:
+    """
+    Igual que _prepare_chat_turn, pero Gemini se llama con el cliente async.
+    Los accesos a la base (milisegundos) van al threadpool: así un chat solo
+    ocupa un hilo mientras corre el SQL, no durante los segundos de Gemini.
+    """
+    turn = _begin_chat_turn(message, history)
+    if turn.answer is not None:
+        return turn
+
+    db_schema = await run_in_threadpool(get_database_schema, db)
+    intent_data, raw_intent_text = _lookup_plan(turn, db_schema), None
+    if intent_data is None:
+        try:
+            schema_text = build_schema_context(db_schema, turn.user_input, turn.history)
+            intent_prompt = _build_intent_prompt(schema_text, turn.chat_history, turn.user_input)
+            with metrics.CHAT_STAGE_SECONDS.timer(stage="intent"):
+                intent_response = await _generate_async(intent_prompt, INTENT_GENERATION_CONFIG)
+            intent_data, raw_intent_text = parse_intent_json(intent_response)
+        except Exception as e:
+            print(f"Error generando intención: {str(e)}")
+            intent_data, raw_intent_text = None, None
 
-        direct_answer = sanitize_response_text(intent_data.get("direct_answer"))
-        sql_query = intent_data.get("sql_query", "")
+    sql_query = _apply_intent(turn, intent_data, raw_intent_text)
+    if sql_query:
+        _apply_sql_results(turn, await run_in_threadpool(execute_sql_query, db, sql_query))
+    elif turn.search_query:
+        _apply_sql_results(turn, await run_in_threadpool(search_directory, db, turn.search_query))
+    elif turn.semantic_query:
+        _apply_sql_results(turn, await run_in_threadpool(semantic_search_directory, db, turn.semantic_query))
+    return turn
 
-        if direct_answer:
-            return direct_answer, [], intent_data.get("corrected_entity")
 
-        if not sql_query or not is_sql_query_allowed(sql_query):
-            return FORBIDDEN_RESPONSE_TEXT, [], intent_data.get("corrected_entity")
+def _finish_chat_turn(turn: _ChatTurn, final_text: Optional[str]) -> Tuple[str, List[Dict], Optional[str]]:
+    """Cerrar el turno con el texto final de Gemini, o con el fallback local si no hubo."""
+    if not final_text:
+        # Gemini no devolvió nada usable (bloqueo de seguridad, error de API, etc.):
+        # como último recurso armamos algo a partir de los datos crudos.
+        print("Advertencia: Gemini no devolvió texto utilizable en la respuesta final.")
+        metrics.CHAT_FINAL_ANSWERS.inc(source="fallback")
+        fallback_text = sanitize_response_text(compose_fallback_response(turn.db_results))
+        return fallback_text or GENERIC_ERROR_MESSAGE, turn.db_results, turn.corrected_entity
 
-        db_results = execute_sql_query(db, sql_query)
-        if db_results and isinstance(db_results[0], dict) and db_results[0].get("error"):
-            return GENERIC_ERROR_MESSAGE, [], intent_data.get("corrected_entity")
+    # Solo se cachean respuestas redactadas por Gemini: las armadas por el
+    # fallback local suelen venir de una falla transitoria y conviene
+    # reintentar la próxima vez.
+    metrics.CHAT_FINAL_ANSWERS.inc(source="model")
+    result = (final_text, turn.db_results, turn.corrected_entity)
+    chat_cache.answer_cache.set(turn.cache_key, result)
+    return result
 
-        # Nota: si db_results viene vacío, lo dejamos pasar igual a Gemini en
-        # vez de devolver un mensaje fijo por código. El propio prompt ya le
-        # indica cómo manejar la ausencia de resultados, y así lo resuelve
-        # con criterio propio en vez de una frase enlatada siempre igual.
-        results_text = json.dumps(db_results, ensure_ascii=False, default=custom_json_serializer)
-        input_text = f"Resultados de la consulta:\n{results_text}\nPregunta:\n{message}"
 
-        final_prompt = f"""
-Eres POLO, asistente conversacional del Parque Industrial Polo 52.
+def _inflight_key(message: str, history: Optional[List[Dict[str, str]]]) -> tuple:
+    return chat_cache.answer_cache_key(normalize_text(message or ""), history)
 
-Información disponible:
-{input_text}
 
-Historial:
-{chat_history}
+def get_chat_response(db: Session, message: str, history: List[Dict[str, str]] = None):
+    """
+    Generar respuesta del chatbot usando Gemini AI. Pedidos idénticos
+    simultáneos (misma pregunta normalizada y mismo historial) comparten un
+    solo cálculo: ver chat_cache.inflight.
+    """
+    return chat_cache.inflight.do(
+        _inflight_key(message, history), lambda: _compute_chat_response(db, message, history)
+    )
 
-Reglas que no podés romper:
-- Solo hablás de temas del Parque Industrial Polo 52 y de los datos que tenés disponibles. Si te preguntan algo ajeno, respondé: "Solo puedo ayudarte con información del Parque Industrial Polo 52."
-- Nunca muestres CUIL, IDs internos ni datos sensibles.
-- Si la consulta es sobre usuarios, contraseñas, roles o vehículos del sistema interno, respondé exactamente: "No tengo permitido compartir esta información". Esto NO aplica a información comercial (productos, servicios, precios, modalidad de venta, público al que atiende, marcas, certificaciones, contacto) de las empresas ni del propio Parque: esa información es pública y siempre podés compartirla con lo que tengas disponible.
-- Si no hay resultados para la consulta, decilo con naturalidad y, si tiene sentido, ofrecé una alternativa relacionada con el parque.
 
-Fuera de esas reglas, usá tu propio criterio: contestá de forma natural y breve (como en una conversación real, sin relleno), con el tono y formato que mejor se adapten a la pregunta.
-Responde naturalmente:"""
+def _compute_chat_response(db: Session, message: str, history: Optional[List[Dict[str, str]]]):
+    try:
+        turn = _prepare_chat_turn(db, message, history)
+        if turn.answer is not None:
+            return turn.answer
 
         try:
-            final_response = _generate(final_prompt, FINAL_GENERATION_CONFIG)
-            final_text = sanitize_response_text(extract_text_from_gemini(final_response))
+            with metrics.CHAT_STAGE_SECONDS.timer(stage="final_generation") as labels:
+                final_response = _generate(turn.final_prompt, FINAL_GENERATION_CONFIG)
+                final_text = sanitize_response_text(extract_text_from_gemini(final_response))
+                if not final_text:
+                    labels["outcome"] = "empty"
         except Exception as e:
             print(f"Error generando respuesta final: {str(e)}")
             final_text = None
 
-        if not final_text:
-            # Gemini no devolvió nada usable (bloqueo de seguridad, error de API, etc.):
-            # como último recurso armamos algo a partir de los datos crudos.
-            print("Advertencia: Gemini no devolvió texto utilizable en la respuesta final.")
-            fallback_text = sanitize_response_text(compose_fallback_response(db_results))
-            if fallback_text:
-                return fallback_text, db_results, intent_data.get("corrected_entity")
-            return GENERIC_ERROR_MESSAGE, db_results, intent_data.get("corrected_entity")
-
-        return final_text, db_results, intent_data.get("corrected_entity")
+        return _finish_chat_turn(turn, final_text)
 
     except Exception as e:
         print(f"Error general en get_chat_response: {str(e)}")
         return GENERIC_ERROR_MESSAGE, [], None
 
 
+async def get_chat_response_async(db: Session, message: str, history: List[Dict[str, str]] = None):
+    """
+    Variante asíncrona de get_chat_response, para llamar directo desde
+    endpoints `async def`: cientos de chats en vuelo cuestan corrutinas, no
+    hilos del threadpool (que también atiende login, directorio, etc.).
+    Comparte los cálculos en vuelo con la variante sincrónica.
+    """
+    return await chat_cache.inflight.do_async(
+        _inflight_key(message, history), lambda: _compute_chat_response_async(db, message, history)
+    )
+
+
+async def _compute_chat_response_async(db: Session, message: str, history: Optional[List[Dict[str, str]]]):
+    try:
+        turn = await _prepare_chat_turn_async(db, message, history)
+        if turn.answer is not None:
+            return turn.answer
+
+        try:
+            with metrics.CHAT_STAGE_SECONDS.timer(stage="final_generation") as labels:
+                final_response = await _generate_async(turn.final_prompt, FINAL_GENERATION_CONFIG)
+                final_text = sanitize_response_text(extract_text_from_gemini(final_response))
+                if not final_text:
+                    labels["outcome"] = "empty"
+        except Exception as e:
+            print(f"Error generando respuesta final: {str(e)}")
+            final_text = None
+
+        return _finish_chat_turn(turn, final_text)
+
+    except Exception as e:
+        print(f"Error general en get_chat_response_async: {str(e)}")
+        return GENERIC_ERROR_MESSAGE, [], None
+
+
+def _sanitize_stream_fragment(fragment: str) -> str:
+    """Como sanitize_response_text, pero sin recortar espacios entre fragmentos."""
+    return re.sub(r"\*+", "", fragment.replace("•", "-"))
+
+
 def get_chat_response_stream(
     db: Session,
     text_message: str,
     history: Optional[List[Dict[str, str]]] = None,
-):
+) -> Iterator[Tuple[str, dict]]:
+    """
+    Variante en streaming de get_chat_response, pensada para Server-Sent Events.
+
+    Las etapas de intención y SQL corren igual que en la versión bloqueante;
+    la respuesta final se pide a Gemini en streaming y cada fragmento se
+    reenvía apenas llega. Emite tuplas (evento, payload) en este orden:
+
+    - "intent": entidad corregida y de dónde salió el plan (cache o modelo).
+    - "data": filas devueltas por la consulta SQL (y si se cortaron por los topes).
+    - "text": uno o más fragmentos de la respuesta final.
+    - "done": texto completo + tiempo al primer token y latencia total (ms), y
+      la forma del resultado si la respuesta salió de una plantilla.
     """
-    Variante en streaming: procesa intent + DB igual que get_chat_response,
-    pero entrega la respuesta final en un solo chunk (Gemini no se re-llama
-    para no duplicar costo/latencia).
+    started = time.perf_counter()
+    first_token_at: Optional[float] = None
+
+    try:
+        turn = _prepare_chat_turn(db, text_message, history)
+    except Exception as e:
+        print(f"Error general en get_chat_response_stream: {str(e)}")
+        turn = _ChatTurn(
+            message=text_message,
+            history=history,
+            user_input="",
+            cache_key=(),
+            answer=(GENERIC_ERROR_MESSAGE, [], None),
+        )
+
+    yield "intent", {"corrected_entity": turn.corrected_entity, "source": turn.source}
+    yield "data", {"rows": turn.db_results, "truncated": turn.results_truncated}
+
+    if turn.answer is not None:
+        response_text = turn.answer[0]
+        first_token_at = time.perf_counter()
+        yield "text", {"delta": response_text}
+    else:
+        fragments: List[str] = []
+        stream_failed = False
+        generation_started = time.perf_counter()
+        try:
+            for fragment in _generate_stream(turn.final_prompt, FINAL_GENERATION_CONFIG):
+                fragment = _sanitize_stream_fragment(fragment)
+                if not fragments:
+                    fragment = fragment.lstrip()
+                if not fragment:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                fragments.append(fragment)
+                yield "text", {"delta": fragment}
+        except Exception as e:
+            print(f"Error generando respuesta final en streaming: {str(e)}")
+            stream_failed = True
+
+        streamed_text = sanitize_response_text("".join(fragments))
+        metrics.CHAT_STAGE_SECONDS.observe(
+            time.perf_counter() - generation_started,
+            stage="final_generation",
+            outcome="error" if stream_failed else ("ok" if streamed_text else "empty"),
+        )
+        if stream_failed and fragments:
+            # El cliente ya recibió parte del texto: no se puede reemplazar por
+            # el fallback, y tampoco se cachea una respuesta incompleta.
+            response_text = streamed_text
+        else:
+            response_text, _, _ = _finish_chat_turn(turn, streamed_text)
+            if not fragments:
+                first_token_at = time.perf_counter()
+                yield "text", {"delta": response_text}
+
+    finished = time.perf_counter()
+    ttft_ms = round((first_token_at - started) * 1000, 1)
+    total_ms = round((finished - started) * 1000, 1)
+    print(f" Streaming: primer token en {ttft_ms} ms, total {total_ms} ms")
+    yield "done", {
+        "text": response_text,
+        "ttft_ms": ttft_ms,
+        "total_ms": total_ms,
+        "rendered_shape": turn.rendered_shape,
+    }
+
+
+def _voice_result(
+    text_value: str,
+    audio_bytes: Optional[bytes],
+    db_results: List[Dict],
+    transcript: Optional[str],
+    corrected_entity: Optional[str],
+    error: bool,
+    audio_token: Optional[str] = None,
+) -> dict:
+    import base64
+
+    result = {
+        "text": text_value,
+        "audio_base64": base64.b64encode(audio_bytes).decode("utf-8") if audio_bytes is not None else None,
+        "db_results": db_results,
+        "transcript": transcript,
+        "corrected_entity": corrected_entity,
+        "error": error,
+    }
+    if audio_token is not None:
+        result["audio_token"] = audio_token
+    return result
+
+
+async def _voice_result_async(
+    text_value: str,
+    db_results: List[Dict],
+    transcript: Optional[str],
+    corrected_entity: Optional[str],
+    error: bool,
+    deferred_audio: bool,
+) -> dict:
     """
-    final_text, db_results, corrected = get_chat_response(db=db, message=text_message, history=history)
-    if final_text:
-        yield final_text, db_results, corrected
+    _voice_result con el TTS: esperándolo (audio en base64) o, con
+    deferred_audio, dejándolo en segundo plano en el audio_store y
+    devolviendo solo el token para la URL (ver app/services/audio_store.py).
+    """
+    if deferred_audio:
+        token = audio_store.audio_store.put_pending(text_to_speech_async(text_value))
+        return _voice_result(text_value, None, db_results, transcript, corrected_entity, error, audio_token=token)
+    audio_bytes = await text_to_speech_async(text_value)
+    print(f" Audio generado: {len(audio_bytes)} bytes")
+    return _voice_result(text_value, audio_bytes, db_results, transcript, corrected_entity, error)
 
 
 def get_chat_response_with_audio(
@@ -558,7 +1327,6 @@ def get_chat_response_with_audio(
 ) -> dict:
     """Procesar mensaje de voz o texto y devolver respuesta con audio"""
     from fastapi import HTTPException
-    import base64
 
     try:
         transcript = None
@@ -570,15 +1338,7 @@ def get_chat_response_with_audio(
             if not transcript or len(transcript.strip()) == 0:
                 error_message = GENERIC_ERROR_MESSAGE
                 error_audio = text_to_speech(error_message)
-                error_audio_base64 = base64.b64encode(error_audio).decode("utf-8")
-                return {
-                    "text": error_message,
-                    "audio_base64": error_audio_base64,
-                    "db_results": [],
-                    "transcript": None,
-                    "corrected_entity": None,
-                    "error": True,
-                }
+                return _voice_result(error_message, error_audio, [], None, None, error=True)
 
             message = transcript
             print(f" Transcripción: {message}")
@@ -594,17 +1354,9 @@ def get_chat_response_with_audio(
 
         print("🔊 Generando audio de respuesta...")
         audio_bytes = text_to_speech(response_text)
-        audio_base64 = base64.b64encode(audio_bytes).decode("utf-8")
-        print(f" Audio generado: {len(audio_base64)} caracteres en base64")
-
-        return {
-            "text": response_text,
-            "audio_base64": audio_base64,
-            "db_results": db_results,
-            "transcript": transcript,
-            "corrected_entity": corrected_entity,
-            "error": False,
-        }
+        print(f" Audio generado: {len(audio_bytes)} bytes")
+
+        return _voice_result(response_text, audio_bytes, db_results, transcript, corrected_entity, error=False)
 
     except HTTPException:
         raise
@@ -614,19 +1366,150 @@ def get_chat_response_with_audio(
         try:
             error_response = GENERIC_ERROR_MESSAGE
             error_audio = text_to_speech(error_response)
-            error_audio_base64 = base64.b64encode(error_audio).decode("utf-8")
-            return {
-                "text": error_response,
-                "audio_base64": error_audio_base64,
-                "db_results": [],
-                "transcript": transcript,
-                "corrected_entity": None,
-                "error": True,
-            }
+            return _voice_result(error_response, error_audio, [], transcript, None, error=True)
+        except Exception:
+            raise HTTPException(status_code=500, detail=GENERIC_ERROR_MESSAGE)
+
+
+async def get_chat_response_with_audio_async(
+    db: Session,
+    audio_content: bytes = None,
+    text_message: str = None,
+    history: List[Dict[str, str]] = None,
+    deferred_audio: bool = False,
+) -> dict:
+    """
+    Variante asíncrona de get_chat_response_with_audio (STT, Gemini y TTS sin
+    ocupar hilos). Con deferred_audio no espera al TTS: el resultado trae
+    `audio_token` en vez de `audio_base64`.
+    """
+    from fastapi import HTTPException
+
+    try:
+        transcript = None
+
+        if audio_content:
+            print(f" Procesando audio: {len(audio_content)} bytes")
+            transcript = await transcribe_audio_async(audio_content)
+
+            if not transcript or len(transcript.strip()) == 0:
+                return await _voice_result_async(GENERIC_ERROR_MESSAGE, [], None, None, True, deferred_audio)
+
+            message = transcript
+            print(f" Transcripción: {message}")
+        elif text_message:
+            message = text_message
+            print(f" Mensaje de texto: {message}")
+        else:
+            raise HTTPException(status_code=400, detail="Se requiere audio o texto")
+
+        print(" Procesando con Gemini...")
+        response_text, db_results, corrected_entity = await get_chat_response_async(db, message, history)
+        print(f" Respuesta generada: {response_text[:100]}...")
+
+        print("🔊 Generando audio de respuesta...")
+        return await _voice_result_async(
+            response_text, db_results, transcript, corrected_entity, False, deferred_audio
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        error_msg = f"Error procesando consulta: {str(e)}"
+        print(f" {error_msg}")
+        try:
+            return await _voice_result_async(GENERIC_ERROR_MESSAGE, [], transcript, None, True, deferred_audio)
         except Exception:
             raise HTTPException(status_code=500, detail=GENERIC_ERROR_MESSAGE)
 
 
+async def get_chat_response_audio_stream(
+    db: Session,
+    audio_content: bytes = None,
+    text_message: str = None,
+    history: List[Dict[str, str]] = None,
+    transcript: str = None,
+) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Variante de get_chat_response_with_audio_async que no espera a tener el
+    MP3 de toda la respuesta: la parte en oraciones, las sintetiza en
+    paralelo (acotado, ver voice_service.synthesize_sentences) y entrega
+    cada segmento apenas está listo, en orden. El tótem empieza a hablar
+    después de la primera oración. Emite tuplas (evento, payload):
+
+    - "transcript": lo que se entendió del audio (si vino audio).
+    - "text": respuesta completa, filas y entidad corregida.
+    - "audio": un segmento MP3 (index, total, text, audio_base64).
+    - "done": tiempo al primer audio y latencia total (ms), y si fue error.
+
+    `transcript` es para cuando el audio ya se transcribió afuera (el
+    WebSocket de voz usa streaming_recognize): se trata como entrada de voz,
+    así que vacío también responde con el mensaje de error.
+    """
+    import base64
+
+    started = time.perf_counter()
+    voice_input = bool(audio_content) or transcript is not None
+    error = False
+    db_results: List[Dict] = []
+    corrected_entity = None
+
+    if audio_content:
+        try:
+            transcript = await transcribe_audio_async(audio_content)
+        except Exception as e:
+            print(f"Error en transcripción (audio en streaming): {str(e)}")
+        yield "transcript", {"text": transcript}
+
+    if voice_input and not (transcript or "").strip():
+        response_text, error = GENERIC_ERROR_MESSAGE, True
+    else:
+        try:
+            response_text, db_results, corrected_entity = await get_chat_response_async(
+                db, transcript or text_message, history
+            )
+        except Exception as e:
+            print(f"Error general en get_chat_response_audio_stream: {str(e)}")
+            response_text, error = GENERIC_ERROR_MESSAGE, True
+
+    text_ms = round((time.perf_counter() - started) * 1000, 1)
+    yield "text", {"text": response_text, "db_results": db_results, "corrected_entity": corrected_entity}
+
+    sentences = split_sentences(response_text)
+    first_audio_at: Optional[float] = None
+    async for index, sentence, audio_bytes in synthesize_sentences(sentences):
+        if first_audio_at is None:
+            first_audio_at = time.perf_counter()
+        yield "audio", {
+            "index": index,
+            "total": len(sentences),
+            "text": sentence,
+            "audio_base64": base64.b64encode(audio_bytes).decode("utf-8"),
+        }
+
+    finished = time.perf_counter()
+    ttfa_ms = round(((first_audio_at or finished) - started) * 1000, 1)
+    total_ms = round((finished - started) * 1000, 1)
+    print(f" Audio en streaming: texto en {text_ms} ms, primer audio en {ttfa_ms} ms, total {total_ms} ms")
+    yield "done", {
+        "segments": len(sentences),
+        "text_ms": text_ms,
+        "ttfa_ms": ttfa_ms,
+        "total_ms": total_ms,
+        "error": error,
+    }
+
+
+# Respuestas fijas que el tótem dice una y otra vez: su audio se sintetiza al
+# arrancar (ver app/services/tts_cache.py).
+CANNED_VOICE_PHRASES = (GENERIC_ERROR_MESSAGE, FORBIDDEN_RESPONSE_TEXT, OFF_TOPIC_RESPONSE_TEXT)
+
+
+async def prewarm_voice_cache() -> int:
+    """Dejar en el cache TTS el audio de las respuestas fijas del chatbot."""
+    return await prewarm_tts_cache(CANNED_VOICE_PHRASES)
+
+
 def test_voice_pipeline(db: Session, test_text: str = "Hola, soy POLO Bot del Parque Industrial Polo 52") -> dict:
     """Probar pipeline completo de voz (TTS + chatbot)"""
     results = {"text_to_speech": None, "chat_response": None, "errors": []}
@@ -0,0 +1,243 @@
+# app/services/directory_read_model.py
+"""
+Read model desnormalizado del directorio: tabla `directorio_empresa`, una
+fila por empresa (ver models.DirectorioEmpresa).
+
+Casi todas las preguntas del chatbot terminaban en un SQL escrito por el
+modelo con JOIN de empresa, contacto, tipo_contacto, servicio_polo, lotes e
+info_comercial, muchas veces mal armado (o bien armado pero con un plan
+caro). Con esta tabla la consulta típica es un SELECT sobre una sola tabla,
+más fácil de escribir para Gemini y más barato para PostgreSQL.
+
+Se mantiene "on write" en vez de con una vista materializada, para que
+funcione igual en PostgreSQL y en SQLite (tests) y sin un REFRESH
+programado:
+
+- after_flush junta los cuil de las empresas tocadas (empresa, contacto,
+  servicio_polo, lotes, info_comercial; un cambio en tipo_contacto o
+  tipo_servicio_polo marca todas);
+- before_commit reescribe solo esas filas, dentro de la misma transacción,
+  así que el directorio nunca queda desfasado de lo que se confirmó.
+
+Al arrancar (bootstrap) se reconstruye entera, por si hubo cambios por
+fuera del ORM (SQL a mano, restore de un backup).
+
+Las mismas filas alimentan el índice full-text (directory_search) y el
+vectorial (directory_vectors): se les pasan recién en after_commit, para
+que nunca indexen algo que terminó en rollback.
+"""
+from datetime import datetime
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import delete, event, insert, inspect as sa_inspect, select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.services import directory_search, directory_vectors
+
+_PENDING_CUILS_KEY = "directorio_cuils"
+_PENDING_SERVICIOS_KEY = "directorio_servicios"
+_PENDING_ALL_KEY = "directorio_todo"
+_INDEX_UPDATES_KEY = "directorio_indexar"
+
+# Campos de info_comercial que se copian tal cual.
+INFO_COMERCIAL_FIELDS = (
+    "productos_servicios", "publico_objetivo", "atiende_publico",
+    "horario_atencion_comercial", "rango_precios", "modalidad_venta",
+    "marcas_representadas", "certificaciones", "observaciones_comerciales",
+)
+
+
+# ═══════════════════════════════════════════════════════════════════
+# ARMADO DE FILAS
+# ═══════════════════════════════════════════════════════════════════
+
+
+def _flatten_datos(datos) -> Optional[str]:
+    """{"web": "x.com", "instagram": "@x"} -> "web: x.com; instagram: @x" (buscable con ILIKE)."""
+    if not datos:
+        return None
+    if not isinstance(datos, dict):
+        return str(datos)
+    parts = [f"{key}: {value}" for key, value in datos.items() if value not in (None, "", [], {})]
+    return "; ".join(parts) or None
+
+
+def _where_cuil(column, cuils: Optional[Set[int]]):
+    return [] if cuils is None else [column.in_(cuils)]
+
+
+def build_directory_rows(db: Session, cuils: Optional[Set[int]] = None) -> List[Dict]:
+    """
+    Filas de directorio_empresa para `cuils` (todas si es None). Se arman
+    con SELECT de columnas, no con objetos del ORM, para no tocar el
+    identity map de la sesión que está haciendo el commit.
+    """
+    E, C, TC = models.Empresa, models.Contacto, models.TipoContacto
+    SP, TSP, L, IC = models.ServicioPolo, models.TipoServicioPolo, models.Lote, models.InfoComercial
+
+    empresas = db.execute(
+        select(
+            E.cuil, E.nombre, E.rubro, E.cant_empleados, E.horario_trabajo, E.observaciones,
+            E.fecha_ingreso, E.estado, E.estado_solicitud,
+        ).where(*_where_cuil(E.cuil, cuils))
+    ).all()
+    if not empresas:
+        return []
+
+    contactos: Dict[int, List] = {}
+    for row in db.execute(
+        select(C.cuil_empresa, C.nombre, C.telefono, C.direccion, C.datos, TC.tipo)
+        .outerjoin(TC, TC.id_tipo_contacto == C.id_tipo_contacto)
+        .where(*_where_cuil(C.cuil_empresa, cuils))
+        .order_by(C.id_contacto)
+    ):
+        contactos.setdefault(row.cuil_empresa, []).append(row)
+
+    servicios: Dict[int, List[str]] = {}
+    for row in db.execute(
+        select(SP.cuil, SP.nombre, TSP.tipo)
+        .outerjoin(TSP, TSP.id_tipo_servicio_polo == SP.id_tipo_servicio_polo)
+        .where(*_where_cuil(SP.cuil, cuils))
+        .order_by(SP.id_servicio_polo)
+    ):
+        servicios.setdefault(row.cuil, []).append(f"{row.nombre} ({row.tipo})" if row.tipo else row.nombre)
+
+    lotes: Dict[int, List] = {}
+    for row in db.execute(
+        select(SP.cuil, L.manzana, L.lote)
+        .join(SP, SP.id_servicio_polo == L.id_servicio_polo)
+        .where(*_where_cuil(SP.cuil, cuils))
+        .order_by(L.manzana, L.lote)
+    ):
+        lotes.setdefault(row.cuil, []).append(row)
+
+    info = {
+        row.cuil: row
+        for row in db.execute(
+            select(IC.cuil, *(getattr(IC, name) for name in INFO_COMERCIAL_FIELDS))
+            .where(*_where_cuil(IC.cuil, cuils))
+        )
+    }
+
+    now = datetime.now()
+    rows = []
+    for empresa in empresas:
+        row = dict(empresa._mapping)
+        row["actualizado"] = now
+
+        empresa_contactos = contactos.get(empresa.cuil, [])
+        comercial = next(
+            (c for c in empresa_contactos if (c.tipo or "").lower() == "comercial"),
+            empresa_contactos[0] if empresa_contactos else None,
+        )
+        row["contacto_nombre"] = comercial.nombre if comercial else None
+        row["contacto_telefono"] = comercial.telefono if comercial else None
+        row["contacto_direccion"] = comercial.direccion if comercial else None
+        row["contacto_datos"] = _flatten_datos(comercial.datos) if comercial else None
+
+        row["servicios_polo"] = "; ".join(servicios.get(empresa.cuil, [])) or None
+        empresa_lotes = lotes.get(empresa.cuil, [])
+        row["lotes"] = "; ".join(f"manzana {l.manzana} lote {l.lote}" for l in empresa_lotes) or None
+        row["manzana"] = empresa_lotes[0].manzana if empresa_lotes else None
+        row["lote"] = empresa_lotes[0].lote if empresa_lotes else None
+
+        empresa_info = info.get(empresa.cuil)
+        for name in INFO_COMERCIAL_FIELDS:
+            row[name] = getattr(empresa_info, name) if empresa_info else None
+        rows.append(row)
+    return rows
+
+
+def refresh_directory_rows(db: Session, cuils: Optional[Iterable[int]] = None) -> int:
+    """Reescribir las filas de `cuils` (todas si es None). Devuelve cuántas quedaron."""
+    cuil_set = None if cuils is None else set(cuils)
+    if cuil_set is not None and not cuil_set:
+        return 0
+
+    table = models.DirectorioEmpresa.__table__
+    rows = build_directory_rows(db, cuil_set)
+    if cuil_set is None:
+        db.execute(delete(table))
+    else:
+        db.execute(delete(table).where(table.c.cuil.in_(cuil_set)))
+    if rows:
+        db.execute(insert(table), rows)
+    db.info.setdefault(_INDEX_UPDATES_KEY, []).append((cuil_set, rows))
+    return len(rows)
+
+
+def refresh_directory_read_model(db: Session) -> int:
+    """Reconstrucción completa (arranque). Confirma la transacción."""
+    count = refresh_directory_rows(db)
+    db.commit()
+    print(f"Directorio desnormalizado reconstruido: {count} empresa(s)")
+    return count
+
+
+# ═══════════════════════════════════════════════════════════════════
+# MANTENIMIENTO EN CADA COMMIT
+# ═══════════════════════════════════════════════════════════════════
+
+
+def _values(obj, attribute: str) -> Set:
+    """Valor actual y anterior (si cambió en este flush) de un atributo."""
+    values = {getattr(obj, attribute, None)}
+    history = sa_inspect(obj).attrs[attribute].history
+    values.update(history.deleted or ())
+    values.discard(None)
+    return values
+
+
+def _collect_changes(session: Session, objects: Iterable) -> None:
+    info = session.info
+    for obj in objects:
+        if isinstance(obj, (models.Empresa, models.ServicioPolo, models.InfoComercial)):
+            info.setdefault(_PENDING_CUILS_KEY, set()).update(_values(obj, "cuil"))
+        elif isinstance(obj, models.Contacto):
+            info.setdefault(_PENDING_CUILS_KEY, set()).update(_values(obj, "cuil_empresa"))
+        elif isinstance(obj, models.Lote):
+            info.setdefault(_PENDING_SERVICIOS_KEY, set()).update(_values(obj, "id_servicio_polo"))
+        elif isinstance(obj, (models.TipoContacto, models.TipoServicioPolo)):
+            info[_PENDING_ALL_KEY] = True
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session: Session, flush_context) -> None:
+    # Igual que en chat_cache: en after_flush new/dirty/deleted todavía
+    # reflejan lo que se acaba de escribir.
+    _collect_changes(session, chain(session.new, session.dirty, session.deleted))
+
+
+@event.listens_for(Session, "before_commit")
+def _before_commit(session: Session) -> None:
+    # Lo que todavía no se mandó a la base se flushea acá, para que sus
+    # cambios entren en esta misma actualización.
+    if session.new or session.dirty or session.deleted:
+        session.flush()
+
+    info = session.info
+    refresh_all = info.pop(_PENDING_ALL_KEY, False)
+    cuils = info.pop(_PENDING_CUILS_KEY, set())
+    servicio_ids = info.pop(_PENDING_SERVICIOS_KEY, set())
+    if not (refresh_all or cuils or servicio_ids):
+        return
+
+    if servicio_ids and not refresh_all:
+        SP = models.ServicioPolo
+        cuils |= set(session.execute(select(SP.cuil).where(SP.id_servicio_polo.in_(servicio_ids))).scalars())
+    refresh_directory_rows(session, None if refresh_all else cuils)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session: Session) -> None:
+    for cuils, rows in session.info.pop(_INDEX_UPDATES_KEY, ()):
+        directory_search.apply_directory_changes(cuils, rows)
+        directory_vectors.apply_directory_changes(cuils, rows)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session: Session) -> None:
+    for key in (_PENDING_CUILS_KEY, _PENDING_SERVICIOS_KEY, _PENDING_ALL_KEY, _INDEX_UPDATES_KEY):
+        session.info.pop(key, None)
@@ -0,0 +1,323 @@
+# app/services/directory_search.py
+"""
+Búsqueda full-text sobre el directorio de empresas.
+
+Las preguntas del tipo "¿quién vende tornillos?" dependían de que Gemini
+escribiera ILIKE '%tornillo%' sobre productos_servicios, marcas y
+observaciones: un scan secuencial, sin plurales ("tornillos" no encuentra
+"tornillo"), sin acentos ("electrónica" vs "electronica") y sin orden por
+relevancia.
+
+Acá hay un índice invertido en memoria del proceso, armado a partir de las
+filas de directorio_empresa (app/services/directory_read_model.py):
+
+- el texto se normaliza una vez por documento: minúsculas, sin acentos,
+  sin stopwords y con un stemming liviano para español (plurales y vocal
+  final: "tornillos" y "tornillo" -> "tornill");
+- cada campo pesa distinto (nombre y productos más que observaciones);
+- el ranking es BM25 y cada término de la consulta también busca por
+  prefijo ("tornill" encuentra "tornilleria"), con menos peso.
+
+Se mantiene solo: directory_read_model deja en la sesión las filas que
+reescribe y, cuando el commit se confirma, se aplican acá (after_commit).
+Si todavía no se armó, el primer search lo arma leyendo la base. Como el
+rate limiting, es estado por proceso (uvicorn corre sin --workers).
+
+Se usa tanto desde el chatbot (campo search_query de la intención) como
+desde GET /search?q=...
+"""
+import bisect
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import models
+
+# Campos del directorio que se indexan, con su peso.
+FIELD_WEIGHTS: Dict[str, float] = {
+    "nombre": 3.0,
+    "productos_servicios": 3.0,
+    "rubro": 2.0,
+    "marcas_representadas": 2.0,
+    "servicios_polo": 1.0,
+    "certificaciones": 1.0,
+    "observaciones": 1.0,
+    "observaciones_comerciales": 1.0,
+}
+
+# BM25
+_K1 = 1.2
+_B = 0.75
+# Peso de un término que solo matchea por prefijo, frente a uno exacto.
+PREFIX_MATCH_WEIGHT = 0.5
+_MIN_PREFIX_LENGTH = 4
+_MAX_PREFIX_EXPANSIONS = 20
+
+_STOPWORDS = frozenset({
+    "a", "al", "ante", "con", "contra", "de", "del", "desde", "e", "el", "en", "entre",
+    "es", "esta", "este", "esto", "hacia", "hasta", "la", "las", "le", "les", "lo", "los",
+    "mas", "me", "mi", "ni", "no", "o", "para", "pero", "por", "que", "se", "si", "sin",
+    "sobre", "su", "sus", "te", "tu", "u", "un", "una", "unas", "uno", "unos", "y", "ya",
+    "sa", "srl", "sas",
+})
+# Palabras que aparecen en las preguntas pero no describen lo que se busca.
+_QUERY_NOISE = frozenset({
+    "quien", "quienes", "cual", "cuales", "donde", "hay", "alguna", "alguien", "algun",
+    "vende", "venden", "vendan", "fabrica", "fabrican", "hace", "hacen", "ofrece", "ofrecen",
+    "comprar", "compro", "conseguir", "consigo", "busco", "necesito", "empresa", "empresas",
+    "parque", "polo",
+})
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _fold(text_value: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text_value.lower())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def stem(word: str) -> str:
+    """Stemming liviano: plural y vocal final ("tornillos" -> "tornill", "motores" -> "motor")."""
+    if len(word) > 4 and word.endswith("es") and word[-3] not in "aeiou":
+        word = word[:-2]
+    elif len(word) > 3 and word.endswith("s"):
+        word = word[:-1]
+    if len(word) > 4 and word[-1] in "aeo":
+        word = word[:-1]
+    return word
+
+
+def analyze(text_value: Optional[str]) -> List[str]:
+    """Texto -> términos indexables (sin acentos, sin stopwords, con stem)."""
+    if not text_value:
+        return []
+    return [
+        stem(word)
+        for word in _WORD_RE.findall(_fold(str(text_value)))
+        if word not in _STOPWORDS and (len(word) > 1 or word.isdigit())
+    ]
+
+
+def analyze_query(query: Optional[str]) -> List[str]:
+    if not query:
+        return []
+    words = [word for word in _WORD_RE.findall(_fold(query)) if word not in _QUERY_NOISE]
+    terms = analyze(" ".join(words))
+    return list(dict.fromkeys(terms))
+
+
+def is_listed(row: Dict) -> bool:
+    """Empresa activa y aprobada: las demás solo aparecen si se pide explícitamente."""
+    return bool(row.get("estado")) and (row.get("estado_solicitud") or "aprobada") == "aprobada"
+
+
+class InvertedIndex:
+    """Índice término -> {cuil: frecuencia ponderada}, con ranking BM25."""
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._postings: Dict[str, Dict[int, float]] = defaultdict(dict)
+        self._doc_terms: Dict[int, Dict[str, float]] = {}
+        self._doc_length: Dict[int, float] = {}
+        self._active: Set[int] = set()
+        self._total_length = 0.0
+        self._vocabulary: List[str] = []
+        self._vocabulary_dirty = False
+        self.built = False
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def _remove(self, cuil: int) -> None:
+        terms = self._doc_terms.pop(cuil, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(cuil, None)
+                if not postings:
+                    del self._postings[term]
+                    self._vocabulary_dirty = True
+        self._total_length -= self._doc_length.pop(cuil, 0.0)
+        self._active.discard(cuil)
+
+    def _add(self, row: Dict) -> None:
+        cuil = row["cuil"]
+        terms: Dict[str, float] = defaultdict(float)
+        for field_name, weight in FIELD_WEIGHTS.items():
+            for term in analyze(row.get(field_name)):
+                terms[term] += weight
+        self._doc_terms[cuil] = dict(terms)
+        length = sum(terms.values())
+        self._doc_length[cuil] = length
+        self._total_length += length
+        if is_listed(row):
+            self._active.add(cuil)
+        for term, frequency in terms.items():
+            if term not in self._postings:
+                self._vocabulary_dirty = True
+            self._postings[term][cuil] = frequency
+
+    def replace_all(self, rows: Iterable[Dict]) -> None:
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._doc_length.clear()
+            self._active.clear()
+            self._total_length = 0.0
+            for row in rows:
+                self._add(row)
+            self._vocabulary_dirty = True
+            self.built = True
+
+    def update(self, cuils: Iterable[int], rows: Iterable[Dict]) -> None:
+        """Reemplazar los documentos de `cuils` por `rows` (los que falten quedan borrados)."""
+        with self._lock:
+            for cuil in cuils:
+                self._remove(cuil)
+            for row in rows:
+                self._remove(row["cuil"])
+                self._add(row)
+
+    def _expand(self, term: str) -> List[Tuple[str, float]]:
+        """El término exacto y, si es largo, los del vocabulario que empiezan con él."""
+        matches = [(term, 1.0)] if term in self._postings else []
+        if len(term) < _MIN_PREFIX_LENGTH:
+            return matches
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_dirty = False
+        start = bisect.bisect_left(self._vocabulary, term)
+        for candidate in self._vocabulary[start:start + _MAX_PREFIX_EXPANSIONS + 1]:
+            if not candidate.startswith(term):
+                break
+            if candidate != term:
+                matches.append((candidate, PREFIX_MATCH_WEIGHT))
+        return matches
+
+    def search(self, query: str, limit: int = 10, only_active: bool = True) -> List[Tuple[int, float]]:
+        """(cuil, score) ordenados por relevancia."""
+        terms = analyze_query(query)
+        if not terms:
+            return []
+        with self._lock:
+            total_docs = len(self._doc_terms)
+            if not total_docs:
+                return []
+            average_length = self._total_length / total_docs or 1.0
+            scores: Dict[int, float] = defaultdict(float)
+            for query_term in terms:
+                for term, match_weight in self._expand(query_term):
+                    postings = self._postings[term]
+                    idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for cuil, frequency in postings.items():
+                        if only_active and cuil not in self._active:
+                            continue
+                        norm = _K1 * (1 - _B + _B * self._doc_length[cuil] / average_length)
+                        scores[cuil] += match_weight * idf * frequency * (_K1 + 1) / (frequency + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(cuil, round(score, 4)) for cuil, score in ranked[:limit]]
+
+
+directory_index = InvertedIndex()
+
+
+# ═══════════════════════════════════════════════════════════════════
+# USO DESDE LA APP
+# ═══════════════════════════════════════════════════════════════════
+
+_stats_lock = threading.Lock()
+_stats = {"searches": 0, "search_ms_total": 0.0, "search_ms_max": 0.0, "rebuilds": 0, "updates": 0}
+
+
+def ensure_index(db: Session) -> InvertedIndex:
+    """Armar el índice desde la base si todavía no se armó en este proceso."""
+    if not directory_index.built:
+        from app.services.directory_read_model import build_directory_rows
+
+        directory_index.replace_all(build_directory_rows(db))
+        with _stats_lock:
+            _stats["rebuilds"] += 1
+    return directory_index
+
+
+def apply_directory_changes(cuils: Optional[Set[int]], rows: List[Dict]) -> None:
+    """Aplicar filas ya confirmadas (cuils=None: reconstrucción completa)."""
+    if cuils is None:
+        directory_index.replace_all(rows)
+        with _stats_lock:
+            _stats["rebuilds"] += 1
+        return
+    if not directory_index.built:
+        # Se va a armar entero, con estos cambios incluidos, en el primer search.
+        return
+    directory_index.update(cuils, rows)
+    with _stats_lock:
+        _stats["updates"] += 1
+
+
+def search_companies(db: Session, query: str, limit: int = 10, only_active: bool = True) -> List[Tuple[int, float]]:
+    """Búsqueda rankeada: [(cuil, score), ...]. La usan el chatbot y GET /search."""
+    index = ensure_index(db)
+    started = time.perf_counter()
+    results = index.search(query, limit=limit, only_active=only_active)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    with _stats_lock:
+        _stats["searches"] += 1
+        _stats["search_ms_total"] += elapsed_ms
+        _stats["search_ms_max"] = max(_stats["search_ms_max"], elapsed_ms)
+    return results
+
+
+# Columnas del directorio que vuelven al chatbot (sin cuil: nunca se muestra).
+CHAT_RESULT_COLUMNS = (
+    "nombre", "rubro", "productos_servicios", "marcas_representadas", "rango_precios",
+    "modalidad_venta", "contacto_telefono", "contacto_datos", "lotes",
+)
+
+
+def fetch_chat_rows(db: Session, ranked: List[Tuple[int, float]]) -> List[Dict]:
+    """Filas de directorio_empresa (CHAT_RESULT_COLUMNS) para `ranked`, en ese orden."""
+    if not ranked:
+        return []
+    table = models.DirectorioEmpresa.__table__
+    columns = [table.c.cuil] + [table.c[name] for name in CHAT_RESULT_COLUMNS]
+    by_cuil = {
+        row.cuil: {name: row._mapping[name] for name in CHAT_RESULT_COLUMNS}
+        for row in db.execute(select(*columns).where(table.c.cuil.in_([cuil for cuil, _ in ranked])))
+    }
+    return [by_cuil[cuil] for cuil, _ in ranked if cuil in by_cuil]
+
+
+def search_directory_rows(db: Session, query: str, limit: int = 10) -> List[Dict]:
+    """Filas de directorio_empresa para la búsqueda, en orden de relevancia."""
+    return fetch_chat_rows(db, search_companies(db, query, limit=limit))
+
+
+def get_search_stats() -> Dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    searches = stats["searches"]
+    stats["search_ms_avg"] = round(stats["search_ms_total"] / searches, 3) if searches else 0.0
+    stats["search_ms_total"] = round(stats["search_ms_total"], 3)
+    stats["search_ms_max"] = round(stats["search_ms_max"], 3)
+    stats["documents"] = len(directory_index)
+    stats["built"] = directory_index.built
+    return stats
+
+
+def reset_directory_search() -> None:
+    """Vaciar el índice y los contadores. Pensado para tests."""
+    directory_index.replace_all([])
+    directory_index.built = False
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0.0 if isinstance(_stats[key], float) else 0
@@ -0,0 +1,572 @@
+# app/services/directory_vectors.py
+"""
+Índice vectorial del directorio, para preguntas abiertas del tótem.
+
+Preguntas como "algo para reparar camiones" o "dónde compro insumos de
+limpieza" no coinciden con ningún valor literal de las columnas: el SQL que
+escribe Gemini vuelve vacío y la búsqueda full-text (directory_search)
+tampoco encuentra nada. Acá cada empresa es un documento (datos de empresa,
+info_comercial y contacto comercial, tal como quedan en directorio_empresa)
+con su embedding, y la pregunta se compara contra todos por similitud
+coseno.
+
+- Los vectores se guardan normalizados en una matriz float32 (una fila por
+  empresa). Con CHAT_VECTOR_INDEX_DIR la matriz vive en disco como memmap
+  y sobrevive a los reinicios; sin directorio queda en memoria.
+- La búsqueda es un solo producto matriz-vector más argpartition para el
+  top-k: para unos miles de empresas son décimas de milisegundo.
+- Se mantiene de forma incremental: directory_read_model avisa qué empresas
+  cambiaron (after_commit) y en la siguiente búsqueda se re-embeben solo
+  esas. El commit de un alta nunca espera a la API de embeddings.
+- Cada fila guarda el hash de su documento: al arrancar contra un índice
+  ya persistido solo se re-embeben las empresas cuyo texto cambió.
+- La sincronización completa (la primera del proceso) corre en una tarea
+  del arranque, nunca dentro de un pedido: hasta que termina, el chatbot
+  usa la búsqueda full-text.
+
+Los embeddings salen de Gemini (CHAT_EMBEDDING_MODEL). Sin GOOGLE_API_KEY, o
+con CHAT_VECTOR_EMBEDDER=hashing, se usa un embedder local por hashing de
+términos: léxico y no semántico, pero sin red (tests, desarrollo).
+
+NumPy es opcional como las librerías de Google Cloud en voice_service: si
+no está instalado, el chatbot cae a la búsqueda full-text.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import google.generativeai as genai
+from sqlalchemy.orm import Session
+
+from app.services import directory_search
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+    print(" numpy no instalado: búsqueda semántica del directorio deshabilitada")
+
+EMBEDDING_MODEL = os.getenv("CHAT_EMBEDDING_MODEL", "models/text-embedding-004")
+VECTOR_INDEX_DIR = os.getenv("CHAT_VECTOR_INDEX_DIR", "")
+# Similitud coseno mínima para que una empresa cuente como resultado.
+SEMANTIC_MIN_SCORE = float(os.getenv("CHAT_SEMANTIC_MIN_SCORE", "0.0"))
+
+_EMBED_BATCH_SIZE = 100
+_HASHING_DIMENSIONS = 256
+_MIN_CAPACITY = 64
+_VECTORS_FILE = "vectors.f32"
+_META_FILE = "index.json"
+
+# Campos de directorio_empresa que arman el documento de cada empresa.
+DOCUMENT_FIELDS: Tuple[Tuple[str, str], ...] = (
+    ("nombre", "Empresa"),
+    ("rubro", "Rubro"),
+    ("productos_servicios", "Productos y servicios"),
+    ("marcas_representadas", "Marcas"),
+    ("publico_objetivo", "Público"),
+    ("modalidad_venta", "Venta"),
+    ("certificaciones", "Certificaciones"),
+    ("servicios_polo", "En el parque"),
+    ("observaciones", "Observaciones"),
+    ("observaciones_comerciales", "Observaciones comerciales"),
+    ("contacto_datos", "Contacto"),
+)
+
+
+def document_text(row: Dict) -> str:
+    """Fila de directorio_empresa -> texto que se embebe."""
+    return "\n".join(
+        f"{label}: {row[name]}" for name, label in DOCUMENT_FIELDS if row.get(name) not in (None, "")
+    )
+
+
+def _digest(text_value: str) -> str:
+    return hashlib.blake2b(text_value.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return (vectors / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+
+# ═══════════════════════════════════════════════════════════════════
+# EMBEDDERS
+# ═══════════════════════════════════════════════════════════════════
+
+
+class GeminiEmbedder:
+    """Embeddings de la API de Gemini, en lotes."""
+
+    def __init__(self, model: str = EMBEDDING_MODEL) -> None:
+        self.model = model
+        self.name = model
+
+    def _embed(self, texts: Sequence[str], task_type: str):
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), _EMBED_BATCH_SIZE):
+            result = genai.embed_content(
+                model=self.model, content=list(texts[start:start + _EMBED_BATCH_SIZE]), task_type=task_type
+            )
+            vectors.extend(result["embedding"])
+        return np.asarray(vectors, dtype=np.float32)
+
+    def embed_documents(self, texts: Sequence[str]):
+        return self._embed(texts, "retrieval_document")
+
+    def embed_query(self, text_value: str):
+        return self._embed([text_value], "retrieval_query")[0]
+
+
+class HashingEmbedder:
+    """
+    Embedder local: cada término (ver directory_search.analyze) y sus
+    4-gramas van a una posición del vector por hash, con signo. Coincide en
+    palabras y raíces parecidas, no en significado.
+    """
+
+    def __init__(self, dimensions: int = _HASHING_DIMENSIONS) -> None:
+        self.dimensions = dimensions
+        self.name = f"hashing-{dimensions}"
+
+    def _vector(self, terms: Iterable[str]):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for term in terms:
+            features = [(term, 1.0)] + [(term[i:i + 4], 0.5) for i in range(len(term) - 3)]
+            for feature, weight in features:
+                value = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+                vector[value % self.dimensions] += weight if value >> 63 else -weight
+        return vector
+
+    def embed_documents(self, texts: Sequence[str]):
+        if not texts:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        return np.stack([self._vector(directory_search.analyze(text_value)) for text_value in texts])
+
+    def embed_query(self, text_value: str):
+        return self._vector(directory_search.analyze_query(text_value))
+
+
+def _default_embedder():
+    if np is None:
+        return None
+    if os.getenv("CHAT_VECTOR_EMBEDDER", "").lower() == "hashing" or not os.getenv("GOOGLE_API_KEY"):
+        print(" Búsqueda semántica con embedder local (hashing)")
+        return HashingEmbedder()
+    return GeminiEmbedder()
+
+
+embedder = _default_embedder()
+
+
+# ═══════════════════════════════════════════════════════════════════
+# MATRIZ DE VECTORES
+# ═══════════════════════════════════════════════════════════════════
+
+
+class VectorIndex:
+    """
+    Matriz float32 con un vector normalizado por empresa, más cuil -> fila.
+    Las bajas mueven la última fila al hueco, así la parte usada de la
+    matriz (las primeras len(self) filas) siempre es contigua.
+    """
+
+    def __init__(self, directory: Optional[str] = None) -> None:
+        self.directory = directory or None
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self, embedder_name: str = "") -> None:
+        with self._lock:
+            self.embedder_name = embedder_name
+            self.dimensions = 0
+            self._matrix = None
+            self._active = None
+            self._cuils: List[int] = []
+            self._row_of: Dict[int, int] = {}
+            self._hashes: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._cuils)
+
+    def cuils(self) -> List[int]:
+        with self._lock:
+            return list(self._cuils)
+
+    def hash_of(self, cuil: int) -> Optional[str]:
+        return self._hashes.get(cuil)
+
+    @property
+    def capacity(self) -> int:
+        return 0 if self._matrix is None else self._matrix.shape[0]
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _allocate(self, capacity: int) -> None:
+        """Agrandar la matriz (memmap en disco si hay directorio) copiando las filas usadas."""
+        used = len(self._cuils)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = self._path(_VECTORS_FILE + ".tmp")
+            matrix = np.memmap(temp_path, dtype=np.float32, mode="w+", shape=(capacity, self.dimensions))
+            if used:
+                matrix[:used] = self._matrix[:used]
+            matrix.flush()
+            del matrix
+            self._matrix = None
+            os.replace(temp_path, self._path(_VECTORS_FILE))
+            self._matrix = np.memmap(
+                self._path(_VECTORS_FILE), dtype=np.float32, mode="r+", shape=(capacity, self.dimensions)
+            )
+        else:
+            matrix = np.zeros((capacity, self.dimensions), dtype=np.float32)
+            if used:
+                matrix[:used] = self._matrix[:used]
+            self._matrix = matrix
+        active = np.zeros(capacity, dtype=bool)
+        if used:
+            active[:used] = self._active[:used]
+        self._active = active
+
+    def load(self) -> bool:
+        """Abrir el índice persistido en el directorio. False si no hay (o no se puede leer)."""
+        with self._lock:
+            self.reset()
+            if not self.directory or not os.path.exists(self._path(_META_FILE)):
+                return False
+            try:
+                with open(self._path(_META_FILE), encoding="utf-8") as meta_file:
+                    meta = json.load(meta_file)
+                cuils = [int(cuil) for cuil in meta["cuils"]]
+                matrix = np.memmap(
+                    self._path(_VECTORS_FILE), dtype=np.float32, mode="r+",
+                    shape=(meta["capacity"], meta["dimensions"]),
+                )
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Índice vectorial en {self.directory} ilegible, se rearma: {str(e)}")
+                return False
+            self.embedder_name = meta["embedder"]
+            self.dimensions = meta["dimensions"]
+            self._matrix = matrix
+            self._cuils = cuils
+            self._row_of = {cuil: row for row, cuil in enumerate(cuils)}
+            self._hashes = {int(cuil): digest for cuil, digest in meta["hashes"].items()}
+            self._active = np.zeros(meta["capacity"], dtype=bool)
+            active = set(meta["active"])
+            for row, cuil in enumerate(cuils):
+                self._active[row] = cuil in active
+            return True
+
+    def save(self) -> None:
+        """Bajar la matriz a disco y escribir el mapeo de filas (no hace nada sin directorio)."""
+        if not self.directory:
+            return
+        with self._lock:
+            if self._matrix is None:
+                return
+            self._matrix.flush()
+            meta = {
+                "embedder": self.embedder_name,
+                "dimensions": self.dimensions,
+                "capacity": self.capacity,
+                "cuils": self._cuils,
+                "hashes": {str(cuil): digest for cuil, digest in self._hashes.items()},
+                "active": [cuil for row, cuil in enumerate(self._cuils) if self._active[row]],
+            }
+            temp_path = self._path(_META_FILE + ".tmp")
+            with open(temp_path, "w", encoding="utf-8") as meta_file:
+                json.dump(meta, meta_file)
+            os.replace(temp_path, self._path(_META_FILE))
+
+    def upsert(self, items: Iterable[Tuple[int, object, bool, str]]) -> None:
+        """(cuil, vector, activa, hash del documento) por empresa nueva o cambiada."""
+        with self._lock:
+            for cuil, vector, active, digest in items:
+                vector = _normalize(np.asarray(vector, dtype=np.float32))
+                if not self.dimensions:
+                    self.dimensions = vector.shape[0]
+                row = self._row_of.get(cuil)
+                if row is None:
+                    row = len(self._cuils)
+                    if row >= self.capacity:
+                        self._allocate(max(_MIN_CAPACITY, self.capacity * 2))
+                    self._cuils.append(cuil)
+                    self._row_of[cuil] = row
+                self._matrix[row] = vector
+                self._active[row] = active
+                self._hashes[cuil] = digest
+
+    def set_active(self, cuil: int, active: bool) -> None:
+        with self._lock:
+            row = self._row_of.get(cuil)
+            if row is not None:
+                self._active[row] = active
+
+    def remove(self, cuils: Iterable[int]) -> None:
+        with self._lock:
+            for cuil in cuils:
+                row = self._row_of.pop(cuil, None)
+                if row is None:
+                    continue
+                self._hashes.pop(cuil, None)
+                last = len(self._cuils) - 1
+                if row != last:
+                    moved = self._cuils[last]
+                    self._matrix[row] = self._matrix[last]
+                    self._active[row] = self._active[last]
+                    self._cuils[row] = moved
+                    self._row_of[moved] = row
+                self._cuils.pop()
+                self._active[last] = False
+
+    def search(
+        self, query_vector, limit: int = 5, only_active: bool = True, min_score: float = SEMANTIC_MIN_SCORE
+    ) -> List[Tuple[int, float]]:
+        """(cuil, similitud coseno) de las `limit` empresas más parecidas."""
+        with self._lock:
+            used = len(self._cuils)
+            if not used or limit <= 0:
+                return []
+            query_vector = _normalize(np.asarray(query_vector, dtype=np.float32))
+            scores = self._matrix[:used] @ query_vector
+            if only_active:
+                scores = np.where(self._active[:used], scores, -np.inf)
+            k = min(limit, used)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [
+                (self._cuils[row], round(float(scores[row]), 4))
+                for row in top
+                if np.isfinite(scores[row]) and scores[row] > min_score
+            ]
+
+
+vector_index = VectorIndex(VECTOR_INDEX_DIR) if np is not None else None
+
+
+# ═══════════════════════════════════════════════════════════════════
+# MANTENIMIENTO Y USO DESDE LA APP
+# ═══════════════════════════════════════════════════════════════════
+
+_state_lock = threading.Lock()
+# Un solo proceso de embedding a la vez; las búsquedas concurrentes esperan.
+_sync_lock = threading.Lock()
+# La sincronización completa del arranque, una sola a la vez.
+_warm_lock = threading.Lock()
+# cuil -> fila nueva de directorio_empresa (None: la empresa ya no está).
+_pending: Dict[int, Optional[Dict]] = {}
+# Todas las filas de la última reconstrucción completa, todavía sin aplicar.
+_pending_full: Optional[List[Dict]] = None
+# Si ya hubo una sincronización completa en este proceso. Hasta entonces
+# el chatbot usa la búsqueda full-text.
+_synced = False
+
+_stats_lock = threading.Lock()
+_stats = {
+    "searches": 0, "search_ms_total": 0.0, "search_ms_max": 0.0, "query_embed_ms_total": 0.0,
+    "full_syncs": 0, "incremental_syncs": 0, "embedded_documents": 0,
+}
+
+
+def is_available() -> bool:
+    return np is not None and embedder is not None
+
+
+def is_ready() -> bool:
+    """Disponible y ya sincronizado entero: se puede buscar sin embeber el directorio."""
+    return is_available() and _synced
+
+
+def apply_directory_changes(cuils: Optional[Iterable[int]], rows: List[Dict]) -> None:
+    """
+    Anotar filas ya confirmadas (cuils=None: reconstrucción completa, con
+    todas las filas). No embebe nada: eso queda para la próxima búsqueda
+    o para warm_index.
+    """
+    global _pending_full
+    if not is_available():
+        return
+    with _state_lock:
+        if cuils is None:
+            _pending_full = list(rows)
+            _pending.clear()
+            return
+        for cuil in cuils:
+            _pending[cuil] = None
+        for row in rows:
+            _pending[row["cuil"]] = row
+
+
+def _index_rows(rows: Iterable[Dict]) -> int:
+    """Embeber solo las filas cuyo documento cambió; al resto se le actualiza el estado."""
+    changed = []
+    for row in rows:
+        text_value = document_text(row)
+        digest = _digest(text_value)
+        if vector_index.hash_of(row["cuil"]) == digest:
+            vector_index.set_active(row["cuil"], directory_search.is_listed(row))
+        else:
+            changed.append((row["cuil"], text_value, digest, directory_search.is_listed(row)))
+    if changed:
+        vectors = embedder.embed_documents([text_value for _, text_value, _, _ in changed])
+        vector_index.upsert(
+            (cuil, vector, active, digest) for (cuil, _, digest, active), vector in zip(changed, vectors)
+        )
+    return len(changed)
+
+
+def sync_index() -> "VectorIndex":
+    """
+    Poner el índice al día con las filas anotadas por los commits. No toca
+    la base: las filas llegan ya armadas desde directory_read_model.
+    """
+    global _pending_full, _synced
+    with _sync_lock:
+        with _state_lock:
+            full_rows, pending = _pending_full, dict(_pending)
+            _pending_full = None
+            _pending.clear()
+        full = full_rows is not None
+        if not full and not pending:
+            return vector_index
+        try:
+            if full:
+                # La primera vez en el proceso se parte de lo persistido (si es
+                # del mismo embedder): solo se re-embebe lo que cambió.
+                if vector_index.embedder_name != embedder.name:
+                    if not vector_index.load() or vector_index.embedder_name != embedder.name:
+                        vector_index.reset(embedder.name)
+                present = {row["cuil"] for row in full_rows}
+                vector_index.remove([cuil for cuil in vector_index.cuils() if cuil not in present])
+                embedded = _index_rows(full_rows)
+            else:
+                embedded = 0
+            vector_index.remove([cuil for cuil, row in pending.items() if row is None])
+            embedded += _index_rows(row for row in pending.values() if row is not None)
+            vector_index.save()
+        except Exception:
+            # Se reintenta más adelante; los cambios que llegaron mientras
+            # tanto son más nuevos y tienen prioridad.
+            with _state_lock:
+                if full and _pending_full is None:
+                    _pending_full = full_rows
+                for cuil, row in pending.items():
+                    _pending.setdefault(cuil, row)
+            raise
+        if full:
+            _synced = True
+    with _stats_lock:
+        _stats["full_syncs" if full else "incremental_syncs"] += 1
+        _stats["embedded_documents"] += embedded
+    if full:
+        print(f"Índice vectorial del directorio: {len(vector_index)} empresa(s), {embedded} embebida(s)")
+    return vector_index
+
+
+def warm_index(session_factory=None) -> int:
+    """
+    Sincronización completa fuera de los pedidos (tarea de arranque en
+    main.py, o en segundo plano si una búsqueda la encuentra pendiente).
+    Embeber el directorio entero son muchas llamadas a la API: dentro de un
+    pedido dejaba al usuario esperando con una conexión del pool tomada.
+    Si la reconstrucción del arranque (bootstrap) ya anotó las filas no se
+    lee la base; si no, se leen con una sesión propia que se cierra antes
+    de embeber. Devuelve cuántas empresas quedaron en el índice.
+    """
+    global _pending_full
+    if not is_available() or _synced:
+        return len(vector_index) if vector_index is not None else 0
+    if not _warm_lock.acquire(blocking=False):
+        return len(vector_index)
+    try:
+        with _state_lock:
+            needs_rows = _pending_full is None
+        if needs_rows:
+            from app.services.directory_read_model import build_directory_rows
+
+            if session_factory is None:
+                from app.chatbot_db import ChatbotSessionLocal as session_factory
+            db = session_factory()
+            try:
+                rows = build_directory_rows(db)
+            finally:
+                db.close()
+            with _state_lock:
+                # Una reconstrucción confirmada mientras se leía es más nueva.
+                if _pending_full is None:
+                    _pending_full = rows
+        sync_index()
+    except Exception as e:
+        print(f"Error sincronizando el índice vectorial del directorio: {str(e)}")
+    finally:
+        _warm_lock.release()
+    return len(vector_index)
+
+
+def start_background_sync() -> bool:
+    """Lanzar warm_index en un hilo si hace falta y no está corriendo ya."""
+    if not is_available() or _synced or _warm_lock.locked():
+        return False
+    threading.Thread(target=warm_index, name="directory-vectors-sync", daemon=True).start()
+    return True
+
+
+def semantic_search(query: str, limit: int = 5, only_active: bool = True) -> List[Tuple[int, float]]:
+    """Empresas más parecidas a `query`: [(cuil, similitud), ...]. Vacío si el índice no está listo."""
+    if not is_ready() or not (query or "").strip():
+        return []
+    started = time.perf_counter()
+    query_vector = embedder.embed_query(query)
+    embedded_at = time.perf_counter()
+    index = sync_index()
+    synced_at = time.perf_counter()
+    results = index.search(query_vector, limit=limit, only_active=only_active)
+    finished = time.perf_counter()
+    search_ms = (finished - synced_at) * 1000
+    with _stats_lock:
+        _stats["searches"] += 1
+        _stats["query_embed_ms_total"] += (embedded_at - started) * 1000
+        _stats["search_ms_total"] += search_ms
+        _stats["search_ms_max"] = max(_stats["search_ms_max"], search_ms)
+    return results
+
+
+def semantic_directory_rows(db: Session, query: str, limit: int = 5) -> List[Dict]:
+    """Filas de directorio_empresa para la búsqueda semántica, de la más a la menos parecida."""
+    # La pregunta se embebe (red) antes de tocar la base.
+    return directory_search.fetch_chat_rows(db, semantic_search(query, limit=limit))
+
+
+def get_vector_stats() -> Dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    searches = stats["searches"]
+    stats["search_ms_avg"] = round(stats["search_ms_total"] / searches, 3) if searches else 0.0
+    stats["query_embed_ms_avg"] = round(stats["query_embed_ms_total"] / searches, 3) if searches else 0.0
+    for key in ("search_ms_total", "search_ms_max", "query_embed_ms_total"):
+        stats[key] = round(stats[key], 3)
+    stats["available"] = is_available()
+    stats["ready"] = is_ready()
+    stats["embedder"] = embedder.name if embedder is not None else None
+    stats["documents"] = len(vector_index) if vector_index is not None else 0
+    stats["persisted"] = bool(vector_index is not None and vector_index.directory)
+    with _state_lock:
+        stats["pending"] = len(_pending)
+    return stats
+
+
+def reset_directory_vectors() -> None:
+    """Vaciar el índice (sin borrar lo persistido) y los contadores. Pensado para tests."""
+    global _pending_full, _synced
+    with _state_lock:
+        _pending.clear()
+        _pending_full = None
+        _synced = False
+    if vector_index is not None:
+        vector_index.reset()
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0.0 if isinstance(_stats[key], float) else 0
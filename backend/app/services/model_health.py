@@ -0,0 +1,344 @@
+# app/services/model_health.py
+"""
+Circuit breaker por modelo de Gemini.
+
+Antes, cualquier excepción en _generate (un timeout, un 429 pasajero)
+degradaba el modelo activo para siempre: el proceso terminaba en el último
+candidato (gemini-2.5-pro, el más lento) hasta el próximo reinicio.
+
+Ahora cada candidato tiene su propio breaker:
+
+- closed: se usa normalmente.
+- open: se saltea hasta que vence su cooldown.
+- half_open: venció el cooldown; el próximo pedido real hace de prueba
+  (una sola a la vez). Si anda, vuelve a closed; si no, se reabre con un
+  cooldown el doble de largo (hasta un tope).
+
+Los errores se clasifican, porque no significan lo mismo:
+
+- deprecated (404 / "no longer available"): se abre enseguida y por
+  mucho tiempo; el modelo no va a volver. Se decide por el tipo de la
+  excepción de google.api_core o el código HTTP, no por el texto: un 400
+  común no tiene que dejar al modelo afuera por horas.
+- quota (429 / resource exhausted): se abre enseguida, cooldown corto.
+- transient (timeouts, 5xx, red) y otros: se abre recién después de
+  varios fallos seguidos.
+
+Como los candidatos se recorren siempre en orden de preferencia, apenas el
+preferido sale de open el próximo pedido lo prueba y, si responde, se vuelve
+a él: un mal minuto de Google no nos deja en el fallback para siempre.
+
+También se lleva un EWMA de latencia por modelo y una ventana con las
+latencias recientes, que usa el modo de hedging (ver más abajo); el estado
+completo se expone en /health. Igual que app/rate_limit.py, es estado por
+proceso.
+"""
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:
+    google_exceptions = None
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+FAILURE_THRESHOLD = int(os.getenv("GEMINI_BREAKER_FAILURE_THRESHOLD", "3"))
+TRANSIENT_COOLDOWN_SECONDS = float(os.getenv("GEMINI_BREAKER_COOLDOWN_SECONDS", "30"))
+MAX_COOLDOWN_SECONDS = float(os.getenv("GEMINI_BREAKER_MAX_COOLDOWN_SECONDS", "300"))
+QUOTA_COOLDOWN_SECONDS = float(os.getenv("GEMINI_QUOTA_COOLDOWN_SECONDS", "60"))
+DEPRECATED_COOLDOWN_SECONDS = float(os.getenv("GEMINI_DEPRECATED_COOLDOWN_SECONDS", "21600"))
+LATENCY_EWMA_ALPHA = 0.2
+LATENCY_WINDOW = 200
+
+# Por código HTTP: los errores de la API (google.api_core) lo traen en
+# `.code`; otros clientes, en `.status_code`.
+_DEPRECATED_STATUS = {404, 410}
+_QUOTA_STATUS = {429}
+_TRANSIENT_STATUS = {408, 500, 502, 503, 504}
+
+# Solo para errores sin tipo ni código (RuntimeError de un wrapper, cassettes
+# del transporte): palabras o frases completas. Un 400 cualquiera que
+# mencione "1500" o "is not supported" no puede abrir el breaker por horas.
+_DEPRECATED_RE = re.compile(r"\b(404|410|not found|no longer available|has been deprecated|is deprecated)\b")
+_QUOTA_RE = re.compile(
+    r"\b(429|quota|resource ?exhausted|resource has been exhausted|rate limit(ed)?|too many requests)\b"
+)
+_TRANSIENT_RE = re.compile(
+    r"\b(50[0234]|timeout|timed out|deadline exceeded|unavailable|internal (server )?error|"
+    r"connection (reset|refused|aborted|error)|reset by peer|temporarily)\b"
+)
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    for attribute in ("code", "status_code"):
+        value = getattr(exc, attribute, None)
+        if isinstance(value, int) and not isinstance(value, bool) and 100 <= value < 600:
+            return value
+    return None
+
+
+def _classify_status(status: int) -> str:
+    if status in _DEPRECATED_STATUS:
+        return "deprecated"
+    if status in _QUOTA_STATUS:
+        return "quota"
+    if status in _TRANSIENT_STATUS or status >= 500:
+        return "transient"
+    return "other"
+
+
+def classify_error(exc: BaseException) -> str:
+    """
+    'deprecated' | 'quota' | 'transient' | 'other'. Manda el tipo o el
+    código HTTP del error; el mensaje se mira solo si no hay ninguno de los dos.
+    """
+    if isinstance(exc, TimeoutError):
+        return "transient"
+    if google_exceptions is not None:
+        if isinstance(exc, google_exceptions.NotFound):
+            return "deprecated"
+        if isinstance(exc, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)):
+            return "quota"
+        if isinstance(exc, (google_exceptions.ServerError, google_exceptions.DeadlineExceeded,
+                            google_exceptions.ServiceUnavailable, google_exceptions.RetryError)):
+            return "transient"
+        if isinstance(exc, google_exceptions.GoogleAPICallError):
+            status = _status_code(exc)
+            return _classify_status(status) if status is not None else "other"
+    status = _status_code(exc)
+    if status is not None:
+        return _classify_status(status)
+    if isinstance(exc, ConnectionError):
+        return "transient"
+    description = str(exc).lower()
+    if _DEPRECATED_RE.search(description):
+        return "deprecated"
+    if _QUOTA_RE.search(description):
+        return "quota"
+    if _TRANSIENT_RE.search(description):
+        return "transient"
+    return "other"
+
+
+class ModelBreaker:
+    """Estado de salud de un modelo. Todos los métodos toman el lock del registro."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.cooldown_seconds = 0.0
+        self.probe_in_flight = False
+        self.latency_ewma_ms: Optional[float] = None
+        self.recent_latencies_ms: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.successes = 0
+        self.failures: Dict[str, int] = {"deprecated": 0, "quota": 0, "transient": 0, "other": 0}
+        self.last_error: Optional[str] = None
+
+    def allow_request(self, now: float) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if now < self.open_until:
+                return False
+            self.state = HALF_OPEN
+            self.probe_in_flight = False
+        # half_open: una sola prueba a la vez.
+        if self.probe_in_flight:
+            return False
+        self.probe_in_flight = True
+        return True
+
+    def record_success(self, latency_ms: float) -> None:
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.probe_in_flight = False
+        self.cooldown_seconds = 0.0
+        self.recent_latencies_ms.append(latency_ms)
+        if self.latency_ewma_ms is None:
+            self.latency_ewma_ms = latency_ms
+        else:
+            self.latency_ewma_ms += LATENCY_EWMA_ALPHA * (latency_ms - self.latency_ewma_ms)
+
+    def record_failure(self, kind: str, message: str, now: float) -> None:
+        self.failures[kind] = self.failures.get(kind, 0) + 1
+        self.consecutive_failures += 1
+        self.last_error = message[:200]
+        was_probe = self.state == HALF_OPEN
+        self.probe_in_flight = False
+
+        if kind == "deprecated":
+            cooldown = DEPRECATED_COOLDOWN_SECONDS
+        elif kind == "quota":
+            cooldown = max(QUOTA_COOLDOWN_SECONDS, self.cooldown_seconds * 2 if was_probe else 0)
+        elif was_probe or self.consecutive_failures >= FAILURE_THRESHOLD:
+            cooldown = min(
+                self.cooldown_seconds * 2 if was_probe and self.cooldown_seconds else TRANSIENT_COOLDOWN_SECONDS,
+                MAX_COOLDOWN_SECONDS,
+            )
+        else:
+            return  # todavía tolerable: sigue closed
+
+        self.state = OPEN
+        self.cooldown_seconds = cooldown
+        self.open_until = now + cooldown
+
+    def snapshot(self, now: float) -> Dict[str, object]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_in_seconds": round(max(self.open_until - now, 0.0), 1) if self.state == OPEN else 0.0,
+            "latency_ewma_ms": round(self.latency_ewma_ms, 1) if self.latency_ewma_ms is not None else None,
+            "successes": self.successes,
+            "failures": dict(self.failures),
+            "last_error": self.last_error,
+        }
+
+
+_lock = threading.Lock()
+_breakers: Dict[str, ModelBreaker] = {}
+
+
+def _breaker(name: str) -> ModelBreaker:
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers[name] = ModelBreaker(name)
+    return breaker
+
+
+def allow_request(name: str) -> bool:
+    """True si se puede llamar al modelo ahora (closed, o le toca la prueba de half_open)."""
+    with _lock:
+        return _breaker(name).allow_request(time.monotonic())
+
+
+def record_success(name: str, latency_ms: float) -> None:
+    with _lock:
+        _breaker(name).record_success(latency_ms)
+
+
+def record_failure(name: str, exc: BaseException) -> str:
+    """Registrar el fallo y devolver su clasificación."""
+    kind = classify_error(exc)
+    with _lock:
+        breaker = _breaker(name)
+        previous_state = breaker.state
+        breaker.record_failure(kind, str(exc), time.monotonic())
+        opened = breaker.state == OPEN and previous_state != OPEN
+    if opened:
+        print(f"⚠️  Circuit breaker abierto para '{name}' ({kind}) por {breaker.cooldown_seconds:.0f}s")
+    return kind
+
+
+def record_latency_sample(name: str, latency_ms: float) -> None:
+    """
+    Sumar una muestra de latencia sin contar éxito ni fallo. Se usa para la
+    llamada que pierde un hedge: se cancela, pero tardó *al menos* eso, y
+    sin la muestra el percentil quedaría sesgado hacia abajo.
+    """
+    with _lock:
+        _breaker(name).recent_latencies_ms.append(latency_ms)
+
+
+def latency_percentile(name: str, percentile: float) -> Optional[float]:
+    """Percentil (nearest-rank) de las latencias recientes del modelo, o None si no hay muestras."""
+    with _lock:
+        samples = sorted(_breaker(name).recent_latencies_ms)
+    if not samples:
+        return None
+    rank = max(math.ceil(percentile / 100 * len(samples)), 1)
+    return samples[min(rank, len(samples)) - 1]
+
+
+def release_probe(name: str) -> None:
+    """Liberar una prueba half_open que no llegó a hacerse (p. ej. un stream abandonado)."""
+    with _lock:
+        breaker = _breakers.get(name)
+        if breaker is not None:
+            breaker.probe_in_flight = False
+
+
+def get_model_health(names) -> Dict[str, Dict[str, object]]:
+    """Estado de los breakers de `names` (en orden de preferencia), para /health."""
+    now = time.monotonic()
+    with _lock:
+        return {name: _breaker(name).snapshot(now) for name in dict.fromkeys(names)}
+
+
+# ═══════════════════════════════════════════════════════════════════
+# HEDGING (opt-in)
+# ═══════════════════════════════════════════════════════════════════
+# Si la llamada al modelo preferido no volvió dentro del percentil
+# GEMINI_HEDGE_PERCENTILE de sus latencias recientes, se lanza la misma
+# llamada al siguiente candidato sano y gana la primera respuesta. Cuesta
+# pedidos extra a Gemini, por eso está apagado por defecto y se cuenta todo.
+
+HEDGING_ENABLED = os.getenv("GEMINI_HEDGING", "false").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("GEMINI_HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_DELAY_MS = float(os.getenv("GEMINI_HEDGE_DEFAULT_DELAY_MS", "3000"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("GEMINI_HEDGE_MIN_DELAY_MS", "200"))
+
+_hedge_stats = {
+    "calls": 0,
+    "hedged": 0,
+    "hedge_wins": 0,
+    "primary_wins": 0,
+    "extra_requests": 0,
+    "extra_prompt_tokens": 0,
+}
+
+
+def hedge_delay_seconds(name: str) -> float:
+    """Cuánto esperar al modelo `name` antes de lanzar el hedge."""
+    with _lock:
+        enough = len(_breaker(name).recent_latencies_ms) >= HEDGE_MIN_SAMPLES
+    delay_ms = latency_percentile(name, HEDGE_PERCENTILE) if enough else None
+    if delay_ms is None:
+        delay_ms = HEDGE_DEFAULT_DELAY_MS
+    return max(delay_ms, HEDGE_MIN_DELAY_MS) / 1000
+
+
+def record_hedge_call() -> None:
+    with _lock:
+        _hedge_stats["calls"] += 1
+
+
+def record_hedge_launched(prompt_tokens: int) -> None:
+    with _lock:
+        _hedge_stats["hedged"] += 1
+        _hedge_stats["extra_requests"] += 1
+        _hedge_stats["extra_prompt_tokens"] += prompt_tokens
+
+
+def record_hedge_outcome(hedge_won: bool) -> None:
+    with _lock:
+        _hedge_stats["hedge_wins" if hedge_won else "primary_wins"] += 1
+
+
+def get_hedge_stats() -> Dict[str, object]:
+    with _lock:
+        stats = dict(_hedge_stats)
+    stats["enabled"] = HEDGING_ENABLED
+    stats["percentile"] = HEDGE_PERCENTILE
+    stats["hedge_rate"] = round(stats["hedged"] / stats["calls"], 4) if stats["calls"] else 0.0
+    stats["hedge_win_rate"] = round(stats["hedge_wins"] / stats["hedged"], 4) if stats["hedged"] else 0.0
+    return stats
+
+
+def reset_model_health() -> None:
+    """Vuelve todos los modelos a closed y sin historia. Pensado para tests."""
+    with _lock:
+        _breakers.clear()
+        for key in _hedge_stats:
+            _hedge_stats[key] = 0
@@ -0,0 +1,157 @@
+# app/services/result_encoder.py
+"""
+Codificación compacta de los resultados SQL para el prompt final.
+
+Antes las filas iban al prompt como json.dumps(db_results): el nombre de
+cada columna repetido en cada fila, los null, los cuil/id que igual no se
+pueden mostrar y, con 50 filas anchas, varios miles de tokens que hacían
+más lenta y más cara la segunda llamada a Gemini. Acá:
+
+- se proyectan las columnas visibles (sin cuil ni id, igual que
+  compose_fallback_response) y se descartan las que vienen vacías en todas
+  las filas;
+- una fila sola va como "columna: valor", solo con los campos cargados;
+- varias filas van como tabla con el encabezado una sola vez, separada por
+  " | ", con las celdas vacías en blanco;
+- hay tope de filas (CHAT_PROMPT_MAX_ROWS) y de tokens
+  (CHAT_PROMPT_RESULTS_TOKEN_BUDGET); lo que no entra se resume en un
+  "(N filas más sin mostrar)".
+
+Los tokens se estiman igual que en schema_context. Se lleva la cuenta de
+cuánto habría costado el JSON y cuánto se ahorró (sale en /health).
+"""
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from app.services.answer_renderer import format_value, is_hidden_column
+from app.services.schema_context import estimate_tokens
+
+RESULTS_MAX_ROWS = int(os.getenv("CHAT_PROMPT_MAX_ROWS", "30"))
+RESULTS_TOKEN_BUDGET = int(os.getenv("CHAT_PROMPT_RESULTS_TOKEN_BUDGET", "1500"))
+# Una celda más larga que esto se recorta (un "observaciones" de varios párrafos).
+MAX_CELL_CHARS = 300
+
+EMPTY_RESULTS_TEXT = "(sin resultados)"
+_SEPARATOR = " | "
+
+
+@dataclass
+class EncodedResults:
+    """Texto de los resultados para el prompt, con lo que costó frente al JSON."""
+
+    text: str
+    rows_total: int = 0
+    rows_included: int = 0
+    columns: List[str] = field(default_factory=list)
+    tokens: int = 0
+    json_tokens: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(self.json_tokens - self.tokens, 0)
+
+
+def _cell(value) -> str:
+    text_value = format_value(value)
+    if text_value is None:
+        return ""
+    text_value = " ".join(text_value.replace("|", "/").split())
+    if len(text_value) > MAX_CELL_CHARS:
+        text_value = text_value[: MAX_CELL_CHARS - 1].rstrip() + "…"
+    return text_value
+
+
+def _rest_marker(remaining: int) -> str:
+    return f"({remaining} fila más sin mostrar)" if remaining == 1 else f"({remaining} filas más sin mostrar)"
+
+
+def encode_results(
+    db_results: List[Dict], max_rows: Optional[int] = None, token_budget: Optional[int] = None
+) -> EncodedResults:
+    """Filas de la consulta -> texto compacto para el prompt final."""
+    max_rows = RESULTS_MAX_ROWS if max_rows is None else max_rows
+    token_budget = RESULTS_TOKEN_BUDGET if token_budget is None else token_budget
+    rows = [row for row in db_results or [] if isinstance(row, dict)]
+    json_tokens = estimate_tokens(json.dumps(list(db_results or []), ensure_ascii=False, default=str))
+
+    cells = [{key: _cell(value) for key, value in row.items() if not is_hidden_column(key)} for row in rows]
+    columns: List[str] = []
+    for row in cells[:max_rows]:
+        for key, value in row.items():
+            if value and key not in columns:
+                columns.append(key)
+
+    if not columns:
+        return _record(EncodedResults(text=EMPTY_RESULTS_TEXT, rows_total=len(rows), json_tokens=json_tokens))
+
+    if len(cells) == 1:
+        lines = [f"{key}: {cells[0][key]}" for key in columns if cells[0].get(key)]
+        text_value = "\n".join(lines)
+        return _record(
+            EncodedResults(
+                text=text_value, rows_total=1, rows_included=1, columns=columns,
+                tokens=estimate_tokens(text_value), json_tokens=json_tokens,
+            )
+        )
+
+    lines = [_SEPARATOR.join(columns)]
+    used_tokens = estimate_tokens(lines[0])
+    # Reserva para el marcador de filas que no entran.
+    marker_tokens = estimate_tokens(_rest_marker(len(cells)))
+    included = 0
+    for row in cells[:max_rows]:
+        line = _SEPARATOR.join(row.get(key, "") for key in columns)
+        line_tokens = estimate_tokens(line) + 1
+        if included and used_tokens + line_tokens + marker_tokens > token_budget:
+            break
+        lines.append(line)
+        used_tokens += line_tokens
+        included += 1
+
+    if included < len(cells):
+        lines.append(_rest_marker(len(cells) - included))
+    text_value = "\n".join(lines)
+    return _record(
+        EncodedResults(
+            text=text_value, rows_total=len(cells), rows_included=included, columns=columns,
+            tokens=estimate_tokens(text_value), json_tokens=json_tokens,
+        )
+    )
+
+
+# ═══════════════════════════════════════════════════════════════════
+# MÉTRICAS
+# ═══════════════════════════════════════════════════════════════════
+
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "rows_total": 0, "rows_included": 0, "tokens": 0, "json_tokens": 0}
+
+
+def _record(encoded: EncodedResults) -> EncodedResults:
+    with _stats_lock:
+        _stats["requests"] += 1
+        _stats["rows_total"] += encoded.rows_total
+        _stats["rows_included"] += encoded.rows_included
+        _stats["tokens"] += encoded.tokens
+        _stats["json_tokens"] += encoded.json_tokens
+    return encoded
+
+
+def get_encoder_stats() -> Dict[str, object]:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["tokens_saved"] = max(stats["json_tokens"] - stats["tokens"], 0)
+    stats["savings_ratio"] = round(stats["tokens_saved"] / stats["json_tokens"], 4) if stats["json_tokens"] else 0.0
+    stats["max_rows"] = RESULTS_MAX_ROWS
+    stats["token_budget"] = RESULTS_TOKEN_BUDGET
+    return stats
+
+
+def reset_encoder_stats() -> None:
+    """Pone los contadores en cero. Pensado para tests."""
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
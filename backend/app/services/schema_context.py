@@ -0,0 +1,274 @@
+# app/services/schema_context.py
+"""
+Contexto de esquema para la etapa de intención del chatbot.
+
+get_database_schema arma un párrafo largo con todas las tablas, columnas y
+relaciones permitidas, y ese texto viajaba entero a Gemini en cada mensaje:
+cada tabla nueva sumaba tokens (y latencia) a todas las preguntas, aunque
+no tuvieran nada que ver con ella.
+
+Acá se guarda una representación compacta por tabla y un índice de palabras
+clave/sinónimos ("lote", "manzana", "teléfono", "precio"...). Para cada
+pregunta se mandan solo las tablas relevantes más las que hacen falta para
+los JOIN (las que referencian por clave foránea, p. ej. lotes ->
+servicio_polo -> empresa). Si la pregunta no pega con ninguna tabla (un
+saludo, una pregunta ambigua) se manda el esquema compacto completo, que
+igual es bastante más corto que el texto original.
+
+El ahorro de tokens se imprime por pedido y se acumula en contadores que
+expone /health.
+"""
+import math
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+# Palabras clave y sinónimos (ya normalizados: minúsculas y sin acentos) que
+# apuntan a cada tabla del directorio. Los nombres de tabla y de columna se
+# agregan solos al índice; acá va el vocabulario con el que pregunta la gente.
+TABLE_KEYWORDS: Dict[str, FrozenSet[str]] = {
+    "empresa": frozenset({
+        "empresa", "compania", "firma", "fabrica", "industria", "negocio", "rubro",
+        "empleado", "trabajador", "personal", "horario", "ingreso", "estado",
+    }),
+    "contacto": frozenset({
+        "contacto", "telefono", "tel", "celular", "whatsapp", "direccion", "domicilio",
+        "correo", "mail", "email", "web", "pagina", "sitio", "redes", "instagram",
+        "facebook", "linkedin", "comunicar", "llamar", "escribir", "ubicacion", "donde",
+    }),
+    "tipo_contacto": frozenset({"tipo_contacto"}),
+    "servicio_polo": frozenset({
+        "servicio", "espacio", "comedor", "restaurante", "banco", "cajero", "guardia",
+        "seguridad", "salon", "sum", "estacionamiento", "propietario", "instalacion",
+    }),
+    "tipo_servicio_polo": frozenset({"tipo_servicio_polo"}),
+    "lotes": frozenset({
+        "lote", "manzana", "terreno", "parcela", "predio", "dueno", "propietario",
+        "coordenada", "latitud", "longitud", "mapa", "ubicacion", "donde", "queda",
+    }),
+    "info_comercial": frozenset({
+        "precio", "costo", "valor", "barato", "caro", "economico", "premium", "producto",
+        "vende", "venta", "compra", "comprar", "catalogo", "marca", "certificacion",
+        "certificado", "iso", "publico", "cliente", "mayorista", "minorista", "online",
+        "presencial", "b2b", "b2c", "comercial", "ofrece", "fabrica", "distribuye",
+    }),
+}
+
+# Partes de nombres de tabla/columna que aparecen en casi todas las tablas
+# (o en casi todas las preguntas): no sirven para elegir.
+_GENERIC_WORDS = frozenset({"id", "nombre", "datos", "tipo", "cuil", "polo"})
+
+# Read model desnormalizado (una fila por empresa, ver
+# app/services/directory_read_model.py): la fuente preferida para el SQL del
+# chatbot. Se lista primero y se marca como tal en el esquema.
+PREFERRED_TABLE = "directorio_empresa"
+
+# Tablas que se mandan siempre que haya algo relevante: casi todas las
+# preguntas terminan filtrando o nombrando empresas.
+ALWAYS_INCLUDED_TABLES = frozenset({"empresa", PREFERRED_TABLE})
+
+# Apagar la poda (CHAT_SCHEMA_PRUNING=false) manda siempre el esquema compacto completo.
+SCHEMA_PRUNING_ENABLED = os.getenv("CHAT_SCHEMA_PRUNING", "true").lower() not in ("0", "false", "no")
+
+_TOKEN_RE = re.compile(r"[a-z0-9_]+")
+
+
+def estimate_tokens(text_value: str) -> int:
+    """
+    Estimación de tokens de Gemini (~4 caracteres por token en español con
+    SQL mezclado). Alcanza para comparar prompts entre sí sin llamar a
+    count_tokens, que es otra ida y vuelta a la API.
+    """
+    return math.ceil(len(text_value) / 4) if text_value else 0
+
+
+def _word_forms(word: str) -> Set[str]:
+    """La palabra y sus singulares posibles: 'lotes' -> lote, 'redes' -> red, 'clientes' -> cliente."""
+    forms = {word}
+    if len(word) > 3 and word.endswith("s"):
+        forms.add(word[:-1])
+        if word.endswith("es"):
+            forms.add(word[:-2])
+    return forms
+
+
+def _keywords(text_value: str) -> Set[str]:
+    words: Set[str] = set()
+    for token in _TOKEN_RE.findall(text_value.lower()):
+        words |= _word_forms(token)
+        # "cuil_empresa" también tiene que matchear con "empresa".
+        for part in token.split("_"):
+            if part:
+                words |= _word_forms(part)
+    return words
+
+
+_GENERIC_FORMS = frozenset(form for word in _GENERIC_WORDS for form in _word_forms(word))
+
+
+@dataclass
+class TableSchema:
+    """Una tabla ya inspeccionada: columnas (nombre, tipo, pk, nullable) y claves foráneas."""
+
+    name: str
+    columns: List[Tuple[str, str, bool, bool]] = field(default_factory=list)
+    foreign_keys: List[Tuple[str, str, str]] = field(default_factory=list)  # (columna, tabla, columna)
+
+    @property
+    def referenced_tables(self) -> Set[str]:
+        return {ref_table for _, ref_table, _ in self.foreign_keys}
+
+    def compact(self) -> str:
+        """`lotes(id_lotes* Integer, id_servicio_polo Integer->servicio_polo.id_servicio_polo, ...)`"""
+        references = {column: f"{table}.{ref}" for column, table, ref in self.foreign_keys}
+        parts = []
+        for name, type_name, primary_key, _ in self.columns:
+            part = f"{name}{'*' if primary_key else ''} {type_name}"
+            if name in references:
+                part += f"->{references[name]}"
+            parts.append(part)
+        return f"{self.name}({', '.join(parts)})"
+
+
+@dataclass
+class SchemaContext:
+    """Lo que se manda a Gemini para una pregunta, con su costo estimado."""
+
+    text: str
+    tables: List[str]
+    pruned: bool
+    tokens: int
+    full_tokens: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(self.full_tokens - self.tokens, 0)
+
+
+class SchemaCatalog:
+    """Esquema compacto + índice palabra clave -> tablas, armado una vez por esquema."""
+
+    HEADER = "Tablas (col* = clave primaria, col->tabla.col = relación para JOIN):"
+
+    def __init__(self, tables: Iterable[TableSchema], full_text: str) -> None:
+        self.tables: Dict[str, TableSchema] = {table.name: table for table in tables}
+        # Texto largo del que sale este catálogo: los tokens que se ahorran
+        # se miden contra él.
+        self.full_text = full_text
+        self.full_tokens = estimate_tokens(full_text)
+        self._index: Dict[str, Set[str]] = {}
+        for table in self.tables.values():
+            words = _keywords(table.name) | TABLE_KEYWORDS.get(table.name.lower(), frozenset())
+            join_columns = {column for column, _, _ in table.foreign_keys}
+            for column in table.columns:
+                # Las columnas de JOIN (cuil_empresa) nombran a la otra tabla, no a esta.
+                if column[0] not in join_columns:
+                    words |= _keywords(column[0])
+            for word in words - _GENERIC_FORMS:
+                self._index.setdefault(word, set()).add(table.name)
+
+    def matching_tables(self, text_value: str) -> Set[str]:
+        matches: Set[str] = set()
+        for word in _keywords(text_value):
+            matches |= self._index.get(word, set())
+        return matches
+
+    def with_join_tables(self, names: Set[str]) -> Set[str]:
+        """Agrega, transitivamente, las tablas a las que apuntan las claves foráneas."""
+        selected = set(names)
+        pending = list(names)
+        while pending:
+            table = self.tables.get(pending.pop())
+            if table is None:
+                continue
+            for ref_table in table.referenced_tables:
+                if ref_table in self.tables and ref_table not in selected:
+                    selected.add(ref_table)
+                    pending.append(ref_table)
+        return selected
+
+    def render(self, names: Iterable[str]) -> str:
+        wanted = set(names)
+        lines = [self.HEADER]
+        if PREFERRED_TABLE in wanted and PREFERRED_TABLE in self.tables:
+            lines.append(
+                f"- {self.tables[PREFERRED_TABLE].compact()}  "
+                "<- PREFERIDA: una fila por empresa con contacto, lotes e info comercial, sin JOIN"
+            )
+        lines.extend(
+            f"- {table.compact()}"
+            for name, table in self.tables.items()
+            if name in wanted and name != PREFERRED_TABLE
+        )
+        omitted = [name for name in self.tables if name not in wanted]
+        if omitted:
+            lines.append(f"Otras tablas (no parecen necesarias para esta consulta): {', '.join(omitted)}")
+        return "\n".join(lines)
+
+    def context_for(self, question: str, previous_question: Optional[str] = None) -> SchemaContext:
+        """
+        Esquema a mandar para `question`. La pregunta anterior del usuario
+        también cuenta: en "¿y su teléfono?" la empresa viene del turno previo.
+        """
+        relevant: Set[str] = set()
+        if SCHEMA_PRUNING_ENABLED:
+            relevant = self.matching_tables(question)
+            if previous_question:
+                relevant |= self.matching_tables(previous_question)
+        if relevant:
+            relevant |= {name for name in ALWAYS_INCLUDED_TABLES if name in self.tables}
+            selected = self.with_join_tables(relevant)
+        else:
+            selected = set(self.tables)
+
+        text_value = self.render(selected)
+        ordered = [name for name in self.tables if name in selected]
+        return SchemaContext(
+            text=text_value,
+            tables=ordered,
+            pruned=len(ordered) < len(self.tables),
+            tokens=estimate_tokens(text_value),
+            full_tokens=self.full_tokens,
+        )
+
+
+# ═══════════════════════════════════════════════════════════════════
+# MÉTRICAS
+# ═══════════════════════════════════════════════════════════════════
+
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "pruned_requests": 0, "prompt_tokens": 0, "full_schema_tokens": 0}
+
+
+def record_schema_context(context: SchemaContext) -> None:
+    with _stats_lock:
+        _stats["requests"] += 1
+        _stats["pruned_requests"] += int(context.pruned)
+        _stats["prompt_tokens"] += context.tokens
+        _stats["full_schema_tokens"] += context.full_tokens
+    print(
+        f"Esquema para intención: {len(context.tables)} tabla(s) "
+        f"[{', '.join(context.tables)}], ~{context.tokens} tokens "
+        f"(texto completo ~{context.full_tokens}, ahorro ~{context.tokens_saved})"
+    )
+
+
+def get_schema_context_stats() -> Dict[str, object]:
+    with _stats_lock:
+        stats = dict(_stats)
+    saved = stats["full_schema_tokens"] - stats["prompt_tokens"]
+    stats["tokens_saved"] = saved
+    stats["savings_ratio"] = (
+        round(saved / stats["full_schema_tokens"], 4) if stats["full_schema_tokens"] else 0.0
+    )
+    stats["pruning_enabled"] = SCHEMA_PRUNING_ENABLED
+    return stats
+
+
+def reset_schema_context_stats() -> None:
+    """Pone los contadores en cero. Pensado para tests."""
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
@@ -0,0 +1,225 @@
+# app/services/sql_guard.py
+"""
+Validación del SQL que genera el modelo, en una sola pasada.
+
+La versión anterior de is_sql_query_allowed hacía ~30 re.search (una por
+palabra clave prohibida y otra por tabla) sobre una copia en minúsculas y
+sin comillas de la consulta. Era lenta y además ciega: al borrar las
+comillas no distinguía un identificador entre comillas de un literal (un
+ILIKE '%servicio%' quedaba bloqueado por nombrar una tabla prohibida).
+
+Acá la consulta se tokeniza una sola vez (un único regex con alternativas,
+recorrido con finditer) y, sobre esos tokens, una pequeña máquina de estados
+junta todo lo que hace falta:
+
+- qué tablas se referencian (FROM / JOIN / listas con coma, también dentro
+  de subconsultas), con su alias;
+- cuántas subconsultas hay;
+- si aparece alguna palabra clave de DML/DDL fuera de un literal, una
+  sentencia apilada, comentarios o funciones peligrosas.
+
+El tokenizador solo entiende literales estándar ('...' con '' como
+escape). Los que PostgreSQL lee distinto ($$...$$, $tag$...$tag$, E'...' con
+barras invertidas) se rechazan: si no, una comilla dentro de uno de ellos
+correría el fin del literal y escondería el resto de la consulta (por
+ejemplo un UNION sobre una tabla prohibida). Lo mismo los U&"..." y U&'...'
+con escapes Unicode: U&"\0075suario" es la tabla usuario para el motor.
+
+El resultado es un SqlVerdict con el motivo del rechazo, que queda en el log.
+"""
+import re
+from dataclasses import dataclass, field
+from typing import AbstractSet, Dict, List, Optional, Set
+
+# Palabras clave que no pueden aparecer fuera de un literal: el modelo solo
+# debería generar un único SELECT de lectura.
+FORBIDDEN_SQL_KEYWORDS = frozenset({
+    "insert", "update", "delete", "drop", "alter", "truncate", "grant",
+    "revoke", "create", "commit", "rollback", "begin", "exec", "execute",
+    "call", "copy", "vacuum", "attach", "detach", "pragma",
+    # SELECT ... INTO crea una tabla; LOCK/LISTEN/NOTIFY/PREPARE no son lectura.
+    "into", "lock", "listen", "notify", "prepare", "declare",
+})
+
+# Funciones que leen archivos, ejecutan SQL armado en un string o tocan
+# otras sesiones: con ellas se podría leer una tabla prohibida sin nombrarla
+# en un FROM.
+FORBIDDEN_SQL_FUNCTIONS = frozenset({
+    "query_to_xml", "query_to_xml_and_xmlschema", "cursor_to_xml", "table_to_xml",
+    "table_to_xml_and_xmlschema", "dblink", "dblink_exec", "lo_import", "lo_export",
+    "set_config", "current_setting", "load_extension", "readfile", "writefile",
+})
+
+# Esquemas/prefijos del catálogo del motor: nunca son datos del directorio.
+_CATALOG_PREFIXES = ("pg_", "sqlite_")
+_CATALOG_SCHEMAS = frozenset({"pg_catalog", "information_schema"})
+
+# Palabras que terminan una lista de tablas del FROM.
+_CLAUSE_KEYWORDS = frozenset({
+    "where", "group", "order", "having", "limit", "offset", "union", "intersect",
+    "except", "window", "fetch", "for", "returning",
+})
+_JOIN_MODIFIERS = frozenset({"inner", "left", "right", "full", "outer", "cross", "natural"})
+# Lo que puede seguir a una tabla sin ser su alias.
+_NOT_AN_ALIAS = _CLAUSE_KEYWORDS | _JOIN_MODIFIERS | {"join", "on", "using"}
+_TABLE_PREFIX_KEYWORDS = frozenset({"only", "lateral"})
+
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<ws>\s+)
+  | (?P<comment>--|/\*)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<unterminated>')
+  | (?P<quoted>"(?:[^"]|"")+")
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<number>\d+(?:\.\d*)?)
+  | (?P<punct>[(),.;])
+  | (?P<other>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+@dataclass
+class SqlVerdict:
+    """Resultado de validar una consulta: si se permite, por qué no, y qué lee."""
+
+    allowed: bool
+    reason: Optional[str] = None
+    tables: Set[str] = field(default_factory=set)
+    aliases: Dict[str, str] = field(default_factory=dict)
+    subqueries: int = 0
+
+    def __bool__(self) -> bool:
+        return self.allowed
+
+
+def _reject(verdict: SqlVerdict, reason: str) -> SqlVerdict:
+    verdict.allowed = False
+    verdict.reason = reason
+    return verdict
+
+
+def validate_sql(sql_query: Optional[str], forbidden_tables: AbstractSet[str]) -> SqlVerdict:
+    """Validar que sea un único SELECT de solo lectura sobre tablas permitidas."""
+    verdict = SqlVerdict(allowed=True)
+    if not sql_query or not sql_query.strip():
+        return _reject(verdict, "consulta vacía")
+
+    # Tokens significativos: (tipo, texto en minúsculas / identificador sin comillas).
+    tokens: List[tuple] = []
+    previous = None
+    for match in _TOKEN_RE.finditer(sql_query):
+        kind = match.lastgroup
+        if kind == "ws":
+            previous = None
+            continue
+        if kind == "comment":
+            return _reject(verdict, "comentario SQL")
+        if kind == "unterminated":
+            return _reject(verdict, "literal sin cerrar")
+        value = match.group()
+        if "$" in value and kind != "string":
+            return _reject(verdict, "literal con $ (dollar quoting)")
+        if kind in ("string", "quoted") and "\\" in value:
+            return _reject(verdict, "barra invertida en un literal")
+        if previous is not None and previous.lastgroup == "word":
+            if kind == "string" and previous.group().lower() == "e":
+                return _reject(verdict, "literal con escapes (E'...')")
+            if value == "&" and previous.group().lower() == "u":
+                return _reject(verdict, "literal con escapes Unicode (U&...)")
+        previous = match
+        if kind == "word":
+            value = value.lower()
+            if value in FORBIDDEN_SQL_KEYWORDS:
+                return _reject(verdict, f"palabra clave prohibida: {value}")
+        elif kind == "quoted":
+            kind, value = "word", value[1:-1].replace('""', '"').lower()
+        tokens.append((kind, value))
+
+    if not tokens or tokens[0] != ("word", "select"):
+        return _reject(verdict, "no es un SELECT")
+    if tokens[-1] == ("punct", ";"):
+        tokens.pop()
+
+    # Una pasada por los tokens: FROM/JOIN abren una "lista de tablas" en la
+    # profundidad de paréntesis actual; la coma en esa lista trae otra tabla.
+    # Los paréntesis de funciones (EXTRACT(YEAR FROM fecha), TRIM(... FROM x))
+    # se marcan aparte para que su FROM no se confunda con el de una consulta.
+    parens: List[bool] = []  # True = subconsulta / lista de la consulta, False = expresión
+    table_list_depths: List[int] = []
+    expect_table = False
+    count = len(tokens)
+    i = 0
+    while i < count:
+        kind, value = tokens[i]
+        nxt = tokens[i + 1] if i + 1 < count else (None, None)
+
+        if kind == "punct":
+            if value == ";":
+                return _reject(verdict, "sentencias apiladas")
+            if value == "(":
+                is_query = expect_table or nxt == ("word", "select")
+                if is_query:
+                    verdict.subqueries += 1
+                parens.append(is_query or (i > 0 and tokens[i - 1][0] != "word"))
+                expect_table = False
+            elif value == ")":
+                if not parens:
+                    return _reject(verdict, "paréntesis desbalanceados")
+                depth = len(parens)
+                while table_list_depths and table_list_depths[-1] >= depth:
+                    table_list_depths.pop()
+                parens.pop()
+            elif value == "," and table_list_depths and table_list_depths[-1] == len(parens):
+                expect_table = True
+            i += 1
+            continue
+
+        if kind != "word":
+            expect_table = False
+            i += 1
+            continue
+
+        if nxt == ("punct", "(") and value in FORBIDDEN_SQL_FUNCTIONS:
+            return _reject(verdict, f"función prohibida: {value}")
+        if value.startswith(_CATALOG_PREFIXES) or value in _CATALOG_SCHEMAS:
+            return _reject(verdict, f"catálogo del motor: {value}")
+
+        if expect_table:
+            if value in _TABLE_PREFIX_KEYWORDS:
+                i += 1
+                continue
+            # esquema.tabla: interesa la tabla.
+            while i + 2 < count and tokens[i + 1] == ("punct", ".") and tokens[i + 2][0] == "word":
+                i += 2
+                value = tokens[i][1]
+            if value in forbidden_tables:
+                return _reject(verdict, f"tabla prohibida: {value}")
+            verdict.tables.add(value)
+            # Alias opcional, con o sin AS.
+            j = i + 1
+            if j < count and tokens[j] == ("word", "as"):
+                j += 1
+            if j < count and tokens[j][0] == "word" and tokens[j][1] not in _NOT_AN_ALIAS:
+                verdict.aliases[tokens[j][1]] = value
+                i = j
+            expect_table = False
+        elif value == "from":
+            if not parens or parens[-1]:
+                table_list_depths.append(len(parens))
+                expect_table = True
+        elif value == "join":
+            expect_table = True
+        elif value in _CLAUSE_KEYWORDS and table_list_depths and table_list_depths[-1] == len(parens):
+            table_list_depths.pop()
+        elif value in forbidden_tables and tokens[i - 1] != ("word", "as"):
+            # Fuera de un FROM/JOIN (usuario.email, un CTE, un alias sin AS...)
+            # un nombre de tabla prohibida tampoco se acepta; solo como alias
+            # explícito ("AS servicio") es inofensivo.
+            return _reject(verdict, f"tabla prohibida: {value}")
+        i += 1
+
+    if parens:
+        return _reject(verdict, "paréntesis desbalanceados")
+    return verdict
@@ -0,0 +1,294 @@
+# app/services/tts_cache.py
+"""
+Cache del audio sintetizado (TTS), direccionado por contenido.
+
+Cada respuesta de voz pagaba una llamada a Google Text-to-Speech (300-800
+ms), aunque el texto fuera siempre el mismo: el mensaje de error genérico,
+el "No tengo permitido compartir esta información", los saludos o una
+respuesta popular que ya salió del answer_cache. Acá el MP3 se guarda con
+una clave que es el hash del texto, la voz, el idioma y la configuración de
+audio (cambiar la voz o la velocidad invalida solo, sin borrar nada):
+
+- memoria: LRU acotado por bytes (TTS_CACHE_MEMORY_BYTES);
+- disco (opcional, TTS_CACHE_DIR): un .mp3 por clave, escrito de forma
+  atómica y leído con mmap; sobrevive a los reinicios y comparte el audio
+  entre procesos. Se poda por antigüedad de uso al pasar
+  TTS_CACHE_DISK_MAX_BYTES.
+
+Un acierto en disco se promueve a memoria. Las frases fijas se sintetizan
+al arrancar (voice_service.prewarm_tts_cache), así el primer error o el
+primer rechazo del día ya no esperan a Google. Desde código async se usan
+get_async/put_async: la lectura, la escritura y la poda del disco van al
+threadpool para no frenar el event loop.
+"""
+import hashlib
+import json
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+MEMORY_MAX_BYTES = int(os.getenv("TTS_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+DISK_DIR = os.getenv("TTS_CACHE_DIR", "")
+DISK_MAX_BYTES = int(os.getenv("TTS_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024)))
+PREWARM_ENABLED = os.getenv("TTS_CACHE_PREWARM", "true").lower() not in ("0", "false", "no")
+
+AUDIO_EXTENSION = ".mp3"
+
+
+def audio_cache_key(text: str, voice_name: str, language_code: str, audio_config: Dict) -> str:
+    payload = json.dumps(
+        {"text": text, "voice": voice_name, "language": language_code, "audio": audio_config},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryTier:
+    """LRU de clave -> MP3, acotado por la suma de bytes."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            audio = self._entries.get(key)
+            if audio is not None:
+                self._entries.move_to_end(key)
+            return audio
+
+    def put(self, key: str, audio: bytes) -> None:
+        # Un audio más grande que todo el presupuesto no se guarda (vaciaría el cache).
+        if len(audio) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = audio
+            self._bytes += len(audio)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.evictions = 0
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+class DiskTier:
+    """Un archivo por clave en `directory/<2 primeros>/<clave>.mp3`."""
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._bytes: Optional[int] = None
+        self.evictions = 0
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + AUDIO_EXTENSION)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.path_for(key)
+        try:
+            with open(path, "rb") as fh:
+                if os.fstat(fh.fileno()).st_size == 0:
+                    return None
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    audio = bytes(mapped)
+            # La fecha de modificación hace de "último uso" para la poda.
+            os.utime(path)
+            return audio
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            print(f" Cache TTS: no se pudo leer {path}: {e}")
+            return None
+
+    def put(self, key: str, audio: bytes) -> None:
+        path = self.path_for(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as fh:
+                fh.write(audio)
+            existed = os.path.exists(path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f" Cache TTS: no se pudo escribir {path}: {e}")
+            return
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._scan_bytes()
+            elif not existed:
+                self._bytes += len(audio)
+            if self._bytes > self.max_bytes:
+                self._prune()
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(AUDIO_EXTENSION):
+                    yield os.path.join(root, name)
+
+    def _scan_bytes(self) -> int:
+        total = 0
+        for path in self._files():
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def _prune(self) -> None:
+        """Borrar los menos usados hasta quedar en el 90% del tope."""
+        entries = []
+        for path in self._files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+        self._bytes = total
+
+    def stats(self) -> Dict:
+        return {"directory": self.directory, "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+class TTSCache:
+    """Memoria y, si hay directorio, disco. Lleva los contadores para /health."""
+
+    def __init__(self, memory: MemoryTier, disk: Optional[DiskTier]) -> None:
+        self.memory = memory
+        self.disk = disk
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.synthesized = 0
+        self.synthesis_ms = 0.0
+
+    def get(self, key: str) -> Optional[bytes]:
+        audio = self._get_from_memory(key)
+        if audio is None and self.disk is not None:
+            return self._get_from_disk(key)
+        if audio is None:
+            self._count("misses")
+        return audio
+
+    async def get_async(self, key: str) -> Optional[bytes]:
+        """get() sin bloquear el event loop: solo el disco va al threadpool."""
+        audio = self._get_from_memory(key)
+        if audio is None and self.disk is not None:
+            return await run_in_threadpool(self._get_from_disk, key)
+        if audio is None:
+            self._count("misses")
+        return audio
+
+    def _get_from_memory(self, key: str) -> Optional[bytes]:
+        audio = self.memory.get(key)
+        if audio is not None:
+            self._count("memory_hits")
+        return audio
+
+    def _get_from_disk(self, key: str) -> Optional[bytes]:
+        audio = self.disk.get(key)
+        if audio is None:
+            self._count("misses")
+            return None
+        self.memory.put(key, audio)
+        self._count("disk_hits")
+        return audio
+
+    def put(self, key: str, audio: bytes, synthesis_ms: float = 0.0) -> None:
+        if self._put_in_memory(key, audio, synthesis_ms) and self.disk is not None:
+            self.disk.put(key, audio)
+
+    async def put_async(self, key: str, audio: bytes, synthesis_ms: float = 0.0) -> None:
+        """put() sin bloquear el event loop: la escritura (y la poda) del disco van al threadpool."""
+        if self._put_in_memory(key, audio, synthesis_ms) and self.disk is not None:
+            await run_in_threadpool(self.disk.put, key, audio)
+
+    def _put_in_memory(self, key: str, audio: bytes, synthesis_ms: float) -> bool:
+        if not audio:
+            return False
+        with self._lock:
+            self.synthesized += 1
+            self.synthesis_ms += synthesis_ms
+        self.memory.put(key, audio)
+        return True
+
+    def path_for(self, key: str) -> Optional[str]:
+        """Archivo en disco del audio, si está: para servirlo directo sin cargarlo."""
+        if self.disk is None:
+            return None
+        path = self.disk.path_for(key)
+        return path if os.path.exists(path) else None
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            avg_ms = self.synthesis_ms / self.synthesized if self.synthesized else 0.0
+            stats = {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "synthesized": self.synthesized,
+                "avg_synthesis_ms": round(avg_ms, 1),
+                # Estimado: cada acierto es una síntesis promedio que no se hizo.
+                "synthesis_ms_saved": round(hits * avg_ms, 1),
+            }
+        stats["memory"] = {**self.memory.stats(), "evictions": self.memory.evictions}
+        stats["disk"] = {**self.disk.stats(), "evictions": self.disk.evictions} if self.disk else None
+        return stats
+
+    def reset(self) -> None:
+        """Vacía la memoria y pone los contadores en cero (el disco queda). Pensado para tests."""
+        self.memory.clear()
+        with self._lock:
+            self.memory_hits = self.disk_hits = self.misses = self.synthesized = 0
+            self.synthesis_ms = 0.0
+
+
+tts_cache = TTSCache(MemoryTier(MEMORY_MAX_BYTES), DiskTier(DISK_DIR, DISK_MAX_BYTES) if DISK_DIR else None)
+
+
+def get_tts_cache_stats() -> Dict:
+    return tts_cache.stats()
+
+
+def reset_tts_cache() -> None:
+    tts_cache.reset()
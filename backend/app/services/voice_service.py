@@ -1,8 +1,14 @@
 # app/services/voice_service.py
+import asyncio
 import os
+import re
+import time
+from typing import AsyncIterator, Iterable, List, Tuple
 
 from fastapi import HTTPException
 
+from app import metrics
+from app.services import ai_transport, audio_preprocessing, tts_cache
 from app.services.common import GENERIC_ERROR_MESSAGE
 
 try:
@@ -34,6 +40,64 @@ except ImportError:
 # ═══════════════════════════════════════════════════════════════════
 
 
+# Clientes async de Google (grpc.aio): se crean recién en el primer uso,
+# porque quedan atados al event loop en el que se construyen.
+_speech_async_client = None
+_tts_async_client = None
+
+
+def _get_speech_async_client():
+    global _speech_async_client
+    if _speech_async_client is None:
+        _speech_async_client = speech.SpeechAsyncClient()
+    return _speech_async_client
+
+
+def _get_tts_async_client():
+    global _tts_async_client
+    if _tts_async_client is None:
+        _tts_async_client = texttospeech.TextToSpeechAsyncClient()
+    return _tts_async_client
+
+
+def _recognition_config(language_code: str, audio_format: audio_preprocessing.AudioFormat = None):
+    # Sin formato (streaming desde el navegador): WebM/Opus del MediaRecorder.
+    audio_format = audio_format or audio_preprocessing.UNKNOWN_FORMAT
+    config = {
+        "encoding": speech.RecognitionConfig.AudioEncoding[audio_format.encoding],
+        "language_code": language_code,
+        "enable_automatic_punctuation": True,
+        "model": "default",
+        "use_enhanced": True,
+    }
+    if audio_format.sample_rate_hertz:
+        config["sample_rate_hertz"] = audio_format.sample_rate_hertz
+    return speech.RecognitionConfig(**config)
+
+
+def _prepare_for_stt(audio_content: bytes):
+    """
+    Preprocesamiento local (app/services/audio_preprocessing.py). Devuelve
+    el audio listo para Google, o None si no tiene voz: en ese caso no hay
+    llamada a Google y la transcripción es "". Lo que Google rechazaría
+    igual (muy grande, muy largo, formato no soportado) es un error 4xx.
+    """
+    try:
+        return audio_preprocessing.prepare_audio(audio_content)
+    except audio_preprocessing.AudioRejected as rejected:
+        print(f" Audio descartado antes de STT ({rejected.reason}): {rejected}")
+        if rejected.reason in ("empty", "silent"):
+            return None
+        status_code = 415 if rejected.reason == "unsupported" else 413
+        raise HTTPException(status_code=status_code, detail=str(rejected))
+
+
+def _join_transcript(response) -> str:
+    if not response.results:
+        return ""
+    return " ".join(result.alternatives[0].transcript for result in response.results).strip()
+
+
 def transcribe_audio_google(audio_content: bytes, language_code: str = "es-AR") -> str:
     """Convertir audio a texto usando Google Speech-to-Text"""
     try:
@@ -41,23 +105,32 @@ def transcribe_audio_google(audio_content: bytes, language_code: str = "es-AR")
             raise HTTPException(status_code=503, detail="Servicio de transcripción no disponible")
 
         audio = speech.RecognitionAudio(content=audio_content)
-        config = speech.RecognitionConfig(
-            encoding=speech.RecognitionConfig.AudioEncoding.WEBM_OPUS,
-            sample_rate_hertz=48000,
-            language_code=language_code,
-            enable_automatic_punctuation=True,
-            model="default",
-            use_enhanced=True,
-        )
+        config = _recognition_config(language_code, audio_preprocessing.sniff_format(audio_content))
+        with metrics.VOICE_SECONDS.timer(operation="stt"):
+            response = speech_client.recognize(config=config, audio=audio)
+        transcript = _join_transcript(response)
+        if transcript:
+            print(f" Transcripción Google: {transcript}")
+        return transcript
 
-        response = speech_client.recognize(config=config, audio=audio)
-        if not response.results:
-            return ""
+    except Exception as e:
+        print(f" Error en transcripción Google: {str(e)}")
+        raise HTTPException(status_code=500, detail=GENERIC_ERROR_MESSAGE)
+
+
+async def transcribe_audio_google_async(audio_content: bytes, language_code: str = "es-AR") -> str:
+    """Versión asíncrona de transcribe_audio_google (SpeechAsyncClient)."""
+    try:
+        if not speech_client:
+            raise HTTPException(status_code=503, detail="Servicio de transcripción no disponible")
 
-        transcript = " ".join(
-            result.alternatives[0].transcript for result in response.results
-        ).strip()
-        print(f" Transcripción Google: {transcript}")
+        audio = speech.RecognitionAudio(content=audio_content)
+        config = _recognition_config(language_code, audio_preprocessing.sniff_format(audio_content))
+        with metrics.VOICE_SECONDS.timer(operation="stt"):
+            response = await _get_speech_async_client().recognize(config=config, audio=audio)
+        transcript = _join_transcript(response)
+        if transcript:
+            print(f" Transcripción Google: {transcript}")
         return transcript
 
     except Exception as e:
@@ -67,48 +140,165 @@ def transcribe_audio_google(audio_content: bytes, language_code: str = "es-AR")
 
 def transcribe_audio(audio_content: bytes, language_code: str = "es-AR") -> str:
     """Transcribir audio usando Google Cloud"""
+    prepared = _prepare_for_stt(audio_content)
+    if prepared is None:
+        return ""
+    audio_content = prepared.content
+    if ai_transport.MODE != "live":
+        return ai_transport.transcribe(audio_content, language_code, transcribe_audio_google)
     if VOICE_PROVIDER == "google" and speech_client:
         return transcribe_audio_google(audio_content, language_code)
 
     raise HTTPException(status_code=503, detail=GENERIC_ERROR_MESSAGE)
 
 
+async def transcribe_audio_async(audio_content: bytes, language_code: str = "es-AR") -> str:
+    """Transcribir audio usando Google Cloud, sin bloquear el event loop"""
+    prepared = _prepare_for_stt(audio_content)
+    if prepared is None:
+        return ""
+    audio_content = prepared.content
+    if ai_transport.MODE != "live":
+        return await ai_transport.transcribe_async(audio_content, language_code, transcribe_audio_google_async)
+    if VOICE_PROVIDER == "google" and speech_client:
+        return await transcribe_audio_google_async(audio_content, language_code)
+
+    raise HTTPException(status_code=503, detail=GENERIC_ERROR_MESSAGE)
+
+
+async def stream_transcribe_async(
+    audio_chunks: AsyncIterator[bytes], language_code: str = "es-AR"
+) -> AsyncIterator[Tuple[str, bool]]:
+    """
+    Transcribir mientras el usuario habla (streaming_recognize de Google).
+
+    `audio_chunks` son los fragmentos WebM/Opus tal como los entrega el
+    MediaRecorder del navegador. Produce tuplas (texto, es_final): los
+    resultados intermedios sirven para mostrar lo que se va entendiendo, y
+    con single_utterance Google cierra el primer enunciado apenas detecta
+    el silencio, sin esperar a que termine la subida.
+
+    Sin red (AI_TRANSPORT=replay/fake) no hay cassettes de streaming: se
+    junta todo el audio y se transcribe con transcribe_audio_async, que
+    devuelve un único resultado final.
+    """
+    if ai_transport.MODE != "live":
+        audio_content = b"".join([chunk async for chunk in audio_chunks])
+        if audio_content:
+            yield await transcribe_audio_async(audio_content, language_code), True
+        return
+    if not (VOICE_PROVIDER == "google" and speech_client):
+        raise HTTPException(status_code=503, detail=GENERIC_ERROR_MESSAGE)
+
+    streaming_config = speech.StreamingRecognitionConfig(
+        config=_recognition_config(language_code),
+        interim_results=True,
+        single_utterance=True,
+    )
+
+    async def requests():
+        # El primer mensaje lleva solo la configuración; después, audio.
+        yield speech.StreamingRecognizeRequest(streaming_config=streaming_config)
+        async for chunk in audio_chunks:
+            yield speech.StreamingRecognizeRequest(audio_content=chunk)
+
+    # Medido a mano y no con timer(): el generador se cierra a propósito
+    # apenas llega el resultado final, y eso no es un error.
+    started = time.perf_counter()
+    outcome = "ok"
+    responses = None
+    try:
+        responses = await _get_speech_async_client().streaming_recognize(requests=requests())
+        async for response in responses:
+            for result in response.results:
+                if not result.alternatives:
+                    continue
+                transcript = result.alternatives[0].transcript.strip()
+                if result.is_final and transcript:
+                    print(f" Transcripción Google (streaming): {transcript}")
+                yield transcript, result.is_final
+    except Exception as e:
+        outcome = "error"
+        print(f" Error en transcripción Google (streaming): {str(e)}")
+        raise HTTPException(status_code=500, detail=GENERIC_ERROR_MESSAGE)
+    finally:
+        # Si el que consume cortó antes (ya tiene el resultado final), no
+        # dejar abierta la llamada a Google.
+        if responses is not None and hasattr(responses, "cancel"):
+            responses.cancel()
+        metrics.VOICE_SECONDS.observe(time.perf_counter() - started, operation="stt_stream", outcome=outcome)
+
+
 # ═══════════════════════════════════════════════════════════════════
 # TEXT TO SPEECH
 # ═══════════════════════════════════════════════════════════════════
 
 
+# Google Cloud TTS no ofrece una voz específicamente "es-AR": solo tiene
+# familias es-ES (España) y es-US (español latinoamericano neutro). es-US
+# es la aproximación más cercana disponible al acento argentino.
+# Studio-B: voz de la línea "Studio" de Google (más natural que Neural2,
+# que sonaba robotizada), elegida por el usuario tras comparar muestras.
+# Es una voz masculina (ssml_gender abajo debe coincidir).
+TTS_LANGUAGE_CODE = "es-US"
+TTS_VOICE_NAME = "es-US-Studio-B"
+# Parámetros de audio: también forman parte de la clave del cache TTS.
+TTS_AUDIO_SETTINGS = {
+    "audio_encoding": "MP3",
+    "speaking_rate": 1.0,
+    "pitch": 0.0,
+    "volume_gain_db": 0.0,
+    "effects_profile_id": ["headphone-class-device"],
+}
+
+
+def _synthesis_request(text: str, language_code: str, voice_name: str) -> dict:
+    return {
+        "input": texttospeech.SynthesisInput(text=text),
+        "voice": texttospeech.VoiceSelectionParams(
+            language_code=language_code,
+            name=voice_name,
+            ssml_gender=texttospeech.SsmlVoiceGender.MALE,
+        ),
+        "audio_config": texttospeech.AudioConfig(
+            **{
+                **TTS_AUDIO_SETTINGS,
+                "audio_encoding": texttospeech.AudioEncoding[TTS_AUDIO_SETTINGS["audio_encoding"]],
+            }
+        ),
+    }
+
+
 def text_to_speech_google(
-    text: str, language_code: str = "es-US", voice_name: str = "es-US-Studio-B"
+    text: str, language_code: str = TTS_LANGUAGE_CODE, voice_name: str = TTS_VOICE_NAME
 ) -> bytes:
-    # Google Cloud TTS no ofrece una voz específicamente "es-AR": solo tiene
-    # familias es-ES (España) y es-US (español latinoamericano neutro). es-US
-    # es la aproximación más cercana disponible al acento argentino.
-    # Studio-B: voz de la línea "Studio" de Google (más natural que Neural2,
-    # que sonaba robotizada), elegida por el usuario tras comparar muestras.
-    # Es una voz masculina (ssml_gender abajo debe coincidir).
     """Convertir texto a voz usando Google Text-to-Speech"""
     try:
         if not tts_client:
             raise HTTPException(status_code=503, detail="Servicio de síntesis de voz no disponible")
 
-        synthesis_input = texttospeech.SynthesisInput(text=text)
-        voice = texttospeech.VoiceSelectionParams(
-            language_code=language_code,
-            name=voice_name,
-            ssml_gender=texttospeech.SsmlVoiceGender.MALE,
-        )
-        audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3,
-            speaking_rate=1.0,
-            pitch=0.0,
-            volume_gain_db=0.0,
-            effects_profile_id=["headphone-class-device"],
-        )
+        with metrics.VOICE_SECONDS.timer(operation="tts"):
+            response = tts_client.synthesize_speech(**_synthesis_request(text, language_code, voice_name))
+        print(f" Audio Google generado: {len(response.audio_content)} bytes")
+        return response.audio_content
 
-        response = tts_client.synthesize_speech(
-            input=synthesis_input, voice=voice, audio_config=audio_config
-        )
+    except Exception as e:
+        print(f" Error en síntesis Google: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error al generar audio: {str(e)}")
+
+
+async def text_to_speech_google_async(
+    text: str, language_code: str = TTS_LANGUAGE_CODE, voice_name: str = TTS_VOICE_NAME
+) -> bytes:
+    """Versión asíncrona de text_to_speech_google (TextToSpeechAsyncClient)."""
+    try:
+        if not tts_client:
+            raise HTTPException(status_code=503, detail="Servicio de síntesis de voz no disponible")
+
+        with metrics.VOICE_SECONDS.timer(operation="tts"):
+            response = await _get_tts_async_client().synthesize_speech(
+                **_synthesis_request(text, language_code, voice_name)
+            )
         print(f" Audio Google generado: {len(response.audio_content)} bytes")
         return response.audio_content
 
@@ -117,18 +307,140 @@ def text_to_speech_google(
         raise HTTPException(status_code=500, detail=f"Error al generar audio: {str(e)}")
 
 
-def text_to_speech(text: str, voice_provider: str = None) -> bytes:
-    """Sintetizar voz usando Google Cloud (único proveedor soportado)"""
+def _check_voice_provider(voice_provider: str = None) -> None:
     if voice_provider and voice_provider != "google":
         raise HTTPException(status_code=400, detail="Proveedor de voz no soportado. Usa 'google'.")
+    if not (VOICE_PROVIDER == "google" and tts_client) and not ai_transport.is_offline():
+        raise HTTPException(
+            status_code=503,
+            detail="No hay servicio de síntesis de voz configurado. Configura GOOGLE_APPLICATION_CREDENTIALS.",
+        )
 
-    if VOICE_PROVIDER == "google" and tts_client:
-        return text_to_speech_google(text)
 
-    raise HTTPException(
-        status_code=503,
-        detail="No hay servicio de síntesis de voz configurado. Configura GOOGLE_APPLICATION_CREDENTIALS.",
-    )
+def tts_cache_key(text: str) -> str:
+    """Clave del audio de `text` con la voz y la configuración actuales (ver tts_cache)."""
+    settings = dict(TTS_AUDIO_SETTINGS)
+    if ai_transport.MODE == "fake":
+        # El audio sintético (silencio) no puede quedar en disco como si fuera el real.
+        settings["fake"] = True
+    return tts_cache.audio_cache_key(text, TTS_VOICE_NAME, TTS_LANGUAGE_CODE, settings)
+
+
+def text_to_speech(text: str, voice_provider: str = None) -> bytes:
+    """Sintetizar voz usando Google Cloud (único proveedor soportado), con cache por contenido"""
+    _check_voice_provider(voice_provider)
+    key = tts_cache_key(text)
+    audio = tts_cache.tts_cache.get(key)
+    if audio is not None:
+        return audio
+
+    started = time.perf_counter()
+    if ai_transport.MODE != "live":
+        audio = ai_transport.synthesize(text, text_to_speech_google)
+    else:
+        audio = text_to_speech_google(text)
+    tts_cache.tts_cache.put(key, audio, (time.perf_counter() - started) * 1000)
+    return audio
+
+
+async def text_to_speech_async(text: str, voice_provider: str = None) -> bytes:
+    """Sintetizar voz usando Google Cloud, sin bloquear el event loop, con cache por contenido"""
+    _check_voice_provider(voice_provider)
+    key = tts_cache_key(text)
+    audio = await tts_cache.tts_cache.get_async(key)
+    if audio is not None:
+        return audio
+
+    started = time.perf_counter()
+    if ai_transport.MODE != "live":
+        audio = await ai_transport.synthesize_async(text, text_to_speech_google_async)
+    else:
+        audio = await text_to_speech_google_async(text)
+    await tts_cache.tts_cache.put_async(key, audio, (time.perf_counter() - started) * 1000)
+    return audio
+
+
+# ═══════════════════════════════════════════════════════════════════
+# TTS POR ORACIONES (audio en streaming)
+# ═══════════════════════════════════════════════════════════════════
+
+# Síntesis en paralelo por respuesta: más acelera poco y gasta cuota de Google.
+TTS_SENTENCE_CONCURRENCY = int(os.getenv("TTS_SENTENCE_CONCURRENCY", "3"))
+# Oraciones más cortas que esto ("¡Hola!") se juntan con la siguiente.
+TTS_MIN_SENTENCE_CHARS = int(os.getenv("TTS_MIN_SENTENCE_CHARS", "25"))
+
+# Fin de oración seguido de espacio (no corta "3.5" ni "www.polo52.com"),
+# o salto de línea (cada ítem de una lista es su propio segmento).
+_SENTENCE_BOUNDARY_RE = re.compile(r"(?<=[.!?…;:])\s+|\n+")
+
+
+def split_sentences(text: str, min_chars: int = None) -> List[str]:
+    """Partir una respuesta en oraciones para sintetizarlas por separado."""
+    min_chars = TTS_MIN_SENTENCE_CHARS if min_chars is None else min_chars
+    sentences: List[str] = []
+    pending = ""
+    for piece in _SENTENCE_BOUNDARY_RE.split(text or ""):
+        # Viñetas de lista ("- Empresa"): no se leen en voz alta.
+        piece = piece.strip().lstrip("-•*").strip()
+        if not piece:
+            continue
+        pending = f"{pending} {piece}" if pending else piece
+        if len(pending) >= min_chars:
+            sentences.append(pending)
+            pending = ""
+    if pending:
+        if sentences and len(pending) < min_chars:
+            sentences[-1] = f"{sentences[-1]} {pending}"
+        else:
+            sentences.append(pending)
+    return sentences
+
+
+async def synthesize_sentences(
+    sentences: List[str], concurrency: int = None
+) -> AsyncIterator[Tuple[int, str, bytes]]:
+    """
+    Sintetizar las oraciones en paralelo (a lo sumo `concurrency` a la vez)
+    y entregarlas en orden, cada una apenas está lista ella y las
+    anteriores. Cada oración pasa por el cache TTS. Si el consumidor corta
+    antes, las síntesis pendientes se cancelan.
+    """
+    semaphore = asyncio.Semaphore(max(concurrency or TTS_SENTENCE_CONCURRENCY, 1))
+
+    async def synthesize(sentence: str) -> bytes:
+        async with semaphore:
+            return await text_to_speech_async(sentence)
+
+    tasks = [asyncio.ensure_future(synthesize(sentence)) for sentence in sentences]
+    try:
+        for index, (sentence, task) in enumerate(zip(sentences, tasks)):
+            yield index, sentence, await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def is_tts_available() -> bool:
+    return bool(VOICE_PROVIDER == "google" and tts_client) or ai_transport.is_offline()
+
+
+async def prewarm_tts_cache(phrases: Iterable[str]) -> int:
+    """
+    Sintetizar de antemano frases fijas (errores, rechazos) para que ya
+    estén en el cache. Las que ya estaban (p. ej. en disco) no se piden de
+    nuevo. Devuelve cuántas quedaron disponibles.
+    """
+    if not is_tts_available():
+        return 0
+    ready = 0
+    for phrase in dict.fromkeys(phrases):
+        try:
+            await text_to_speech_async(phrase)
+            ready += 1
+        except Exception as e:
+            print(f" Cache TTS: no se pudo precalentar '{phrase[:40]}': {e}")
+    print(f"🔊 Cache TTS precalentado: {ready} frase(s)")
+    return ready
 
 
 # ═══════════════════════════════════════════════════════════════════
@@ -138,7 +450,7 @@ def text_to_speech(text: str, voice_provider: str = None) -> bytes:
 
 def get_voice_services_status() -> dict:
     """Obtener estado de los servicios de voz configurados"""
-    status = {"provider": VOICE_PROVIDER, "services": {}}
+    status = {"provider": VOICE_PROVIDER, "transport": ai_transport.MODE, "services": {}}
 
     if speech_client and tts_client:
         status["services"]["google_cloud"] = {
@@ -0,0 +1,95 @@
+"""
+Microbenchmark del validador de SQL del chatbot: la versión anterior (un
+re.search por palabra clave y por tabla prohibida) contra
+app/services/sql_guard.validate_sql (una sola pasada).
+
+Herramienta offline, no forma parte de la API. Uso (desde backend/):
+    python scripts/bench_sql_guard.py
+    python scripts/bench_sql_guard.py --number 20000
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.services.sql_guard import validate_sql  # noqa: E402
+
+FORBIDDEN_SQL_TABLES = {
+    "usuario", "rol", "rol_usuario", "vehiculos", "tipo_vehiculo", "empresa_vehiculos",
+    "servicio", "tipo_servicio", "empresa_servicio", "password_history", "chat_mensaje",
+}
+_LEGACY_KEYWORDS = {
+    "insert", "update", "delete", "drop", "alter", "truncate", "grant",
+    "revoke", "create", "commit", "rollback", "begin", "exec", "execute",
+    "call", "copy", "vacuum", "attach", "detach", "pragma",
+}
+
+# Consultas como las que genera el modelo en producción.
+QUERIES = [
+    "SELECT nombre, rubro FROM empresa WHERE rubro ILIKE '%logistica%'",
+    "SELECT e.nombre, c.telefono, c.direccion FROM empresa e JOIN contacto c ON c.cuil_empresa = e.cuil "
+    "WHERE e.nombre ILIKE '%express%'",
+    "SELECT l.lote, l.manzana, l.dueno FROM lotes l JOIN servicio_polo sp ON sp.id_servicio_polo = "
+    "l.id_servicio_polo WHERE l.manzana = 3 ORDER BY l.lote",
+    "SELECT e.nombre, ic.productos_servicios, ic.rango_precios FROM empresa e LEFT JOIN info_comercial ic "
+    "ON ic.cuil = e.cuil WHERE ic.rango_precios ILIKE '%econ%' AND e.estado = true LIMIT 20",
+    "SELECT nombre FROM empresa WHERE cuil IN (SELECT cuil FROM info_comercial WHERE atiende_publico) ;",
+]
+
+
+def legacy_is_sql_query_allowed(sql_query: str) -> bool:
+    """Copia fiel de la validación anterior, solo para comparar."""
+    if not sql_query:
+        return False
+    stripped = sql_query.strip()
+    if not stripped.lower().startswith("select"):
+        return False
+    body = stripped[:-1] if stripped.endswith(";") else stripped
+    if ";" in body:
+        return False
+    if "--" in body or "/*" in body:
+        return False
+    normalized = re.sub(r"\s+", " ", body.lower()).replace('"', "").replace("'", "")
+    for keyword in _LEGACY_KEYWORDS:
+        if re.search(rf"\b{keyword}\b", normalized):
+            return False
+    for table in FORBIDDEN_SQL_TABLES:
+        if re.search(rf"\b{table}\b", normalized):
+            return False
+    return True
+
+
+def run(number: int) -> dict:
+    """Microsegundos por consulta (mejor de 5 repeticiones) de cada validador."""
+
+    def legacy():
+        for query in QUERIES:
+            legacy_is_sql_query_allowed(query)
+
+    def single_pass():
+        for query in QUERIES:
+            validate_sql(query, FORBIDDEN_SQL_TABLES)
+
+    results = {}
+    for name, func in (("regex", legacy), ("sql_guard", single_pass)):
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        results[name] = best / (number * len(QUERIES)) * 1e6
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=5000, help="iteraciones por repetición")
+    args = parser.parse_args()
+
+    results = run(args.number)
+    for name, micros in results.items():
+        print(f"{name:>10}: {micros:7.2f} µs/consulta")
+    print(f"{'speedup':>10}: {results['regex'] / results['sql_guard']:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
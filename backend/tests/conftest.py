@@ -6,9 +6,23 @@ import pytest
 from fastapi.testclient import TestClient
 
 from app.main import app
-from app.routes.auth import get_current_user
+from app.routes.auth import get_current_user, get_current_user_ws
 from app.config import get_db
+from app.chatbot_db import get_chatbot_db, reset_chatbot_pool_stats
+from app.metrics import reset_metrics
 from app.rate_limit import reset_rate_limits
+from app.services import answer_renderer
+from app.services.ai_transport import reset_transport_stats
+from app.services.answer_renderer import reset_renderer_stats
+from app.services.chat_cache import reset_chat_caches
+from app.services.chat_history import reset_history_stats
+from app.services.result_encoder import reset_encoder_stats
+from app.services.tts_cache import reset_tts_cache
+from app.services.audio_store import reset_audio_store
+from app.services.audio_preprocessing import reset_preprocessing_stats
+from app.services.directory_search import reset_directory_search
+from app.services.directory_vectors import reset_directory_vectors
+from app.services.model_health import reset_model_health
 
 
 class DummyUser:
@@ -31,12 +45,50 @@ def override_dependencies():
     Sobrescribe dependencias globales del proyecto para aislar las pruebas.
     """
     app.dependency_overrides[get_current_user] = lambda: DummyUser()
+    app.dependency_overrides[get_current_user_ws] = lambda: DummyUser()
     app.dependency_overrides[get_db] = _dummy_db
+    app.dependency_overrides[get_chatbot_db] = _dummy_db
     reset_rate_limits()
+    reset_chat_caches()
+    reset_history_stats()
+    reset_model_health()
+    reset_chatbot_pool_stats()
+    reset_directory_search()
+    reset_directory_vectors()
+    reset_renderer_stats()
+    reset_encoder_stats()
+    reset_metrics()
+    reset_transport_stats()
+    reset_tts_cache()
+    reset_audio_store()
+    reset_preprocessing_stats()
     client = TestClient(app)
     yield client
     app.dependency_overrides.clear()
     reset_rate_limits()
+    reset_chat_caches()
+    reset_history_stats()
+    reset_model_health()
+    reset_chatbot_pool_stats()
+    reset_directory_search()
+    reset_directory_vectors()
+    reset_renderer_stats()
+    reset_encoder_stats()
+    reset_metrics()
+    reset_transport_stats()
+    reset_tts_cache()
+    reset_audio_store()
+    reset_preprocessing_stats()
+
+
+@pytest.fixture
+def model_final_answers(monkeypatch):
+    """
+    Apaga las plantillas de app/services/answer_renderer.py para los tests
+    que verifican la respuesta final que redacta Gemini (mockeado). El
+    resto de la suite corre como en producción, con las plantillas activas.
+    """
+    monkeypatch.setattr(answer_renderer, "TEMPLATE_ANSWERS_ENABLED", False)
 
 
 @pytest.fixture
@@ -0,0 +1,167 @@
+"""
+Tests del transporte intercambiable de Gemini y Google Speech
+(app/services/ai_transport.py): grabar y reproducir cassettes, latencias
+inyectadas y el modo fake corriendo el pipeline completo sin red.
+"""
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import create_engine, text as sa_text
+from sqlalchemy.orm import sessionmaker
+
+from app.services import ai_transport, chatbot_service, voice_service
+
+
+class _LiveModel:
+    """Hace de genai.GenerativeModel real: cuenta las llamadas."""
+
+    def __init__(self, text="Respuesta real."):
+        self.text = text
+        self.calls = 0
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        self.calls += 1
+        if stream:
+            return iter([ai_transport.TextResponse(word) for word in ("Respuesta ", "en ", "partes.")])
+        return ai_transport.TextResponse(self.text)
+
+    async def generate_content_async(self, prompt, generation_config=None):
+        self.calls += 1
+        return ai_transport.TextResponse(self.text)
+
+
+@pytest.fixture
+def transport(monkeypatch, tmp_path):
+    def set_mode(mode, **settings):
+        monkeypatch.setattr(ai_transport, "MODE", mode)
+        monkeypatch.setattr(ai_transport, "CASSETTE_DIR", str(tmp_path))
+        monkeypatch.setattr(ai_transport, "LATENCY_SPEC", settings.get("latency", "none"))
+        monkeypatch.setattr(ai_transport, "REPLAY_MISS", settings.get("miss", "error"))
+
+    return set_mode
+
+
+def test_record_then_replay_without_calling_the_model(transport):
+    live = _LiveModel()
+    transport("record")
+    config = chatbot_service.FINAL_GENERATION_CONFIG
+    recorded = ai_transport.wrap_model("gemini-x", live).generate_content("hola", generation_config=config)
+
+    transport("replay")
+    replayed = ai_transport.wrap_model("gemini-x", live).generate_content("hola", generation_config=config)
+
+    assert recorded.text == replayed.text == "Respuesta real."
+    assert live.calls == 1
+    stats = ai_transport.get_transport_stats()
+    assert (stats["recorded"], stats["replayed"]) == ({"gemini": 1}, {"gemini": 1})
+
+
+def test_stream_is_recorded_and_replayed_in_fragments(transport):
+    live = _LiveModel()
+    transport("record")
+    list(ai_transport.wrap_model("m", live).generate_content("p", stream=True))
+
+    transport("replay")
+    chunks = list(ai_transport.wrap_model("m", live).generate_content("p", stream=True))
+
+    assert [chunk.text for chunk in chunks] == ["Respuesta ", "en ", "partes."]
+
+
+def test_replay_miss_raises_or_falls_back_to_fake(transport):
+    transport("replay")
+    with pytest.raises(ai_transport.CassetteMissError):
+        ai_transport.wrap_model("m", _LiveModel()).generate_content("sin grabar")
+
+    transport("replay", miss="fake")
+    response = ai_transport.wrap_model("m", _LiveModel()).generate_content("sin grabar")
+    assert response.text
+
+
+def test_live_mode_returns_the_model_untouched(transport):
+    live = _LiveModel()
+    transport("live")
+    assert ai_transport.wrap_model("m", live) is live
+
+
+@pytest.mark.parametrize(
+    "spec, recorded, expected",
+    [("", 120.0, 120.0), ("recorded", None, 0.0), ("none", 120.0, 0.0), ("fixed:50", 120.0, 50.0)],
+)
+def test_latency_specs(spec, recorded, expected):
+    assert ai_transport.parse_latency(spec)(recorded) == expected
+
+
+def test_random_latencies_are_reproducible():
+    sampler = ai_transport.parse_latency("lognormal:900,0.5")
+    first = [sampler(None) for _ in range(5)]
+    ai_transport.reset_transport_stats()
+    assert [sampler(None) for _ in range(5)] == first
+    assert 300 <= ai_transport.parse_latency("uniform:300,1500")(None) <= 1500
+
+
+def test_invalid_latency_spec():
+    with pytest.raises(ValueError):
+        ai_transport.parse_latency("gaussian:1")
+
+
+def test_voice_record_and_replay(transport):
+    transport("record")
+    calls = []
+
+    def live_stt(audio, language_code):
+        calls.append(audio)
+        return "donde queda el comedor"
+
+    assert ai_transport.transcribe(b"audio", "es-AR", live_stt) == "donde queda el comedor"
+    assert asyncio.run(ai_transport.synthesize_async("Hola", _async_tts)) == b"mp3"
+
+    transport("replay")
+    assert ai_transport.transcribe(b"audio", "es-AR", live_stt) == "donde queda el comedor"
+    assert voice_service.text_to_speech("Hola") == b"mp3"
+    assert len(calls) == 1
+
+
+async def _async_tts(text_value):
+    return b"mp3"
+
+
+def test_fake_voice_works_without_credentials(transport):
+    transport("fake")
+
+    audio = voice_service.text_to_speech("Hola, soy POLO.")
+    transcript = asyncio.run(voice_service.transcribe_audio_async(b"\x00" * 100))
+
+    assert audio.startswith(b"\xff\xfb") and len(audio) % 417 == 0
+    assert transcript in ai_transport.FAKE_TRANSCRIPTS
+
+
+@pytest.mark.usefixtures("model_final_answers")
+def test_fake_mode_runs_the_chat_pipeline_offline(transport, monkeypatch):
+    transport("fake")
+    monkeypatch.setattr(chatbot_service, "_schema_cache", None)
+    monkeypatch.setattr(chatbot_service, "_model_instances", {})
+    engine = create_engine("sqlite:///:memory:")
+    with engine.begin() as conn:
+        conn.execute(sa_text("CREATE TABLE directorio_empresa (cuil INTEGER PRIMARY KEY, nombre TEXT, rubro TEXT)"))
+        conn.execute(sa_text("INSERT INTO directorio_empresa VALUES (1, 'Logistica Express', 'Logística')"))
+        conn.execute(sa_text("INSERT INTO directorio_empresa VALUES (2, 'Metalúrgica Sur', 'Metalurgia')"))
+    db = sessionmaker(bind=engine)()
+
+    text_value, data, _ = chatbot_service.get_chat_response(db, "¿Cuántas empresas hay?")
+    greeting, _, _ = chatbot_service.get_chat_response(db, "hola")
+    db.close()
+
+    assert data == [{"total": 2}]
+    assert "total: 2" in text_value
+    assert greeting.startswith("¡Hola!")
+    assert ai_transport.get_transport_stats()["fake"] == {"gemini": 3}
+
+
+def test_fake_intent_shapes():
+    def intent(question):
+        return json.loads(ai_transport.fake_intent(f'Consulta del usuario (texto libre normalizado): "{question}"'))
+
+    assert intent("quien vende tornillos")["search_query"] == "tornillos"
+    assert "LIKE '%logistica%'" in intent("telefono de logistica express")["sql_query"]
+    assert intent("gracias")["direct_answer"]
@@ -0,0 +1,184 @@
+"""
+Tests de las respuestas por plantilla (app/services/answer_renderer.py):
+qué formas de resultado se responden sin Gemini, cuáles siguen yendo al
+modelo, y el contador de llamadas ahorradas que sale en /health.
+"""
+import json
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine, text as sa_text
+from sqlalchemy.orm import sessionmaker
+
+from app.services import answer_renderer, chatbot_service
+
+
+def _render(rows, question="dame el dato", **kwargs):
+    return answer_renderer.render_answer(question, rows, **kwargs)
+
+
+def test_single_company_phone():
+    text_value, shape = _render([{"nombre": "Logistica Express", "contacto_telefono": "4800-1234", "cuil": 1}])
+
+    assert shape == "single_fact"
+    assert text_value == "Logistica Express: teléfono: 4800-1234."
+
+
+def test_lot_location():
+    text_value, shape = _render([{"nombre": "Logistica Express", "manzana": 3, "lote": 12}])
+
+    assert shape == "location"
+    assert text_value == "Logistica Express está en la manzana 3, lote 12."
+
+
+def test_count():
+    assert _render([{"count": 12}], "cuantas empresas hay") == ("En total son 12.", "count")
+
+
+def test_list_of_names_by_rubro():
+    rows = [{"nombre": "A", "rubro": "Logística"}, {"nombre": "B", "rubro": "Logística"}, {"nombre": "C"}]
+
+    text_value, shape = _render(rows)
+
+    assert shape == "name_list"
+    assert text_value.splitlines() == ["Encontré 3 resultados:", "- A (Logística)", "- B (Logística)", "- C"]
+
+
+@pytest.mark.parametrize(
+    "tables, header",
+    [
+        ({"empresa"}, "Encontré 2 empresas:"),
+        ({"directorio_empresa"}, "Encontré 2 empresas:"),
+        ({"contacto"}, "Encontré 2 contactos:"),
+        ({"servicio_polo"}, "Encontré 2 servicios:"),
+        ({"empresa", "contacto"}, "Encontré 2 resultados:"),
+        ({"tipo_servicio_polo"}, "Encontré 2 resultados:"),
+    ],
+)
+def test_list_header_names_what_the_query_read(tables, header):
+    text_value, _ = _render([{"nombre": "A"}, {"nombre": "B"}], tables=tables)
+
+    assert text_value.splitlines()[0] == header
+
+
+def test_single_row_list_header_is_neutral_without_tables():
+    assert _render([{"nombre": "Juan Pérez"}]) == ("Encontré este resultado:\n- Juan Pérez", "name_list")
+
+
+def test_truncated_list_says_there_are_more():
+    rows = chatbot_service.SqlRows([{"nombre": "A"}, {"nombre": "B"}])
+    rows.truncated = True
+
+    text_value, _ = _render(rows, truncated=True)
+
+    assert "Hay más resultados" in text_value
+
+
+def test_fields_and_dates_are_formatted():
+    text_value, _ = _render([{"nombre": "A", "fecha_ingreso": date(2020, 1, 1), "atiende_publico": True}])
+
+    assert text_value == "A: en el parque desde: 2020-01-01 y atiende al público: sí."
+
+
+@pytest.mark.parametrize(
+    "rows, question, kwargs",
+    [
+        ([], "telefono de x", {}),  # sin resultados: Gemini lo dice con naturalidad
+        ([{"error": "x"}], "telefono de x", {}),
+        ([{"nombre": "A", "productos_servicios": "x" * 200}], "que vende a", {}),
+        ([{"nombre": "A", "a": 1, "b": 2, "c": 3, "d": 4}], "datos de a", {}),
+        ([{"nombre": f"E{i}"} for i in range(20)], "empresas", {}),
+        ([{"nombre": "A", "rubro": "x", "telefono": "1"}] * 2, "empresas", {}),
+        ([{"nombre": "A", "telefono": "1"}], "cual me recomendas", {}),
+        ([{"nombre": "A", "telefono": "1"}], "compara a y b", {}),
+        ([{"nombre": "A", "telefono": "1"}], "telefono de a", {"from_search": True}),
+    ],
+)
+def test_shapes_that_need_the_model(rows, question, kwargs):
+    assert _render(rows, question, **kwargs) == (None, None)
+
+
+# ═══════════════════════════════════════════════════════════════════
+# En el pipeline
+# ═══════════════════════════════════════════════════════════════════
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+@pytest.fixture
+def empresa_db(monkeypatch):
+    monkeypatch.setattr(chatbot_service, "_schema_cache", None)
+    engine = create_engine("sqlite:///:memory:")
+    with engine.begin() as conn:
+        conn.execute(sa_text("CREATE TABLE empresa (cuil INTEGER PRIMARY KEY, nombre TEXT, telefono TEXT)"))
+        conn.execute(sa_text("INSERT INTO empresa VALUES (1, 'Logistica Express', '4800-1234')"))
+    db = sessionmaker(bind=engine)()
+    yield db
+    db.close()
+
+
+def _fake_gemini(monkeypatch, sql_query):
+    prompts = []
+
+    def fake_generate(prompt, generation_config):
+        prompts.append(prompt)
+        if generation_config is chatbot_service.INTENT_GENERATION_CONFIG:
+            return _FakeResponse(json.dumps({"needs_more_info": False, "sql_query": sql_query}))
+        return _FakeResponse("Respuesta redactada por Gemini.")
+
+    monkeypatch.setattr(chatbot_service, "_generate", fake_generate)
+    return prompts
+
+
+def test_simple_result_skips_the_final_gemini_call(client, empresa_db, monkeypatch):
+    prompts = _fake_gemini(monkeypatch, "SELECT nombre, telefono FROM empresa WHERE nombre LIKE '%express%'")
+
+    text_value, data, _ = chatbot_service.get_chat_response(empresa_db, "telefono de logistica express")
+
+    assert text_value == "Logistica Express: teléfono: 4800-1234."
+    assert data == [{"nombre": "Logistica Express", "telefono": "4800-1234"}]
+    assert len(prompts) == 1
+
+    # La respuesta por plantilla también se cachea.
+    chatbot_service.get_chat_response(empresa_db, "telefono de logistica express")
+    assert len(prompts) == 1
+
+    stats = client.get("/health").json()["chat_answer_renderer"]
+    assert stats["template"] == 1
+    assert stats["by_shape"] == {"single_fact": 1}
+
+
+def test_synthesis_question_still_goes_to_gemini(empresa_db, monkeypatch):
+    prompts = _fake_gemini(monkeypatch, "SELECT nombre, telefono FROM empresa")
+
+    text_value, _, _ = chatbot_service.get_chat_response(empresa_db, "por que me recomendas logistica express")
+
+    assert text_value == "Respuesta redactada por Gemini."
+    assert len(prompts) == 2
+    stats = answer_renderer.get_renderer_stats()
+    assert (stats["template"], stats["model"], stats["llm_skip_rate"]) == (0, 1, 0.0)
+
+
+def test_stream_reports_rendered_shape(empresa_db, monkeypatch):
+    _fake_gemini(monkeypatch, "SELECT nombre FROM empresa")
+
+    events = list(chatbot_service.get_chat_response_stream(empresa_db, "empresas del parque"))
+
+    done = events[-1][1]
+    assert done["text"] == "Encontré esta empresa:\n- Logistica Express"
+    assert done["rendered_shape"] == "name_list"
+
+
+def test_contact_list_is_not_called_companies(empresa_db, monkeypatch):
+    with empresa_db.get_bind().begin() as conn:
+        conn.execute(sa_text("CREATE TABLE contacto (id_contacto INTEGER PRIMARY KEY, nombre TEXT)"))
+        conn.execute(sa_text("INSERT INTO contacto (nombre) VALUES ('Ana Gómez'), ('Luis Díaz')"))
+    prompts = _fake_gemini(monkeypatch, "SELECT nombre FROM contacto")
+
+    text_value, _, _ = chatbot_service.get_chat_response(empresa_db, "contactos del parque")
+
+    assert text_value == "Encontré 2 contactos:\n- Ana Gómez\n- Luis Díaz"
+    assert len(prompts) == 1
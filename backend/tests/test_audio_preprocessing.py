@@ -0,0 +1,179 @@
+"""
+Tests del preprocesamiento de audio antes de STT
+(app/services/audio_preprocessing.py): reconocimiento del formato, detección
+de voz en WAV y en Opus (WebM/Ogg) sin decodificar, recorte y remuestreo, y
+que un toque al tótem sin hablar no llega a Google.
+"""
+import asyncio
+import io
+import wave
+
+import numpy as np
+import pytest
+
+from app.services import audio_preprocessing, voice_service
+from app.services.audio_preprocessing import AudioRejected, prepare_audio, sniff_format
+
+
+def _wav(samples: np.ndarray, rate: int, channels: int = 1) -> bytes:
+    pcm = (np.clip(samples, -1, 1) * 32767).astype("<i2")
+    if channels == 2:
+        pcm = np.repeat(pcm, 2)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def _tone(seconds: float, rate: int, amplitude: float = 0.3) -> np.ndarray:
+    t = np.arange(int(seconds * rate)) / rate
+    return (amplitude * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+
+
+def _ebml(element_id: bytes, payload: bytes) -> bytes:
+    return element_id + b"\x01" + len(payload).to_bytes(7, "big") + payload
+
+
+def _webm(packet_sizes) -> bytes:
+    """WebM como el del MediaRecorder: Segment y Cluster de tamaño desconocido, un SimpleBlock por paquete."""
+    unknown = b"\x01\xff\xff\xff\xff\xff\xff\xff"
+    blocks = b"".join(
+        # Paquete CELT de 20 ms (TOC 0xF8) del tamaño pedido.
+        _ebml(b"\xa3", b"\x81\x00\x00\x80" + b"\xf8" + b"\x11" * (size - 1))
+        for size in packet_sizes
+    )
+    return (
+        _ebml(b"\x1a\x45\xdf\xa3", _ebml(b"\x42\x82", b"webm"))
+        + b"\x18\x53\x80\x67" + unknown
+        + _ebml(b"\x16\x54\xae\x6b", _ebml(b"\xae", _ebml(b"\x86", b"A_OPUS")))
+        + b"\x1f\x43\xb6\x75" + unknown
+        + _ebml(b"\xe7", b"\x00")
+        + blocks
+    )
+
+
+def _ogg(packet_sizes) -> bytes:
+    packets = [b"OpusHead" + b"\x01" * 11, b"OpusTags" + b"\x00" * 8]
+    packets += [b"\xf8" + b"\x11" * (size - 1) for size in packet_sizes]
+    table = bytes(len(packet) for packet in packets)
+    header = b"OggS" + b"\x00" * 22 + bytes([len(table)])
+    return header + table + b"".join(packets)
+
+
+def test_sniff_format():
+    assert sniff_format(_webm([100])).encoding == "WEBM_OPUS"
+    assert sniff_format(_ogg([100])).encoding == "OGG_OPUS"
+    assert sniff_format(_wav(_tone(0.1, 16000), 16000)).encoding == "LINEAR16"
+    assert sniff_format(b"fLaC\x00\x00").encoding == "FLAC"
+    assert sniff_format(b"ID3\x04\x00").encoding == "MP3"
+    assert sniff_format(b"\xff\xfb\x90\x64").encoding == "MP3"
+    # AAC en ADTS comparte el sincronismo de MP3 (capa 00): no se manda como MP3.
+    assert sniff_format(b"\xff\xf1\x50\x80\x02\x1f\xfc") == audio_preprocessing.AudioFormat("aac", None, None)
+    assert sniff_format(b"\xff\xf9\x50\x80\x02\x1f\xfc").encoding is None
+    assert sniff_format(b"\x00\x00\x00\x18ftypM4A ").encoding is None
+    assert sniff_format(b"desconocido") == audio_preprocessing.UNKNOWN_FORMAT
+
+
+@pytest.mark.parametrize("build", [_webm, _ogg])
+def test_opus_vad_by_packet_size(build):
+    speech = prepare_audio(build([3] * 20 + [120] * 30 + [3] * 10))
+    assert speech.duration_ms == 1200 and speech.voiced_ms == 600
+
+    with pytest.raises(AudioRejected) as exc_info:
+        prepare_audio(build([3] * 100))
+    assert exc_info.value.reason == "silent"
+
+
+def test_opus_over_length_is_rejected(monkeypatch):
+    monkeypatch.setattr(audio_preprocessing, "MAX_AUDIO_SECONDS", 1)
+
+    with pytest.raises(AudioRejected) as exc_info:
+        prepare_audio(_webm([120] * 60))
+    assert exc_info.value.reason == "too_long"
+
+
+def test_wav_is_trimmed_downmixed_and_resampled():
+    rate = 44100
+    samples = np.concatenate([np.zeros(rate), _tone(1.0, rate), np.zeros(rate)])
+
+    prepared = prepare_audio(_wav(samples, rate, channels=2))
+
+    assert prepared.format == audio_preprocessing.AudioFormat("wav", "LINEAR16", 16000)
+    with wave.open(io.BytesIO(prepared.content)) as wav:
+        assert (wav.getnchannels(), wav.getframerate()) == (1, 16000)
+        # 1 s de voz + 300 ms de margen de cada lado.
+        assert abs(wav.getnframes() / 16000 - 1.6) < 0.05
+    assert prepared.voiced_ms == pytest.approx(1000, abs=40)
+
+
+def test_wav_over_length_is_trimmed(monkeypatch):
+    monkeypatch.setattr(audio_preprocessing, "MAX_AUDIO_SECONDS", 2)
+
+    prepared = prepare_audio(_wav(_tone(5.0, 16000), 16000))
+
+    assert prepared.duration_ms == pytest.approx(2000)
+
+
+def test_silent_and_empty_wav_are_rejected():
+    noise = np.random.default_rng(0).normal(0, 0.001, 16000).astype(np.float32)
+    for data, reason in ((_wav(noise, 16000), "silent"), (b"", "empty")):
+        with pytest.raises(AudioRejected) as exc_info:
+            prepare_audio(data)
+        assert exc_info.value.reason == reason
+    assert audio_preprocessing.get_preprocessing_stats()["rejected"] == {"silent": 1, "empty": 1}
+
+
+@pytest.fixture
+def google_stt(monkeypatch):
+    calls = []
+
+    async def recognize(audio_content, language_code="es-AR"):
+        calls.append(audio_content)
+        return "donde queda el comedor"
+
+    monkeypatch.setattr(voice_service, "VOICE_PROVIDER", "google")
+    monkeypatch.setattr(voice_service, "speech_client", object())
+    monkeypatch.setattr(voice_service, "transcribe_audio_google_async", recognize)
+    return calls
+
+
+def test_silent_tap_never_reaches_google(google_stt):
+    transcript = asyncio.run(voice_service.transcribe_audio_async(_webm([3] * 50)))
+
+    assert transcript == ""
+    assert google_stt == []
+
+
+def test_google_receives_the_prepared_audio(google_stt):
+    rate = 48000
+    audio = _wav(np.concatenate([np.zeros(rate), _tone(0.5, rate)]), rate)
+
+    assert asyncio.run(voice_service.transcribe_audio_async(audio)) == "donde queda el comedor"
+    assert len(google_stt[0]) < len(audio) / 3
+
+
+@pytest.mark.parametrize(
+    "audio, status_code",
+    [(b"\x00\x00\x00\x18ftypM4A " + b"\x00" * 100, 415), (b"\x1a\x45\xdf\xa3" + b"\x00" * 2048, 413)],
+)
+def test_unusable_audio_is_a_client_error(google_stt, monkeypatch, audio, status_code):
+    monkeypatch.setattr(audio_preprocessing, "MAX_AUDIO_BYTES", 1024)
+
+    with pytest.raises(voice_service.HTTPException) as exc_info:
+        asyncio.run(voice_service.transcribe_audio_async(audio))
+    assert exc_info.value.status_code == status_code
+    assert google_stt == []
+
+
+def test_recognition_config_follows_the_format():
+    if voice_service.speech is None:
+        pytest.skip("google-cloud-speech no instalado")
+    wav_config = voice_service._recognition_config("es-AR", audio_preprocessing.AudioFormat("wav", "LINEAR16", 16000))
+    default_config = voice_service._recognition_config("es-AR")
+
+    assert wav_config.encoding == voice_service.speech.RecognitionConfig.AudioEncoding.LINEAR16
+    assert wav_config.sample_rate_hertz == 16000
+    assert default_config.encoding == voice_service.speech.RecognitionConfig.AudioEncoding.WEBM_OPUS
@@ -0,0 +1,119 @@
+"""
+Tests del TTS por oraciones (voice_service.split_sentences /
+synthesize_sentences) y del endpoint SSE /api/voice/chat/audio-stream: los
+segmentos salen en orden aunque se sinteticen en paralelo, con tope de
+concurrencia, y el evento final trae el tiempo al primer audio.
+"""
+import asyncio
+import base64
+import json
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.services import chatbot_service, voice_service
+from app.services.common import GENERIC_ERROR_MESSAGE
+
+
+def test_split_sentences_merges_short_ones():
+    text = "¡Hola! Encontré 2 empresas de logística en el parque.\n- Logistica Express\n- Transportes Sur"
+
+    assert voice_service.split_sentences(text, min_chars=10) == [
+        "¡Hola! Encontré 2 empresas de logística en el parque.",
+        "Logistica Express",
+        "Transportes Sur",
+    ]
+
+
+def test_split_sentences_keeps_decimals_and_urls():
+    text = "El lote mide 3.5 hectáreas. Más info en www.polo52.com.ar, de lunes a viernes."
+
+    assert voice_service.split_sentences(text, min_chars=1) == [
+        "El lote mide 3.5 hectáreas.",
+        "Más info en www.polo52.com.ar, de lunes a viernes.",
+    ]
+
+
+def test_split_sentences_short_tail_goes_with_previous():
+    assert voice_service.split_sentences("Una oración bastante larga para el tótem. Chau.", min_chars=20) == [
+        "Una oración bastante larga para el tótem. Chau."
+    ]
+    assert voice_service.split_sentences("") == []
+
+
+@pytest.fixture
+def slow_tts(monkeypatch):
+    """TTS falso donde la primera oración es la más lenta."""
+    state = {"running": 0, "max_running": 0}
+
+    async def fake_tts(text, voice_provider=None):
+        state["running"] += 1
+        state["max_running"] = max(state["max_running"], state["running"])
+        await asyncio.sleep(0.03 if text.startswith("0") else 0.005)
+        state["running"] -= 1
+        return f"mp3:{text}".encode()
+
+    monkeypatch.setattr(voice_service, "text_to_speech_async", fake_tts)
+    return state
+
+
+def test_segments_come_out_in_order_with_bounded_concurrency(slow_tts):
+    sentences = [f"{i} oración" for i in range(6)]
+
+    async def collect():
+        return [item async for item in voice_service.synthesize_sentences(sentences, concurrency=2)]
+
+    results = asyncio.run(collect())
+
+    assert [index for index, _, _ in results] == list(range(6))
+    assert results[3][2] == "mp3:3 oración".encode()
+    assert slow_tts["max_running"] == 2
+
+
+def _parse_sse(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+async def _answer(db, message, history):
+    return "Encontré dos empresas de logística. Logistica Express está en la manzana 3.", [{"nombre": "X"}], None
+
+
+def test_audio_stream_endpoint_sends_segments_then_timings(client: TestClient, slow_tts):
+    with patch.object(chatbot_service, "get_chat_response_async", side_effect=_answer):
+        response = client.post("/api/voice/chat/audio-stream", json={"text": "empresas de logistica"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _parse_sse(response.text)
+    assert [name for name, _ in events] == ["text", "audio", "audio", "done"]
+    audio = [payload for name, payload in events if name == "audio"]
+    assert [segment["index"] for segment in audio] == [0, 1]
+    assert base64.b64decode(audio[0]["audio_base64"]).decode() == "mp3:Encontré dos empresas de logística."
+    done = events[-1][1]
+    assert done["segments"] == 2 and done["error"] is False
+    assert done["ttfa_ms"] <= done["total_ms"]
+
+
+def test_audio_stream_with_unintelligible_audio_speaks_the_error(client: TestClient, slow_tts, monkeypatch):
+    async def empty_transcript(audio_content, language_code="es-AR"):
+        return ""
+
+    monkeypatch.setattr(chatbot_service, "transcribe_audio_async", empty_transcript)
+    audio_base64 = base64.b64encode(b"ruido").decode()
+
+    response = client.post("/api/voice/chat/audio-stream", json={"audio_base64": audio_base64})
+
+    events = _parse_sse(response.text)
+    assert events[0] == ("transcript", {"text": ""})
+    assert events[1][1]["text"] == GENERIC_ERROR_MESSAGE
+    assert events[-1][1]["error"] is True
+
+
+def test_audio_stream_requires_audio_or_text(client: TestClient):
+    assert client.post("/api/voice/chat/audio-stream", json={"text": " "}).status_code == 400
+    assert client.post("/api/voice/chat/audio-stream", json={"audio_base64": "%%%"}).status_code == 400
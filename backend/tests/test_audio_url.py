@@ -0,0 +1,135 @@
+"""
+Tests del audio por URL (app/services/audio_store.py y GET
+/api/voice/audio/{token}): /chat?audio_delivery=url responde sin esperar al
+TTS, el MP3 se sirve binario con Content-Length y Range, y los tokens vencen.
+"""
+import asyncio
+import base64
+import os
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.services import audio_store, chatbot_service, tts_cache, voice_service
+
+AUDIO = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def fake_tts(monkeypatch):
+    calls = []
+
+    async def tts(text, voice_provider=None):
+        calls.append(text)
+        return AUDIO
+
+    monkeypatch.setattr(chatbot_service, "text_to_speech_async", tts)
+    return calls
+
+
+async def _answer(db, message, history):
+    return "Logistica Express está en la manzana 3.", [{"nombre": "Logistica Express"}], None
+
+
+def test_voice_chat_with_audio_url(client: TestClient, fake_tts):
+    with patch.object(chatbot_service, "get_chat_response_async", side_effect=_answer):
+        by_url = client.post("/api/voice/chat?audio_delivery=url", json={"text": "donde esta logistica"})
+        inline = client.post("/api/voice/chat", json={"text": "donde esta logistica"})
+
+    data = by_url.json()["data"]
+    assert data["audio_base64"] is None
+    assert data["text"] == "Logistica Express está en la manzana 3."
+    assert base64.b64decode(inline.json()["data"]["audio_base64"]) == AUDIO
+    # El JSON ya no carga el audio: es una fracción del inline.
+    assert len(by_url.content) * 10 < len(inline.content)
+
+    audio = client.get(data["audio_url"])
+    assert audio.status_code == 200
+    assert audio.headers["content-type"] == "audio/mpeg"
+    assert audio.headers["content-length"] == str(len(AUDIO))
+    assert audio.headers["accept-ranges"] == "bytes"
+    assert audio.content == AUDIO
+
+
+@pytest.mark.parametrize(
+    "range_header, expected_range, expected_body",
+    [
+        ("bytes=0-99", "bytes 0-99/10240", AUDIO[:100]),
+        ("bytes=10000-", "bytes 10000-10239/10240", AUDIO[10000:]),
+        ("bytes=-40", "bytes 10200-10239/10240", AUDIO[-40:]),
+        ("bytes=10200-99999", "bytes 10200-10239/10240", AUDIO[10200:]),
+    ],
+)
+def test_audio_url_serves_ranges(client: TestClient, range_header, expected_range, expected_body):
+    token = audio_store.audio_store.put(AUDIO)
+
+    response = client.get(f"/api/voice/audio/{token}", headers={"Range": range_header})
+
+    assert response.status_code == 206
+    assert response.headers["content-range"] == expected_range
+    assert response.headers["content-length"] == str(len(expected_body))
+    assert response.content == expected_body
+
+
+def test_audio_url_unsatisfiable_range_and_unknown_token(client: TestClient):
+    token = audio_store.audio_store.put(AUDIO)
+
+    response = client.get(f"/api/voice/audio/{token}", headers={"Range": "bytes=20000-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */10240"
+    assert client.get("/api/voice/audio/no-existe").status_code == 404
+
+
+def test_audio_url_survives_the_tts_disk_cache_pruning_its_file(client: TestClient, tmp_path, monkeypatch):
+    cache = tts_cache.TTSCache(tts_cache.MemoryTier(1024 * 1024), tts_cache.DiskTier(str(tmp_path), 1024 * 1024))
+    monkeypatch.setattr(tts_cache, "tts_cache", cache)
+    key = voice_service.tts_cache_key("Hola")
+    cache.put(key, AUDIO)
+
+    token = audio_store.audio_store.put(AUDIO)
+    # El cache poda sus archivos por su cuenta, antes de que venza el token.
+    os.remove(cache.path_for(key))
+    response = client.get(f"/api/voice/audio/{token}", headers={"Range": "bytes=0-9"})
+
+    assert response.status_code == 206
+    assert response.content == AUDIO[:10]
+    assert audio_store.get_audio_store_stats()["bytes"] == len(AUDIO)
+
+
+def test_pending_audio_is_awaited_and_tokens_expire(monkeypatch):
+    store = audio_store.AudioStore(ttl_seconds=60, max_bytes=1024 * 1024)
+
+    async def slow_tts():
+        await asyncio.sleep(0.01)
+        return b"mp3"
+
+    async def scenario():
+        token = store.put_pending(slow_tts())
+        return await store.get(token), token
+
+    stored, token = asyncio.run(scenario())
+    assert stored == audio_store.StoredAudio(b"mp3")
+
+    clock = [audio_store.time.monotonic() + 61]
+    monkeypatch.setattr(audio_store.time, "monotonic", lambda: clock[0])
+    assert asyncio.run(store.get(token)) is None
+    assert store.stats()["expired"] == 1
+
+
+def test_failed_synthesis_and_byte_cap():
+    store = audio_store.AudioStore(ttl_seconds=60, max_bytes=10)
+
+    async def broken_tts():
+        raise RuntimeError("tts caído")
+
+    async def scenario():
+        token = store.put_pending(broken_tts())
+        return await store.get(token)
+
+    assert asyncio.run(scenario()) is None
+    first = store.put(b"x" * 6)
+    second = store.put(b"y" * 6)
+    assert asyncio.run(store.get(first)) is None
+    assert asyncio.run(store.get(second)).audio == b"y" * 6
+    assert store.stats()["failed"] == 1 and store.stats()["evictions"] == 1
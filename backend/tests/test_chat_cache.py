@@ -0,0 +1,377 @@
+"""
+Tests de los caches del chatbot (app/services/chat_cache.py): LRU + TTL,
+contadores, claves, la invalidación automática cuando se escriben tablas
+del directorio a través del ORM, el cache de planes (pregunta -> SQL) y
+la unificación de pedidos idénticos simultáneos (single-flight).
+"""
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine, text as sa_text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import models
+from app.config import Base
+from app.services import chat_cache, chatbot_service
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+def _intent_json(**overrides):
+    base = {
+        "needs_more_info": False,
+        "sql_query": "",
+        "direct_answer": "",
+        "corrected_entity": "",
+        "question": "",
+    }
+    base.update(overrides)
+    return json.dumps(base)
+
+
+@pytest.fixture(autouse=True)
+def reset_schema_cache():
+    original = chatbot_service._schema_cache
+    chatbot_service._schema_cache = None
+    yield
+    chatbot_service._schema_cache = original
+
+
+# ═══════════════════════════════════════════════════════════════════
+# TTLCache
+# ═══════════════════════════════════════════════════════════════════
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = chat_cache.TTLCache("t", max_entries=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" pasa a ser la más reciente
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_cache_expires_entries(monkeypatch):
+    now = {"t": 1000.0}
+    monkeypatch.setattr(chat_cache.time, "monotonic", lambda: now["t"])
+    cache = chat_cache.TTLCache("t", max_entries=10, ttl_seconds=5)
+    cache.set("a", 1)
+
+    now["t"] += 4
+    assert cache.get("a") == 1
+    now["t"] += 2
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_counts_hits_and_misses():
+    cache = chat_cache.TTLCache("t", max_entries=10, ttl_seconds=60)
+    cache.get("x")
+    cache.set("x", "valor")
+    cache.get("x")
+    cache.get("x")
+
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == pytest.approx(2 / 3, abs=1e-3)
+
+
+def test_ttl_cache_returns_independent_copies():
+    cache = chat_cache.TTLCache("t", max_entries=10, ttl_seconds=60)
+    cache.set("k", ("texto", [{"nombre": "A"}], None))
+    first = cache.get("k")
+    first[1].append({"nombre": "B"})
+    assert cache.get("k") == ("texto", [{"nombre": "A"}], None)
+
+
+def test_answer_cache_key_ignores_punctuation_and_spacing():
+    key_a = chat_cache.answer_cache_key(chatbot_service.normalize_text("¿Qué empresas  de logística hay?"), None)
+    key_b = chat_cache.answer_cache_key(chatbot_service.normalize_text("que empresas de logistica hay"), None)
+    assert key_a == key_b
+
+
+def test_answer_cache_key_depends_on_history():
+    question = "y su telefono"
+    key_a = chat_cache.answer_cache_key(question, [{"user": "empresa A", "assistant": "..."}])
+    key_b = chat_cache.answer_cache_key(question, [{"user": "empresa B", "assistant": "..."}])
+    assert key_a != key_b
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Integración con get_chat_response
+# ═══════════════════════════════════════════════════════════════════
+
+
+@pytest.fixture
+def orm_db():
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(bind=engine)
+    db = SessionLocal()
+    db.add(
+        models.Empresa(
+            cuil=1,
+            nombre="Logistica Express S.A.",
+            rubro="Logistica",
+            cant_empleados=30,
+            observaciones="",
+            fecha_ingreso=date(2020, 1, 1),
+            horario_trabajo="8 a 18hs",
+            estado=True,
+        )
+    )
+    db.commit()
+    chat_cache.reset_chat_caches()
+    yield db
+    db.close()
+    engine.dispose()
+
+
+def _counting_generate(calls, final_text="Está Logistica Express S.A."):
+    def fake_generate(prompt, generation_config):
+        calls.append(prompt)
+        if generation_config is chatbot_service.INTENT_GENERATION_CONFIG:
+            return _FakeResponse(_intent_json(sql_query="SELECT nombre, rubro FROM empresa"))
+        return _FakeResponse(final_text)
+
+    return fake_generate
+
+
+@pytest.mark.usefixtures("model_final_answers")
+def test_repeated_question_is_served_from_cache(orm_db, monkeypatch):
+    calls = []
+    monkeypatch.setattr(chatbot_service, "_generate", _counting_generate(calls))
+
+    first = chatbot_service.get_chat_response(orm_db, "¿Qué empresas de logística hay?")
+    second = chatbot_service.get_chat_response(orm_db, "que empresas de logistica hay")
+
+    assert first == second
+    assert len(calls) == 2  # intención + respuesta final, una sola vez
+    assert chat_cache.answer_cache.stats()["hits"] == 1
+
+
+@pytest.mark.usefixtures("model_final_answers")
+def test_fallback_answers_are_not_cached(orm_db, monkeypatch):
+    def failing_final(prompt, generation_config):
+        if generation_config is chatbot_service.INTENT_GENERATION_CONFIG:
+            return _FakeResponse(_intent_json(sql_query="SELECT nombre, rubro FROM empresa"))
+        raise RuntimeError("Gemini caído")
+
+    monkeypatch.setattr(chatbot_service, "_generate", failing_final)
+    chatbot_service.get_chat_response(orm_db, "que empresas hay")
+
+    assert len(chat_cache.answer_cache) == 0
+
+
+@pytest.mark.usefixtures("model_final_answers")
+def test_orm_write_to_directory_table_invalidates_answers(orm_db, monkeypatch):
+    calls = []
+    monkeypatch.setattr(chatbot_service, "_generate", _counting_generate(calls))
+    chatbot_service.get_chat_response(orm_db, "que empresas hay")
+    assert len(chat_cache.answer_cache) == 1
+
+    empresa = orm_db.get(models.Empresa, 1)
+    empresa.rubro = "Transporte"
+    orm_db.commit()
+
+    assert len(chat_cache.answer_cache) == 0
+    chatbot_service.get_chat_response(orm_db, "que empresas hay")
+    # El plan SQL sigue cacheado (no depende de los datos): solo se repite
+    # la respuesta final, ahora con los datos nuevos.
+    assert len(calls) == 3
+
+
+def test_write_to_unrelated_table_keeps_answers(orm_db, monkeypatch):
+    monkeypatch.setattr(chatbot_service, "_generate", _counting_generate([]))
+    chatbot_service.get_chat_response(orm_db, "que empresas hay")
+
+    orm_db.add(models.Rol(tipo_rol="publico"))
+    orm_db.commit()
+
+    assert len(chat_cache.answer_cache) == 1
+
+
+def test_rolled_back_write_does_not_invalidate(orm_db, monkeypatch):
+    monkeypatch.setattr(chatbot_service, "_generate", _counting_generate([]))
+    chatbot_service.get_chat_response(orm_db, "que empresas hay")
+
+    orm_db.get(models.Empresa, 1).nombre = "Otro nombre"
+    orm_db.flush()
+    orm_db.rollback()
+
+    assert len(chat_cache.answer_cache) == 1
+    assert orm_db.execute(sa_text("SELECT nombre FROM empresa")).scalar() == "Logistica Express S.A."
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Cache de planes (etapa de intención)
+# ═══════════════════════════════════════════════════════════════════
+
+
+def test_cached_plan_skips_intent_call_but_reads_live_data(orm_db, monkeypatch):
+    prompts = []
+
+    def fake_generate(prompt, generation_config):
+        prompts.append(generation_config)
+        if generation_config is chatbot_service.INTENT_GENERATION_CONFIG:
+            return _FakeResponse(_intent_json(sql_query="SELECT nombre, rubro FROM empresa"))
+        return _FakeResponse("respuesta")
+
+    monkeypatch.setattr(chatbot_service, "_generate", fake_generate)
+    chatbot_service.get_chat_response(orm_db, "que empresas hay")
+
+    orm_db.get(models.Empresa, 1).rubro = "Transporte"
+    orm_db.commit()  # invalida answer_cache, no plan_cache
+
+    _, data, _ = chatbot_service.get_chat_response(orm_db, "que empresas hay")
+
+    assert prompts.count(chatbot_service.INTENT_GENERATION_CONFIG) == 1
+    assert data == [{"nombre": "Logistica Express S.A.", "rubro": "Transporte"}]
+    assert chat_cache.plan_cache.stats()["hits"] == 1
+
+
+def test_rejected_plans_are_not_cached(orm_db, monkeypatch):
+    monkeypatch.setattr(
+        chatbot_service,
+        "_generate",
+        lambda prompt, generation_config: _FakeResponse(_intent_json(sql_query="SELECT * FROM usuario")),
+    )
+    chatbot_service.get_chat_response(orm_db, "dame los usuarios")
+    assert len(chat_cache.plan_cache) == 0
+
+
+def test_plan_whose_query_failed_is_not_cached(orm_db, monkeypatch):
+    prompts = []
+
+    def fake_generate(prompt, generation_config):
+        prompts.append(generation_config)
+        if generation_config is chatbot_service.INTENT_GENERATION_CONFIG:
+            return _FakeResponse(_intent_json(sql_query="SELECT nombre, rubro FROM empresa"))
+        return _FakeResponse("respuesta")
+
+    real_execute = chatbot_service.execute_sql_query
+    executions = []
+
+    def flaky_execute(db, sql_query):
+        executions.append(sql_query)
+        if len(executions) == 1:
+            return [{"error": chatbot_service.GENERIC_ERROR_MESSAGE}]
+        return real_execute(db, sql_query)
+
+    monkeypatch.setattr(chatbot_service, "_generate", fake_generate)
+    monkeypatch.setattr(chatbot_service, "execute_sql_query", flaky_execute)
+
+    first, _, _ = chatbot_service.get_chat_response(orm_db, "que empresas hay")
+    assert first == chatbot_service.GENERIC_ERROR_MESSAGE
+    assert len(chat_cache.plan_cache) == 0
+
+    _, data, _ = chatbot_service.get_chat_response(orm_db, "que empresas hay")
+
+    # La segunda vez se vuelve a planificar con Gemini y el plan, ahora sí, queda.
+    assert prompts.count(chatbot_service.INTENT_GENERATION_CONFIG) == 2
+    assert data == [{"nombre": "Logistica Express S.A.", "rubro": "Logistica"}]
+    assert len(chat_cache.plan_cache) == 1
+
+
+def test_plan_cache_key_changes_with_schema():
+    key_a = chat_cache.plan_cache_key("que empresas hay", None, "- Tabla 'empresa'")
+    key_b = chat_cache.plan_cache_key("que empresas hay", None, "- Tabla 'empresa'\n- Tabla 'lotes'")
+    assert key_a != key_b
+
+
+def test_schema_change_flushes_plan_cache(orm_db, monkeypatch):
+    monkeypatch.setattr(chatbot_service, "_generate", _counting_generate([]))
+    chatbot_service.get_chat_response(orm_db, "que empresas hay")
+    assert len(chat_cache.plan_cache) == 1
+
+    orm_db.execute(sa_text("CREATE TABLE nueva_tabla (id INTEGER PRIMARY KEY)"))
+    orm_db.commit()
+    chatbot_service.get_database_schema(orm_db, force_refresh=True)
+
+    assert len(chat_cache.plan_cache) == 0
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Single-flight
+# ═══════════════════════════════════════════════════════════════════
+
+
+def test_single_flight_runs_once_and_hands_out_copies():
+    flight = chat_cache.SingleFlight("t")
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return ("texto", [{"nombre": "A"}], None)
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        leader = executor.submit(flight.do, "k", compute)
+        started.wait(5)
+        followers = [executor.submit(flight.do, "k", compute) for _ in range(4)]
+        while flight.followers < 4:
+            time.sleep(0.001)
+        release.set()
+        results = [leader.result()] + [future.result() for future in followers]
+
+    assert len(calls) == 1
+    assert all(result == results[0] for result in results)
+    assert len({id(result[1]) for result in results}) == 5
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 4, "coalescing_rate": 0.8}
+
+
+def test_single_flight_shares_errors_and_then_forgets_the_key():
+    flight = chat_cache.SingleFlight("t")
+
+    def boom():
+        raise ValueError("falló")
+
+    with pytest.raises(ValueError):
+        flight.do("k", boom)
+    assert flight.do("k", lambda: 1) == 1
+    assert flight.stats()["leaders"] == 2
+
+
+@pytest.mark.usefixtures("model_final_answers")
+def test_concurrent_identical_chats_share_one_pipeline(orm_db, monkeypatch):
+    calls = []
+
+    async def slow_generate_async(prompt, generation_config):
+        calls.append(prompt)
+        await asyncio.sleep(0.05)
+        return _counting_generate([])(prompt, generation_config)
+
+    monkeypatch.setattr(chatbot_service, "_generate_async", slow_generate_async)
+
+    async def run_all():
+        questions = ["¿Qué empresas de logística hay?"] + ["que empresas de logistica hay"] * 5
+        return await asyncio.gather(*(chatbot_service.get_chat_response_async(orm_db, q) for q in questions))
+
+    results = asyncio.run(run_all())
+
+    assert len(calls) == 2  # intención + respuesta final, una sola vez para los 6
+    assert all(result == results[0] for result in results)
+    assert len({id(result[1]) for result in results}) == 6
+    stats = chat_cache.get_chat_cache_stats()["inflight"]
+    assert (stats["leaders"], stats["coalesced"]) == (1, 5)
+    assert chat_cache.answer_cache.stats()["hits"] == 0
@@ -1,7 +1,8 @@
 """
 Tests de integración end-to-end del endpoint HTTP /chat: base de datos real
 (sqlite en memoria, con el esquema real de la app) + FastAPI TestClient,
-mockeando únicamente la llamada a Gemini (chatbot_service._generate).
+mockeando únicamente la llamada a Gemini (chatbot_service._generate, en
+el que delega _generate_async durante estos tests).
 
 A diferencia de test_chat_routes.py (que mockea get_chat_response entero y
 solo prueba el "pegamento" de la ruta), acá se ejercita el pipeline real:
@@ -17,6 +18,7 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
 from app import models
+from app.chatbot_db import get_chatbot_db
 from app.config import Base, get_db
 from app.main import app
 from app.services import chatbot_service
@@ -39,6 +41,19 @@ def _intent_json(**overrides):
     return json.dumps(base)
 
 
+@pytest.fixture(autouse=True)
+def async_gemini_uses_sync_mock(monkeypatch):
+    """
+    /chat/ corre la variante async del pipeline (_generate_async). Los tests
+    de este archivo mockean _generate, así que la versión async delega en
+    lo que haya en ese momento en chatbot_service._generate.
+    """
+    async def delegate(prompt, generation_config):
+        return chatbot_service._generate(prompt, generation_config)
+
+    monkeypatch.setattr(chatbot_service, "_generate_async", delegate)
+
+
 @pytest.fixture
 def chat_client():
     engine = create_engine(
@@ -73,6 +88,7 @@ def chat_client():
             db.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_chatbot_db] = override_get_db
 
     original_schema_cache = chatbot_service._schema_cache
     chatbot_service._schema_cache = None
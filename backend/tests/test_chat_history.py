@@ -0,0 +1,117 @@
+"""
+Tests del historial acotado (app/services/chat_history.py): ventana de
+turnos textuales, resumen incremental cacheado, presupuesto de tokens y
+que el pipeline arme el historial una sola vez por pedido.
+"""
+import json
+
+import pytest
+
+from app.services import chat_history, chatbot_service
+
+
+def _turns(count, answer="Hay tres empresas de logística. Son A, B y C."):
+    return [{"user": f"pregunta número {i}", "assistant": answer} for i in range(count)]
+
+
+def test_short_history_is_kept_verbatim():
+    history = _turns(2)
+    context = chat_history.build_history_context(history, token_budget=600, recent_turns=4)
+
+    assert context.text == chat_history.format_turns(history)
+    assert context.turns_verbatim == 2
+    assert context.turns_summarized == 0
+
+
+def test_older_turns_are_folded_into_summary():
+    context = chat_history.build_history_context(_turns(6), token_budget=600, recent_turns=2)
+
+    assert context.text.startswith(chat_history.SUMMARY_HEADER)
+    assert context.turns_verbatim == 2
+    assert context.turns_summarized == 4
+    assert "Usuario: pregunta número 5" in context.text
+    assert "Usuario: pregunta número 0" not in context.text
+    # Del resumen solo queda la primera oración de la respuesta.
+    assert 'se respondió "Hay tres empresas de logística."' in context.text
+
+
+def test_history_respects_token_budget():
+    history = _turns(40, answer="x" * 400)
+    context = chat_history.build_history_context(history, token_budget=300, recent_turns=4)
+
+    assert context.tokens <= 300
+    assert context.turns_verbatim < 4  # turnos largos: ni la ventana textual entra completa
+    assert "pregunta número 39" in context.text
+
+
+def test_single_huge_turn_keeps_its_end():
+    history = [{"user": "inicio " + "y " * 2000 + "final de la pregunta"}]
+    context = chat_history.build_history_context(history, token_budget=50, recent_turns=4)
+
+    assert context.tokens <= 50
+    assert context.text.rstrip().endswith("final de la pregunta")
+
+
+def test_rolling_summary_reuses_previous_turn(monkeypatch):
+    history = _turns(5)
+    chat_history.build_history_context(history, token_budget=600, recent_turns=2)
+    summarized = []
+    original = chat_history.summarize_turn
+
+    def counting_summarize(entry):
+        summarized.append(entry["user"])
+        return original(entry)
+
+    monkeypatch.setattr(chat_history, "summarize_turn", counting_summarize)
+    history.append({"user": "pregunta número 5", "assistant": "ok"})
+    chat_history.build_history_context(history, token_budget=600, recent_turns=2)
+
+    # Solo el turno que salió de la ventana textual se resume de nuevo.
+    assert summarized == ["pregunta número 3"]
+
+
+def test_history_stats_report_budget_and_summaries():
+    chat_history.build_history_context(_turns(1), token_budget=600, recent_turns=4)
+    chat_history.build_history_context(_turns(8), token_budget=600, recent_turns=2)
+
+    stats = chat_history.get_history_stats()
+    assert stats["requests"] == 2
+    assert stats["summarized_requests"] == 1
+    assert stats["turns_summarized"] == 6
+    assert stats["token_budget"] == chat_history.HISTORY_TOKEN_BUDGET
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+@pytest.mark.usefixtures("model_final_answers")
+def test_pipeline_builds_history_once_for_both_prompts(monkeypatch):
+    calls = []
+    original = chat_history.build_history_context
+
+    def counting_build(history, *args, **kwargs):
+        calls.append(history)
+        return original(history, *args, **kwargs)
+
+    prompts = []
+
+    def fake_generate(prompt, generation_config):
+        prompts.append(prompt)
+        if generation_config is chatbot_service.INTENT_GENERATION_CONFIG:
+            return _FakeResponse(json.dumps({"needs_more_info": False, "sql_query": "SELECT 1 AS uno"}))
+        return _FakeResponse("respuesta")
+
+    monkeypatch.setattr(chat_history, "build_history_context", counting_build)
+    monkeypatch.setattr(chatbot_service, "_generate", fake_generate)
+    monkeypatch.setattr(chatbot_service, "get_database_schema", lambda db: "esquema")
+    monkeypatch.setattr(chatbot_service, "execute_sql_query", lambda db, query: [{"uno": 1}])
+
+    history = _turns(10)
+    chatbot_service.get_chat_response(object(), "y cuantas son", history)
+
+    assert len(calls) == 1
+    assert len(prompts) == 2
+    assert all(chat_history.SUMMARY_HEADER in prompt for prompt in prompts)
+    assert all("Usuario: pregunta número 0" not in prompt for prompt in prompts)
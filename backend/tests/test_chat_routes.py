@@ -5,7 +5,7 @@ from fastapi.testclient import TestClient
 
 def test_chat_endpoint_returns_reply(client: TestClient):
     fake_response = ("Hola", [{"empresa": "Logistica"}], "Logistica")
-    with patch("app.routes.chat.get_chat_response", return_value=fake_response):
+    with patch("app.routes.chat.get_chat_response_async", return_value=fake_response):
         response = client.post("/chat/", json={"message": "hola"})
 
     assert response.status_code == 200
@@ -16,7 +16,7 @@ def test_chat_endpoint_returns_reply(client: TestClient):
 
 
 def test_chat_endpoint_handles_errors(client: TestClient):
-    with patch("app.routes.chat.get_chat_response", side_effect=RuntimeError("boom")):
+    with patch("app.routes.chat.get_chat_response_async", side_effect=RuntimeError("boom")):
         response = client.post("/chat/", json={"message": "hola"})
 
     assert response.status_code == 500
@@ -0,0 +1,234 @@
+"""
+Tests del streaming real de la respuesta final: get_chat_response_stream
+(eventos intent/data/text/done), _generate_stream (migración de candidato
+antes del primer fragmento) y el endpoint SSE /api/voice/chat/stream.
+"""
+import json
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text as sa_text
+from sqlalchemy.orm import sessionmaker
+
+from app.services import chat_cache, chatbot_service
+from app.services.common import GENERIC_ERROR_MESSAGE
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+def _intent_json(**overrides):
+    base = {
+        "needs_more_info": False,
+        "sql_query": "",
+        "direct_answer": "",
+        "corrected_entity": "",
+        "question": "",
+    }
+    base.update(overrides)
+    return json.dumps(base)
+
+
+@pytest.fixture(autouse=True)
+def reset_schema_cache():
+    original = chatbot_service._schema_cache
+    chatbot_service._schema_cache = None
+    yield
+    chatbot_service._schema_cache = original
+
+
+@pytest.fixture
+def empresa_db():
+    engine = create_engine("sqlite:///:memory:")
+    SessionLocal = sessionmaker(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(sa_text("CREATE TABLE empresa (cuil INTEGER PRIMARY KEY, nombre TEXT, rubro TEXT)"))
+        conn.execute(
+            sa_text("INSERT INTO empresa (cuil, nombre, rubro) VALUES (1, 'Logistica Express S.A.', 'Logistica')")
+        )
+    db = SessionLocal()
+    yield db
+    db.close()
+
+
+def _sql_intent(prompt, generation_config):
+    return _FakeResponse(_intent_json(sql_query="SELECT nombre, rubro FROM empresa"))
+
+
+# ═══════════════════════════════════════════════════════════════════
+# get_chat_response_stream
+# ═══════════════════════════════════════════════════════════════════
+
+
+@pytest.mark.usefixtures("model_final_answers")
+def test_stream_emits_intent_data_text_and_done_in_order(empresa_db, monkeypatch):
+    monkeypatch.setattr(chatbot_service, "_generate", _sql_intent)
+    monkeypatch.setattr(
+        chatbot_service,
+        "_generate_stream",
+        lambda prompt, generation_config: iter(["En el parque ", "está **Logistica** ", "Express S.A."]),
+    )
+
+    events = list(chatbot_service.get_chat_response_stream(empresa_db, "que empresas hay"))
+    names = [name for name, _ in events]
+
+    assert names == ["intent", "data", "text", "text", "text", "done"]
+    assert events[1][1]["rows"] == [{"nombre": "Logistica Express S.A.", "rubro": "Logistica"}]
+    deltas = "".join(payload["delta"] for name, payload in events if name == "text")
+    assert deltas == "En el parque está Logistica Express S.A."
+    done = events[-1][1]
+    assert done["text"] == "En el parque está Logistica Express S.A."
+    assert 0 <= done["ttft_ms"] <= done["total_ms"]
+
+
+@pytest.mark.usefixtures("model_final_answers")
+def test_stream_caches_completed_answer(empresa_db, monkeypatch):
+    monkeypatch.setattr(chatbot_service, "_generate", _sql_intent)
+    monkeypatch.setattr(
+        chatbot_service, "_generate_stream", lambda prompt, generation_config: iter(["Hola ", "mundo"])
+    )
+    list(chatbot_service.get_chat_response_stream(empresa_db, "que empresas hay"))
+
+    text_reply, data, _ = chatbot_service.get_chat_response(empresa_db, "que empresas hay")
+    assert text_reply == "Hola mundo"
+    assert chat_cache.answer_cache.stats()["hits"] == 1
+
+
+def test_stream_direct_answer_is_sent_as_single_chunk(empresa_db, monkeypatch):
+    monkeypatch.setattr(
+        chatbot_service,
+        "_generate",
+        lambda prompt, generation_config: _FakeResponse(_intent_json(direct_answer="¡Hola! Soy POLO.")),
+    )
+    monkeypatch.setattr(
+        chatbot_service,
+        "_generate_stream",
+        lambda prompt, generation_config: pytest.fail("un saludo no necesita la etapa final"),
+    )
+
+    events = list(chatbot_service.get_chat_response_stream(empresa_db, "hola"))
+    assert [name for name, _ in events] == ["intent", "data", "text", "done"]
+    assert events[-1][1]["text"] == "¡Hola! Soy POLO."
+
+
+@pytest.mark.usefixtures("model_final_answers")
+def test_stream_falls_back_to_local_composition_when_nothing_streamed(empresa_db, monkeypatch):
+    def failing_stream(prompt, generation_config):
+        raise RuntimeError("Gemini caído")
+        yield  # pragma: no cover
+
+    monkeypatch.setattr(chatbot_service, "_generate", _sql_intent)
+    monkeypatch.setattr(chatbot_service, "_generate_stream", failing_stream)
+
+    events = list(chatbot_service.get_chat_response_stream(empresa_db, "que empresas hay"))
+    assert "Logistica Express" in events[-1][1]["text"]
+    assert len(chat_cache.answer_cache) == 0
+
+
+@pytest.mark.usefixtures("model_final_answers")
+def test_stream_keeps_partial_text_when_generation_breaks_midway(empresa_db, monkeypatch):
+    def breaking_stream(prompt, generation_config):
+        yield "Hay una empresa"
+        raise RuntimeError("se cortó la conexión")
+
+    monkeypatch.setattr(chatbot_service, "_generate", _sql_intent)
+    monkeypatch.setattr(chatbot_service, "_generate_stream", breaking_stream)
+
+    events = list(chatbot_service.get_chat_response_stream(empresa_db, "que empresas hay"))
+    assert events[-1][0] == "done"
+    assert events[-1][1]["text"] == "Hay una empresa"
+    assert len(chat_cache.answer_cache) == 0  # una respuesta a medias no se cachea
+
+
+def test_stream_reports_generic_error_when_preparation_fails(empresa_db, monkeypatch):
+    def raising_schema(db, force_refresh=False):
+        raise RuntimeError("la base no responde")
+
+    monkeypatch.setattr(chatbot_service, "get_database_schema", raising_schema)
+
+    events = list(chatbot_service.get_chat_response_stream(empresa_db, "que empresas hay"))
+    assert events[-1][1]["text"] == GENERIC_ERROR_MESSAGE
+
+
+# ═══════════════════════════════════════════════════════════════════
+# _generate_stream
+# ═══════════════════════════════════════════════════════════════════
+
+
+class _StreamingModel:
+    def __init__(self, name, fail_before_first_chunk=False):
+        self.name = name
+        self.fail = fail_before_first_chunk
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        assert stream is True
+        if self.fail:
+            raise RuntimeError("404 no longer available")
+        return iter([_FakeResponse("uno "), _FakeResponse("dos")])
+
+
+def test_generate_stream_migrates_candidate_before_first_chunk(monkeypatch):
+    monkeypatch.setattr(chatbot_service, "_active_model_index", 0)
+    monkeypatch.setattr(chatbot_service, "_MODEL_CANDIDATES", ["roto", "bueno"])
+    monkeypatch.setattr(
+        chatbot_service,
+        "_get_model_instance",
+        lambda name: _StreamingModel(name, fail_before_first_chunk=(name == "roto")),
+    )
+
+    fragments = list(chatbot_service._generate_stream("prompt", chatbot_service.FINAL_GENERATION_CONFIG))
+
+    assert fragments == ["uno ", "dos"]
+    assert chatbot_service._active_model_index == 1
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Endpoint SSE
+# ═══════════════════════════════════════════════════════════════════
+
+
+def _parse_sse(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_voice_chat_stream_endpoint_sends_server_sent_events(client: TestClient):
+    fake_events = iter(
+        [
+            ("intent", {"corrected_entity": None, "source": "model"}),
+            ("data", {"rows": []}),
+            ("text", {"delta": "Hola"}),
+            ("done", {"text": "Hola", "ttft_ms": 1.0, "total_ms": 2.0}),
+        ]
+    )
+    with patch("app.routes.voice.services.get_chat_response_stream", return_value=fake_events):
+        response = client.post("/api/voice/chat/stream", json={"text": "hola"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _parse_sse(response.text)
+    assert [name for name, _ in events] == ["intent", "data", "text", "done"]
+    assert events[-1][1]["ttft_ms"] == 1.0
+
+
+def test_voice_chat_stream_endpoint_emits_error_event(client: TestClient):
+    def broken_stream(**kwargs):
+        yield "intent", {"corrected_entity": None, "source": "model"}
+        raise RuntimeError("boom")
+
+    with patch("app.routes.voice.services.get_chat_response_stream", side_effect=broken_stream):
+        response = client.post("/api/voice/chat/stream", json={"text": "hola"})
+
+    events = _parse_sse(response.text)
+    assert events[-1] == ("error", {"message": GENERIC_ERROR_MESSAGE})
+
+
+def test_voice_chat_stream_requires_text(client: TestClient):
+    response = client.post("/api/voice/chat/stream", json={"text": "  "})
+    assert response.status_code == 400
@@ -0,0 +1,162 @@
+"""
+Tests del pool de solo lectura del chatbot (app/chatbot_db.py): que no
+permita escribir, que mida la espera de checkout y los timeouts, que las
+métricas lleguen a /health y que el pipeline devuelva la conexión al pool
+mientras espera a Gemini.
+"""
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import create_engine, exc as sa_exc, text as sa_text
+from sqlalchemy.orm import sessionmaker
+
+from app import chatbot_db
+from app.services import chatbot_service
+
+
+@pytest.fixture
+def sqlite_file_url(tmp_path):
+    url = f"sqlite:///{tmp_path / 'polo.db'}"
+    writer = create_engine(url)
+    with writer.begin() as conn:
+        conn.execute(sa_text("CREATE TABLE empresa (cuil INTEGER PRIMARY KEY, nombre TEXT)"))
+        conn.execute(sa_text("INSERT INTO empresa VALUES (1, 'Logistica Express')"))
+    writer.dispose()
+    return url
+
+
+@pytest.fixture
+def small_pool(monkeypatch, sqlite_file_url):
+    monkeypatch.setattr(chatbot_db, "CHATBOT_DB_POOL_SIZE", 1)
+    monkeypatch.setattr(chatbot_db, "CHATBOT_DB_MAX_OVERFLOW", 0)
+    monkeypatch.setattr(chatbot_db, "CHATBOT_DB_POOL_TIMEOUT", 0.05)
+    engine = chatbot_db._make_chatbot_engine(sqlite_file_url)
+    monkeypatch.setattr(chatbot_db, "chatbot_engine", engine)
+    yield engine
+    engine.dispose()
+
+
+def test_chatbot_sessions_are_read_only(small_pool):
+    db = sessionmaker(bind=small_pool)()
+    try:
+        assert db.execute(sa_text("SELECT nombre FROM empresa")).scalar() == "Logistica Express"
+        with pytest.raises(sa_exc.OperationalError):
+            db.execute(sa_text("DELETE FROM empresa"))
+    finally:
+        db.close()
+
+
+def test_pool_stats_track_checkouts_and_utilization(small_pool):
+    with small_pool.connect() as conn:
+        conn.execute(sa_text("SELECT 1"))
+        stats = chatbot_db.get_chatbot_pool_stats()
+        assert stats["checked_out"] == 1
+        assert stats["utilization"] == 1.0
+
+    stats = chatbot_db.get_chatbot_pool_stats()
+    assert stats["checkouts"] == 1
+    assert stats["checked_out"] == 0
+    assert stats["checked_out_peak"] == 1
+    assert stats["pool_size"] == 1
+
+
+def test_exhausted_pool_times_out_and_is_counted(small_pool):
+    with small_pool.connect():
+        with pytest.raises(sa_exc.TimeoutError):
+            small_pool.connect()
+
+    stats = chatbot_db.get_chatbot_pool_stats()
+    assert stats["timeouts"] == 1
+    assert stats["wait_ms_max"] >= 40
+
+
+def test_health_reports_chatbot_pool(client, small_pool):
+    with small_pool.connect():
+        pass
+
+    body = client.get("/health").json()
+
+    assert body["chatbot_db_pool"]["checkouts"] == 1
+    assert body["chatbot_db_pool"]["max_overflow"] == 0
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Conexión liberada entre etapas del pipeline
+# ═══════════════════════════════════════════════════════════════════
+
+CONCURRENT_CHATS = 8
+SLOW_GEMINI_SECONDS = 0.2
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+def _slow_gemini_reply(prompt, generation_config):
+    if generation_config is chatbot_service.INTENT_GENERATION_CONFIG:
+        return _FakeResponse(json.dumps({"needs_more_info": False, "sql_query": "SELECT nombre FROM empresa"}))
+    return _FakeResponse("Está Logistica Express.")
+
+
+@pytest.fixture
+def slow_gemini(monkeypatch):
+    monkeypatch.setattr(chatbot_service, "get_database_schema", lambda db: "empresa(cuil*, nombre)")
+
+    def slow_generate(prompt, generation_config):
+        time.sleep(SLOW_GEMINI_SECONDS)
+        return _slow_gemini_reply(prompt, generation_config)
+
+    async def slow_generate_async(prompt, generation_config):
+        await asyncio.sleep(SLOW_GEMINI_SECONDS)
+        return _slow_gemini_reply(prompt, generation_config)
+
+    monkeypatch.setattr(chatbot_service, "_generate", slow_generate)
+    monkeypatch.setattr(chatbot_service, "_generate_async", slow_generate_async)
+
+
+def _assert_pool_stayed_flat(results):
+    assert all(data == [{"nombre": "Logistica Express"}] for _, data, _ in results)
+    stats = chatbot_db.get_chatbot_pool_stats()
+    # Una sola conexión alcanza para todos los chats concurrentes: cada uno
+    # la toma unos milisegundos para su SQL y la devuelve antes de volver a
+    # esperar a Gemini. Si se retuviera, el resto vencería el pool_timeout.
+    assert stats["timeouts"] == 0
+    assert stats["checkouts"] == CONCURRENT_CHATS
+    assert stats["checked_out_peak"] == 1
+    assert stats["checked_out"] == 0
+
+
+def test_async_pipeline_returns_connection_while_waiting_on_gemini(small_pool, slow_gemini):
+    SessionLocal = sessionmaker(bind=small_pool)
+
+    async def one_chat(i):
+        db = SessionLocal()
+        try:
+            return await chatbot_service.get_chat_response_async(db, f"empresa número {i}")
+        finally:
+            db.close()
+
+    async def run_all():
+        return await asyncio.gather(*(one_chat(i) for i in range(CONCURRENT_CHATS)))
+
+    _assert_pool_stayed_flat(asyncio.run(run_all()))
+
+
+def test_sync_pipeline_returns_connection_while_waiting_on_gemini(small_pool, slow_gemini):
+    SessionLocal = sessionmaker(bind=small_pool)
+
+    def one_chat(i):
+        db = SessionLocal()
+        try:
+            return chatbot_service.get_chat_response(db, f"empresa número {i}")
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=CONCURRENT_CHATS) as executor:
+        results = list(executor.map(one_chat, range(CONCURRENT_CHATS)))
+
+    _assert_pool_stayed_flat(results)
@@ -261,6 +261,7 @@ def test_final_stage_exception_falls_back_to_local_composition(empresa_db, monke
     assert data
 
 
+@pytest.mark.usefixtures("model_final_answers")
 def test_final_answer_from_gemini_is_trusted_even_if_it_sounds_negative(empresa_db, monkeypatch):
     """
     Ya no hay código que reescriba lo que Gemini responde por pattern-matching
@@ -282,6 +283,7 @@ def test_final_answer_from_gemini_is_trusted_even_if_it_sounds_negative(empresa_
     assert data  # los datos igual viajan en la respuesta, aunque el texto no los mencione
 
 
+@pytest.mark.usefixtures("model_final_answers")
 def test_final_prompt_leaves_tone_and_format_to_the_model(empresa_db, monkeypatch):
     """
     El prompt final solo fija las reglas de seguridad/alcance (no datos
@@ -302,3 +304,108 @@ def test_final_prompt_leaves_tone_and_format_to_the_model(empresa_db, monkeypatc
     final_prompt = captured_prompts[1]
     assert "usá tu propio criterio" in final_prompt.lower()
     assert "CUIL" in final_prompt  # la única regla dura que se mantiene: nunca exponer datos sensibles
+
+
+def test_async_pipeline_matches_sync_pipeline(monkeypatch):
+    """get_chat_response_async comparte las etapas de get_chat_response: solo cambia el I/O."""
+    import asyncio
+
+    from sqlalchemy.pool import StaticPool
+
+    # La variante async corre el SQL en el threadpool: la conexión sqlite
+    # tiene que poder usarse desde otro hilo.
+    engine = create_engine(
+        "sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    with engine.begin() as conn:
+        conn.execute(sa_text("CREATE TABLE empresa (cuil INTEGER PRIMARY KEY, nombre TEXT, rubro TEXT)"))
+        conn.execute(
+            sa_text("INSERT INTO empresa (cuil, nombre, rubro) VALUES (1, 'Logistica Express S.A.', 'Logistica')")
+        )
+    db = sessionmaker(bind=engine)()
+
+    def fake_generate(prompt, generation_config):
+        if generation_config is chatbot_service.INTENT_GENERATION_CONFIG:
+            return _FakeResponse(_intent_json(sql_query="SELECT nombre, rubro FROM empresa"))
+        return _FakeResponse("Está Logistica Express S.A.")
+
+    async def fake_generate_async(prompt, generation_config):
+        return fake_generate(prompt, generation_config)
+
+    monkeypatch.setattr(chatbot_service, "_generate", fake_generate)
+    monkeypatch.setattr(chatbot_service, "_generate_async", fake_generate_async)
+
+    sync_result = chatbot_service.get_chat_response(db, "que empresas de logistica hay")
+    chatbot_service.chat_cache.reset_chat_caches()
+    async_result = asyncio.run(chatbot_service.get_chat_response_async(db, "que empresas de logistica hay"))
+    db.close()
+
+    assert async_result == sync_result
+    assert "Logistica Express" in async_result[0]
+
+
+def test_templates_on_by_default_answer_simple_lists_without_the_final_call(monkeypatch):
+    """Como en producción (CHAT_TEMPLATE_ANSWERS sin definir): sync y async, una sola llamada a Gemini."""
+    import asyncio
+
+    from sqlalchemy.pool import StaticPool
+
+    from app.services import answer_renderer
+
+    assert answer_renderer.TEMPLATE_ANSWERS_ENABLED
+    engine = create_engine(
+        "sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    with engine.begin() as conn:
+        conn.execute(sa_text("CREATE TABLE empresa (cuil INTEGER PRIMARY KEY, nombre TEXT, rubro TEXT)"))
+        conn.execute(sa_text("INSERT INTO empresa VALUES (1, 'Logistica Express S.A.', 'Logistica')"))
+        conn.execute(sa_text("INSERT INTO empresa VALUES (2, 'Transportes Sur', 'Logistica')"))
+    db = sessionmaker(bind=engine)()
+    calls = []
+
+    def fake_generate(prompt, generation_config):
+        calls.append(generation_config)
+        if generation_config is chatbot_service.INTENT_GENERATION_CONFIG:
+            return _FakeResponse(_intent_json(sql_query="SELECT nombre FROM empresa WHERE rubro LIKE '%logistica%'"))
+        return _FakeResponse("No debería llegar acá.")
+
+    async def fake_generate_async(prompt, generation_config):
+        return fake_generate(prompt, generation_config)
+
+    monkeypatch.setattr(chatbot_service, "_generate", fake_generate)
+    monkeypatch.setattr(chatbot_service, "_generate_async", fake_generate_async)
+
+    sync_result = chatbot_service.get_chat_response(db, "que empresas de logistica hay")
+    chatbot_service.chat_cache.reset_chat_caches()
+    async_result = asyncio.run(chatbot_service.get_chat_response_async(db, "que empresas de logistica hay"))
+    db.close()
+
+    assert sync_result[0] == "Encontré 2 empresas:\n- Logistica Express S.A.\n- Transportes Sur"
+    assert async_result == sync_result
+    assert calls == [chatbot_service.INTENT_GENERATION_CONFIG] * 2
+    assert answer_renderer.get_renderer_stats()["by_shape"] == {"name_list": 2}
+
+
+def test_async_voice_pipeline_transcribes_answers_and_synthesizes(empresa_db, monkeypatch):
+    import asyncio
+    import base64
+
+    async def fake_transcribe(audio_content, language_code="es-AR"):
+        return "hola"
+
+    async def fake_tts(text_value, voice_provider=None):
+        return b"mp3"
+
+    async def fake_generate_async(prompt, generation_config):
+        return _FakeResponse(_intent_json(direct_answer="¡Hola! Soy POLO."))
+
+    monkeypatch.setattr(chatbot_service, "transcribe_audio_async", fake_transcribe)
+    monkeypatch.setattr(chatbot_service, "text_to_speech_async", fake_tts)
+    monkeypatch.setattr(chatbot_service, "_generate_async", fake_generate_async)
+
+    result = asyncio.run(chatbot_service.get_chat_response_with_audio_async(empresa_db, audio_content=b"webm"))
+
+    assert result["transcript"] == "hola"
+    assert result["text"] == "¡Hola! Soy POLO."
+    assert base64.b64decode(result["audio_base64"]) == b"mp3"
+    assert result["error"] is False
@@ -6,9 +6,12 @@ DB), lo que colgaba el único event loop del proceso durante todo el
 tiempo de esa llamada -- cualquier otra request (incluso a endpoints
 livianos) quedaba esperando.
 
-Estos tests miden tiempo real: si alguien vuelve a llamar a una función
-bloqueante sin `run_in_threadpool`, el tiempo total vuelve a ser ~N veces
-el de una sola llamada en vez de solaparse, y el test falla.
+Hoy esos endpoints usan las variantes async del pipeline
+(get_chat_response_async, transcribe_audio_async, ...). Estos tests miden
+tiempo real: si alguien vuelve a llamar a una función bloqueante desde la
+ruta, el tiempo total vuelve a ser ~N veces el de una sola llamada en vez
+de solaparse, y el test falla. El último test cubre además el motivo del
+cambio: el chat ya no ocupa hilos del threadpool mientras espera a Gemini.
 """
 import asyncio
 import time
@@ -55,11 +58,11 @@ async def _fire_concurrent_requests(path: str, json_body: dict, count: int = CON
 
 
 def test_chat_endpoint_does_not_block_the_event_loop():
-    def slow_get_chat_response(db, message, history=None):
-        time.sleep(SIMULATED_BLOCKING_SECONDS)
+    async def slow_get_chat_response(db, message, history=None):
+        await asyncio.sleep(SIMULATED_BLOCKING_SECONDS)
         return ("ok", [], None)
 
-    with patch("app.routes.chat.get_chat_response", side_effect=slow_get_chat_response):
+    with patch("app.routes.chat.get_chat_response_async", side_effect=slow_get_chat_response):
         elapsed = asyncio.run(_fire_concurrent_requests("/chat/", {"message": "hola"}))
 
     assert elapsed < SERIALIZED_THRESHOLD, (
@@ -71,11 +74,11 @@ def test_chat_endpoint_does_not_block_the_event_loop():
 def test_voice_transcribe_does_not_block_the_event_loop():
     app.dependency_overrides[get_current_user] = lambda: _DummyPublicUser()
 
-    def slow_transcribe(audio_bytes, language):
-        time.sleep(SIMULATED_BLOCKING_SECONDS)
+    async def slow_transcribe(audio_bytes, language):
+        await asyncio.sleep(SIMULATED_BLOCKING_SECONDS)
         return "transcripcion simulada"
 
-    with patch("app.routes.voice.services.transcribe_audio", side_effect=slow_transcribe):
+    with patch("app.routes.voice.services.transcribe_audio_async", side_effect=slow_transcribe):
 
         async def _run():
             transport = httpx.ASGITransport(app=app)
@@ -98,3 +101,58 @@ def test_voice_transcribe_does_not_block_the_event_loop():
         f"{CONCURRENT_REQUESTS} requests a /api/voice/transcribe tardaron {elapsed:.2f}s: "
         "parecen estar serializándose en vez de solaparse."
     )
+
+
+@pytest.mark.usefixtures("model_final_answers")
+def test_async_chat_pipeline_does_not_hold_threadpool_while_waiting_on_gemini(tmp_path, monkeypatch):
+    """
+    Con el threadpool reducido a 2 hilos, 20 chats concurrentes cuya
+    llamada a Gemini tarda 0.2s deben solaparse: Gemini se espera como
+    corrutina y solo el SQL pasa (brevemente) por el threadpool. Si Gemini
+    volviera a correr en hilos, tardarían ~20 * 0.2 / 2 = 2s.
+    """
+    from anyio import to_thread
+    from sqlalchemy import create_engine, text as sa_text
+    from sqlalchemy.orm import sessionmaker
+
+    from app.services import chatbot_service
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'chat.db'}", connect_args={"check_same_thread": False})
+    with engine.begin() as conn:
+        conn.execute(sa_text("CREATE TABLE empresa (cuil INTEGER PRIMARY KEY, nombre TEXT, rubro TEXT)"))
+        conn.execute(sa_text("INSERT INTO empresa VALUES (1, 'Logistica Express S.A.', 'Logistica')"))
+    SessionLocal = sessionmaker(bind=engine)
+
+    class _Resp:
+        def __init__(self, text):
+            self.text = text
+
+    async def slow_generate_async(prompt, generation_config):
+        await asyncio.sleep(0.2)
+        if generation_config is chatbot_service.INTENT_GENERATION_CONFIG:
+            return _Resp('{"needs_more_info": false, "sql_query": "SELECT nombre FROM empresa"}')
+        return _Resp("Está Logistica Express S.A.")
+
+    monkeypatch.setattr(chatbot_service, "_generate_async", slow_generate_async)
+    monkeypatch.setattr(chatbot_service, "_schema_cache", None)
+
+    async def _run():
+        to_thread.current_default_thread_limiter().total_tokens = 2
+
+        async def one_chat(i):
+            db = SessionLocal()
+            try:
+                # Preguntas distintas: ningún cache puede acortar el camino.
+                return await chatbot_service.get_chat_response_async(db, f"empresas {i}")
+            finally:
+                db.close()
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[one_chat(i) for i in range(20)])
+        return time.perf_counter() - start, results
+
+    elapsed, results = asyncio.run(_run())
+    engine.dispose()
+
+    assert all(text == "Está Logistica Express S.A." for text, _, _ in results)
+    assert elapsed < 1.5, f"20 chats async tardaron {elapsed:.2f}s con 2 hilos: Gemini parece ocupar el threadpool"
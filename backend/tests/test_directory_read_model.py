@@ -0,0 +1,197 @@
+"""
+Tests del directorio desnormalizado del chatbot
+(app/services/directory_read_model.py): armado de la fila por empresa,
+mantenimiento en cada commit, reconstrucción completa y su lugar como
+fuente preferida en el esquema que ve Gemini.
+"""
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine, text as sa_text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import models
+from app.config import Base
+from app.services import chatbot_service, directory_read_model, schema_context
+
+
+@pytest.fixture
+def db():
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([
+        models.TipoContacto(id_tipo_contacto=1, tipo="comercial"),
+        models.TipoContacto(id_tipo_contacto=2, tipo="empresarial"),
+        models.TipoServicioPolo(id_tipo_servicio_polo=2, tipo="nave"),
+    ])
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _empresa(cuil=1, nombre="Logistica Express S.A."):
+    return models.Empresa(
+        cuil=cuil,
+        nombre=nombre,
+        rubro="Logistica",
+        cant_empleados=30,
+        observaciones="",
+        fecha_ingreso=date(2020, 1, 1),
+        horario_trabajo="8 a 18hs",
+        estado=True,
+    )
+
+
+def _directorio(db, cuil=1):
+    return db.execute(
+        sa_text("SELECT * FROM directorio_empresa WHERE cuil = :c"), {"c": cuil}
+    ).mappings().first()
+
+
+@pytest.fixture
+def empresa_completa(db):
+    db.add(_empresa())
+    db.add_all([
+        models.Contacto(
+            nombre="Recepción", telefono="111", cuil_empresa=1, id_tipo_contacto=2,
+        ),
+        models.Contacto(
+            nombre="Ventas", telefono="4800-1234", direccion="Calle 5 N° 100", cuil_empresa=1,
+            id_tipo_contacto=1, datos={"web": "logex.com.ar", "instagram": "@logex", "fax": ""},
+        ),
+        models.ServicioPolo(id_servicio_polo=10, nombre="Nave Norte", id_tipo_servicio_polo=2, cuil=1),
+        models.InfoComercial(cuil=1, productos_servicios="Fletes y depósito", rango_precios="Medio"),
+    ])
+    db.flush()
+    db.add(models.Lote(id_servicio_polo=10, dueno="Logistica Express", lote=12, manzana=3))
+    db.commit()
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Mantenimiento en cada commit
+# ═══════════════════════════════════════════════════════════════════
+
+
+def test_commit_builds_flattened_row(db, empresa_completa):
+    row = _directorio(db)
+
+    assert row["nombre"] == "Logistica Express S.A."
+    assert row["contacto_nombre"] == "Ventas"  # el comercial, no el primero cargado
+    assert row["contacto_telefono"] == "4800-1234"
+    assert row["contacto_datos"] == "web: logex.com.ar; instagram: @logex"
+    assert row["servicios_polo"] == "Nave Norte (nave)"
+    assert row["lotes"] == "manzana 3 lote 12"
+    assert (row["manzana"], row["lote"]) == (3, 12)
+    assert row["productos_servicios"] == "Fletes y depósito"
+    assert row["rango_precios"] == "Medio"
+
+
+def test_changes_in_source_tables_refresh_the_row(db, empresa_completa):
+    contacto = db.query(models.Contacto).filter_by(nombre="Ventas").one()
+    contacto.telefono = "4800-9999"
+    db.commit()
+    assert _directorio(db)["contacto_telefono"] == "4800-9999"
+
+    # Un lote llega a la empresa a través de servicio_polo.
+    db.add(models.Lote(id_servicio_polo=10, dueno="Logistica Express", lote=13, manzana=3))
+    db.commit()
+    assert _directorio(db)["lotes"] == "manzana 3 lote 12; manzana 3 lote 13"
+
+    info = db.get(models.InfoComercial, 1)
+    info.rango_precios = "Premium"
+    db.commit()
+    assert _directorio(db)["rango_precios"] == "Premium"
+
+
+def test_only_touched_companies_are_rewritten(db, empresa_completa, monkeypatch):
+    db.add(_empresa(cuil=2, nombre="Metalúrgica Sur"))
+    db.commit()
+
+    refreshed = []
+    original = directory_read_model.refresh_directory_rows
+    monkeypatch.setattr(
+        directory_read_model,
+        "refresh_directory_rows",
+        lambda session, cuils=None: refreshed.append(cuils) or original(session, cuils),
+    )
+    db.get(models.Empresa, 2).rubro = "Metalurgia"
+    db.commit()
+
+    assert refreshed == [{2}]
+    assert _directorio(db, 2)["rubro"] == "Metalurgia"
+
+
+def test_deleting_a_company_removes_its_row(db, empresa_completa):
+    db.add(_empresa(cuil=2, nombre="Metalúrgica Sur"))
+    db.commit()
+
+    db.delete(db.get(models.Empresa, 2))
+    db.commit()
+
+    assert _directorio(db, 2) is None
+    assert _directorio(db, 1) is not None
+
+
+def test_rollback_discards_pending_refresh(db, empresa_completa):
+    db.get(models.Empresa, 1).nombre = "Otro nombre"
+    db.flush()
+    db.rollback()
+    db.commit()
+
+    assert _directorio(db)["nombre"] == "Logistica Express S.A."
+
+
+def test_full_rebuild_catches_changes_made_outside_the_orm(db, empresa_completa):
+    db.execute(sa_text("UPDATE empresa SET rubro = 'Transporte' WHERE cuil = 1"))
+    db.execute(sa_text("DELETE FROM directorio_empresa"))
+    db.commit()
+
+    assert directory_read_model.refresh_directory_read_model(db) == 1
+    assert _directorio(db)["rubro"] == "Transporte"
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Fuente preferida del chatbot
+# ═══════════════════════════════════════════════════════════════════
+
+
+@pytest.fixture
+def fresh_schema_cache():
+    original = (chatbot_service._schema_cache, chatbot_service._schema_catalog)
+    chatbot_service._schema_cache = None
+    chatbot_service._schema_catalog = None
+    yield
+    chatbot_service._schema_cache, chatbot_service._schema_catalog = original
+
+
+def test_schema_lists_directory_first_as_preferred(db, fresh_schema_cache):
+    full = chatbot_service.get_database_schema(db)
+    text_value = chatbot_service.build_schema_context(
+        full, chatbot_service.normalize_text("¿Cuál es el teléfono de Logistica Express?")
+    )
+
+    table_lines = [line for line in text_value.splitlines() if line.startswith("- ")]
+    assert table_lines[0].startswith(f"- {schema_context.PREFERRED_TABLE}(")
+    assert "PREFERIDA" in table_lines[0]
+    assert "directorio_empresa" in chatbot_service._build_intent_prompt(text_value, "", "x")
+
+
+def test_single_table_query_answers_a_typical_question(db, empresa_completa):
+    query = (
+        "SELECT nombre, contacto_telefono, lotes FROM directorio_empresa "
+        "WHERE nombre LIKE '%express%'"
+    )
+    assert chatbot_service.validate_sql_query(query).tables == {"directorio_empresa"}
+
+    rows = chatbot_service.execute_sql_query(db, query)
+
+    assert rows == [
+        {"nombre": "Logistica Express S.A.", "contacto_telefono": "4800-1234", "lotes": "manzana 3 lote 12"}
+    ]
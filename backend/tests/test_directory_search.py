@@ -0,0 +1,212 @@
+"""
+Tests de la búsqueda full-text del directorio (app/services/directory_search.py):
+normalización en español, ranking, mantenimiento en cada commit, uso desde
+el chatbot (search_query) y desde GET /search?q=, y latencia sobre 10k
+empresas.
+"""
+import json
+import time
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import models
+from app.config import Base, get_db
+from app.main import app
+from app.services import chatbot_service, directory_search
+
+
+def _doc(cuil, nombre, productos="", rubro="Industria", observaciones="", activa=True, **extra):
+    doc = {
+        "cuil": cuil,
+        "nombre": nombre,
+        "rubro": rubro,
+        "productos_servicios": productos,
+        "observaciones": observaciones,
+        "estado": activa,
+        "estado_solicitud": "aprobada",
+    }
+    doc.update(extra)
+    return doc
+
+
+@pytest.mark.parametrize(
+    "text_value, expected",
+    [
+        ("Tornillos y BULONES", ["tornill", "bulon"]),
+        ("tornillo", ["tornill"]),
+        ("Electrónica del Sur", ["electronic", "sur"]),
+        ("Motores eléctricos", ["motor", "electric"]),
+    ],
+)
+def test_analyze_folds_accents_and_plurals(text_value, expected):
+    assert directory_search.analyze(text_value) == expected
+
+
+def test_query_noise_is_ignored():
+    assert directory_search.analyze_query("¿Quién vende tornillos en el parque?") == ["tornill"]
+
+
+@pytest.fixture
+def index():
+    idx = directory_search.InvertedIndex()
+    idx.replace_all([
+        _doc(1, "Bulonera Central", productos="Tornillos, bulones y tuercas"),
+        _doc(2, "Metalúrgica Sur", productos="Estructuras metálicas", observaciones="También algunos tornillos"),
+        _doc(3, "Tornillería Industrial", productos="Fijaciones"),
+        _doc(4, "Pinturas Norte", productos="Pinturas y tornillos", activa=False),
+        _doc(5, "Imprenta Rápida", productos="Impresiones", marcas_representadas="Epson"),
+    ])
+    return idx
+
+
+def test_ranking_prefers_stronger_fields(index):
+    ranked = [cuil for cuil, _ in index.search("tornillos")]
+    # En productos o en el nombre (tornilleria, por prefijo) pesa más que
+    # una mención en observaciones.
+    assert set(ranked[:2]) == {1, 3}
+    assert ranked[2] == 2
+
+
+def test_inactive_companies_are_filtered_unless_asked(index):
+    assert 4 not in [cuil for cuil, _ in index.search("tornillo")]
+    assert 4 in [cuil for cuil, _ in index.search("tornillo", only_active=False)]
+
+
+def test_accents_and_brands(index):
+    assert [cuil for cuil, _ in index.search("imprenta rapida")] == [5]
+    assert [cuil for cuil, _ in index.search("epson")] == [5]
+    assert index.search("zapatos") == []
+
+
+def test_update_replaces_and_removes_documents(index):
+    index.update({1, 3}, [_doc(1, "Bulonera Central", productos="Solo tuercas")])
+    ranked = [cuil for cuil, _ in index.search("tornillos")]
+    assert ranked == [2]
+    assert [cuil for cuil, _ in index.search("tuercas")] == [1]
+
+
+def test_search_is_fast_on_ten_thousand_companies():
+    words = ["tornillos", "pinturas", "motores", "cables", "maderas", "plasticos", "vidrios", "harinas"]
+    idx = directory_search.InvertedIndex()
+    idx.replace_all(
+        _doc(
+            i,
+            f"Empresa {i}",
+            productos=f"{words[i % 8]} {words[(i * 3) % 8]} y servicio {i % 97}",
+            observaciones=f"lote {i % 300} marca{i % 50}",
+        )
+        for i in range(10_000)
+    )
+
+    best = min(
+        _elapsed_ms(lambda: idx.search("tornillos pinturas", limit=10)) for _ in range(5)
+    )
+    assert best < 10, f"{best:.2f} ms"
+
+
+def _elapsed_ms(func):
+    started = time.perf_counter()
+    func()
+    return (time.perf_counter() - started) * 1000
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Con la base: mantenimiento en cada commit, chatbot y /search
+# ═══════════════════════════════════════════════════════════════════
+
+
+@pytest.fixture
+def db():
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(bind=engine)
+    session = SessionLocal()
+    for cuil, nombre, productos in [
+        (1, "Bulonera Central", "Tornillos, bulones y tuercas"),
+        (2, "Pinturas Norte", "Pinturas industriales"),
+    ]:
+        session.add(
+            models.Empresa(
+                cuil=cuil, nombre=nombre, rubro="Industria", cant_empleados=10, observaciones="",
+                fecha_ingreso=date(2020, 1, 1), horario_trabajo="8 a 17", estado=True,
+            )
+        )
+        session.add(models.InfoComercial(cuil=cuil, productos_servicios=productos))
+    session.commit()
+    session.SessionLocal = SessionLocal
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _cuils(db, query):
+    return [cuil for cuil, _ in directory_search.search_companies(db, query)]
+
+
+def test_index_is_built_lazily_and_follows_commits(db):
+    assert _cuils(db, "tornillos") == [1]
+
+    db.get(models.InfoComercial, 2).productos_servicios = "Pinturas y tornillos"
+    db.commit()
+    assert set(_cuils(db, "tornillos")) == {1, 2}
+
+    db.get(models.InfoComercial, 1).productos_servicios = "Tuercas"
+    db.flush()
+    db.rollback()
+    assert set(_cuils(db, "tornillos")) == {1, 2}
+
+    db.delete(db.get(models.Empresa, 1))
+    db.commit()
+    assert _cuils(db, "tornillos") == [2]
+    assert directory_search.get_search_stats()["rebuilds"] == 1
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+def test_chatbot_search_query_returns_ranked_directory_rows(db, monkeypatch):
+    monkeypatch.setattr(chatbot_service, "get_database_schema", lambda session: "esquema")
+    prompts = []
+
+    def fake_generate(prompt, generation_config):
+        prompts.append(prompt)
+        if generation_config is chatbot_service.INTENT_GENERATION_CONFIG:
+            return _FakeResponse(json.dumps({"needs_more_info": False, "sql_query": "", "search_query": "tornillos"}))
+        return _FakeResponse("Bulonera Central vende tornillos.")
+
+    monkeypatch.setattr(chatbot_service, "_generate", fake_generate)
+    text_value, data, _ = chatbot_service.get_chat_response(db, "¿Quién vende tornillos?")
+
+    assert text_value == "Bulonera Central vende tornillos."
+    assert [row["nombre"] for row in data] == ["Bulonera Central"]
+    assert "cuil" not in data[0]
+    assert "Tornillos, bulones y tuercas" in prompts[1]
+
+
+def test_search_endpoint_full_text_is_ranked(client, db):
+    db.get(models.InfoComercial, 2).productos_servicios = "Pinturas, algún tornillo"
+    db.commit()
+
+    def override_get_db():
+        session = db.SessionLocal()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    response = client.get("/search", params={"q": "tornillos bulones"})
+
+    assert response.status_code == 200
+    assert [empresa["nombre"] for empresa in response.json()] == ["Bulonera Central", "Pinturas Norte"]
+    assert client.get("/search", params={"q": "zapatos"}).status_code == 404
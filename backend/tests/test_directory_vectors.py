@@ -0,0 +1,280 @@
+"""
+Tests del índice vectorial del directorio (app/services/directory_vectors.py):
+top-k por similitud coseno, persistencia en memmap, mantenimiento
+incremental en cada commit y uso desde el chatbot (semantic_query) sin
+pasar por el SQL. Usan el embedder local por hashing: sin red.
+"""
+import json
+import time
+from datetime import date
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+
+from app import models  # noqa: E402
+from app.config import Base  # noqa: E402
+from app.services import chatbot_service, directory_vectors  # noqa: E402
+
+
+class _CountingEmbedder(directory_vectors.HashingEmbedder):
+    def __init__(self):
+        super().__init__()
+        self.documents = []
+
+    def embed_documents(self, texts):
+        self.documents.extend(texts)
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def embedder(monkeypatch):
+    counting = _CountingEmbedder()
+    monkeypatch.setattr(directory_vectors, "embedder", counting)
+    return counting
+
+
+def _vector(*values):
+    return np.array(values, dtype=np.float32)
+
+
+def test_search_returns_top_k_by_cosine():
+    index = directory_vectors.VectorIndex()
+    index.upsert([
+        (1, _vector(1, 0, 0), True, "a"),
+        (2, _vector(1, 1, 0), True, "b"),
+        (3, _vector(0, 0, 1), True, "c"),
+        (4, _vector(1, 0.1, 0), False, "d"),
+    ])
+
+    assert [cuil for cuil, _ in index.search(_vector(2, 0, 0), limit=2)] == [1, 2]
+    assert index.search(_vector(2, 0, 0), limit=1, only_active=False)[0][0] == 1
+    assert 4 in [cuil for cuil, _ in index.search(_vector(1, 0, 0), limit=3, only_active=False)]
+    # La similitud no depende del largo del vector.
+    assert index.search(_vector(5, 0, 0), limit=1) == [(1, 1.0)]
+
+
+def test_remove_keeps_rows_contiguous():
+    index = directory_vectors.VectorIndex()
+    index.upsert([(cuil, _vector(cuil, 1, 0), True, str(cuil)) for cuil in (1, 2, 3)])
+
+    index.remove([1])
+
+    assert sorted(index.cuils()) == [2, 3]
+    assert index.hash_of(1) is None
+    assert {cuil for cuil, _ in index.search(_vector(1, 1, 0), limit=5)} == {2, 3}
+
+
+def test_matrix_is_memory_mapped_and_survives_a_restart(tmp_path):
+    index = directory_vectors.VectorIndex(str(tmp_path))
+    index.upsert([(cuil, _vector(cuil, 1, 0), cuil != 2, str(cuil)) for cuil in range(1, 71)])
+    index.save()
+
+    assert isinstance(index._matrix, np.memmap)
+    assert index._matrix.dtype == np.float32
+    vectors_file = tmp_path / "vectors.f32"
+    assert vectors_file.stat().st_size == index.capacity * 3 * 4
+
+    reopened = directory_vectors.VectorIndex(str(tmp_path))
+    assert reopened.load()
+    assert len(reopened) == 70
+    assert reopened.hash_of(5) == "5"
+    query = _vector(2, 1, 0)
+    assert reopened.search(query, limit=3) == index.search(query, limit=3)
+    assert 2 not in [cuil for cuil, _ in reopened.search(query, limit=70)]
+
+
+def test_search_is_fast_on_ten_thousand_companies():
+    rng = np.random.default_rng(52)
+    index = directory_vectors.VectorIndex()
+    index.upsert((cuil, vector, True, "") for cuil, vector in enumerate(rng.standard_normal((10_000, 768))))
+    query = rng.standard_normal(768)
+
+    best = min(_elapsed_ms(lambda: index.search(query, limit=5)) for _ in range(5))
+    assert best < 10, f"{best:.2f} ms"
+
+
+def _elapsed_ms(func):
+    started = time.perf_counter()
+    func()
+    return (time.perf_counter() - started) * 1000
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Con la base: mantenimiento incremental y chatbot
+# ═══════════════════════════════════════════════════════════════════
+
+
+@pytest.fixture
+def db():
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    for cuil, nombre, rubro, productos in [
+        (1, "Taller Ruta 2", "Mecánica pesada", "Reparación de camiones y acoplados"),
+        (2, "Química del Sur", "Química", "Insumos de limpieza, detergentes y lavandinas"),
+        (3, "Imprenta Rápida", "Gráfica", "Impresiones y folletos"),
+    ]:
+        session.add(
+            models.Empresa(
+                cuil=cuil, nombre=nombre, rubro=rubro, cant_empleados=10, observaciones="",
+                fecha_ingreso=date(2020, 1, 1), horario_trabajo="8 a 17", estado=True,
+            )
+        )
+        session.add(models.InfoComercial(cuil=cuil, productos_servicios=productos))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _warm(db):
+    return directory_vectors.warm_index(sessionmaker(bind=db.get_bind()))
+
+
+def _cuils(db, query, limit=1):
+    _warm(db)
+    return [cuil for cuil, _ in directory_vectors.semantic_search(query, limit=limit)]
+
+
+def test_document_joins_company_commercial_and_contact_fields():
+    text_value = directory_vectors.document_text(
+        {"nombre": "Taller", "productos_servicios": "Frenos", "contacto_datos": "web: taller.com", "rubro": None}
+    )
+    assert text_value == "Empresa: Taller\nProductos y servicios: Frenos\nContacto: web: taller.com"
+
+
+def test_only_changed_companies_are_re_embedded(db, embedder):
+    assert _cuils(db, "reparar camiones") == [1]
+    assert len(embedder.documents) == 3
+
+    db.get(models.InfoComercial, 3).productos_servicios = "Insumos de limpieza para oficinas"
+    db.commit()
+    db.get(models.Empresa, 1).estado = False
+    db.commit()
+
+    assert set(_cuils(db, "insumos de limpieza", limit=2)) == {2, 3}
+    # La baja lógica de la empresa 1 no cambia su texto: no se re-embebe.
+    assert len(embedder.documents) == 4
+    assert 1 not in _cuils(db, "reparar camiones", limit=3)
+
+    db.delete(db.get(models.Empresa, 3))
+    db.commit()
+    assert 3 not in _cuils(db, "insumos de limpieza", limit=3)
+
+    stats = directory_vectors.get_vector_stats()
+    assert stats["full_syncs"] == 1
+    assert stats["embedded_documents"] == 4
+    assert stats["documents"] == 2
+
+
+def test_persisted_index_skips_unchanged_companies_after_restart(db, embedder, tmp_path, monkeypatch):
+    monkeypatch.setattr(directory_vectors, "vector_index", directory_vectors.VectorIndex(str(tmp_path)))
+    assert _cuils(db, "reparar camiones") == [1]
+    assert len(embedder.documents) == 3
+
+    # "Reinicio": índice nuevo sobre el mismo directorio, todo por sincronizar.
+    directory_vectors.reset_directory_vectors()
+    monkeypatch.setattr(directory_vectors, "vector_index", directory_vectors.VectorIndex(str(tmp_path)))
+    db.get(models.InfoComercial, 2).productos_servicios = "Detergentes industriales"
+    db.commit()
+
+    assert _cuils(db, "reparar camiones") == [1]
+    assert embedder.documents[3:] == [
+        directory_vectors.document_text({
+            "nombre": "Química del Sur", "rubro": "Química", "productos_servicios": "Detergentes industriales",
+        })
+    ]
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+def test_chatbot_semantic_query_uses_top_k_without_sql(db, embedder, monkeypatch):
+    monkeypatch.setattr(chatbot_service, "get_database_schema", lambda session: "esquema")
+    monkeypatch.setattr(chatbot_service, "execute_sql_query", lambda *args: pytest.fail("no debería ir al SQL"))
+    prompts = []
+
+    def fake_generate(prompt, generation_config):
+        prompts.append(prompt)
+        if generation_config is chatbot_service.INTENT_GENERATION_CONFIG:
+            return _FakeResponse(json.dumps(
+                {"needs_more_info": False, "sql_query": "", "semantic_query": "reparar camiones"}
+            ))
+        return _FakeResponse("Te puede ayudar Taller Ruta 2.")
+
+    monkeypatch.setattr(chatbot_service, "_generate", fake_generate)
+    _warm(db)
+    text_value, data, _ = chatbot_service.get_chat_response(db, "algo para reparar camiones")
+
+    assert text_value == "Te puede ayudar Taller Ruta 2."
+    assert data[0]["nombre"] == "Taller Ruta 2"
+    assert len(data) <= chatbot_service.SEMANTIC_MAX_RESULTS
+    assert "búsqueda por similitud" in prompts[1]
+
+
+def test_semantic_query_falls_back_to_full_text_without_vectors(db, monkeypatch):
+    monkeypatch.setattr(directory_vectors, "is_available", lambda: False)
+
+    rows = chatbot_service.semantic_search_directory(db, "imprenta")
+
+    assert [row["nombre"] for row in rows] == ["Imprenta Rápida"]
+
+
+def test_first_search_does_not_embed_the_directory_inside_the_request(db, embedder, monkeypatch):
+    started = []
+    monkeypatch.setattr(directory_vectors, "start_background_sync", lambda: started.append(True))
+
+    rows = chatbot_service.semantic_search_directory(db, "imprenta")
+
+    # Sin sincronización previa: full-text y la sincronización queda en segundo plano.
+    assert [row["nombre"] for row in rows] == ["Imprenta Rápida"]
+    assert started == [True]
+    assert embedder.documents == []
+    assert directory_vectors.semantic_search("imprenta") == []
+
+
+def test_warm_index_releases_its_session_before_embedding(db, embedder, monkeypatch):
+    sessions = []
+
+    def session_factory():
+        session = sessionmaker(bind=db.get_bind())()
+        sessions.append(session)
+        return session
+
+    closed_at_embed = []
+    original = embedder.embed_documents
+
+    def embed_documents(texts):
+        closed_at_embed.append(all(not session.in_transaction() for session in sessions))
+        return original(texts)
+
+    monkeypatch.setattr(embedder, "embed_documents", embed_documents)
+
+    assert directory_vectors.warm_index(session_factory) == 3
+    assert closed_at_embed == [True]
+    assert directory_vectors.is_ready()
+    # Ya sincronizado: no vuelve a leer la base.
+    directory_vectors.warm_index(session_factory)
+    assert len(sessions) == 1
+
+
+def test_full_rebuild_rows_are_applied_without_reading_the_database(db, embedder):
+    from app.services.directory_read_model import build_directory_rows
+
+    directory_vectors.apply_directory_changes(None, build_directory_rows(db))
+    directory_vectors.warm_index(lambda: pytest.fail("no debería abrir una sesión"))
+
+    assert directory_vectors.is_ready()
+    assert len(embedder.documents) == 3
+
@@ -0,0 +1,109 @@
+"""
+Tests de las métricas de /metrics (app/metrics.py): formato de texto de
+Prometheus, el timer que marca errores, la etiqueta de ruta por plantilla y
+los histogramas por etapa que deja un chat.
+"""
+import json
+
+import pytest
+from sqlalchemy import create_engine, text as sa_text
+from sqlalchemy.orm import sessionmaker
+
+from app import metrics
+from app.services import chatbot_service
+
+
+@pytest.fixture
+def histogram():
+    metric = metrics.Histogram("test_seconds", "Prueba.", ("stage", "outcome"), buckets=(0.1, 1.0))
+    yield metric
+    metrics.REGISTRY.remove(metric)
+
+
+def test_histogram_renders_cumulative_buckets(histogram):
+    histogram.observe(0.05, stage="a", outcome="ok")
+    histogram.observe(0.5, stage="a", outcome="ok")
+    histogram.observe(3, stage="a", outcome="ok")
+
+    assert histogram.render().splitlines() == [
+        "# HELP test_seconds Prueba.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="a",outcome="ok",le="0.1"} 1',
+        'test_seconds_bucket{stage="a",outcome="ok",le="1"} 2',
+        'test_seconds_bucket{stage="a",outcome="ok",le="+Inf"} 3',
+        'test_seconds_sum{stage="a",outcome="ok"} 3.55',
+        'test_seconds_count{stage="a",outcome="ok"} 3',
+    ]
+
+
+def test_label_values_are_escaped(histogram):
+    histogram.observe(0.01, stage='a"b\\c\nd', outcome="ok")
+
+    assert 'stage="a\\"b\\\\c\\nd"' in histogram.render()
+
+
+def test_timer_marks_errors_and_keeps_explicit_outcome(histogram):
+    with pytest.raises(RuntimeError):
+        with histogram.timer(stage="x"):
+            raise RuntimeError("boom")
+    with histogram.timer(stage="x") as labels:
+        labels["outcome"] = "rejected"
+
+    assert histogram.count(stage="x", outcome="error") == 1
+    assert histogram.count(stage="x", outcome="rejected") == 1
+
+
+def test_wrong_labels_are_rejected(histogram):
+    with pytest.raises(ValueError):
+        histogram.observe(1, stage="x")
+
+
+def test_metrics_endpoint(client):
+    client.get("/health")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert 'polo_http_request_seconds_count{route="/health",method="GET",outcome="ok"} 1' in body
+    assert 'polo_threadpool_threads{state="total"}' in body
+    assert "# TYPE polo_chat_stage_seconds histogram" in body
+
+
+def test_unmatched_routes_do_not_create_one_label_per_path(client):
+    client.get("/no-existe/123")
+    client.get("/no-existe/456")
+
+    assert metrics.HTTP_REQUEST_SECONDS.count(route="unmatched", method="GET", outcome="client_error") == 2
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+@pytest.mark.usefixtures("model_final_answers")
+def test_chat_pipeline_records_each_stage(monkeypatch):
+    monkeypatch.setattr(chatbot_service, "_schema_cache", None)
+    engine = create_engine("sqlite:///:memory:")
+    with engine.begin() as conn:
+        conn.execute(sa_text("CREATE TABLE empresa (cuil INTEGER PRIMARY KEY, nombre TEXT)"))
+        conn.execute(sa_text("INSERT INTO empresa VALUES (1, 'Logistica Express')"))
+    db = sessionmaker(bind=engine)()
+
+    def fake_generate(prompt, generation_config):
+        if generation_config is chatbot_service.INTENT_GENERATION_CONFIG:
+            return _FakeResponse(json.dumps({"needs_more_info": False, "sql_query": "SELECT nombre FROM empresa"}))
+        raise RuntimeError("Gemini caído")
+
+    monkeypatch.setattr(chatbot_service, "_generate", fake_generate)
+    chatbot_service.get_chat_response(db, "que empresas hay")
+    db.close()
+
+    stage = metrics.CHAT_STAGE_SECONDS
+    assert stage.count(stage="intent", outcome="ok") == 1
+    assert stage.count(stage="sql_validation", outcome="allowed") == 1
+    assert stage.count(stage="sql_execution", outcome="ok") == 1
+    assert stage.count(stage="final_generation", outcome="error") == 1
+    assert metrics.CHAT_FINAL_ANSWERS.value(source="fallback") == 1
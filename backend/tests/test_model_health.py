@@ -0,0 +1,279 @@
+"""
+Tests del circuit breaker por modelo (app/services/model_health.py) y de
+cómo _generate elige candidato: clasificación de errores, apertura,
+half-open con una sola prueba, vuelta al modelo preferido, hedging de
+_generate_async y /health.
+"""
+import asyncio
+
+import pytest
+
+from app.services import chatbot_service, model_health
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = {"t": 1000.0}
+    monkeypatch.setattr(model_health.time, "monotonic", lambda: now["t"])
+    return now
+
+
+@pytest.mark.parametrize(
+    "message, kind",
+    [
+        ("404 models/gemini-x is not found", "deprecated"),
+        ("This model is no longer available", "deprecated"),
+        ("429 Resource has been exhausted (e.g. check quota)", "quota"),
+        ("503 The service is currently unavailable", "transient"),
+        ("Deadline Exceeded", "transient"),
+        ("prompt bloqueado por seguridad", "other"),
+    ],
+)
+def test_classify_error(message, kind):
+    assert model_health.classify_error(RuntimeError(message)) == kind
+
+
+def test_timeout_error_is_transient():
+    assert model_health.classify_error(TimeoutError()) == "transient"
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "mime type is not supported",
+        "Request payload size exceeds the limit: 1500 tokens",
+        "Invalid argument: internal_field_500 must be positive",
+        "Unsupported language code",
+    ],
+)
+def test_ordinary_errors_are_not_mistaken_for_deprecation(message):
+    assert model_health.classify_error(RuntimeError(message)) == "other"
+
+
+def test_google_api_errors_are_classified_by_type_not_message():
+    exceptions = pytest.importorskip("google.api_core.exceptions")
+
+    assert model_health.classify_error(exceptions.NotFound("models/gemini-x")) == "deprecated"
+    assert model_health.classify_error(exceptions.ResourceExhausted("x")) == "quota"
+    assert model_health.classify_error(exceptions.InternalServerError("x")) == "transient"
+    assert model_health.classify_error(exceptions.ServiceUnavailable("x")) == "transient"
+    assert model_health.classify_error(exceptions.DeadlineExceeded("x")) == "transient"
+    # Un 400 que menciona 404 o "not found" sigue siendo un 400.
+    assert model_health.classify_error(exceptions.InvalidArgument("field not found: 404 is not supported")) == "other"
+
+
+def test_status_code_attribute_wins_over_message():
+    class HttpError(Exception):
+        def __init__(self, status_code, message):
+            super().__init__(message)
+            self.status_code = status_code
+
+    assert model_health.classify_error(HttpError(400, "model not found")) == "other"
+    assert model_health.classify_error(HttpError(404, "bad request")) == "deprecated"
+    assert model_health.classify_error(HttpError(503, "")) == "transient"
+
+
+def test_transient_errors_open_only_after_threshold(clock):
+    for _ in range(model_health.FAILURE_THRESHOLD - 1):
+        model_health.record_failure("m", RuntimeError("503 unavailable"))
+    assert model_health.allow_request("m")
+
+    model_health.record_failure("m", RuntimeError("503 unavailable"))
+    assert not model_health.allow_request("m")
+
+
+def test_quota_opens_immediately_and_recovers_through_single_probe(clock):
+    model_health.record_failure("m", RuntimeError("429 quota exceeded"))
+    assert not model_health.allow_request("m")
+
+    clock["t"] += model_health.QUOTA_COOLDOWN_SECONDS
+    assert model_health.allow_request("m")  # prueba half_open
+    assert not model_health.allow_request("m")  # solo una a la vez
+
+    model_health.record_success("m", 120.0)
+    assert model_health.get_model_health(["m"])["m"]["state"] == model_health.CLOSED
+    assert model_health.allow_request("m")
+
+
+def test_failed_probe_doubles_cooldown(clock):
+    for _ in range(model_health.FAILURE_THRESHOLD):
+        model_health.record_failure("m", RuntimeError("timeout"))
+    clock["t"] += model_health.TRANSIENT_COOLDOWN_SECONDS
+    assert model_health.allow_request("m")
+
+    model_health.record_failure("m", RuntimeError("timeout"))
+    snapshot = model_health.get_model_health(["m"])["m"]
+    assert snapshot["state"] == model_health.OPEN
+    assert snapshot["retry_in_seconds"] == pytest.approx(2 * model_health.TRANSIENT_COOLDOWN_SECONDS)
+
+
+def test_latency_ewma_tracks_successes():
+    model_health.record_success("m", 100.0)
+    model_health.record_success("m", 200.0)
+    expected = 100.0 + model_health.LATENCY_EWMA_ALPHA * 100.0
+    assert model_health.get_model_health(["m"])["m"]["latency_ewma_ms"] == pytest.approx(expected)
+
+
+# ═══════════════════════════════════════════════════════════════════
+# _generate con breakers
+# ═══════════════════════════════════════════════════════════════════
+
+
+@pytest.fixture
+def two_models(monkeypatch):
+    behaviour = {"preferido": "ok", "respaldo": "ok"}
+    calls = []
+
+    class FakeModel:
+        def __init__(self, name):
+            self.name = name
+
+        def generate_content(self, prompt, generation_config=None):
+            calls.append(self.name)
+            if behaviour[self.name] != "ok":
+                raise RuntimeError(behaviour[self.name])
+            return _FakeResponse(self.name)
+
+    monkeypatch.setattr(chatbot_service, "_MODEL_CANDIDATES", ["preferido", "respaldo"])
+    monkeypatch.setattr(chatbot_service, "_active_model_index", 0)
+    monkeypatch.setattr(chatbot_service, "_get_model_instance", lambda name: FakeModel(name))
+    return behaviour, calls
+
+
+def test_transient_error_does_not_demote_preferred_model(two_models, clock):
+    behaviour, calls = two_models
+    behaviour["preferido"] = "504 deadline exceeded"
+    assert chatbot_service._generate("p", chatbot_service.FINAL_GENERATION_CONFIG).text == "respaldo"
+
+    behaviour["preferido"] = "ok"
+    calls.clear()
+    assert chatbot_service._generate("p", chatbot_service.FINAL_GENERATION_CONFIG).text == "preferido"
+    assert calls == ["preferido"]
+
+
+def test_preferred_model_is_probed_again_after_cooldown(two_models, clock):
+    behaviour, calls = two_models
+    behaviour["preferido"] = "429 quota"
+    chatbot_service._generate("p", chatbot_service.FINAL_GENERATION_CONFIG)
+
+    calls.clear()
+    chatbot_service._generate("p", chatbot_service.FINAL_GENERATION_CONFIG)
+    assert calls == ["respaldo"]  # breaker abierto: ni se intenta
+
+    behaviour["preferido"] = "ok"
+    clock["t"] += model_health.QUOTA_COOLDOWN_SECONDS
+    calls.clear()
+    assert chatbot_service._generate("p", chatbot_service.FINAL_GENERATION_CONFIG).text == "preferido"
+    assert chatbot_service._active_model_index == 0
+
+
+def test_generate_fails_fast_when_every_breaker_is_open(two_models, clock):
+    behaviour, calls = two_models
+    behaviour["preferido"] = behaviour["respaldo"] = "404 not found"
+    with pytest.raises(RuntimeError):
+        chatbot_service._generate("p", chatbot_service.FINAL_GENERATION_CONFIG)
+
+    calls.clear()
+    with pytest.raises(RuntimeError):
+        chatbot_service._generate("p", chatbot_service.FINAL_GENERATION_CONFIG)
+    assert calls == []
+
+
+def test_health_endpoint_reports_model_state(client, monkeypatch):
+    monkeypatch.setattr(chatbot_service, "_MODEL_CANDIDATES", ["preferido", "respaldo"])
+    monkeypatch.setattr(chatbot_service, "_active_model_index", 0)
+    model_health.record_failure("respaldo", RuntimeError("429 quota"))
+
+    body = client.get("/health").json()
+
+    assert body["gemini_models"]["active"] == "preferido"
+    assert body["gemini_models"]["candidates"]["respaldo"]["state"] == "open"
+    assert body["gemini_models"]["candidates"]["respaldo"]["failures"]["quota"] == 1
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Hedging (_generate_async)
+# ═══════════════════════════════════════════════════════════════════
+
+
+@pytest.fixture
+def async_models(monkeypatch):
+    delays = {"lento": 0.0, "rapido": 0.0}
+    started, cancelled = [], []
+
+    class FakeAsyncModel:
+        def __init__(self, name):
+            self.name = name
+
+        async def generate_content_async(self, prompt, generation_config=None):
+            started.append(self.name)
+            try:
+                await asyncio.sleep(delays[self.name])
+            except asyncio.CancelledError:
+                cancelled.append(self.name)
+                raise
+            return _FakeResponse(self.name)
+
+    monkeypatch.setattr(chatbot_service, "_MODEL_CANDIDATES", ["lento", "rapido"])
+    monkeypatch.setattr(chatbot_service, "_active_model_index", 0)
+    monkeypatch.setattr(chatbot_service, "_get_model_instance", lambda name: FakeAsyncModel(name))
+    monkeypatch.setattr(model_health, "HEDGING_ENABLED", True)
+    monkeypatch.setattr(model_health, "HEDGE_DEFAULT_DELAY_MS", 50)
+    monkeypatch.setattr(model_health, "HEDGE_MIN_DELAY_MS", 10)
+    return delays, started, cancelled
+
+
+def test_slow_primary_is_hedged_and_cancelled(async_models):
+    delays, started, cancelled = async_models
+    delays["lento"] = 2.0
+
+    response = asyncio.run(chatbot_service._generate_async("p", chatbot_service.FINAL_GENERATION_CONFIG))
+
+    assert response.text == "rapido"
+    assert started == ["lento", "rapido"]
+    assert cancelled == ["lento"]
+    stats = model_health.get_hedge_stats()
+    assert stats["hedged"] == 1
+    assert stats["hedge_wins"] == 1
+    assert stats["extra_requests"] == 1
+    # El perdedor aporta su demora a la ventana de latencias.
+    assert model_health.latency_percentile("lento", 100) >= 50
+
+
+def test_fast_primary_is_not_hedged(async_models):
+    delays, started, _ = async_models
+
+    response = asyncio.run(chatbot_service._generate_async("p", chatbot_service.FINAL_GENERATION_CONFIG))
+
+    assert response.text == "lento"
+    assert started == ["lento"]
+    stats = model_health.get_hedge_stats()
+    assert stats["calls"] == 1
+    assert stats["hedged"] == 0
+
+
+def test_hedge_delay_follows_recent_latency_percentile(monkeypatch):
+    monkeypatch.setattr(model_health, "HEDGE_MIN_SAMPLES", 10)
+    for latency in range(100, 1100, 100):  # 100..1000 ms
+        model_health.record_success("m", float(latency))
+
+    assert model_health.hedge_delay_seconds("m") == pytest.approx(
+        model_health.latency_percentile("m", model_health.HEDGE_PERCENTILE) / 1000
+    )
+    assert model_health.latency_percentile("m", 50) == 500
+
+
+def test_hedging_is_off_by_default(async_models, monkeypatch):
+    delays, started, _ = async_models
+    monkeypatch.setattr(model_health, "HEDGING_ENABLED", False)
+    delays["lento"] = 0.1
+
+    response = asyncio.run(chatbot_service._generate_async("p", chatbot_service.FINAL_GENERATION_CONFIG))
+
+    assert response.text == "lento"
+    assert started == ["lento"]
@@ -86,7 +86,7 @@ def test_rate_limit_is_isolated_per_bucket_name():
 
 
 def test_chat_endpoint_gets_rate_limited(client: TestClient):
-    with patch("app.routes.chat.get_chat_response", return_value=("hola", [], None)):
+    with patch("app.routes.chat.get_chat_response_async", return_value=("hola", [], None)):
         for _ in range(30):
             client.post("/chat/", json={"message": "hola"})
 
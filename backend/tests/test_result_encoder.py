@@ -0,0 +1,105 @@
+"""
+Tests de la codificación compacta de resultados para el prompt final
+(app/services/result_encoder.py): proyección de columnas, tabla con
+encabezado único, nulls fuera, topes de filas y tokens, y ahorro frente al
+JSON que se mandaba antes.
+"""
+import json
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine, text as sa_text
+from sqlalchemy.orm import sessionmaker
+
+from app.services import chatbot_service, result_encoder
+
+
+def test_table_has_header_once_and_no_ids_or_null_columns():
+    rows = [
+        {"cuil": 20111, "nombre": "Logistica Express", "rubro": "Logística", "telefono": None, "id_contacto": 3},
+        {"cuil": 20222, "nombre": "Metalúrgica Sur", "rubro": None, "telefono": None, "id_contacto": 4},
+    ]
+
+    encoded = result_encoder.encode_results(rows)
+
+    assert encoded.text.splitlines() == [
+        "nombre | rubro",
+        "Logistica Express | Logística",
+        "Metalúrgica Sur | ",
+    ]
+    assert "20111" not in encoded.text
+    assert encoded.columns == ["nombre", "rubro"]
+
+
+def test_single_row_is_key_value_without_empty_fields():
+    encoded = result_encoder.encode_results(
+        [{"nombre": "Logistica Express", "fecha_ingreso": date(2020, 1, 1), "datos": {"web": "x.com", "fax": ""}, "x": ""}]
+    )
+
+    assert encoded.text == "nombre: Logistica Express\nfecha_ingreso: 2020-01-01\ndatos: Web: x.com"
+
+
+def test_cells_cannot_break_the_table():
+    encoded = result_encoder.encode_results([{"nombre": "A | B\nC"}, {"nombre": "x" * 1000}])
+
+    lines = encoded.text.splitlines()
+    assert lines[1] == "A / B C"
+    assert len(lines[2]) == result_encoder.MAX_CELL_CHARS
+
+
+def test_row_cap_adds_marker():
+    encoded = result_encoder.encode_results([{"nombre": f"Empresa {i}"} for i in range(10)], max_rows=3)
+
+    assert encoded.text.splitlines()[-1] == "(7 filas más sin mostrar)"
+    assert (encoded.rows_included, encoded.rows_total) == (3, 10)
+
+
+def test_token_budget_is_respected_and_savings_reported():
+    rows = [
+        {"cuil": i, "nombre": f"Empresa número {i}", "rubro": "Industria metalúrgica", "observaciones": None}
+        for i in range(200)
+    ]
+
+    encoded = result_encoder.encode_results(rows, max_rows=200, token_budget=300)
+
+    assert encoded.tokens <= 300
+    assert 0 < encoded.rows_included < 200
+    assert encoded.text.endswith(f"({200 - encoded.rows_included} filas más sin mostrar)")
+    assert encoded.json_tokens > 10 * encoded.tokens
+    stats = result_encoder.get_encoder_stats()
+    assert stats["tokens_saved"] == encoded.tokens_saved > 0
+
+
+def test_empty_results():
+    assert result_encoder.encode_results([]).text == result_encoder.EMPTY_RESULTS_TEXT
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+@pytest.mark.usefixtures("model_final_answers")
+def test_final_prompt_carries_compact_results(client, monkeypatch):
+    engine = create_engine("sqlite:///:memory:")
+    with engine.begin() as conn:
+        conn.execute(sa_text("CREATE TABLE empresa (cuil INTEGER PRIMARY KEY, nombre TEXT, rubro TEXT)"))
+        conn.execute(sa_text("INSERT INTO empresa VALUES (20111, 'Logistica Express', 'Logística')"))
+        conn.execute(sa_text("INSERT INTO empresa VALUES (20222, 'Metalúrgica Sur', NULL)"))
+    db = sessionmaker(bind=engine)()
+    monkeypatch.setattr(chatbot_service, "get_database_schema", lambda session: "esquema")
+    prompts = []
+
+    def fake_generate(prompt, generation_config):
+        prompts.append(prompt)
+        if generation_config is chatbot_service.INTENT_GENERATION_CONFIG:
+            return _FakeResponse(json.dumps({"needs_more_info": False, "sql_query": "SELECT * FROM empresa"}))
+        return _FakeResponse("Hay dos empresas.")
+
+    monkeypatch.setattr(chatbot_service, "_generate", fake_generate)
+    chatbot_service.get_chat_response(db, "que empresas hay")
+    db.close()
+
+    assert "nombre | rubro\nLogistica Express | Logística\nMetalúrgica Sur | " in prompts[1]
+    assert "20111" not in prompts[1]
+    assert client.get("/health").json()["chat_result_encoding"]["requests"] == 1
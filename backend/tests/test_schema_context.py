@@ -0,0 +1,138 @@
+"""
+Tests del contexto de esquema para la etapa de intención
+(app/services/schema_context.py): índice de palabras clave, JOIN
+obligatorios, formato compacto y ahorro de tokens frente al texto completo.
+"""
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.config import Base
+from app.services import chatbot_service, schema_context
+
+
+@pytest.fixture(autouse=True)
+def reset_schema_state():
+    original = (chatbot_service._schema_cache, chatbot_service._schema_catalog)
+    chatbot_service._schema_cache = None
+    chatbot_service._schema_catalog = None
+    schema_context.reset_schema_context_stats()
+    yield
+    chatbot_service._schema_cache, chatbot_service._schema_catalog = original
+    schema_context.reset_schema_context_stats()
+
+
+@pytest.fixture
+def orm_db():
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    yield db
+    db.close()
+    engine.dispose()
+
+
+def _context(db, question, history=None):
+    full = chatbot_service.get_database_schema(db)
+    text_value = chatbot_service.build_schema_context(full, chatbot_service.normalize_text(question), history)
+    return full, text_value
+
+
+def _listed_tables(text_value):
+    return {line[2:].split("(", 1)[0] for line in text_value.splitlines() if line.startswith("- ")}
+
+
+def test_lot_question_brings_lots_and_join_path_to_empresa(orm_db):
+    _, text_value = _context(orm_db, "¿Quién es el dueño del lote 12 de la manzana 3?")
+    assert _listed_tables(text_value) == {
+        "directorio_empresa", "lotes", "servicio_polo", "tipo_servicio_polo", "empresa",
+    }
+
+
+def test_phone_question_brings_contacts(orm_db):
+    _, text_value = _context(orm_db, "¿Cuál es el teléfono de Logistica Express?")
+    tables = _listed_tables(text_value)
+    assert {"contacto", "tipo_contacto", "empresa"} <= tables
+    assert "lotes" not in tables
+    assert "info_comercial" not in tables
+
+
+def test_price_question_brings_commercial_info(orm_db):
+    _, text_value = _context(orm_db, "¿Qué empresas tienen precios económicos?")
+    assert _listed_tables(text_value) == {"directorio_empresa", "info_comercial", "empresa"}
+
+
+def test_follow_up_uses_previous_question(orm_db):
+    history = [{"user": "¿Dónde queda el lote 5?", "assistant": "En la manzana 2."}]
+    _, text_value = _context(orm_db, "¿y el dueño?", history)
+    assert "lotes" in _listed_tables(text_value)
+
+
+def test_unmatched_question_gets_full_compact_schema(orm_db):
+    full, text_value = _context(orm_db, "hola")
+    catalog = chatbot_service._schema_catalog
+    assert _listed_tables(text_value) == set(catalog.tables)
+    assert schema_context.estimate_tokens(text_value) < schema_context.estimate_tokens(full)
+
+
+def test_compact_schema_never_lists_forbidden_tables(orm_db):
+    _, text_value = _context(orm_db, "hola")
+    for forbidden in ("usuario", "rol_usuario", "password_history", "chat_mensaje", "vehiculos"):
+        assert forbidden not in _listed_tables(text_value)
+
+
+def test_compact_table_format_marks_keys_and_relations(orm_db):
+    chatbot_service.get_database_schema(orm_db)
+    compact = chatbot_service._schema_catalog.tables["lotes"].compact()
+    assert compact.startswith("lotes(id_lotes* INTEGER")
+    assert "id_servicio_polo INTEGER->servicio_polo.id_servicio_polo" in compact
+
+
+def test_token_savings_are_recorded_per_request(orm_db):
+    _context(orm_db, "¿En qué manzana está el lote 4?")
+    _context(orm_db, "hola")
+
+    stats = schema_context.get_schema_context_stats()
+    assert stats["requests"] == 2
+    assert stats["pruned_requests"] == 1
+    assert stats["tokens_saved"] > 0
+    assert 0 < stats["savings_ratio"] < 1
+
+
+def test_unknown_schema_text_is_passed_through(orm_db):
+    chatbot_service.get_database_schema(orm_db)
+    assert chatbot_service.build_schema_context("- Tabla 'otra'", "que lotes hay") == "- Tabla 'otra'"
+    assert schema_context.get_schema_context_stats()["requests"] == 0
+
+
+def test_pruning_can_be_disabled(orm_db, monkeypatch):
+    monkeypatch.setattr(schema_context, "SCHEMA_PRUNING_ENABLED", False)
+    _, text_value = _context(orm_db, "que lotes hay")
+    assert _listed_tables(text_value) == set(chatbot_service._schema_catalog.tables)
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+def test_intent_prompt_uses_pruned_schema(orm_db, monkeypatch):
+    prompts = []
+
+    def fake_generate(prompt, generation_config):
+        prompts.append(prompt)
+        return _FakeResponse(json.dumps({"needs_more_info": False, "direct_answer": "ok"}))
+
+    monkeypatch.setattr(chatbot_service, "_generate", fake_generate)
+    chatbot_service.get_chat_response(orm_db, "¿Qué lotes hay en la manzana 2?")
+
+    assert "- lotes(" in prompts[0]
+    assert "- contacto(" not in prompts[0]
+    assert "La base de datos tiene las siguientes tablas" not in prompts[0]
@@ -0,0 +1,143 @@
+"""
+Tests de la ejecución acotada del SQL del chatbot (execute_sql_query):
+LIMIT forzado, topes de filas/bytes, aviso de truncado a la etapa final y
+que un error deje la sesión usable.
+"""
+import copy
+import json
+
+import pytest
+from sqlalchemy import create_engine, text as sa_text
+from sqlalchemy.orm import sessionmaker
+
+from app.services import chatbot_service, result_encoder
+
+
+@pytest.fixture
+def many_rows_db():
+    engine = create_engine("sqlite:///:memory:")
+    with engine.begin() as conn:
+        conn.execute(sa_text("CREATE TABLE empresa (cuil INTEGER PRIMARY KEY, nombre TEXT, observaciones TEXT)"))
+        for i in range(200):
+            conn.execute(
+                sa_text("INSERT INTO empresa (cuil, nombre, observaciones) VALUES (:c, :n, :o)"),
+                {"c": i, "n": f"Empresa {i:03d}", "o": "x" * 100},
+            )
+    db = sessionmaker(bind=engine)()
+    yield db
+    db.close()
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("SELECT nombre FROM empresa", "SELECT nombre FROM empresa LIMIT 51"),
+        ("SELECT nombre FROM empresa;", "SELECT nombre FROM empresa LIMIT 51"),
+        ("SELECT nombre FROM empresa LIMIT 5", "SELECT nombre FROM empresa LIMIT 5"),
+        ("SELECT nombre FROM empresa limit 1000 offset 10", "SELECT nombre FROM empresa limit 51 offset 10"),
+        ("SELECT nombre FROM empresa LIMIT ALL", "SELECT nombre FROM empresa LIMIT 51"),
+        ("SELECT nombre FROM empresa limit all offset 5;", "SELECT nombre FROM empresa limit 51 offset 5"),
+        ("SELECT nombre FROM empresa FETCH FIRST 10 ROWS ONLY", "SELECT nombre FROM empresa LIMIT 10"),
+        ("SELECT nombre FROM empresa fetch next 500 rows only;", "SELECT nombre FROM empresa LIMIT 51"),
+        (
+            "SELECT nombre FROM empresa ORDER BY 1 OFFSET 5 ROWS FETCH FIRST ROW ONLY",
+            "SELECT nombre FROM empresa ORDER BY 1 OFFSET 5 ROWS LIMIT 1",
+        ),
+        (
+            "SELECT nombre FROM empresa WHERE cuil IN (SELECT cuil FROM lotes LIMIT 3)",
+            "SELECT nombre FROM empresa WHERE cuil IN (SELECT cuil FROM lotes LIMIT 3) LIMIT 51",
+        ),
+    ],
+)
+def test_enforce_sql_limit(query, expected):
+    assert chatbot_service.enforce_sql_limit(query, 50) == expected
+
+
+def test_small_result_is_not_truncated(many_rows_db):
+    rows = chatbot_service.execute_sql_query(many_rows_db, "SELECT nombre FROM empresa WHERE cuil < 3 ORDER BY cuil")
+    assert rows == [{"nombre": "Empresa 000"}, {"nombre": "Empresa 001"}, {"nombre": "Empresa 002"}]
+    assert rows.truncated is False
+
+
+def test_row_cap_truncates_and_reports(many_rows_db, monkeypatch):
+    monkeypatch.setattr(chatbot_service, "SQL_MAX_ROWS", 10)
+    rows = chatbot_service.execute_sql_query(many_rows_db, "SELECT nombre FROM empresa ORDER BY cuil")
+
+    assert len(rows) == 10
+    assert rows.truncated is True
+    assert rows.truncation_reason == "rows"
+
+
+def test_model_limit_below_cap_is_not_reported_as_truncated(many_rows_db, monkeypatch):
+    monkeypatch.setattr(chatbot_service, "SQL_MAX_ROWS", 10)
+    rows = chatbot_service.execute_sql_query(many_rows_db, "SELECT nombre FROM empresa LIMIT 10")
+    assert len(rows) == 10
+    assert rows.truncated is False
+
+
+def test_byte_budget_truncates(many_rows_db, monkeypatch):
+    monkeypatch.setattr(chatbot_service, "SQL_MAX_BYTES", 1000)
+    rows = chatbot_service.execute_sql_query(many_rows_db, "SELECT nombre, observaciones FROM empresa")
+
+    assert rows.truncated is True
+    assert rows.truncation_reason == "bytes"
+    assert len(json.dumps(list(rows))) <= 1000 + 200
+
+
+def test_sql_error_returns_generic_error_and_keeps_session_usable(many_rows_db):
+    result = chatbot_service.execute_sql_query(many_rows_db, "SELECT columna_inexistente FROM empresa")
+    assert result[0]["error"] == chatbot_service.GENERIC_ERROR_MESSAGE
+    assert many_rows_db.execute(sa_text("SELECT COUNT(*) FROM empresa")).scalar() == 200
+
+
+def test_truncation_flag_survives_cache_copy():
+    rows = chatbot_service.SqlRows([{"nombre": "A"}])
+    rows.truncated, rows.truncation_reason = True, "rows"
+    copied = copy.deepcopy(rows)
+    assert copied == [{"nombre": "A"}]
+    assert copied.truncated is True
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+@pytest.mark.usefixtures("model_final_answers")
+def test_final_prompt_is_told_about_truncation(many_rows_db, monkeypatch):
+    monkeypatch.setattr(chatbot_service, "SQL_MAX_ROWS", 5)
+    monkeypatch.setattr(chatbot_service, "get_database_schema", lambda db: "esquema")
+    prompts = []
+
+    def fake_generate(prompt, generation_config):
+        prompts.append(prompt)
+        if generation_config is chatbot_service.INTENT_GENERATION_CONFIG:
+            return _FakeResponse(json.dumps({"needs_more_info": False, "sql_query": "SELECT nombre FROM empresa"}))
+        return _FakeResponse("Hay muchas empresas.")
+
+    monkeypatch.setattr(chatbot_service, "_generate", fake_generate)
+    _, data, _ = chatbot_service.get_chat_response(many_rows_db, "listame todas las empresas")
+
+    assert len(data) == 5
+    assert "Se muestran solo los primeros 5 resultados" in prompts[1]
+
+
+def test_truncation_note_counts_the_rows_the_encoder_kept(monkeypatch):
+    monkeypatch.setattr(result_encoder, "RESULTS_MAX_ROWS", 3)
+    rows = [{"nombre": f"Empresa {i}"} for i in range(10)]
+
+    # El SQL no se truncó, pero el encoder solo manda 3 filas.
+    prompt = chatbot_service._build_final_prompt("listame todas", rows, "")
+    assert "Se muestran solo los primeros 3 resultados" in prompt
+
+    sql_rows = chatbot_service.SqlRows(rows)
+    sql_rows.truncated = True
+    prompt = chatbot_service._build_final_prompt("listame todas", sql_rows, "", truncated=True)
+    assert "Se muestran solo los primeros 3 resultados" in prompt
+    assert "primeros 10" not in prompt
+
+
+def test_no_truncation_note_when_everything_fits():
+    prompt = chatbot_service._build_final_prompt("listame todas", [{"nombre": "A"}, {"nombre": "B"}], "")
+    assert "Se muestran solo" not in prompt
+
@@ -0,0 +1,211 @@
+"""
+Tests del validador de SQL en una pasada (app/services/sql_guard.py):
+veredicto estructurado (tablas, alias, subconsultas), corpus de intentos de
+evasión, fuzzing determinístico y comparación de costo contra la versión
+anterior basada en regex (scripts/bench_sql_guard.py).
+"""
+import os
+import random
+import sys
+
+import pytest
+
+from app.services import chatbot_service, sql_guard
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+import bench_sql_guard  # noqa: E402
+
+
+def _validate(query):
+    return sql_guard.validate_sql(query, chatbot_service.FORBIDDEN_SQL_TABLES)
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Veredicto estructurado
+# ═══════════════════════════════════════════════════════════════════
+
+
+def test_verdict_lists_tables_and_aliases():
+    verdict = _validate(
+        "SELECT e.nombre, c.telefono FROM empresa e JOIN contacto AS c ON c.cuil_empresa = e.cuil"
+    )
+    assert verdict.allowed
+    assert verdict.tables == {"empresa", "contacto"}
+    assert verdict.aliases == {"e": "empresa", "c": "contacto"}
+
+
+def test_verdict_counts_subqueries_and_reads_their_tables():
+    verdict = _validate(
+        "SELECT nombre FROM empresa WHERE cuil IN (SELECT cuil FROM info_comercial) "
+        "AND EXISTS (SELECT 1 FROM lotes l, servicio_polo sp WHERE sp.cuil = empresa.cuil)"
+    )
+    assert verdict.allowed
+    assert verdict.subqueries == 2
+    assert verdict.tables == {"empresa", "info_comercial", "lotes", "servicio_polo"}
+
+
+def test_function_from_is_not_a_table():
+    verdict = _validate("SELECT EXTRACT(YEAR FROM fecha_ingreso) AS anio, TRIM(BOTH ' ' FROM nombre) FROM empresa")
+    assert verdict.allowed
+    assert verdict.tables == {"empresa"}
+
+
+def test_verdict_reports_reason():
+    verdict = _validate("SELECT * FROM empresa e, usuario u")
+    assert not verdict
+    assert verdict.reason == "tabla prohibida: usuario"
+
+
+def test_unicode_escape_identifier_is_rejected():
+    # El tokenizador vería la tabla "u"; PostgreSQL ejecuta SELECT * FROM usuario.
+    verdict = _validate('SELECT * FROM U&"\\0075suario"')
+    assert not verdict
+    assert verdict.reason == "literal con escapes Unicode (U&...)"
+    assert not _validate("SELECT nombre FROM empresa WHERE nombre = U&'d\\0061ta'")
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        # Palabras clave y nombres de tablas prohibidas dentro de literales
+        # ya no son falsos positivos.
+        "SELECT nombre FROM empresa WHERE nombre ILIKE '%servicio%'",
+        "SELECT nombre FROM empresa WHERE observaciones ILIKE '%drop%'",
+        "SELECT nombre FROM empresa WHERE nombre = 'O''Higgins S.A.'",
+        "SELECT sp.nombre AS servicio FROM servicio_polo sp",
+        'SELECT "nombre" FROM "empresa"',
+        "SELECT COUNT(*) FROM empresa GROUP BY rubro ORDER BY 1 DESC LIMIT 5",
+        "SELECT nombre FROM empresa UNION SELECT nombre FROM servicio_polo",
+    ],
+)
+def test_allowed_corpus(query):
+    assert _validate(query).allowed, _validate(query).reason
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Corpus de evasión
+# ═══════════════════════════════════════════════════════════════════
+
+BYPASS_CORPUS = [
+    "SELECT nombre FROM empresa UNION SELECT email FROM usuario",
+    "SELECT * FROM empresa e, usuario u",
+    "SELECT * FROM empresa e,\nrol_usuario ru",
+    "SELECT * FROM empresa JOIN public.usuario u ON true",
+    'SELECT * FROM "public"."usuario"',
+    'SELECT * FROM "Password_History"',
+    "SELECT (SELECT contrasena FROM usuario LIMIT 1) FROM empresa",
+    "SELECT * FROM empresa WHERE EXISTS (SELECT 1 FROM rol_usuario)",
+    "SELECT * FROM ONLY usuario",
+    "SELECT * FROM empresa, LATERAL (SELECT * FROM chat_mensaje) x",
+    "SELECT * FROM empresa CROSS JOIN vehiculos",
+    "SELECT * FROM (empresa JOIN usuario ON true)",
+    "SELECT usuario.email FROM empresa",
+    "SELECT query_to_xml('select * from usuario', true, true, '')",
+    "SELECT * FROM dblink('dbname=x', 'select 1') AS t(a int)",
+    "SELECT * FROM pg_user",
+    "SELECT * FROM pg_catalog.pg_shadow",
+    "SELECT table_name FROM information_schema.tables",
+    "SELECT name FROM sqlite_master",
+    "SELECT pg_sleep(10)",
+    "SELECT * INTO copia FROM empresa",
+    "SELECT * FROM empresa FOR UPDATE",
+    "SELECT * FROM empresa; DROP TABLE empresa",
+    "SELECT * FROM empresa WHERE nombre = 'a'; DELETE FROM empresa; --'",
+    "SELECT * FROM empresa WHERE nombre = 'sin cerrar",
+    "SELECT * FROM empresa /**/",
+    "SELECT * FROM empresa WHERE (nombre = 'a'",
+    "SELECT * FROM empresa WHERE nombre = 'a')",
+    "select\n*\nfrom\tUSUARIO",
+    "WITH u AS (SELECT * FROM empresa) SELECT * FROM u",
+    # Literales que PostgreSQL lee distinto que un '...' estándar.
+    "SELECT email, $$'$$ FROM usuario UNION SELECT nombre, $$'$$ FROM empresa",
+    "SELECT email, $x$'$x$ FROM usuario UNION SELECT nombre, $x$'$x$ FROM empresa",
+    "SELECT email, E'\\'' FROM usuario UNION SELECT nombre, E'\\'' FROM empresa",
+    "SELECT email, e'\\'' FROM usuario UNION SELECT nombre, e'\\'' FROM empresa",
+    "SELECT nombre FROM empresa WHERE nombre = 'a\\' OR 1=1",
+    # Escapes Unicode: para PostgreSQL U&"\0075suario" es usuario.
+    'SELECT * FROM U&"\\0075suario"',
+    'SELECT * FROM u&"\\0075suario"',
+    "SELECT nombre, U&'\\0027' FROM empresa",
+    'SELECT * FROM "us\\uario"',
+    "  ",
+]
+
+
+@pytest.mark.parametrize("query", BYPASS_CORPUS)
+def test_bypass_corpus_is_rejected(query):
+    assert not _validate(query).allowed
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Fuzzing determinístico
+# ═══════════════════════════════════════════════════════════════════
+
+_BASE_QUERIES = bench_sql_guard.QUERIES
+_HOSTILE_SUFFIXES = [
+    "; DROP TABLE empresa",
+    " UNION SELECT email, contrasena FROM usuario",
+    " -- comentario",
+    " /* x */",
+    ", usuario",
+    " JOIN rol ON true",
+    " AND cuil IN (SELECT cuil FROM empresa_servicio)",
+    " AND nombre = 'abierto",
+    ", $$'$$ FROM usuario UNION SELECT nombre, $$'$$ FROM empresa",
+    ", E'\\'' FROM usuario UNION SELECT nombre, E'\\'' FROM empresa",
+    ' UNION SELECT email, 1 FROM U&"\\0075suario"',
+    ", U&'\\0027' FROM empresa",
+]
+
+
+def _mutate_case_and_spacing(rng, query):
+    chars = []
+    for ch in query:
+        if ch == " " and rng.random() < 0.3:
+            chars.append(rng.choice(["  ", "\n", "\t"]))
+        elif ch.isalpha() and rng.random() < 0.3:
+            chars.append(ch.swapcase())
+        else:
+            chars.append(ch)
+    return "".join(chars)
+
+
+def test_fuzz_hostile_suffixes_are_always_rejected():
+    rng = random.Random(52)
+    for _ in range(500):
+        base = rng.choice(_BASE_QUERIES).rstrip(" ;")
+        if " LIMIT " in base:
+            base = base.split(" LIMIT ")[0]
+        query = _mutate_case_and_spacing(rng, base + rng.choice(_HOSTILE_SUFFIXES))
+        assert not _validate(query).allowed, query
+
+
+def test_fuzz_benign_mutations_stay_allowed():
+    rng = random.Random(7)
+    for _ in range(500):
+        query = _mutate_case_and_spacing(rng, rng.choice(_BASE_QUERIES))
+        assert _validate(query).allowed, query
+
+
+def test_fuzz_random_input_never_raises():
+    rng = random.Random(1)
+    alphabet = "SELECTFROMWHEREselectfrom empresa usuario'\"();,.-*/\n\t0123456789$"
+    for _ in range(2000):
+        query = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 80)))
+        verdict = _validate(query)
+        assert isinstance(verdict.allowed, bool)
+
+
+# ═══════════════════════════════════════════════════════════════════
+# Costo frente a la versión regex
+# ═══════════════════════════════════════════════════════════════════
+
+
+def test_single_pass_validator_agrees_with_legacy_on_production_queries():
+    for query in _BASE_QUERIES:
+        assert _validate(query).allowed == bench_sql_guard.legacy_is_sql_query_allowed(query)
+
+
+def test_single_pass_validator_is_cheaper_than_regex_version():
+    results = bench_sql_guard.run(number=200)
+    assert results["sql_guard"] < results["regex"]
@@ -0,0 +1,130 @@
+"""
+Tests del cache de audio TTS (app/services/tts_cache.py): LRU por bytes en
+memoria, archivos en disco que sobreviven a la memoria, clave por voz y
+configuración, y que un turno de voz repetido no vuelve a llamar a Google.
+"""
+import asyncio
+import threading
+
+import pytest
+
+from app.services import chatbot_service, tts_cache, voice_service
+
+
+@pytest.fixture
+def fake_google_tts(monkeypatch):
+    calls = []
+
+    def synthesize(text, language_code=voice_service.TTS_LANGUAGE_CODE, voice_name=voice_service.TTS_VOICE_NAME):
+        calls.append(text)
+        return f"mp3:{text}".encode()
+
+    async def synthesize_async(text, language_code=voice_service.TTS_LANGUAGE_CODE, voice_name=voice_service.TTS_VOICE_NAME):
+        return synthesize(text)
+
+    monkeypatch.setattr(voice_service, "VOICE_PROVIDER", "google")
+    monkeypatch.setattr(voice_service, "tts_client", object())
+    monkeypatch.setattr(voice_service, "text_to_speech_google", synthesize)
+    monkeypatch.setattr(voice_service, "text_to_speech_google_async", synthesize_async)
+    return calls
+
+
+def test_memory_tier_evicts_by_bytes():
+    memory = tts_cache.MemoryTier(max_bytes=10)
+    memory.put("a", b"1234")
+    memory.put("b", b"1234")
+    memory.get("a")
+    memory.put("c", b"1234")
+
+    assert memory.get("b") is None
+    assert memory.get("a") == b"1234" and memory.get("c") == b"1234"
+    assert memory.stats()["bytes"] == 8
+    memory.put("huge", b"x" * 11)
+    assert memory.get("huge") is None
+
+
+def test_disk_tier_survives_a_cold_memory(tmp_path):
+    cache = tts_cache.TTSCache(tts_cache.MemoryTier(1024), tts_cache.DiskTier(str(tmp_path), 1024))
+    cache.put("k" * 64, b"audio", synthesis_ms=500)
+
+    cache.memory.clear()
+    assert cache.get("k" * 64) == b"audio"
+    assert cache.get("k" * 64) == b"audio"
+
+    stats = cache.stats()
+    assert (stats["disk_hits"], stats["memory_hits"]) == (1, 1)
+    assert stats["synthesis_ms_saved"] == 1000.0
+    assert cache.path_for("k" * 64).endswith(".mp3")
+
+
+def test_disk_tier_prunes_least_recently_used(tmp_path):
+    disk = tts_cache.DiskTier(str(tmp_path), max_bytes=25)
+    disk.put("a" * 64, b"x" * 10)
+    disk.put("b" * 64, b"x" * 10)
+    disk.put("c" * 64, b"x" * 10)
+
+    remaining = [key for key in ("a", "b", "c") if disk.get(key * 64)]
+    assert len(remaining) == 2 and "c" in remaining
+    assert disk.evictions == 1
+
+
+def test_key_changes_with_voice_and_audio_settings():
+    base = tts_cache.audio_cache_key("hola", "es-US-Studio-B", "es-US", {"speaking_rate": 1.0})
+
+    assert base == tts_cache.audio_cache_key("hola", "es-US-Studio-B", "es-US", {"speaking_rate": 1.0})
+    assert base != tts_cache.audio_cache_key("hola", "es-US-Neural2-B", "es-US", {"speaking_rate": 1.0})
+    assert base != tts_cache.audio_cache_key("hola", "es-US-Studio-B", "es-US", {"speaking_rate": 1.2})
+
+
+def test_repeated_text_skips_google(fake_google_tts):
+    first = voice_service.text_to_speech("Hola")
+    second = asyncio.run(voice_service.text_to_speech_async("Hola"))
+
+    assert first == second == b"mp3:Hola"
+    assert fake_google_tts == ["Hola"]
+    assert tts_cache.get_tts_cache_stats()["memory_hits"] == 1
+
+
+def test_prewarm_synthesizes_canned_phrases_once(fake_google_tts):
+    ready = asyncio.run(chatbot_service.prewarm_voice_cache())
+
+    assert ready == len(chatbot_service.CANNED_VOICE_PHRASES)
+    voice_service.text_to_speech(chatbot_service.GENERIC_ERROR_MESSAGE)
+    assert len(fake_google_tts) == len(chatbot_service.CANNED_VOICE_PHRASES)
+
+
+def test_prewarm_without_voice_service_is_a_no_op():
+    assert asyncio.run(chatbot_service.prewarm_voice_cache()) == 0
+
+
+def test_voice_turn_with_cached_answer_reuses_audio(fake_google_tts, monkeypatch):
+    monkeypatch.setattr(chatbot_service, "get_chat_response", lambda db, message, history: ("Respuesta", [], None))
+
+    chatbot_service.get_chat_response_with_audio(None, text_message="hola")
+    result = chatbot_service.get_chat_response_with_audio(None, text_message="hola")
+
+    assert fake_google_tts == ["Respuesta"]
+    assert result["error"] is False and result["audio_base64"]
+
+
+def test_async_path_does_disk_io_off_the_event_loop(tmp_path, monkeypatch):
+    cache = tts_cache.TTSCache(tts_cache.MemoryTier(1024), tts_cache.DiskTier(str(tmp_path), 1024))
+    threads = []
+    for name in ("get", "put"):
+        original = getattr(cache.disk, name)
+
+        def spy(*args, _original=original):
+            threads.append(threading.get_ident())
+            return _original(*args)
+
+        monkeypatch.setattr(cache.disk, name, spy)
+
+    async def scenario():
+        await cache.put_async("k" * 64, b"audio")
+        cache.memory.clear()
+        return await cache.get_async("k" * 64), threading.get_ident()
+
+    audio, loop_thread = asyncio.run(scenario())
+
+    assert audio == b"audio"
+    assert len(threads) == 2 and loop_thread not in threads
@@ -14,7 +14,7 @@ def test_transcribe_requires_file_content(client: TestClient):
 
 
 def test_transcribe_returns_text(client: TestClient):
-    with patch("app.routes.voice.services.transcribe_audio", return_value="hola mundo"):
+    with patch("app.routes.voice.services.transcribe_audio_async", return_value="hola mundo"):
         response = client.post(
             "/api/voice/transcribe",
             files={"audio": ("audio.wav", b"123", "audio/wav")},
@@ -34,7 +34,7 @@ def test_synthesize_validates_empty_text(client: TestClient):
 
 def test_synthesize_returns_audio_stream(client: TestClient):
     fake_audio = b"12345"
-    with patch("app.routes.voice.services.text_to_speech", return_value=fake_audio):
+    with patch("app.routes.voice.services.text_to_speech_async", return_value=fake_audio):
         response = client.post("/api/voice/synthesize", json={"text": "Hola"})
     assert response.status_code == 200
     assert response.content == fake_audio
@@ -56,7 +56,7 @@ def test_voice_chat_with_text_payload(client: TestClient):
         "corrected_entity": None,
         "error": False,
     }
-    with patch("app.routes.voice.services.get_chat_response_with_audio", return_value=fake_result):
+    with patch("app.routes.voice.services.get_chat_response_with_audio_async", return_value=fake_result):
         response = client.post("/api/voice/chat", json={"text": "Hola"})
     assert response.status_code == 200
     payload = response.json()
@@ -74,7 +74,7 @@ def test_voice_test_endpoint_success(client: TestClient):
 
 def test_synthesize_base64_returns_payload(client: TestClient):
     fake_audio = b"bytes"
-    with patch("app.routes.voice.services.text_to_speech", return_value=fake_audio):
+    with patch("app.routes.voice.services.text_to_speech_async", return_value=fake_audio):
         response = client.post("/api/voice/synthesize-base64", json={"text": "Hola"})
     assert response.status_code == 200
     payload = response.json()
@@ -127,7 +127,7 @@ def test_voice_chat_accepts_audio_file(client: TestClient):
         "corrected_entity": None,
         "error": False,
     }
-    with patch("app.routes.voice.services.get_chat_response_with_audio", return_value=fake_result):
+    with patch("app.routes.voice.services.get_chat_response_with_audio_async", return_value=fake_result):
         response = client.post(
             "/api/voice/chat",
             files={"audio": ("voz.wav", b"audio-bytes", "audio/wav")},
@@ -137,7 +137,7 @@ def test_voice_chat_accepts_audio_file(client: TestClient):
 
 
 def test_transcribe_returns_empty_warning(client: TestClient):
-    with patch("app.routes.voice.services.transcribe_audio", return_value=""):
+    with patch("app.routes.voice.services.transcribe_audio_async", return_value=""):
         response = client.post(
             "/api/voice/transcribe",
             files={"audio": ("audio.wav", b"123", "audio/wav")},
@@ -0,0 +1,151 @@
+"""
+Tests del WebSocket de voz (/api/voice/chat/ws): transcripciones
+intermedias mientras llega el audio, el chatbot arrancando con el primer
+resultado final sin esperar el "stop", y el rechazo sin token.
+"""
+import asyncio
+import base64
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app.main import app
+from app.routes.auth import get_current_user_ws
+from app import services
+from app.services import ai_transport, chatbot_service, voice_service
+from app.services.common import GENERIC_ERROR_MESSAGE
+
+
+@pytest.fixture
+def fake_tts(monkeypatch):
+    async def tts(text, voice_provider=None):
+        return f"mp3:{text}".encode()
+
+    monkeypatch.setattr(voice_service, "text_to_speech_async", tts)
+
+
+@pytest.fixture
+def streaming_stt(monkeypatch):
+    """streaming_recognize falso: un resultado intermedio por frame y el final con el tercero."""
+
+    async def stream(audio_chunks, language_code="es-AR"):
+        words = []
+        async for chunk in audio_chunks:
+            words.append(chunk.decode())
+            is_final = len(words) == 3
+            yield " ".join(words), is_final
+            if is_final:
+                return
+
+    monkeypatch.setattr(services, "stream_transcribe_async", stream)
+
+
+async def _answer(db, message, history):
+    return f"Respuesta a {message}. Es la primera oración del tótem.", [], None
+
+
+def test_interim_then_final_then_audio(client: TestClient, streaming_stt, fake_tts):
+    with patch.object(chatbot_service, "get_chat_response_async", side_effect=_answer) as answer:
+        with client.websocket_connect("/api/voice/chat/ws") as ws:
+            ws.send_json({"type": "start", "history": [{"role": "user", "content": "hola"}]})
+            for word in ("donde", "queda", "el"):
+                ws.send_bytes(word.encode())
+            messages = []
+            while not messages or messages[-1]["type"] != "done":
+                messages.append(ws.receive_json())
+
+    transcripts = [m for m in messages if m["type"] == "transcript"]
+    assert [(m["text"], m["final"]) for m in transcripts] == [
+        ("donde", False),
+        ("donde queda", False),
+        ("donde queda el", True),
+    ]
+    # Sin "stop": el chatbot arrancó con el resultado final.
+    assert answer.call_args.args[1:] == ("donde queda el", [{"role": "user", "content": "hola"}])
+    audio = [m for m in messages if m["type"] == "audio"]
+    assert base64.b64decode(audio[0]["audio_base64"]).decode() == "mp3:Respuesta a donde queda el."
+    assert messages[-1]["error"] is False
+
+
+def test_silence_speaks_the_error(client: TestClient, streaming_stt, fake_tts):
+    with client.websocket_connect("/api/voice/chat/ws") as ws:
+        ws.send_json({"type": "stop"})
+        messages = []
+        while not messages or messages[-1]["type"] != "done":
+            messages.append(ws.receive_json())
+
+    assert messages[0] == {"type": "text", "text": GENERIC_ERROR_MESSAGE, "db_results": [], "corrected_entity": None}
+    assert messages[-1]["error"] is True
+
+
+def test_fake_transport_transcribes_the_whole_recording(client: TestClient, fake_tts, monkeypatch):
+    monkeypatch.setattr(ai_transport, "MODE", "fake")
+    monkeypatch.setattr(ai_transport, "LATENCY_SPEC", "none")
+
+    with patch.object(chatbot_service, "get_chat_response_async", side_effect=_answer):
+        with client.websocket_connect("/api/voice/chat/ws") as ws:
+            ws.send_bytes(b"\x00" * 200)
+            ws.send_bytes(b"\x00" * 200)
+            ws.send_json({"type": "stop"})
+            transcript = ws.receive_json()
+
+    assert transcript["type"] == "transcript" and transcript["final"] is True
+    assert transcript["text"] in ai_transport.FAKE_TRANSCRIPTS
+
+
+def test_stream_transcribe_offline_without_audio_yields_nothing(monkeypatch):
+    monkeypatch.setattr(ai_transport, "MODE", "fake")
+
+    async def no_audio():
+        return
+        yield
+
+    async def collect():
+        return [item async for item in voice_service.stream_transcribe_async(no_audio())]
+
+    assert asyncio.run(collect()) == []
+
+
+def test_websocket_without_token_is_rejected(client: TestClient):
+    del app.dependency_overrides[get_current_user_ws]
+
+    with pytest.raises(WebSocketDisconnect) as exc_info:
+        with client.websocket_connect("/api/voice/chat/ws") as ws:
+            ws.receive_json()
+
+    assert exc_info.value.code == 1008
+
+
+def test_stream_transcribe_sends_config_first_and_yields_results(monkeypatch):
+    speech = voice_service.speech
+    sent = []
+
+    class FakeStreamingClient:
+        async def streaming_recognize(self, requests):
+            async for request in requests:
+                sent.append(request)
+
+            async def responses():
+                for text, is_final in (("dónde", False), ("dónde queda", True)):
+                    alternative = speech.SpeechRecognitionAlternative(transcript=text)
+                    result = speech.StreamingRecognitionResult(alternatives=[alternative], is_final=is_final)
+                    yield speech.StreamingRecognizeResponse(results=[result])
+
+            return responses()
+
+    monkeypatch.setattr(voice_service, "VOICE_PROVIDER", "google")
+    monkeypatch.setattr(voice_service, "speech_client", object())
+    monkeypatch.setattr(voice_service, "_speech_async_client", FakeStreamingClient())
+
+    async def chunks():
+        yield b"opus-1"
+        yield b"opus-2"
+
+    async def collect():
+        return [item async for item in voice_service.stream_transcribe_async(chunks())]
+
+    assert asyncio.run(collect()) == [("dónde", False), ("dónde queda", True)]
+    assert sent[0].streaming_config.interim_results and sent[0].streaming_config.single_utterance
+    assert [request.audio_content for request in sent[1:]] == [b"opus-1", b"opus-2"]